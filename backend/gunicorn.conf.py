@@ -0,0 +1,45 @@
+"""
+Gunicorn settings for the multi-process production server.
+
+    gunicorn server:app -c gunicorn.conf.py
+
+Workers are uvicorn (ASGI) workers sized from the CPU count.  State that
+must agree across workers (rate limits, verification codes, upstream
+dispenser leadership, buffered counters) lives in Redis, so any number of
+workers or nodes can serve the same traffic.
+
+Environment:
+- WEB_CONCURRENCY      worker count (default: 2 × CPUs + 1, capped by MAX_WORKERS)
+- MAX_WORKERS          cap for the computed default (default 6; every worker has
+                       its own SQLAlchemy pool of up to 15 Postgres connections)
+- PORT                 listen port (default 8000)
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+
+_default_workers = min(multiprocessing.cpu_count() * 2 + 1, int(os.getenv("MAX_WORKERS", "6")))
+workers = int(os.getenv("WEB_CONCURRENCY", _default_workers))
+
+# Build the app once in the master so workers share its memory pages.  Nothing
+# touches the network until each worker's lifespan startup runs.
+preload_app = True
+
+# Chat responses stream for a while; uvicorn workers heartbeat independently of
+# request length, so this only reaps genuinely stuck workers.
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Drop any Postgres connections inherited from the master after preload."""
+    from database import engine
+
+    engine.dispose(close=False)
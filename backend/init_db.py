@@ -1,13 +1,50 @@
+"""
+Schema setup, run once per deploy (the ``db-init`` compose service) rather
+than on every worker boot.  Creates any missing tables from ``models.py``;
+column changes to existing tables go through ``migrations/``.
+"""
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# Same local-dev env file as server.py; must load before database.py reads DATABASE_URL
+if os.path.exists("../secrets/Mikoshi.env"):
+    load_dotenv("../secrets/Mikoshi.env")
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
 from database import Base, engine
-from models import User  # Add other models as needed
+import models  # noqa: F401  (registers every mapper before create_all)
+
+
+def wait_for_db(max_retries=20, delay=3):
+    for attempt in range(1, max_retries + 1):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            print(f"Database is available (attempt {attempt}).")
+            return True
+        except OperationalError as e:
+            print(f"Attempt {attempt}: Database not available yet: {e}")
+            time.sleep(delay)
+    return False
 
 
 def init_db():
+    if not wait_for_db():
+        print("Failed to connect to database after retries.")
+        return False
     try:
         Base.metadata.create_all(bind=engine)
         print("Database tables created!")
+        return True
     except Exception as e:
         print(f"Error creating tables: {e}")
+        return False
+
 
 if __name__ == "__main__":
-    init_db()
+    sys.exit(0 if init_db() else 1)
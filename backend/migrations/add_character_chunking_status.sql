@@ -0,0 +1,20 @@
+-- Migration: Background long-description chunking
+-- Description: Adds chunking_status, long_description_hash and chunking_started_at to characters;
+--              pending rows are the job queue drained by utils/long_description_chunker.py
+-- Created: 2026-10-19
+
+ALTER TABLE characters ADD COLUMN IF NOT EXISTS chunking_status VARCHAR(16) NOT NULL DEFAULT 'none';
+ALTER TABLE characters ADD COLUMN IF NOT EXISTS long_description_hash VARCHAR(64);
+ALTER TABLE characters ADD COLUMN IF NOT EXISTS chunking_started_at TIMESTAMPTZ;
+
+-- Existing chunks were made synchronously from the stored text: mark them done
+UPDATE characters
+SET chunking_status = 'done',
+    long_description_hash = encode(sha256(convert_to(long_description, 'UTF8')), 'hex')
+WHERE chunking_status = 'none'
+  AND long_description_chunks <> '[]'::jsonb
+  AND COALESCE(long_description, '') <> '';
+
+CREATE INDEX IF NOT EXISTS ix_characters_chunking_queue
+    ON characters (id)
+    WHERE chunking_status IN ('pending', 'running');
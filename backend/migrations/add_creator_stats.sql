@@ -0,0 +1,47 @@
+-- Migration: Denormalised creator statistics
+-- Description: Adds creator_stats (content counts, views and likes per creator), kept up to
+--              date by the create/delete, like and view-flush paths
+-- Created: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS creator_stats (
+    user_id VARCHAR PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    character_count INTEGER NOT NULL DEFAULT 0,
+    scene_count INTEGER NOT NULL DEFAULT 0,
+    persona_count INTEGER NOT NULL DEFAULT 0,
+    character_views BIGINT NOT NULL DEFAULT 0,
+    scene_views BIGINT NOT NULL DEFAULT 0,
+    persona_views BIGINT NOT NULL DEFAULT 0,
+    character_likes BIGINT NOT NULL DEFAULT 0,
+    scene_likes BIGINT NOT NULL DEFAULT 0,
+    persona_likes BIGINT NOT NULL DEFAULT 0
+);
+
+-- Backfill from the content tables (safe to re-run: recomputes every row)
+INSERT INTO creator_stats (
+    user_id,
+    character_count, scene_count, persona_count,
+    character_views, scene_views, persona_views,
+    character_likes, scene_likes, persona_likes
+)
+SELECT u.id,
+       COALESCE(c.n, 0), COALESCE(s.n, 0), COALESCE(p.n, 0),
+       COALESCE(c.views, 0), COALESCE(s.views, 0), COALESCE(p.views, 0),
+       COALESCE(c.likes, 0), COALESCE(s.likes, 0), COALESCE(p.likes, 0)
+FROM users u
+LEFT JOIN (SELECT creator_id, COUNT(*) AS n, SUM(COALESCE(views, 0)) AS views, SUM(COALESCE(likes, 0)) AS likes
+           FROM characters GROUP BY creator_id) c ON c.creator_id = u.id
+LEFT JOIN (SELECT creator_id, COUNT(*) AS n, SUM(COALESCE(views, 0)) AS views, SUM(COALESCE(likes, 0)) AS likes
+           FROM scenes GROUP BY creator_id) s ON s.creator_id = u.id
+LEFT JOIN (SELECT creator_id, COUNT(*) AS n, SUM(COALESCE(views, 0)) AS views, SUM(COALESCE(likes, 0)) AS likes
+           FROM personas GROUP BY creator_id) p ON p.creator_id = u.id
+WHERE c.creator_id IS NOT NULL OR s.creator_id IS NOT NULL OR p.creator_id IS NOT NULL
+ON CONFLICT (user_id) DO UPDATE SET
+    character_count = EXCLUDED.character_count,
+    scene_count = EXCLUDED.scene_count,
+    persona_count = EXCLUDED.persona_count,
+    character_views = EXCLUDED.character_views,
+    scene_views = EXCLUDED.scene_views,
+    persona_views = EXCLUDED.persona_views,
+    character_likes = EXCLUDED.character_likes,
+    scene_likes = EXCLUDED.scene_likes,
+    persona_likes = EXCLUDED.persona_likes;
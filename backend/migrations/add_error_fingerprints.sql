@@ -0,0 +1,49 @@
+-- Migration: Error fingerprinting and pre-aggregated error stats
+-- Description: Adds error_logs.fingerprint, the error_fingerprints dedup table and
+--              the error_stats_hourly rollup read by /api/error-logs/stats and /summary
+-- Created: 2026-10-19
+
+ALTER TABLE error_logs ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(40);
+CREATE INDEX IF NOT EXISTS idx_error_logs_fingerprint ON error_logs(fingerprint);
+
+CREATE TABLE IF NOT EXISTS error_fingerprints (
+    fingerprint VARCHAR(40) PRIMARY KEY,
+    error_type VARCHAR(100) NOT NULL,
+    severity VARCHAR(20) NOT NULL,
+    source VARCHAR(20) NOT NULL,
+    endpoint VARCHAR(255),
+    sample_message TEXT,
+    count BIGINT NOT NULL DEFAULT 0,
+    stored_count BIGINT NOT NULL DEFAULT 0,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_error_fingerprints_last_seen ON error_fingerprints(last_seen DESC);
+
+CREATE TABLE IF NOT EXISTS error_stats_hourly (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    fingerprint VARCHAR(40) NOT NULL,
+    error_type VARCHAR(100) NOT NULL,
+    severity VARCHAR(20) NOT NULL,
+    source VARCHAR(20) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, fingerprint)
+);
+
+-- Backfill the rollup from existing rows so the dashboard keeps its history.
+-- Same value as utils.error_logger.compute_fingerprint without stack frames:
+-- md5 of type|severity|source|endpoint, with the query string dropped and
+-- numeric path segments collapsed to {n}
+INSERT INTO error_stats_hourly (bucket, fingerprint, error_type, severity, source, count)
+SELECT date_trunc('hour', timestamp),
+       md5(
+           COALESCE(NULLIF(error_type, ''), 'Unknown') || '|' || severity || '|' || source || '|'
+           || regexp_replace(split_part(COALESCE(endpoint, ''), '?', 1), '/\d+(?=/|$)', '/{n}', 'g')
+       ),
+       error_type, severity, source, COUNT(*)
+FROM error_logs
+GROUP BY 1, 2, 3, 4, 5
+ON CONFLICT (bucket, fingerprint) DO UPDATE SET count = EXCLUDED.count;
+
+COMMENT ON TABLE error_fingerprints IS 'Deduplicated errors with occurrence counters';
+COMMENT ON TABLE error_stats_hourly IS 'Hourly error counts per fingerprint for the admin dashboard';
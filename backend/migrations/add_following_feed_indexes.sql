@@ -0,0 +1,12 @@
+-- Migration: Following feed indexes
+-- Description: Composite (creator_id, is_public, created_time) indexes used by the
+--              keyset-paginated /api/following/feed query
+-- Created: 2026-10-19
+
+-- CONCURRENTLY cannot run inside a transaction block; run with psql -f (autocommit)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_characters_creator_public_created
+    ON characters (creator_id, is_public, created_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_scenes_creator_public_created
+    ON scenes (creator_id, is_public, created_time);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_personas_creator_public_created
+    ON personas (creator_id, is_public, created_time);
@@ -0,0 +1,34 @@
+-- Migration: Row version counters
+-- Description: Adds row_version to characters, scenes, personas, users and chat_histories,
+--              bumped by a BEFORE UPDATE trigger (so raw-SQL updates count too); the
+--              conditional GET layer (utils/conditional.py) builds ETags from it
+-- Created: 2026-10-19
+
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.row_version := OLD.row_version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE characters ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE scenes ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE personas ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE chat_histories ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+
+DROP TRIGGER IF EXISTS trg_characters_row_version ON characters;
+CREATE TRIGGER trg_characters_row_version BEFORE UPDATE ON characters
+    FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+DROP TRIGGER IF EXISTS trg_scenes_row_version ON scenes;
+CREATE TRIGGER trg_scenes_row_version BEFORE UPDATE ON scenes
+    FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+DROP TRIGGER IF EXISTS trg_personas_row_version ON personas;
+CREATE TRIGGER trg_personas_row_version BEFORE UPDATE ON personas
+    FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+DROP TRIGGER IF EXISTS trg_users_row_version ON users;
+CREATE TRIGGER trg_users_row_version BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_row_version();
+DROP TRIGGER IF EXISTS trg_chat_histories_row_version ON chat_histories;
+CREATE TRIGGER trg_chat_histories_row_version BEFORE UPDATE ON chat_histories
+    FOR EACH ROW EXECUTE FUNCTION bump_row_version();
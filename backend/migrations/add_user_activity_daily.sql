@@ -0,0 +1,53 @@
+-- Migration: Daily user activity rollup
+-- Description: Adds user_activity_daily, written incrementally from the auth, chat and
+--              credit ledger paths and read by /api/admin/user-stats
+-- Created: 2026-10-19
+
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    activity_date DATE NOT NULL,
+    user_id VARCHAR NOT NULL,
+    registered BOOLEAN NOT NULL DEFAULT FALSE,
+    login_count INTEGER NOT NULL DEFAULT 0,
+    chat_messages INTEGER NOT NULL DEFAULT 0,
+    new_chats INTEGER NOT NULL DEFAULT 0,
+    usage_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (activity_date, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_user_activity_daily_user_id ON user_activity_daily(user_id);
+
+-- Backfill the last 40 days (the dashboard reads at most 30) from the existing sources
+INSERT INTO user_activity_daily (activity_date, user_id, registered, login_count)
+SELECT (timestamp AT TIME ZONE 'UTC')::date,
+       user_id,
+       bool_or(action = 'register'),
+       COUNT(*) FILTER (WHERE action = 'login')
+FROM audit_logs
+WHERE action IN ('register', 'login')
+  AND user_id IS NOT NULL
+  AND timestamp >= now() - INTERVAL '40 days'
+GROUP BY 1, 2
+ON CONFLICT (activity_date, user_id) DO UPDATE
+    SET registered = EXCLUDED.registered,
+        login_count = EXCLUDED.login_count;
+
+INSERT INTO user_activity_daily (activity_date, user_id, chat_messages, new_chats)
+SELECT (m.created_at AT TIME ZONE 'UTC')::date,
+       h.user_id,
+       COUNT(*) FILTER (WHERE m.role IN ('user', 'assistant')),
+       COUNT(DISTINCT h.chat_id) FILTER (
+           WHERE (h.created_at AT TIME ZONE 'UTC')::date = (m.created_at AT TIME ZONE 'UTC')::date
+       )
+FROM chat_history_messages m
+JOIN chat_histories h ON h.chat_id = m.chat_id
+WHERE m.created_at >= now() - INTERVAL '40 days'
+GROUP BY 1, 2
+ON CONFLICT (activity_date, user_id) DO UPDATE
+    SET chat_messages = EXCLUDED.chat_messages,
+        new_chats = EXCLUDED.new_chats;
+
+INSERT INTO user_activity_daily (activity_date, user_id, usage_count)
+SELECT usage_date, user_id, 1
+FROM user_credit_usage_ledger
+WHERE usage_date >= (now() - INTERVAL '40 days')::date
+ON CONFLICT (activity_date, user_id) DO UPDATE
+    SET usage_count = GREATEST(user_activity_daily.usage_count, 1);
@@ -97,32 +97,52 @@ class ModelConfig:
         # Fallback to last tier
         return self.pricing_tiers[-1]
 
+    def _input_output_cost(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        *,
+        cache_hit: bool = False,
+        cache_hit_tokens: int = 0,
+    ) -> float:
+        """Cost in ¥ of one request; ``cache_hit_tokens`` of the input are billed at the cache-hit price."""
+        tier = self.get_pricing_tier(input_tokens)
+        hit_tokens = input_tokens if cache_hit else min(max(int(cache_hit_tokens), 0), input_tokens)
+
+        # Cache-hit pricing (only for models that support it, e.g. DeepSeek)
+        if self.cache_hit_price_per_million is None:
+            hit_tokens = 0
+        miss_tokens = input_tokens - hit_tokens
+
+        cost_input = (miss_tokens / 1_000_000) * tier.input_per_million
+        if hit_tokens:
+            cost_input += (hit_tokens / 1_000_000) * self.cache_hit_price_per_million
+        cost_output = (output_tokens / 1_000_000) * tier.output_per_million
+        return cost_input + cost_output
+
     def estimate_cost(
         self,
         input_tokens: int,
         output_tokens: int,
         *,
         cache_hit: bool = False,
+        cache_hit_tokens: int = 0,
     ) -> float:
         """
         Estimate cost in **RMB (元)** for a request.
 
+        ``cache_hit=True`` prices the whole input at the cache-hit rate;
+        ``cache_hit_tokens`` prices only that part of it there.  The tier is
+        always chosen by the full input size.
+
         Returns 0.0 when pricing data is unavailable.
         """
         if not self.pricing_tiers:
             return 0.0
-
-        # Cache-hit pricing (only for models that support it, e.g. DeepSeek)
-        if cache_hit and self.cache_hit_price_per_million is not None:
-            input_price = self.cache_hit_price_per_million
-        else:
-            input_price = self.get_pricing_tier(input_tokens).input_per_million
-
-        output_price = self.get_pricing_tier(input_tokens).output_per_million
-
-        cost_input = (input_tokens / 1_000_000) * input_price
-        cost_output = (output_tokens / 1_000_000) * output_price
-        return round(cost_input + cost_output, 6)
+        cost = self._input_output_cost(
+            input_tokens, output_tokens, cache_hit=cache_hit, cache_hit_tokens=cache_hit_tokens,
+        )
+        return round(cost, 6)
 
     def tokens_to_credits(
         self,
@@ -130,30 +150,24 @@ class ModelConfig:
         output_tokens: int,
         *,
         cache_hit: bool = False,
+        cache_hit_tokens: int = 0,
     ) -> float:
         """
         Convert token usage to credits (点数).
 
         1 credit = ¥0.001 CNY.  Cost(¥) = (tokens / 1M) × price_per_million.
-        So credits = cost_¥ × 1000 = (input × input_price + output × output_price) / 1000.
+        So credits = cost_¥ × 1000 = (input × input_price + output × output_price) / 1000,
+        with the ``cache_hit_tokens`` share of the input at the cache-hit price.
 
         Returns 0.0 when pricing data is unavailable.
         """
         if not self.pricing_tiers:
             return 0.0
-
-        # Cache-hit pricing (only for models that support it, e.g. DeepSeek)
-        if cache_hit and self.cache_hit_price_per_million is not None:
-            input_price = self.cache_hit_price_per_million
-        else:
-            input_price = self.get_pricing_tier(input_tokens).input_per_million
-
-        output_price = self.get_pricing_tier(input_tokens).output_per_million
-
-        credit_input = (input_tokens / 1_000_000) * input_price
-        credit_output = (output_tokens / 1_000_000) * output_price
+        cost = self._input_output_cost(
+            input_tokens, output_tokens, cache_hit=cache_hit, cache_hit_tokens=cache_hit_tokens,
+        )
         # 1 credit = ¥0.001 → multiply cost by 1000
-        return round((credit_input + credit_output) * 1000, 4)
+        return round(cost * 1000, 4)
 
     def __repr__(self):
         return f"ModelConfig(id={self.id!r})"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Date, Text, ForeignKey, ForeignKeyConstraint, UniqueConstraint, Boolean, Float, BigInteger
+from sqlalchemy import Column, String, Integer, DateTime, Date, Text, ForeignKey, ForeignKeyConstraint, UniqueConstraint, Index, Boolean, Float, BigInteger, text, DDL, event
 from sqlalchemy.orm import relationship
 from database import Base
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
@@ -12,6 +12,10 @@ class Character(Base):
     example_messages = Column(Text, default="")
     long_description = Column(Text, default="", nullable=True)
     long_description_chunks = Column(JSONB, default=list, nullable=False)
+    # Background LLM chunking: 'none' | 'pending' | 'running' | 'done' | 'failed'
+    chunking_status = Column(String(16), nullable=False, default="none", server_default="none")
+    long_description_hash = Column(String(64), nullable=True)  # sha256 of the text the chunks came from
+    chunking_started_at = Column(DateTime(timezone=True), nullable=True)
     context_label = Column(String(20), nullable=False, default="standard")
     tagline = Column(String(255), default="")  # 50 words fits ~255 chars
     tags = Column(ARRAY(Text), default=[])   # array of strings
@@ -45,6 +49,18 @@ class Character(Base):
     # Character-specific chat background configuration
     # { "type": "none"|"preset"|"upload"|"character_picture", "preset_id"?: str, "url"?: str }
     background = Column(JSONB, default=None, nullable=True)
+    # Bumped by the bump_row_version trigger on every UPDATE (ETags, utils/conditional.py)
+    row_version = Column(BigInteger, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # Following feed: a creator's public items, newest first
+        Index('ix_characters_creator_public_created', 'creator_id', 'is_public', 'created_time'),
+        # Chunking worker: the few rows waiting for (or stuck in) a job
+        Index(
+            'ix_characters_chunking_queue', 'id',
+            postgresql_where=text("chunking_status IN ('pending', 'running')"),
+        ),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -90,6 +106,7 @@ class User(Base):
     ban_until = Column(DateTime(timezone=True), nullable=True)
     ban_reason = Column(String(50), nullable=True)  # categorical tag: harassment/spam/abuse/underage/other
     ban_note = Column(Text, nullable=True)  # moderator-visible free text
+    row_version = Column(BigInteger, nullable=False, default=1, server_default="1")
 
     chat_histories = relationship("ChatHistory", back_populates="user", cascade="all, delete-orphan")
 
@@ -151,6 +168,7 @@ class ChatHistory(Base):
     hidden_from_recent = Column(Boolean, default=False, nullable=False)
     last_updated = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC))
+    row_version = Column(BigInteger, nullable=False, default=1, server_default="1")
 
     user = relationship("User", back_populates="chat_histories")
     branches = relationship("ChatHistoryBranch", back_populates="chat", cascade="all, delete-orphan")
@@ -229,6 +247,11 @@ class Persona(Base):
     # Content moderation status: null = normal | 'restricted' | 'takedown'
     moderation_status = Column(String(20), nullable=True)
     appeal_under_review = Column(Boolean, default=False, nullable=False)
+    row_version = Column(BigInteger, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        Index('ix_personas_creator_public_created', 'creator_id', 'is_public', 'created_time'),
+    )
 
 
 class SearchTerm(Base):
@@ -269,6 +292,11 @@ class Scene(Base):
     # Content moderation status: null = normal | 'restricted' | 'takedown'
     moderation_status = Column(String(20), nullable=True)
     appeal_under_review = Column(Boolean, default=False, nullable=False)
+    row_version = Column(BigInteger, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        Index('ix_scenes_creator_public_created', 'creator_id', 'is_public', 'created_time'),
+    )
 
 # Junction table for character likes
 class UserLikedCharacter(Base):
@@ -384,6 +412,64 @@ class ErrorLogModel(Base):
     resolved = Column(Boolean, default=False, nullable=False, index=True)
     resolved_at = Column(DateTime(timezone=True), nullable=True)
     resolved_by = Column(String, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    fingerprint = Column(String(40), nullable=True, index=True)  # see ErrorFingerprint
+
+
+class ErrorFingerprint(Base):
+    """One row per distinct error (type + endpoint + top frames), with repeat counters."""
+    __tablename__ = "error_fingerprints"
+
+    fingerprint = Column(String(40), primary_key=True)
+    error_type = Column(String(100), nullable=False)
+    severity = Column(String(20), nullable=False)
+    source = Column(String(20), nullable=False)
+    endpoint = Column(String(255), nullable=True)
+    sample_message = Column(Text, nullable=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    stored_count = Column(BigInteger, nullable=False, default=0)  # rows actually written to error_logs
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class ErrorStatsHourly(Base):
+    """Hourly error counters per fingerprint, read by /api/error-logs/stats and /summary."""
+    __tablename__ = "error_stats_hourly"
+
+    bucket = Column(DateTime(timezone=True), primary_key=True)  # truncated to the hour
+    fingerprint = Column(String(40), primary_key=True)
+    error_type = Column(String(100), nullable=False)
+    severity = Column(String(20), nullable=False)
+    source = Column(String(20), nullable=False)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+class UserActivityDaily(Base):
+    """One row per user per UTC day they were active, read by /api/admin/user-stats."""
+    __tablename__ = "user_activity_daily"
+
+    activity_date = Column(Date, primary_key=True)
+    user_id = Column(String, primary_key=True, index=True)  # no FK: rollups outlive deleted users
+    registered = Column(Boolean, default=False, nullable=False)  # registered on this day
+    login_count = Column(Integer, default=0, nullable=False)
+    chat_messages = Column(Integer, default=0, nullable=False)  # messages added to saved chats
+    new_chats = Column(Integer, default=0, nullable=False)
+    usage_count = Column(Integer, default=0, nullable=False)  # credit ledger writes
+
+
+class CreatorStats(Base):
+    """Per-creator content totals, maintained by the write paths (utils/creator_stats.py)."""
+    __tablename__ = "creator_stats"
+
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    character_count = Column(Integer, default=0, nullable=False)
+    scene_count = Column(Integer, default=0, nullable=False)
+    persona_count = Column(Integer, default=0, nullable=False)
+    character_views = Column(BigInteger, default=0, nullable=False)
+    scene_views = Column(BigInteger, default=0, nullable=False)
+    persona_views = Column(BigInteger, default=0, nullable=False)
+    character_likes = Column(BigInteger, default=0, nullable=False)
+    scene_likes = Column(BigInteger, default=0, nullable=False)
+    persona_likes = Column(BigInteger, default=0, nullable=False)
 
 
 class PaymentOrder(Base):
@@ -485,4 +571,24 @@ class ContentModerationLog(Base):
     source = Column(String(20), nullable=False, default='direct')  # direct | report | content_review
     source_report_id = Column(Integer, ForeignKey('problem_reports.id', ondelete='SET NULL'), nullable=True)
     notes = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), nullable=False, index=True)
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(UTC), nullable=False, index=True)
+
+
+# row_version triggers for databases created by init_db.py; existing ones get
+# them from migrations/add_row_versions.sql
+_BUMP_ROW_VERSION_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION bump_row_version() RETURNS trigger AS $$
+BEGIN
+    NEW.row_version := OLD.row_version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""")
+event.listen(Base.metadata, "before_create", _BUMP_ROW_VERSION_FUNCTION.execute_if(dialect="postgresql"))
+
+_ROW_VERSION_TRIGGER = DDL(
+    "CREATE TRIGGER trg_%(table)s_row_version BEFORE UPDATE ON %(table)s "
+    "FOR EACH ROW EXECUTE FUNCTION bump_row_version()"
+).execute_if(dialect="postgresql")
+for _versioned in (Character, Scene, Persona, User, ChatHistory):
+    event.listen(_versioned.__table__, "after_create", _ROW_VERSION_TRIGGER)
@@ -1,20 +1,27 @@
+import os
 import re
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc, or_, and_
 from datetime import datetime, timedelta, UTC
 from passlib.context import CryptContext
 from database import get_db
-from models import User, Character, Tag, SearchTerm, ChatHistory, ChatHistoryMessage, UserCreditUsageLedger, ContentReviewQueue, ProblemReport, Scene, Persona, BanAppeal, ContentBanAppeal, UserModerationLog, ContentModerationLog
+from models import User, Character, Tag, SearchTerm, ChatHistory, UserCreditUsageLedger, ContentReviewQueue, ProblemReport, Scene, Persona, BanAppeal, ContentBanAppeal, UserModerationLog, ContentModerationLog
 from utils.session import get_current_admin_user
 from utils.security_middleware import get_rate_limit_status
-from utils.user_utils import enrich_user_with_character_count, build_user_response
+from utils.user_utils import enrich_users_with_character_count, build_user_response
 from typing import List, Optional, Dict
 from pydantic import BaseModel
 from schemas import UserOut, UserMessageOut
-from utils.audit_logger import AuditLog
+from utils.analytics_rollup import daily_totals, count_active_users, retention
 from utils.local_storage_utils import delete_stored_image
 from utils.credit_wallet import get_credit_topup_packages
+from utils.creator_stats import record_deleted
+from utils.stream_metrics import get_stream_metrics
+from utils.prompt_cache_metrics import get_prompt_cache_metrics
+from utils.redis_client import get_command_stats
+from utils.provider_router import get_provider_health
+from utils.fast_json import FastJSONResponse
 from routes.user_messages import create_moderation_message, create_content_moderation_message
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -181,9 +188,7 @@ def get_user_data_stats(
     now = datetime.now(UTC)
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     yesterday_start = today_start - timedelta(days=1)
-    seven_days_ago = today_start - timedelta(days=7)
     thirty_days_ago = today_start - timedelta(days=30)
-    eight_days_ago = today_start - timedelta(days=8)
 
     total_users = db.query(func.count(User.id)).scalar() or 0
 
@@ -195,143 +200,24 @@ def get_user_data_stats(
         )
     ).scalar() or 0
 
-    registered_today = db.query(func.count(func.distinct(AuditLog.user_id))).filter(
-        AuditLog.action == "register",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= today_start
-    ).scalar() or 0
-
-    registered_yesterday = db.query(func.count(func.distinct(AuditLog.user_id))).filter(
-        AuditLog.action == "register",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= yesterday_start,
-        AuditLog.timestamp < today_start,
-    ).scalar() or 0
-
-    activity_user_ids = set()
-
-    today_login_users = db.query(AuditLog.user_id).filter(
-        AuditLog.action == "login",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= today_start
-    ).distinct().all()
-    activity_user_ids.update(user_id for (user_id,) in today_login_users)
-
-    today_chat_users = db.query(ChatHistory.user_id).filter(
-        ChatHistory.last_updated >= today_start
-    ).distinct().all()
-    activity_user_ids.update(user_id for (user_id,) in today_chat_users)
-
-    dau = len(activity_user_ids)
-
-    weekly_activity_user_ids = set()
-    weekly_login_users = db.query(AuditLog.user_id).filter(
-        AuditLog.action == "login",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= seven_days_ago
-    ).distinct().all()
-    weekly_activity_user_ids.update(user_id for (user_id,) in weekly_login_users)
-
-    weekly_chat_users = db.query(ChatHistory.user_id).filter(
-        ChatHistory.last_updated >= seven_days_ago
-    ).distinct().all()
-    weekly_activity_user_ids.update(user_id for (user_id,) in weekly_chat_users)
-
-    monthly_activity_user_ids = set(weekly_activity_user_ids)
-    monthly_login_users = db.query(AuditLog.user_id).filter(
-        AuditLog.action == "login",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= thirty_days_ago
-    ).distinct().all()
-    monthly_activity_user_ids.update(user_id for (user_id,) in monthly_login_users)
-
-    monthly_chat_users = db.query(ChatHistory.user_id).filter(
-        ChatHistory.last_updated >= thirty_days_ago
-    ).distinct().all()
-    monthly_activity_user_ids.update(user_id for (user_id,) in monthly_chat_users)
-
-    wau = len(weekly_activity_user_ids)
-    mau = len(monthly_activity_user_ids)
-
-    avg_chat_length = 0
-    active_branch_counts = (
-        db.query(ChatHistory.chat_id, func.count(ChatHistoryMessage.id).label("message_count"))
-        .outerjoin(
-            ChatHistoryMessage,
-            and_(
-                ChatHistoryMessage.chat_id == ChatHistory.chat_id,
-                ChatHistoryMessage.branch_id == ChatHistory.active_branch_id,
-            ),
-        )
-        .group_by(ChatHistory.chat_id)
-        .all()
-    )
-    if active_branch_counts:
-        total_message_count = sum(int(message_count or 0) for _, message_count in active_branch_counts)
-        avg_chat_length = total_message_count / len(active_branch_counts)
-
-    total_chat_sessions = db.query(func.count(ChatHistory.id)).scalar() or 0
-
-    registrations = db.query(
-        AuditLog.user_id,
-        func.date(AuditLog.timestamp)
-    ).filter(
-        AuditLog.action == "register",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= eight_days_ago
-    ).all()
-
-    activity_dates: Dict[str, set] = {}
-
-    login_activity = db.query(
-        AuditLog.user_id,
-        func.date(AuditLog.timestamp)
-    ).filter(
-        AuditLog.action == "login",
-        AuditLog.user_id.isnot(None),
-        AuditLog.timestamp >= eight_days_ago
-    ).all()
-
-    chat_activity = db.query(
-        ChatHistory.user_id,
-        func.date(ChatHistory.last_updated)
-    ).filter(
-        ChatHistory.last_updated >= eight_days_ago
-    ).all()
-
-    for user_id, activity_date in login_activity + chat_activity:
-        if not user_id or activity_date is None:
-            continue
-        if user_id not in activity_dates:
-            activity_dates[user_id] = set()
-        activity_dates[user_id].add(activity_date)
-
     today_date = today_start.date()
-    d1_eligible = 0
-    d1_retained = 0
-    d7_eligible = 0
-    d7_retained = 0
-
-    for user_id, register_date in registrations:
-        if not user_id or register_date is None:
-            continue
+    totals = daily_totals(db, since=thirty_days_ago.date())
+    registered_today = totals.get(today_date, {}).get("registrations", 0)
+    registered_yesterday = totals.get(yesterday_start.date(), {}).get("registrations", 0)
 
-        user_activity_dates = activity_dates.get(user_id, set())
+    dau = count_active_users(db, today_date, 1)
+    wau = count_active_users(db, today_date, 7)
+    mau = count_active_users(db, today_date, 30)
 
-        d1_date = register_date + timedelta(days=1)
-        if d1_date <= today_date:
-            d1_eligible += 1
-            if d1_date in user_activity_dates:
-                d1_retained += 1
+    window_messages = sum(day["chat_messages"] for day in totals.values())
+    window_new_chats = sum(day["new_chats"] for day in totals.values())
+    avg_chat_length = window_messages / window_new_chats if window_new_chats else 0
 
-        d7_date = register_date + timedelta(days=7)
-        if d7_date <= today_date:
-            d7_eligible += 1
-            if d7_date in user_activity_dates:
-                d7_retained += 1
+    total_chat_sessions = db.query(func.count(ChatHistory.id)).scalar() or 0
 
-    d1_retention = (d1_retained / d1_eligible * 100) if d1_eligible else 0
-    d7_retention = (d7_retained / d7_eligible * 100) if d7_eligible else 0
+    retention_rates = retention(db, today_date)
+    d1_retention = retention_rates["d1_retention"]
+    d7_retention = retention_rates["d7_retention"]
 
     today_token_rows = db.query(
         UserCreditUsageLedger.user_id,
@@ -357,7 +243,7 @@ def get_user_data_stats(
 
     top_daily_message_users = []
 
-    return {
+    return FastJSONResponse({
         "snapshot_at": now.isoformat(),
         "metrics": {
             "user_count": total_users,
@@ -386,9 +272,51 @@ def get_user_data_stats(
         "top_daily_message_users": top_daily_message_users[:10],
         "notes": {
             "credit_usage": "Summed from daily ledger rows written from API response usage.",
-            "retention": "D1/D7 are cohort-based using register audit logs and login/chat activity dates.",
+            "retention": "D1/D7 are cohort-based using registration days and any activity in user_activity_daily.",
+            "activity": "DAU/WAU/MAU count users who registered, logged in, chatted or used credits (daily rollups).",
+            "avg_chat_length": "Messages saved per chat started over the last 30 days.",
         }
-    }
+    })
+
+
+@router.get("/stream-metrics")
+def get_chat_stream_metrics(
+    days: int = Query(7, ge=1, le=30),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Completed vs. client-interrupted chat streams per day, with tokens saved - Admin only."""
+    try:
+        return FastJSONResponse({"days": get_stream_metrics(days)})
+    except Exception:
+        raise HTTPException(status_code=503, detail="Metrics store unavailable")
+
+
+@router.get("/prompt-cache-metrics")
+def get_model_prompt_cache_metrics(
+    days: int = Query(7, ge=1, le=30),
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Provider context-cache hit/miss prompt tokens per model per day - Admin only."""
+    try:
+        return FastJSONResponse({"days": get_prompt_cache_metrics(days)})
+    except Exception:
+        raise HTTPException(status_code=503, detail="Metrics store unavailable")
+
+
+@router.get("/redis-metrics")
+def get_redis_command_metrics(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Per-command Redis latency of the worker process serving this request - Admin only."""
+    return {"pid": os.getpid(), "commands": get_command_stats()}
+
+
+@router.get("/provider-health")
+def get_llm_provider_health(
+    current_admin: User = Depends(get_current_admin_user)
+):
+    """Time-to-first-token, error rate and hedge counts per LLM provider in this worker - Admin only."""
+    return {"pid": os.getpid(), "providers": get_provider_health()}
 
 
 @router.get("/user-stats/user/{user_id}")
@@ -467,7 +395,7 @@ def get_single_user_credit_usage(
         ChatHistory.last_updated >= today_start,
     ).scalar() or 0
 
-    return {
+    return FastJSONResponse({
         "user_id": user_id,
         "user_name": user.name,
         "snapshot_at": now.isoformat(),
@@ -482,7 +410,7 @@ def get_single_user_credit_usage(
         "notes": {
             "credit_usage": "Summed from daily ledger rows written from API response usage. Credits = (input_tokens * input_price + output_tokens * output_price) / 1000.",
         },
-    }
+    })
 
 
 @router.get("/users")
@@ -492,7 +420,7 @@ def get_all_users(
 ):
     """Get all users - Admin only"""
     users = db.query(User).all()
-    return [enrich_user_with_character_count(user, db) for user in users]
+    return enrich_users_with_character_count(users, db)
 
 
 @router.get("/users/{user_id}/linked-accounts")
@@ -546,7 +474,7 @@ def get_all_characters(
 ):
     """Get all characters - Admin only"""
     characters = db.query(Character).all()
-    return [
+    return FastJSONResponse([
         {
             "id": char.id,
             "name": char.name,
@@ -560,7 +488,7 @@ def get_all_characters(
             "tags": char.tags
         }
         for char in characters
-    ]
+    ])
 
 
 @router.get("/scenes")
@@ -570,7 +498,7 @@ def get_all_scenes(
 ):
     """Get all scenes - Admin only"""
     scenes = db.query(Scene).all()
-    return [
+    return FastJSONResponse([
         {
             "id": s.id,
             "name": s.name,
@@ -585,7 +513,7 @@ def get_all_scenes(
             "tags": s.tags,
         }
         for s in scenes
-    ]
+    ])
 
 
 @router.get("/personas")
@@ -595,7 +523,7 @@ def get_all_personas(
 ):
     """Get all personas - Admin only"""
     personas = db.query(Persona).all()
-    return [
+    return FastJSONResponse([
         {
             "id": p.id,
             "name": p.name,
@@ -610,7 +538,7 @@ def get_all_personas(
             "tags": p.tags,
         }
         for p in personas
-    ]
+    ])
 
 
 @router.get("/review-queue")
@@ -683,6 +611,7 @@ def resolve_content_review_queue_item(
     if action == "hide" and character:
         character.is_public = False
     elif action == "delete" and character:
+        record_deleted(db, character)
         db.delete(character)
 
     # Log the action if it affects the content
@@ -919,6 +848,7 @@ def take_moderation_action(
                 elif action == "delete":
                     creator_id = entity.creator_id
                     entity_name = entity.name
+                    record_deleted(db, entity)
                     db.delete(entity)
                     db.flush()
                     if creator_id:
@@ -1073,6 +1003,7 @@ def take_batch_moderation_action(
                     elif action == "delete":
                         _creator_id = entity.creator_id
                         _entity_name = entity.name
+                        record_deleted(db, entity)
                         db.delete(entity)
                         if _creator_id:
                             create_content_moderation_message(
@@ -1247,6 +1178,7 @@ def delete_character(
     
     picture_path = character.picture
     avatar_path = character.avatar_picture
+    record_deleted(db, character)
     db.delete(character)
     db.commit()
     delete_stored_image(picture_path)
@@ -1265,6 +1197,7 @@ def delete_scene(
     if not scene:
         raise HTTPException(status_code=404, detail="Scene not found")
     picture_path = scene.picture
+    record_deleted(db, scene)
     db.delete(scene)
     db.commit()
     delete_stored_image(picture_path)
@@ -1283,6 +1216,7 @@ def delete_persona(
         raise HTTPException(status_code=404, detail="Persona not found")
     picture_path = persona.picture
     avatar_path = persona.avatar_picture
+    record_deleted(db, persona)
     db.delete(persona)
     db.commit()
     delete_stored_image(picture_path)
@@ -1327,6 +1261,7 @@ def moderate_content_item(
         avatar_path = getattr(entity, 'avatar_picture', None)
         creator_id = entity.creator_id
         entity_name = entity.name
+        record_deleted(db, entity)
         db.delete(entity)
         db.flush()
         if creator_id:
@@ -11,6 +11,7 @@ from utils.validators import validate_account_fields
 from utils.sms_utils import send_verification_code, verify_code, create_verified_phone_token, verify_phone_token
 from utils.captcha_utils import verify_captcha_param, get_captcha_verifier
 from utils.audit_logger import record_audit
+from utils.analytics_rollup import record_activity
 from utils.request_utils import get_client_ip, get_user_agent, get_request_metadata, get_device_fingerprint, update_tracking_array
 from utils.image_moderation import moderate_image_with_decision
 from utils.text_moderation import moderate_form_payload_with_review
@@ -136,6 +137,7 @@ def register_user(
     # Store hashed password in a separate field if you add it to User model
     setattr(user, "hashed_password", hashed_password)
     db.add(user)
+    record_activity(db, user.id, registered=True)
     db.commit()
     db.refresh(user)
     
@@ -227,6 +229,7 @@ def login_user(
     fingerprint = get_device_fingerprint(request)
     user.last_known_ips = update_tracking_array(list(user.last_known_ips or []), client_ip)
     user.device_fingerprints = update_tracking_array(list(user.device_fingerprints or []), fingerprint)
+    record_activity(db, user.id, login=True)
     db.commit()
     token = create_session_token(user)
     user_response = build_user_response(user, db)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, UploadFile, File, Form, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy import func
 from sqlalchemy.orm import Session
@@ -20,113 +20,20 @@ from utils.validators import validate_character_fields
 from utils.content_censor import censor_form_payload
 from utils.text_moderation import moderate_form_payload_with_review
 from schemas import CharacterOut, CharacterListOut
-from utils.llm_client import client
 from utils.content_review_queue import enqueue_character_review
-from utils.usage_utils import normalize_usage, usage_to_credits
-from utils.credit_usage_ledger import apply_credit_usage_with_wallet
 from utils.credit_cap import can_consume_credits, get_credit_cap_info, build_credit_cap_reached_payload
 from utils.user_utils import get_active_ban_type, is_upload_banned
+from utils.view_counter import overlay_pending_views
+from utils.liked_set import get_liked_ids
+from utils.following_feed import publish_to_followers
+from utils.creator_stats import record_created, record_deleted, get_creator_stats
+from utils.conditional import entity_etag, not_modified, set_etag
+from utils.fast_json import model_response
+from utils.response_cache import CHARACTERS, cached_body, liked_list_response, list_variant
+from utils.long_description_chunker import clear_chunking, description_hash, notify_chunking_worker, schedule_chunking
 
 router = APIRouter()
 
-LONG_DESCRIPTION_CHUNK_PROMPT = """Split the following character description into semantic chunks for an AI roleplay system.
-
-Rules:
-
-* Each chunk should contain one coherent idea or topic.
-* Each chunk must be understandable on its own.
-* Maximum 800 words per chunk.
-* Maximum 20 chunks total.
-* Preserve important roleplay information.
-* Avoid repeating information across chunks.
-* Rewrite content into dense instruction-style text.
-* Use short phrases and compact wording.
-
-Order the chunks by importance for roleplay:
-
-* Most important character traits, behavior rules, and personality first.
-* Then relationships or motivations.
-* Then background or lore.
-* Least important details last.
-
-Output JSON only:
-
-{
-"chunks": [
-{"content": "..."},
-{"content": "..."}
-]
-}"""
-
-
-def _extract_json_payload(raw: str) -> dict:
-    content = (raw or "").strip()
-    if "```json" in content:
-        content = content.split("```json", 1)[1].split("```", 1)[0].strip()
-    elif "```" in content:
-        content = content.split("```", 1)[1].split("```", 1)[0].strip()
-    return json.loads(content)
-
-
-def _sanitize_chunks(payload: dict) -> list[dict[str, str]]:
-    chunks = payload.get("chunks") if isinstance(payload, dict) else []
-    if not isinstance(chunks, list):
-        return []
-    cleaned: list[dict[str, str]] = []
-    for chunk in chunks[:20]:
-        if not isinstance(chunk, dict):
-            continue
-        text = str(chunk.get("content", "")).strip()
-        if not text:
-            continue
-        words = text.split()
-        if len(words) > 800:
-            text = " ".join(words[:800]).strip()
-        cleaned.append({"content": text})
-    return cleaned
-
-
-def _fallback_split_chunks(long_description: str) -> list[dict[str, str]]:
-    words = (long_description or "").split()
-    if not words:
-        return []
-    chunks = []
-    for i in range(0, len(words), 800):
-        piece = " ".join(words[i:i + 800]).strip()
-        if piece:
-            chunks.append({"content": piece})
-        if len(chunks) >= 20:
-            break
-    return chunks
-
-
-def split_long_description_chunks(long_description: str) -> tuple[list[dict[str, str]], bool, dict]:
-    source = (long_description or "").strip()
-    empty_usage = normalize_usage(None)
-    if not source:
-        return [], True, empty_usage
-    try:
-        response = client.chat.completions.create(
-            model="deepseek-v4-flash",
-            messages=[
-                {"role": "system", "content": LONG_DESCRIPTION_CHUNK_PROMPT},
-                {"role": "user", "content": source},
-            ],
-            max_tokens=1800,
-            temperature=0.2,
-            top_p=0.9,
-        )
-        usage = normalize_usage(getattr(response, "usage", None))
-        raw = response.choices[0].message.content if response and response.choices else ""
-        parsed = _extract_json_payload(raw or "")
-        chunks = _sanitize_chunks(parsed)
-        if chunks:
-            return chunks, True, usage
-        return _fallback_split_chunks(source), False, usage
-    except Exception:
-        return _fallback_split_chunks(source), False, empty_usage
-
-
 def normalize_context_label(value: Optional[str]) -> str:
     return "advanced" if value == "advanced" else "standard"
 
@@ -303,32 +210,15 @@ async def create_character(
         presence_penalty=presence_penalty,
         frequency_penalty=frequency_penalty,
     ) if can_use_advanced_config else default_character_chat_config()
-    long_description_chunks = []
-    if context_label == "advanced" and normalized_long_description:
+    use_long_description_chunks = context_label == "advanced" and bool(normalized_long_description)
+    if use_long_description_chunks:
+        # The split itself is billed by the chunking worker once it has run
         credit_check = can_consume_credits(current_user, db)
         if credit_check["blocked"]:
             return JSONResponse(
                 content=build_credit_cap_reached_payload(credit_check.get("limit") or {}),
                 status_code=429,
             )
-        long_description_chunks, split_ok, split_usage = split_long_description_chunks(normalized_long_description)
-        if not split_ok:
-            raise HTTPException(status_code=502, detail="Failed to split long description into chunks")
-        if split_usage["total_tokens"] > 0:
-            split_credit_amount = usage_to_credits(split_usage, "deepseek-v4-flash")
-            usage_result = apply_credit_usage_with_wallet(
-                db,
-                user=current_user,
-                usage=split_usage,
-                source="character_long_description_split",
-                credit_amount=split_credit_amount,
-            )
-            if not usage_result.get("success"):
-                return JSONResponse(
-                    content=build_credit_cap_reached_payload(usage_result.get("limit") or credit_check.get("limit") or {}),
-                    status_code=429,
-                )
-            db.commit()
 
     char = Character(
         name=name,
@@ -338,7 +228,7 @@ async def create_character(
         greeting=greeting.strip(),
         example_messages=sample_dialogue.strip(),
         long_description=normalized_long_description,
-        long_description_chunks=long_description_chunks,
+        long_description_chunks=[],
         context_label=context_label,
         model=chat_config["model"],
         temperature=chat_config["temperature"],
@@ -357,9 +247,13 @@ async def create_character(
         forked_from_name=forked_from_name,
         background=parse_background_config(background),
     )
+    chunking_queued = use_long_description_chunks and schedule_chunking(char, normalized_long_description)
     db.add(char)
+    record_created(db, char)
     db.commit()
     db.refresh(char)
+    if char.is_public:
+        publish_to_followers(db, char.creator_id, "character", char.id, char.created_time)
 
     if needs_text_review:
         reason = f"Text moderation suggested REVIEW ({review_field}: {review_label or 'Unknown'})"
@@ -445,9 +339,12 @@ async def create_character(
 
     db.commit()
     db.refresh(char)
+    if chunking_queued:
+        notify_chunking_worker()
 
     return {
         "message": f"Character '{name}' created.",
+        "chunking_status": char.chunking_status,
         "content_censored": content_censored,
         "credit_limits": get_credit_cap_info(current_user, db),
     }
@@ -539,41 +436,19 @@ async def update_character(
     final_is_forkable = is_forkable if is_forkable is not None else char.is_forkable
 
     normalized_long_description = long_description.strip()
-    existing_long_description = (char.long_description or "").strip()
-    long_description_changed = normalized_long_description != existing_long_description
-
-    if context_label == "advanced":
-        if not normalized_long_description:
-            long_description_chunks = []
-        elif long_description_changed:
+    chunking_queued = False
+    if context_label == "advanced" and normalized_long_description:
+        # Unchanged text (same hash) keeps its chunks; otherwise the worker re-chunks and bills
+        if description_hash(normalized_long_description) != char.long_description_hash:
             credit_check = can_consume_credits(current_user, db)
             if credit_check["blocked"]:
                 return JSONResponse(
                     content=build_credit_cap_reached_payload(credit_check.get("limit") or {}),
                     status_code=429,
                 )
-            long_description_chunks, split_ok, split_usage = split_long_description_chunks(normalized_long_description)
-            if not split_ok:
-                raise HTTPException(status_code=502, detail="Failed to split long description into chunks")
-            if split_usage["total_tokens"] > 0:
-                split_credit_amount = usage_to_credits(split_usage, "deepseek-v4-flash")
-                usage_result = apply_credit_usage_with_wallet(
-                    db,
-                    user=current_user,
-                    usage=split_usage,
-                    source="character_long_description_split",
-                    credit_amount=split_credit_amount,
-                )
-                if not usage_result.get("success"):
-                    return JSONResponse(
-                        content=build_credit_cap_reached_payload(usage_result.get("limit") or credit_check.get("limit") or {}),
-                        status_code=429,
-                    )
-                db.commit()
-        else:
-            long_description_chunks = char.long_description_chunks or []
+        chunking_queued = schedule_chunking(char, normalized_long_description)
     else:
-        long_description_chunks = []
+        clear_chunking(char)
 
     char.name = name
     char.persona = persona
@@ -582,7 +457,6 @@ async def update_character(
     char.greeting = greeting.strip()
     char.example_messages = sample_dialogue.strip()
     char.long_description = normalized_long_description
-    char.long_description_chunks = long_description_chunks
     char.context_label = context_label
     can_use_advanced_config = is_pro_user
     chat_config = parse_character_chat_config(
@@ -678,8 +552,11 @@ async def update_character(
         )
 
     db.commit()
+    if chunking_queued:
+        notify_chunking_worker()
     return {
         "message": "Character updated successfully",
+        "chunking_status": char.chunking_status,
         "content_censored": content_censored,
         "credit_limits": get_credit_cap_info(current_user, db),
     }
@@ -695,7 +572,19 @@ def get_characters(search: str = None, db: Session = Depends(get_db)):
 
 
 @router.get("/api/character/{character_id}", response_model=CharacterOut)
-def get_character(character_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_character(
+    character_id: int,
+    request: Request,
+    response: Response,
+    include_pending_views: bool = Query(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    etag = None if include_pending_views else entity_etag(db, "character", character_id, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
     row = (
         db.query(Character, User.profile_pic.label("creator_profile_pic"))
         .outerjoin(User, Character.creator_id == User.id)
@@ -721,6 +610,9 @@ def get_character(character_id: int, current_user: User = Depends(get_current_us
         UserLikedCharacter.user_id == current_user.id,
         UserLikedCharacter.character_id == c.id
     ).first())
+    if include_pending_views:
+        overlay_pending_views("character", [c])
+    set_etag(response, etag)
     return c
 
 @router.delete("/api/character/{character_id}/delete")
@@ -740,46 +632,53 @@ async def delete_character(
 
     picture_path = char.picture
     avatar_path = char.avatar_picture
+    record_deleted(db, char)
     db.delete(char)
     db.commit()
     delete_stored_image(picture_path)
     delete_stored_image(avatar_path)
     return {"message": "角色已删除"}
 
-@router.get("/api/characters/popular", response_model=CharacterListOut)
-def get_popular_characters(
-    short: bool = Query(True),
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=100),
-    current_user: User = Depends(get_optional_current_user),
-    db: Session = Depends(get_db)
-):
+def _public_character_page(db: Session, order_by, short: bool, page: int, page_size: int) -> CharacterListOut:
+    """User-independent page of public characters (``liked`` is overlaid by the caller)."""
     total = db.query(Character).filter(Character.is_public == True).count()
     base_query = (
         db.query(Character, User.profile_pic.label("creator_profile_pic"))
         .outerjoin(User, Character.creator_id == User.id)
         .filter(Character.is_public == True)
-        .order_by(((Character.views + Character.likes * 3) / (func.extract('epoch', func.now() - Character.created_time) / 86400.0 + 2)).desc())
+        .order_by(order_by)
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
     if short:
         rows = base_query.limit(10).all()
-        items = []
-        for char, creator_profile_pic in rows:
-            char.creator_profile_pic = creator_profile_pic
-            char.liked = char.id in liked_ids
-            items.append(char)
-        return CharacterListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
+    else:
+        rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
     for char, creator_profile_pic in rows:
         char.creator_profile_pic = creator_profile_pic
-        char.liked = char.id in liked_ids
         items.append(char)
+    if short:
+        return CharacterListOut(items=items, total=total, page=1, page_size=len(items), short=True)
     return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
 
+
+@router.get("/api/characters/popular", response_model=CharacterListOut)
+def get_popular_characters(
+    short: bool = Query(True),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_optional_current_user),
+    db: Session = Depends(get_db)
+):
+    order_by = ((Character.views + Character.likes * 3) / (func.extract('epoch', func.now() - Character.created_time) / 86400.0 + 2)).desc()
+    body = cached_body(
+        "characters:popular",
+        list_variant(short, page, page_size),
+        surrogates=(CHARACTERS,),
+        build=lambda session: _public_character_page(session, order_by, short, page, page_size),
+        db=db,
+    )
+    return liked_list_response(body, db, current_user, "character")
+
 @router.get("/api/characters/recommended", response_model=CharacterListOut)
 def get_recommended_characters(
     short: bool = Query(True),
@@ -789,12 +688,12 @@ def get_recommended_characters(
     db: Session = Depends(get_db)
     ):
     items, total = get_cf_characters(db, current_user.id, page, page_size, short)
-    liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char in items])
     for char in items:
         char.liked = char.id in liked_ids
     if short:
-        return CharacterListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+        return model_response(CharacterListOut(items=items, total=total, page=1, page_size=len(items), short=True))
+    return model_response(CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 @router.get("/api/characters/by-tag/{tag_name}", response_model=List[CharacterOut])
 def get_characters_by_tag(
@@ -809,9 +708,7 @@ def get_characters_by_tag(
     ).order_by(
         Character.views.desc()
     ).limit(limit).all()
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char in chars])
     for char in chars:
         char.liked = char.id in liked_ids
     return chars
@@ -824,31 +721,14 @@ def get_recent_characters(
     current_user: User = Depends(get_optional_current_user),
     db: Session = Depends(get_db)
 ):
-    total = db.query(Character).filter(Character.is_public == True).count()
-    base_query = (
-        db.query(Character, User.profile_pic.label("creator_profile_pic"))
-        .outerjoin(User, Character.creator_id == User.id)
-        .filter(Character.is_public == True)
-        .order_by(Character.created_time.desc())
+    body = cached_body(
+        "characters:recent",
+        list_variant(short, page, page_size),
+        surrogates=(CHARACTERS,),
+        build=lambda session: _public_character_page(session, Character.created_time.desc(), short, page, page_size),
+        db=db,
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
-    if short:
-        rows = base_query.limit(10).all()
-        items = []
-        for char, creator_profile_pic in rows:
-            char.creator_profile_pic = creator_profile_pic
-            char.liked = char.id in liked_ids
-            items.append(char)
-        return CharacterListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
-    items = []
-    for char, creator_profile_pic in rows:
-        char.creator_profile_pic = creator_profile_pic
-        char.liked = char.id in liked_ids
-        items.append(char)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return liked_list_response(body, db, current_user, "character")
 
 @router.get("/api/characters/following", response_model=CharacterListOut)
 def get_following_characters(
@@ -861,7 +741,7 @@ def get_following_characters(
     """Get public characters from creators the current user follows, ordered by recency."""
     from models import UserFollow
     if not current_user:
-        return CharacterListOut(items=[], total=0, page=page, page_size=page_size, short=short)
+        return model_response(CharacterListOut(items=[], total=0, page=page, page_size=page_size, short=short))
 
     followed_ids_sq = (
         db.query(UserFollow.creator_id)
@@ -879,12 +759,12 @@ def get_following_characters(
     total = base_query.count()
     rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
-    liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char, _ in rows])
     for char, creator_profile_pic in rows:
         char.creator_profile_pic = creator_profile_pic
         char.liked = char.id in liked_ids
         items.append(char)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=short)
+    return model_response(CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=short))
 
 # ----------------------------------------------------------------
 
@@ -914,7 +794,7 @@ def get_user_created_characters(
             query = query.filter(Character.is_public == True)
     else:
         if not current_user:
-            return CharacterListOut(items=[], total=0, page=1, page_size=0, short=False)
+            return model_response(CharacterListOut(items=[], total=0, page=1, page_size=0, short=False))
         query = (
             db.query(Character, User.profile_pic.label("creator_profile_pic"))
             .outerjoin(User, Character.creator_id == User.id)
@@ -929,12 +809,12 @@ def get_user_created_characters(
     total = query.count()
     rows = query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
-    liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()} if current_user else set()
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char, _ in rows])
     for char, creator_profile_pic in rows:
         char.creator_profile_pic = creator_profile_pic
         char.liked = char.id in liked_ids
         items.append(char)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 @router.get("/api/characters-liked", response_model=CharacterListOut)
 def get_user_liked_characters(
@@ -945,7 +825,7 @@ def get_user_liked_characters(
     db: Session = Depends(get_db)
 ):
     if not current_user:
-        return CharacterListOut(items=[], total=0, page=1, page_size=0, short=False)
+        return model_response(CharacterListOut(items=[], total=0, page=1, page_size=0, short=False))
 
     query = (
         db.query(Character, User.profile_pic.label("creator_profile_pic"))
@@ -966,7 +846,7 @@ def get_user_liked_characters(
         char.creator_profile_pic = creator_profile_pic
         char.liked = True
         items.append(char)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 
 @router.get("/api/characters-recent-chats", response_model=CharacterListOut)
@@ -978,7 +858,7 @@ def get_recent_chat_characters(
 ):
     """Return characters the current user has recently chatted with, ordered by most recent chat."""
     if not current_user:
-        return CharacterListOut(items=[], total=0, page=1, page_size=0, short=False)
+        return model_response(CharacterListOut(items=[], total=0, page=1, page_size=0, short=False))
 
     from sqlalchemy import func
 
@@ -1008,12 +888,12 @@ def get_recent_chat_characters(
     )
 
     items = []
-    liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char, _ in rows])
     for char, creator_profile_pic in rows:
         char.creator_profile_pic = creator_profile_pic
         char.liked = char.id in liked_ids
         items.append(char)
-    return CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(CharacterListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 
 @router.get("/api/user/{user_id}/characters", response_model=List[CharacterOut])
@@ -1022,7 +902,7 @@ def get_user_characters(user_id: str, current_user: User = Depends(get_current_u
     if not current_user or current_user.id != user_id:
         query = query.filter(Character.is_public == True)
     characters = query.all()
-    liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()} if current_user else set()
+    liked_ids = get_liked_ids(db, current_user, "character", [char.id for char in characters])
     for char in characters:
         char.liked = char.id in liked_ids
     return characters
@@ -1031,16 +911,8 @@ def get_user_characters(user_id: str, current_user: User = Depends(get_current_u
 # Returns: {"total_views": int, "total_likes": int}
 @router.get("/api/user/{user_id}/character-stats")
 def get_user_character_stats(user_id: str, db: Session = Depends(get_db)):
-    # Only count public characters for other users, all for self (frontend should handle privacy)
-    characters = db.query(Character.id).filter(Character.creator_id == user_id).all()
-    char_ids = [c.id for c in characters]
-    if not char_ids:
+    # Totals over all of the user's characters, maintained in creator_stats
+    stats = get_creator_stats(db, user_id)
+    if not stats:
         return {"total_views": 0, "total_likes": 0}
-
-    # Total likes: sum likes of all characters
-    total_likes = db.query(func.coalesce(func.sum(Character.likes), 0)).filter(Character.id.in_(char_ids)).scalar() or 0
-
-    # Total views: sum views of all characters
-    total_views = db.query(func.coalesce(func.sum(Character.views), 0)).filter(Character.id.in_(char_ids)).scalar() or 0
-
-    return {"total_views": total_views, "total_likes": total_likes}
\ No newline at end of file
+    return {"total_views": stats.character_views, "total_likes": stats.character_likes}
\ No newline at end of file
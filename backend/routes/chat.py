@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Request, Depends, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
 from starlette.requests import ClientDisconnect
 from database import get_db
 from model_configs import ALLOWED_MODEL_IDS, get_model
 from utils.session import get_current_user
-from utils.llm_client import client, stream_chat_completion_with_config
+from utils.provider_router import create_chat_completion, stream_chat_completion
 from utils.chat_history_utils import (
     fetch_chat_history_entry,
     upsert_chat_history_entry,
@@ -25,21 +25,28 @@ from utils.chat_history_utils import (
     set_chat_history_active_branch_for_entry,
     toggle_chat_history_message_pin,
 )
+import asyncio
 import uuid
-import json
 import re
 import logging
 from pathlib import Path
 from datetime import datetime, UTC
 from models import User, Character, Scene, ChatHistory
 from utils.message_limit import can_send_user_message, increment_user_message_count
-from utils.context_window import compact_conversation_messages, resolve_context_window_settings
-from utils.usage_utils import normalize_usage, usage_to_credits
+from utils.context_window import assemble_prompt, compact_conversation_messages, resolve_context_window_settings, estimate_tokens
+from utils.usage_utils import add_usage, normalize_usage, usage_to_credits
 from utils.credit_usage_ledger import apply_credit_usage_with_wallet
 from utils.credit_cap import can_consume_credits, get_credit_cap_info, build_credit_cap_reached_payload
 from utils.model_rate_limiter import rate_limiter
-from utils.upstream_bucket import acquire_upstream
+from utils.chat_admission import admit_chat, cache_credit_block, CREDIT_CAP, RATE_LIMIT
 from utils.user_utils import is_chat_banned
+from utils.analytics_rollup import record_activity
+from utils.sse import SSEResponse
+from utils.conditional import chat_history_page_etag, not_modified, set_etag
+from utils.fast_json import FastJSONResponse
+from utils.stream_metrics import record_completed_stream, record_interrupted_stream
+from utils.prompt_cache_metrics import record_prompt_cache_usage
+from utils.stream_accumulator import StreamAccumulator, available_credits
 
 logger = logging.getLogger(__name__)
 
@@ -197,19 +204,6 @@ def build_chunk_context_system_message(selected_chunks: list[str]) -> dict | Non
     }
 
 
-def inject_chunk_context_message(messages: list[dict], context_message: dict | None) -> list[dict]:
-    if not context_message:
-        return messages
-    if not isinstance(messages, list) or not messages:
-        return [context_message]
-
-    injected = list(messages)
-    if injected[-1].get("role") == "user":
-        injected.insert(len(injected) - 1, context_message)
-    else:
-        injected.append(context_message)
-    return injected
-
 def generate_chat_title(messages, existing_title=None):
     """Generate a title from the first user message, or first assistant message as fallback"""
     if existing_title:
@@ -362,6 +356,14 @@ def _persist_chat_history_turn(
     if persona_id:
         payload["persona_id"] = persona_id
 
+    # Committed together with the history entry below
+    record_activity(
+        db_session,
+        current_user_id,
+        chat_messages=2,  # the user's message and the reply
+        new_chat=existing_entry is None,
+    )
+
     return upsert_chat_history_entry(
         db_session,
         user_id=current_user_id,
@@ -369,6 +371,173 @@ def _persist_chat_history_turn(
         payload=payload,
     )
 
+
+STOP_CLIENT_DISCONNECT = "client_disconnect"
+STOP_CREDIT_CAP = "credit_cap"
+
+
+async def _settle_interrupted_stream(
+    *,
+    current_user_id: str,
+    model: str,
+    max_tokens: int,
+    prepared_messages: list[dict],
+    partial_reply: str,
+    response_usage: dict[str, int],
+    is_user_request: bool,
+    persist_kwargs: dict | None,
+    reason: str = STOP_CLIENT_DISCONNECT,
+) -> dict | None:
+    """Bill and save what was generated before the stream was cut short.
+
+    *reason* is ``STOP_CLIENT_DISCONNECT`` (the client went away) or
+    ``STOP_CREDIT_CAP`` (we stopped before the reply outgrew the user's
+    credits).  The upstream is already closed.  The provider's usage normally
+    arrives with the last chunk, so it is estimated from the prompt and the
+    partial reply when missing.  When *persist_kwargs* is given (character
+    chats) a non-empty partial reply is saved with ``usage.interrupted`` set.
+
+    Called from the stream generator, also while it is being cancelled, so
+    the database work runs in a worker thread instead of on the event loop.
+
+    Returns the user's credit limits after billing, or None if nothing was billed.
+    """
+    if response_usage["total_tokens"] > 0:
+        usage = dict(response_usage)
+    else:
+        prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in prepared_messages)
+        completion_tokens = estimate_tokens(partial_reply)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "estimated": True,
+        }
+    usage["interrupted"] = True
+
+    credit_limits = await asyncio.to_thread(
+        _bill_interrupted_stream,
+        current_user_id=current_user_id,
+        model=model,
+        partial_reply=partial_reply,
+        usage=usage,
+        is_user_request=is_user_request,
+        persist_kwargs=persist_kwargs,
+        reason=reason,
+    )
+    if reason == STOP_CLIENT_DISCONNECT:
+        await record_interrupted_stream(usage["completion_tokens"], max_tokens)
+    return credit_limits
+
+
+def _bill_interrupted_stream(
+    *,
+    current_user_id: str,
+    model: str,
+    partial_reply: str,
+    usage: dict,
+    is_user_request: bool,
+    persist_kwargs: dict | None,
+    reason: str,
+) -> dict | None:
+    from database import SessionLocal
+
+    credit_amount = usage_to_credits(usage, model)
+    credit_limits = None
+
+    db_session = SessionLocal()
+    try:
+        stream_user = db_session.query(User).filter(User.id == current_user_id).first()
+        if not stream_user:
+            return None
+        increment_user_message_count(stream_user, db_session, is_user_request)
+        usage_result = apply_credit_usage_with_wallet(
+            db_session,
+            user=stream_user,
+            usage=usage,
+            source="chat_stream_interrupted" if reason == STOP_CLIENT_DISCONNECT else "chat_stream_credit_cap",
+            source_order_no=(persist_kwargs or {}).get("chat_id"),
+            metadata={"stream": True, "interrupted": True, "reason": reason},
+            credit_amount=credit_amount,
+        )
+        if not usage_result.get("success"):
+            db_session.rollback()
+            return None
+        if persist_kwargs is not None and partial_reply.strip():
+            _persist_chat_history_turn(
+                db_session,
+                current_user_id=current_user_id,
+                reply=partial_reply,
+                response_usage=usage,
+                **persist_kwargs,
+            )
+        credit_limits = get_credit_cap_info(stream_user, db_session)
+        db_session.commit()
+        logger.info(
+            "✂️ Stream interrupted (%s) | user=%s | chat=%s | model=%s | completion_tokens=%d%s | credit=%.4f",
+            reason,
+            current_user_id,
+            (persist_kwargs or {}).get("chat_id") or "none",
+            model,
+            usage["completion_tokens"],
+            " (estimated)" if usage.get("estimated") else "",
+            credit_amount,
+        )
+    except Exception:
+        db_session.rollback()
+        logger.exception("Failed to settle interrupted stream | user=%s", current_user_id)
+    finally:
+        db_session.close()
+
+    return credit_limits
+
+
+def _estimate_turn_tokens(messages: list, max_tokens: int) -> int:
+    """Upstream TPM charge for a turn: rough prompt size plus the completion budget."""
+    prompt_tokens = sum(
+        estimate_tokens(message.get("content") if isinstance(message.get("content"), str) else "")
+        for message in messages
+        if isinstance(message, dict)
+    )
+    return prompt_tokens + max_tokens
+
+
+def _admission_rejected_response(admission) -> JSONResponse:
+    headers = {"Retry-After": str(max(1, admission.retry_after_s))}
+    if admission.reason == CREDIT_CAP:
+        return JSONResponse(
+            content=build_credit_cap_reached_payload(admission.credit_limits or {}),
+            status_code=429,
+            headers=headers,
+        )
+    if admission.reason == RATE_LIMIT:
+        return JSONResponse(
+            content={
+                "error": "RATE_LIMIT_EXCEEDED",
+                "message": (
+                    "You are sending requests too quickly. "
+                    "Please wait a moment before trying again."
+                ),
+                "rate_limits": {
+                    "tier": admission.tier,
+                    "limit_rpm": admission.limit,
+                    "remaining": admission.remaining,
+                    "reset_seconds": admission.retry_after_s,
+                },
+            },
+            status_code=429,
+            headers=headers,
+        )
+    return JSONResponse(
+        content={
+            "error": "TOO_MANY_CONCURRENT_REQUESTS",
+            "message": "Please wait for your other replies to finish before sending another message.",
+        },
+        status_code=429,
+        headers=headers,
+    )
+
+
 @router.post("/api/chat")
 async def chat(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     try:
@@ -431,211 +600,303 @@ async def chat(request: Request, current_user: User = Depends(get_current_user),
             status_code=429,
         )
 
-    credit_check = can_consume_credits(current_user, db)
-    credit_limit_info = credit_check.get("limit") or {}
-    logger.info(
-        "💳 Credit check for user=%s | blocked=%s | consume_from_wallet=%s | cap_scope=%s | daily_used=%.2f | monthly_used=%.2f | cap=%.2f",
-        current_user.id,
-        credit_check["blocked"],
-        credit_check.get("consume_from_wallet", False),
-        credit_limit_info.get("cap_scope", "n/a"),
-        float(credit_limit_info.get("daily_credit_usage", 0)),
-        float(credit_limit_info.get("monthly_credit_usage", 0)),
-        float(credit_limit_info.get("credit_cap", 0)),
-    )
-    if credit_check["blocked"]:
-        return JSONResponse(
-            content=build_credit_cap_reached_payload(credit_limit_info),
-            status_code=429,
-        )
-
-    # --- Model API rate limit (per‑user, Redis‑backed sliding window) ---
-    rate_limit_result = await rate_limiter.check(
+    # --- Admission: cached credit flag, per-user RPM, in-flight cap and model limits in one Lua call ---
+    admission = await admit_chat(
         current_user.id,
+        chat_config["model"],
         is_pro=bool(current_user.is_pro),
+        tokens=_estimate_turn_tokens(messages, chat_config["max_tokens"]),
     )
-    if not rate_limit_result["allowed"]:
-        return JSONResponse(
-            content={
-                "error": "RATE_LIMIT_EXCEEDED",
-                "message": (
-                    "You are sending requests too quickly. "
-                    "Please wait a moment before trying again."
-                ),
-                "rate_limits": {
-                    "tier": rate_limit_result["tier"],
-                    "limit_rpm": rate_limit_result["limit"],
-                    "remaining": rate_limit_result["remaining"],
-                    "reset_seconds": rate_limit_result["reset_seconds"],
-                },
-            },
-            status_code=429,
-            headers={"Retry-After": str(max(1, rate_limit_result["reset_seconds"]))},
-        )
-
-    prepared_messages, prepared_context_info = compact_conversation_messages(
-        messages,
-        soft_token_limit=context_window_soft_limit,
-    )
-    if context_messages == messages:
-        context_window_info = prepared_context_info
-    else:
-        _, context_window_info = compact_conversation_messages(
-            context_messages,
-            soft_token_limit=context_window_soft_limit,
-        )
-
-    summary_usage = normalize_usage(None)
-    prepared_summary_usage = _extract_context_summary_usage(prepared_context_info)
-    summary_usage["prompt_tokens"] += prepared_summary_usage["prompt_tokens"]
-    summary_usage["completion_tokens"] += prepared_summary_usage["completion_tokens"]
-    summary_usage["total_tokens"] += prepared_summary_usage["total_tokens"]
-
-    if context_window_info is not prepared_context_info:
-        context_summary_usage = _extract_context_summary_usage(context_window_info)
-        summary_usage["prompt_tokens"] += context_summary_usage["prompt_tokens"]
-        summary_usage["completion_tokens"] += context_summary_usage["completion_tokens"]
-        summary_usage["total_tokens"] += context_summary_usage["total_tokens"]
+    if admission.rejected:
+        return _admission_rejected_response(admission)
 
-    if summary_usage["total_tokens"] > 0:
-        summary_credit_amount = usage_to_credits(summary_usage, "deepseek-v4-flash")
+    # Every path below either takes over the ticket (released when the turn
+    # ends) or hands it back; anything that escapes gives it back too
+    try:
+        credit_check = can_consume_credits(current_user, db)
+        credit_limit_info = credit_check.get("limit") or {}
         logger.info(
-            "📝 Summary credit | user=%s | chat=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f",
+            "💳 Credit check for user=%s | blocked=%s | consume_from_wallet=%s | cap_scope=%s | daily_used=%.2f | monthly_used=%.2f | cap=%.2f",
             current_user.id,
-            chat_id or "none",
-            summary_usage["prompt_tokens"],
-            summary_usage["completion_tokens"],
-            summary_usage["total_tokens"],
-            summary_credit_amount,
-        )
-        summary_usage_result = apply_credit_usage_with_wallet(
-            db,
-            user=current_user,
-            usage=summary_usage,
-            source="chat_context_summary",
-            metadata={"chat_id": chat_id},
-            credit_amount=summary_credit_amount,
+            credit_check["blocked"],
+            credit_check.get("consume_from_wallet", False),
+            credit_limit_info.get("cap_scope", "n/a"),
+            float(credit_limit_info.get("daily_credit_usage", 0)),
+            float(credit_limit_info.get("monthly_credit_usage", 0)),
+            float(credit_limit_info.get("credit_cap", 0)),
         )
-        if not summary_usage_result.get("success"):
+        if credit_check["blocked"]:
+            # Later turns are turned away by the admission script without a Postgres read
+            await cache_credit_block(current_user.id, credit_limit_info)
+            await admission.refund()
             return JSONResponse(
-                content=build_credit_cap_reached_payload(summary_usage_result.get("limit") or credit_limit_info),
+                content=build_credit_cap_reached_payload(credit_limit_info),
                 status_code=429,
             )
-        db.commit()
-        credit_limit_info = get_credit_cap_info(current_user, db)
-        logger.info(
-            "✅ Summary credit applied | user=%s | consumed_from_wallet=%s",
-            current_user.id,
-            summary_usage_result.get("consumed_from_wallet", False),
-        )
-    if not prepared_messages:
-        return JSONResponse(content={"error": "Invalid messages after normalization"}, status_code=400)
-
-    # Get existing chat info if this is an existing chat
-    existing_entry = None
-    if chat_id:
-        existing_entry = fetch_chat_history_entry(db, current_user.id, chat_id)
-        if existing_entry and (not isinstance(branch_id, str) or not branch_id.strip()):
-            branch_id = serialize_chat_history_entry(existing_entry).get("active_branch_id")
-    if isinstance(branch_id, str):
-        branch_id = branch_id.strip() or None
-    else:
-        branch_id = None
 
-    if isinstance(fork_from_message_id, str):
-        fork_from_message_id = fork_from_message_id.strip() or None
-    else:
-        fork_from_message_id = None
-
-    # Generate chat_id upfront for new chats
-    if not chat_id and character_id:
-        chat_id = str(uuid.uuid4())
-
-    character = None
-    effective_character_id = character_id or (existing_entry.character_id if existing_entry else None)
-    if effective_character_id:
-        character = db.query(Character).filter(Character.id == effective_character_id).first()
-        if not character:
-            raise HTTPException(status_code=404, detail="Character not found")
-
-        latest_user_message = _extract_latest_user_message(full_messages)
-        selected_chunks = select_long_description_chunks(
-            character.long_description_chunks,
-            latest_user_message,
-            always_include=2,
-            max_keyword_matched=2,
+        prepared_messages, prepared_context_info = compact_conversation_messages(
+            messages,
+            soft_token_limit=context_window_soft_limit,
         )
-        chunk_context_message = build_chunk_context_system_message(selected_chunks)
-        prepared_messages = inject_chunk_context_message(prepared_messages, chunk_context_message)
-
-    if stream:
-        # Return streaming response
-        async def generate():
-            accumulated_reply = ""
-            current_credit_limit_info = credit_limit_info
-            response_usage = {
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-            }
+        if context_messages == messages:
+            context_window_info = prepared_context_info
+        else:
+            _, context_window_info = compact_conversation_messages(
+                context_messages,
+                soft_token_limit=context_window_soft_limit,
+            )
 
-            # --- upstream bucket (per-model RPM pacing) ---
-            if not await acquire_upstream(chat_config["model"], is_pro=bool(current_user.is_pro)):
-                yield f"data: {json.dumps({'error': 'UPSTREAM_BUSY', 'message': 'The model provider is currently at capacity. Please try again shortly.'})}\n\n"
-                return
+        summary_usage = normalize_usage(None)
+        add_usage(summary_usage, _extract_context_summary_usage(prepared_context_info))
+
+        if context_window_info is not prepared_context_info:
+            add_usage(summary_usage, _extract_context_summary_usage(context_window_info))
+
+        if summary_usage["total_tokens"] > 0:
+            summary_credit_amount = usage_to_credits(summary_usage, "deepseek-v4-flash")
+            logger.info(
+                "📝 Summary credit | user=%s | chat=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f",
+                current_user.id,
+                chat_id or "none",
+                summary_usage["prompt_tokens"],
+                summary_usage["completion_tokens"],
+                summary_usage["total_tokens"],
+                summary_credit_amount,
+            )
+            summary_usage_result = apply_credit_usage_with_wallet(
+                db,
+                user=current_user,
+                usage=summary_usage,
+                source="chat_context_summary",
+                metadata={"chat_id": chat_id},
+                credit_amount=summary_credit_amount,
+            )
+            if not summary_usage_result.get("success"):
+                await admission.refund()
+                return JSONResponse(
+                    content=build_credit_cap_reached_payload(summary_usage_result.get("limit") or credit_limit_info),
+                    status_code=429,
+                )
+            db.commit()
+            credit_limit_info = get_credit_cap_info(current_user, db)
+            logger.info(
+                "✅ Summary credit applied | user=%s | consumed_from_wallet=%s",
+                current_user.id,
+                summary_usage_result.get("consumed_from_wallet", False),
+            )
+        if not prepared_messages:
+            await admission.refund()
+            return JSONResponse(content={"error": "Invalid messages after normalization"}, status_code=400)
+
+        # Get existing chat info if this is an existing chat
+        existing_entry = None
+        if chat_id:
+            existing_entry = fetch_chat_history_entry(db, current_user.id, chat_id)
+            if existing_entry and (not isinstance(branch_id, str) or not branch_id.strip()):
+                branch_id = serialize_chat_history_entry(existing_entry).get("active_branch_id")
+        if isinstance(branch_id, str):
+            branch_id = branch_id.strip() or None
+        else:
+            branch_id = None
 
-            try:
-                for stream_event in stream_chat_completion_with_config(
-                    prepared_messages,
-                    model=chat_config["model"],
-                    max_tokens=chat_config["max_tokens"],
-                    temperature=chat_config["temperature"],
-                    top_p=chat_config["top_p"],
-                    presence_penalty=chat_config["presence_penalty"],
-                    frequency_penalty=chat_config["frequency_penalty"],
-                ):
-                    event_type = (stream_event or {}).get("type")
-                    if event_type == "usage":
-                        response_usage = normalize_usage((stream_event or {}).get("usage"))
-                        continue
-
-                    chunk = (stream_event or {}).get("content")
-                    if not isinstance(chunk, str) or not chunk:
-                        continue
-
-                    accumulated_reply += chunk
-                    # Send each chunk as SSE
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-                
-                # After streaming completes, save to database
-                stream_credit_amount = usage_to_credits(response_usage, chat_config["model"])
-                logger.info(
-                    "💬 Stream credit | user=%s | chat=%s | model=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f | has_character=%s",
-                    current_user.id,
-                    chat_id or "none",
+        if isinstance(fork_from_message_id, str):
+            fork_from_message_id = fork_from_message_id.strip() or None
+        else:
+            fork_from_message_id = None
+
+        # Generate chat_id upfront for new chats
+        if not chat_id and character_id:
+            chat_id = str(uuid.uuid4())
+
+        character = None
+        chunk_context_message = None
+        effective_character_id = character_id or (existing_entry.character_id if existing_entry else None)
+        if effective_character_id:
+            character = db.query(Character).filter(Character.id == effective_character_id).first()
+            if not character:
+                raise HTTPException(status_code=404, detail="Character not found")
+
+            latest_user_message = _extract_latest_user_message(full_messages)
+            selected_chunks = select_long_description_chunks(
+                character.long_description_chunks,
+                latest_user_message,
+                always_include=2,
+                max_keyword_matched=2,
+            )
+            chunk_context_message = build_chunk_context_system_message(selected_chunks)
+
+        # Stable-first: character prompt, summary, history, then this turn's memory chunks
+        prepared_messages = assemble_prompt(prepared_messages, chunk_context_message)
+
+        def _persist_kwargs() -> dict:
+            return dict(
+                chat_id=chat_id,
+                existing_entry=existing_entry,
+                character_id=character_id,
+                scene_id=scene_id,
+                persona_id=persona_id,
+                full_messages=full_messages,
+                persisted_chat_config=persisted_chat_config,
+                context_window_soft_limit=context_window_soft_limit,
+                requested_branch_id=branch_id,
+                fork_from_message_id=fork_from_message_id,
+            )
+
+        if stream:
+            # Return streaming response
+            async def generate():
+                reply = StreamAccumulator(
                     chat_config["model"],
-                    response_usage["prompt_tokens"],
-                    response_usage["completion_tokens"],
-                    response_usage["total_tokens"],
-                    stream_credit_amount,
-                    bool(character_id),
+                    prepared_messages,
+                    budget_credits=available_credits(credit_limit_info),
                 )
-                if character_id:
-                    # Create new DB session for generator context
-                    from database import SessionLocal
-                    db_session = SessionLocal()
+                current_credit_limit_info = credit_limit_info
+                response_usage = {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                }
+
+                # --- upstream bucket: wait for the dispenser if admission queued us ---
+                if not await admission.wait_upstream():
+                    yield {'error': 'UPSTREAM_BUSY', 'message': 'The model provider is currently at capacity. Please try again shortly.'}
+                    return
+
+                upstream_finished = False
+                over_budget = False
+                try:
+                    upstream = stream_chat_completion(
+                        prepared_messages,
+                        model=chat_config["model"],
+                        max_tokens=chat_config["max_tokens"],
+                        temperature=chat_config["temperature"],
+                        top_p=chat_config["top_p"],
+                        presence_penalty=chat_config["presence_penalty"],
+                        frequency_penalty=chat_config["frequency_penalty"],
+                    )
                     try:
-                        stream_user = db_session.query(User).filter(User.id == current_user.id).first()
-                        if not stream_user:
-                            raise HTTPException(status_code=404, detail="User not found")
+                        async for stream_event in upstream:
+                            event_type = (stream_event or {}).get("type")
+                            if event_type == "usage":
+                                response_usage = normalize_usage((stream_event or {}).get("usage"))
+                                continue
+
+                            chunk = (stream_event or {}).get("content")
+                            if not isinstance(chunk, str) or not chunk:
+                                continue
+
+                            if not reply.add(chunk):
+                                # The next chunk would cost more than the user has left: stop here
+                                over_budget = True
+                                break
+                            # SSEResponse coalesces deltas into frames
+                            yield chunk
+                    finally:
+                        # Closes the upstream HTTP response right away if we stop early
+                        try:
+                            await upstream.aclose()
+                        finally:
+                            await admission.release(response_usage["total_tokens"] or reply.estimated_usage()["total_tokens"])
+                    upstream_finished = True
+
+                    if over_budget:
+                        settled_limits = await _settle_interrupted_stream(
+                            current_user_id=current_user.id,
+                            model=chat_config["model"],
+                            max_tokens=chat_config["max_tokens"],
+                            prepared_messages=prepared_messages,
+                            partial_reply=reply.text,
+                            response_usage=reply.estimated_usage(),
+                            is_user_request=limit_check["is_user_request"],
+                            persist_kwargs=_persist_kwargs() if character_id else None,
+                            reason=STOP_CREDIT_CAP,
+                        )
+                        yield {
+                            **build_credit_cap_reached_payload(settled_limits or current_credit_limit_info),
+                            'truncated': True,
+                            'chat_id': chat_id,
+                        }
+                        return
+
+                    await record_completed_stream()
+                    await record_prompt_cache_usage(chat_config["model"], response_usage)
+                
+                    # After streaming completes, save to database
+                    stream_credit_amount = usage_to_credits(response_usage, chat_config["model"])
+                    logger.info(
+                        "💬 Stream credit | user=%s | chat=%s | model=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f | has_character=%s",
+                        current_user.id,
+                        chat_id or "none",
+                        chat_config["model"],
+                        response_usage["prompt_tokens"],
+                        response_usage["completion_tokens"],
+                        response_usage["total_tokens"],
+                        stream_credit_amount,
+                        bool(character_id),
+                    )
+                    if character_id:
+                        # Create new DB session for generator context
+                        from database import SessionLocal
+                        db_session = SessionLocal()
+                        try:
+                            stream_user = db_session.query(User).filter(User.id == current_user.id).first()
+                            if not stream_user:
+                                raise HTTPException(status_code=404, detail="User not found")
+                            limit_info = increment_user_message_count(
+                                stream_user,
+                                db_session,
+                                limit_check["is_user_request"],
+                            ) or (limit_check.get("limit") or {})
+                            usage_result = apply_credit_usage_with_wallet(
+                                db_session,
+                                user=stream_user,
+                                usage=response_usage,
+                                source="chat_stream",
+                                source_order_no=chat_id,
+                                metadata={"stream": True, "character_id": character_id},
+                                credit_amount=stream_credit_amount,
+                            )
+                            if not usage_result.get("success"):
+                                db_session.rollback()
+                                yield {'error': 'CREDIT_CAP_REACHED', 'credit_limits': usage_result.get('limit') or {}}
+                                return
+                            logger.info(
+                                "✅ Stream credit applied (w/ character) | user=%s | chat=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
+                                current_user.id,
+                                chat_id,
+                                usage_result.get("consumed_from_wallet", False),
+                                float(usage_result.get("wallet_balance_after", 0)),
+                            )
+                            entry = _persist_chat_history_turn(
+                                db_session,
+                                current_user_id=current_user.id,
+                                chat_id=chat_id,
+                                existing_entry=existing_entry,
+                                character_id=character_id,
+                                scene_id=scene_id,
+                                persona_id=persona_id,
+                                full_messages=full_messages,
+                                reply=reply.text,
+                                response_usage=response_usage,
+                                persisted_chat_config=persisted_chat_config,
+                                context_window_soft_limit=context_window_soft_limit,
+                                requested_branch_id=branch_id,
+                                fork_from_message_id=fork_from_message_id,
+                            )
+                            serialized_entry = serialize_chat_history_entry(entry)
+                            current_credit_limit_info = get_credit_cap_info(stream_user, db_session)
+                            db_session.commit()
+                        finally:
+                            db_session.close()
+                    else:
                         limit_info = increment_user_message_count(
-                            stream_user,
-                            db_session,
+                            current_user,
+                            db,
                             limit_check["is_user_request"],
                         ) or (limit_check.get("limit") or {})
                         usage_result = apply_credit_usage_with_wallet(
-                            db_session,
-                            user=stream_user,
+                            db,
+                            user=current_user,
                             usage=response_usage,
                             source="chat_stream",
                             source_order_no=chat_id,
@@ -643,200 +904,184 @@ async def chat(request: Request, current_user: User = Depends(get_current_user),
                             credit_amount=stream_credit_amount,
                         )
                         if not usage_result.get("success"):
-                            db_session.rollback()
-                            yield f"data: {json.dumps({'error': 'CREDIT_CAP_REACHED', 'credit_limits': usage_result.get('limit') or {}})}\n\n"
+                            db.rollback()
+                            yield {'error': 'CREDIT_CAP_REACHED', 'credit_limits': usage_result.get('limit') or {}}
                             return
+                        db.commit()
+                        current_credit_limit_info = get_credit_cap_info(current_user, db)
                         logger.info(
-                            "✅ Stream credit applied (w/ character) | user=%s | chat=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
+                            "✅ Stream credit applied (wo/ character) | user=%s | chat=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
                             current_user.id,
                             chat_id,
                             usage_result.get("consumed_from_wallet", False),
                             float(usage_result.get("wallet_balance_after", 0)),
                         )
-                        entry = _persist_chat_history_turn(
-                            db_session,
+
+                    # Send final metadata
+                    # Use actual prompt_tokens from the LLM response when available; the
+                    # pre-call estimate in context_window_info is based only on the input
+                    # messages and is especially inaccurate for the improvised-greeting
+                    # turn where there are no prior messages to derive real usage from.
+                    actual_prompt_tokens = response_usage.get("prompt_tokens", 0)
+                    effective_context_window_info = (
+                        {**context_window_info, "input_tokens": actual_prompt_tokens}
+                        if actual_prompt_tokens > 0
+                        else context_window_info
+                    )
+                    done_payload = {
+                        'done': True,
+                        'chat_id': chat_id,
+                        'chat_title': generate_chat_title(full_messages, existing_entry.title if existing_entry else None),
+                        'limits': limit_info,
+                        'credit_limits': current_credit_limit_info,
+                        'context_window': {**effective_context_window_info, 'message_count': len(context_messages), 'selected_tier': context_window_tier},
+                    }
+                    if character_id:
+                        done_payload['chat_entry'] = serialized_entry
+                        done_payload['branch_id'] = serialized_entry.get('active_branch_id')
+                    yield done_payload
+            
+                except (GeneratorExit, asyncio.CancelledError):
+                    # Client disconnected (SSEResponse closed us): bill and keep only what was generated
+                    if not upstream_finished:
+                        await _settle_interrupted_stream(
                             current_user_id=current_user.id,
-                            chat_id=chat_id,
-                            existing_entry=existing_entry,
-                            character_id=character_id,
-                            scene_id=scene_id,
-                            persona_id=persona_id,
-                            full_messages=full_messages,
-                            reply=accumulated_reply,
+                            model=chat_config["model"],
+                            max_tokens=chat_config["max_tokens"],
+                            prepared_messages=prepared_messages,
+                            partial_reply=reply.text,
                             response_usage=response_usage,
-                            persisted_chat_config=persisted_chat_config,
-                            context_window_soft_limit=context_window_soft_limit,
-                            requested_branch_id=branch_id,
-                            fork_from_message_id=fork_from_message_id,
+                            is_user_request=limit_check["is_user_request"],
+                            persist_kwargs=_persist_kwargs() if character_id else None,
                         )
-                        serialized_entry = serialize_chat_history_entry(entry)
-                        current_credit_limit_info = get_credit_cap_info(stream_user, db_session)
-                        db_session.commit()
-                    finally:
-                        db_session.close()
-                else:
-                    limit_info = increment_user_message_count(
-                        current_user,
-                        db,
-                        limit_check["is_user_request"],
-                    ) or (limit_check.get("limit") or {})
-                    usage_result = apply_credit_usage_with_wallet(
-                        db,
-                        user=current_user,
-                        usage=response_usage,
-                        source="chat_stream",
-                        source_order_no=chat_id,
-                        metadata={"stream": True, "character_id": character_id},
-                        credit_amount=stream_credit_amount,
-                    )
-                    if not usage_result.get("success"):
-                        db.rollback()
-                        yield f"data: {json.dumps({'error': 'CREDIT_CAP_REACHED', 'credit_limits': usage_result.get('limit') or {}})}\n\n"
-                        return
-                    db.commit()
-                    current_credit_limit_info = get_credit_cap_info(current_user, db)
-                    logger.info(
-                        "✅ Stream credit applied (wo/ character) | user=%s | chat=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
-                        current_user.id,
-                        chat_id,
-                        usage_result.get("consumed_from_wallet", False),
-                        float(usage_result.get("wallet_balance_after", 0)),
-                    )
-
-                # Send final metadata
-                # Use actual prompt_tokens from the LLM response when available; the
-                # pre-call estimate in context_window_info is based only on the input
-                # messages and is especially inaccurate for the improvised-greeting
-                # turn where there are no prior messages to derive real usage from.
-                actual_prompt_tokens = response_usage.get("prompt_tokens", 0)
-                effective_context_window_info = (
-                    {**context_window_info, "input_tokens": actual_prompt_tokens}
-                    if actual_prompt_tokens > 0
-                    else context_window_info
-                )
-                done_payload = {
-                    'done': True,
-                    'chat_id': chat_id,
-                    'chat_title': generate_chat_title(full_messages, existing_entry.title if existing_entry else None),
-                    'limits': limit_info,
-                    'credit_limits': current_credit_limit_info,
-                    'context_window': {**effective_context_window_info, 'message_count': len(context_messages), 'selected_tier': context_window_tier},
-                }
-                if character_id:
-                    done_payload['chat_entry'] = serialized_entry
-                    done_payload['branch_id'] = serialized_entry.get('active_branch_id')
-                yield f"data: {json.dumps(done_payload)}\n\n"
-            
-            except ClientDisconnect:
-                return
-            except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-
-        return StreamingResponse(
-            generate(),
-            media_type="text/event-stream",
-            headers={
-                "X-RateLimit-Limit-Minute": str(rate_limit_result["limit"]),
-                "X-RateLimit-Remaining-Minute": str(rate_limit_result["remaining"]),
-            },
-        )
-    
-    else:
-        # Non-streaming fallback (original logic)
-
-        # --- upstream bucket (per-model RPM pacing) ---
-        if not await acquire_upstream(chat_config["model"], is_pro=bool(current_user.is_pro)):
-            return JSONResponse(
-                content={
-                    "error": "UPSTREAM_BUSY",
-                    "message": "The model provider is currently at capacity. Please try again shortly.",
+                    raise
+                except ClientDisconnect:
+                    return
+                except Exception as e:
+                    yield {'error': str(e)}
+
+            return SSEResponse(
+                generate(),
+                # Hands the ticket back if the stream ends before generate() ran;
+                # a no-op once the turn has released it
+                on_close=admission.refund,
+                headers={
+                    "X-RateLimit-Limit-Minute": str(admission.limit),
+                    "X-RateLimit-Remaining-Minute": str(admission.remaining),
                 },
-                status_code=503,
             )
+    
+        else:
+            # Non-streaming fallback (original logic)
+
+            # --- upstream bucket: wait for the dispenser if admission queued us ---
+            if not await admission.wait_upstream():
+                return JSONResponse(
+                    content={
+                        "error": "UPSTREAM_BUSY",
+                        "message": "The model provider is currently at capacity. Please try again shortly.",
+                    },
+                    status_code=503,
+                )
 
-        try:
-            response = client.chat.completions.create(
-                model=chat_config["model"],
-                messages=prepared_messages,
-                max_tokens=chat_config["max_tokens"],
-                temperature=chat_config["temperature"],
-                top_p=chat_config["top_p"],
-                presence_penalty=chat_config["presence_penalty"],
-                frequency_penalty=chat_config["frequency_penalty"],
-            )
-            reply = response.choices[0].message.content.strip()
-            response_usage = normalize_usage(getattr(response, "usage", None))
-        except Exception:
-            return JSONResponse(content={"error": "Server busy, please try again later."}, status_code=503)
-
-        limit_info = increment_user_message_count(
-            current_user,
-            db,
-            limit_check["is_user_request"],
-        ) or (limit_check.get("limit") or {})
-        non_stream_credit_amount = usage_to_credits(response_usage, chat_config["model"])
-        logger.info(
-            "💬 Non-stream credit | user=%s | chat=%s | model=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f",
-            current_user.id,
-            chat_id or "none",
-            chat_config["model"],
-            response_usage["prompt_tokens"],
-            response_usage["completion_tokens"],
-            response_usage["total_tokens"],
-            non_stream_credit_amount,
-        )
-        usage_result = apply_credit_usage_with_wallet(
-            db,
-            user=current_user,
-            usage=response_usage,
-            source="chat_non_stream",
-            source_order_no=chat_id,
-            metadata={"stream": False, "character_id": character_id},
-            credit_amount=non_stream_credit_amount,
-        )
-        if not usage_result.get("success"):
-            db.rollback()
-            return JSONResponse(
-                content=build_credit_cap_reached_payload(usage_result.get("limit") or credit_limit_info),
-                status_code=429,
+            response_usage = normalize_usage(None)
+            try:
+                response = await create_chat_completion(
+                    prepared_messages,
+                    model=chat_config["model"],
+                    max_tokens=chat_config["max_tokens"],
+                    temperature=chat_config["temperature"],
+                    top_p=chat_config["top_p"],
+                    presence_penalty=chat_config["presence_penalty"],
+                    frequency_penalty=chat_config["frequency_penalty"],
+                )
+                reply = response.choices[0].message.content.strip()
+                response_usage = normalize_usage(getattr(response, "usage", None))
+            except Exception:
+                return JSONResponse(content={"error": "Server busy, please try again later."}, status_code=503)
+            finally:
+                await admission.release(response_usage["total_tokens"])
+            await record_prompt_cache_usage(chat_config["model"], response_usage)
+
+            limit_info = increment_user_message_count(
+                current_user,
+                db,
+                limit_check["is_user_request"],
+            ) or (limit_check.get("limit") or {})
+            non_stream_credit_amount = usage_to_credits(response_usage, chat_config["model"])
+            logger.info(
+                "💬 Non-stream credit | user=%s | chat=%s | model=%s | prompt_tokens=%d | completion_tokens=%d | total_tokens=%d | credit=%.4f",
+                current_user.id,
+                chat_id or "none",
+                chat_config["model"],
+                response_usage["prompt_tokens"],
+                response_usage["completion_tokens"],
+                response_usage["total_tokens"],
+                non_stream_credit_amount,
             )
-        db.commit()
-        credit_limit_info = get_credit_cap_info(current_user, db)
-        logger.info(
-            "✅ Non-stream credit applied | user=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
-            current_user.id,
-            usage_result.get("consumed_from_wallet", False),
-            float(usage_result.get("wallet_balance_after", 0)),
-        )
-
-        serialized_entry = None
-
-        # Update chat history
-        if character_id:
-            entry = _persist_chat_history_turn(
+            usage_result = apply_credit_usage_with_wallet(
                 db,
-                current_user_id=current_user.id,
-                chat_id=chat_id,
-                existing_entry=existing_entry,
-                character_id=character_id,
-                scene_id=scene_id,
-                persona_id=persona_id,
-                full_messages=full_messages,
-                reply=reply,
-                response_usage=response_usage,
-                persisted_chat_config=persisted_chat_config,
-                context_window_soft_limit=context_window_soft_limit,
-                requested_branch_id=branch_id,
-                fork_from_message_id=fork_from_message_id,
+                user=current_user,
+                usage=response_usage,
+                source="chat_non_stream",
+                source_order_no=chat_id,
+                metadata={"stream": False, "character_id": character_id},
+                credit_amount=non_stream_credit_amount,
             )
-            serialized_entry = serialize_chat_history_entry(entry)
+            if not usage_result.get("success"):
+                db.rollback()
+                return JSONResponse(
+                    content=build_credit_cap_reached_payload(usage_result.get("limit") or credit_limit_info),
+                    status_code=429,
+                )
+            db.commit()
+            credit_limit_info = get_credit_cap_info(current_user, db)
+            logger.info(
+                "✅ Non-stream credit applied | user=%s | consumed_from_wallet=%s | wallet_balance_after=%.2f",
+                current_user.id,
+                usage_result.get("consumed_from_wallet", False),
+                float(usage_result.get("wallet_balance_after", 0)),
+            )
+
+            serialized_entry = None
+
+            # Update chat history
+            if character_id:
+                entry = _persist_chat_history_turn(
+                    db,
+                    current_user_id=current_user.id,
+                    chat_id=chat_id,
+                    existing_entry=existing_entry,
+                    character_id=character_id,
+                    scene_id=scene_id,
+                    persona_id=persona_id,
+                    full_messages=full_messages,
+                    reply=reply,
+                    response_usage=response_usage,
+                    persisted_chat_config=persisted_chat_config,
+                    context_window_soft_limit=context_window_soft_limit,
+                    requested_branch_id=branch_id,
+                    fork_from_message_id=fork_from_message_id,
+                )
+                serialized_entry = serialize_chat_history_entry(entry)
+
+                return FastJSONResponse({
+                    "response": reply,
+                    "chat_id": entry.chat_id,
+                    "chat_title": entry.title,
+                    "branch_id": serialized_entry.get("active_branch_id"),
+                    "chat_entry": serialized_entry,
+                    "limits": limit_info,
+                    "credit_limits": credit_limit_info,
+                    "context_window": {
+                        **context_window_info,
+                        "message_count": len(context_messages),
+                        "selected_tier": context_window_tier,
+                    },
+                })
 
             return {
                 "response": reply,
-                "chat_id": entry.chat_id,
-                "chat_title": entry.title,
-                "branch_id": serialized_entry.get("active_branch_id"),
-                "chat_entry": serialized_entry,
                 "limits": limit_info,
                 "credit_limits": credit_limit_info,
                 "context_window": {
@@ -845,17 +1090,10 @@ async def chat(request: Request, current_user: User = Depends(get_current_user),
                     "selected_tier": context_window_tier,
                 },
             }
+    except BaseException:
+        await admission.refund()
+        raise
 
-        return {
-            "response": reply,
-            "limits": limit_info,
-            "credit_limits": credit_limit_info,
-            "context_window": {
-                **context_window_info,
-                "message_count": len(context_messages),
-                "selected_tier": context_window_tier,
-            },
-        }
 
 @router.post("/api/chat/rename")
 async def rename_chat(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -952,10 +1190,10 @@ async def select_chat_branch(request: Request, current_user: User = Depends(get_
     db.commit()
     db.refresh(entry)
 
-    return {
+    return FastJSONResponse({
         "status": "success",
         "chat": serialize_chat_history_entry(entry),
-    }
+    })
 
 
 @router.post("/api/chat/pin-message")
@@ -1063,6 +1301,7 @@ async def restore_chat_to_recent(request: Request, current_user: User = Depends(
 
 @router.get("/api/chat/history")
 async def get_chat_history(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     current_user: User = Depends(get_current_user),
@@ -1072,7 +1311,13 @@ async def get_chat_history(
         page = 1
     if page_size < 1 or page_size > 100:
         page_size = 20
-    return fetch_user_chat_history_paginated(db, current_user.id, page=page, page_size=page_size)
+    etag = chat_history_page_etag(db, current_user.id, page, page_size)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    response = FastJSONResponse(fetch_user_chat_history_paginated(db, current_user.id, page=page, page_size=page_size))
+    set_etag(response, etag)
+    return response
 
 
 @router.get("/api/chat/history-by-character")
@@ -1086,7 +1331,7 @@ async def get_chat_history_by_character(
         page = 1
     if page_size < 1 or page_size > 100:
         page_size = 20
-    return fetch_user_chat_history_grouped_by_character(db, current_user.id, page=page, page_size=page_size)
+    return FastJSONResponse(fetch_user_chat_history_grouped_by_character(db, current_user.id, page=page, page_size=page_size))
 
 
 @router.post("/api/chat/delete-by-character")
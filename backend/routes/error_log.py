@@ -5,7 +5,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query, status, Header
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, func
 from database import get_db
-from models import ErrorLogModel, User
+from models import ErrorLogModel, ErrorFingerprint, ErrorStatsHourly, User
 from utils.session import get_current_admin_user, get_current_user
 from pydantic import BaseModel, field_validator
 from typing import List, Optional
@@ -31,6 +31,7 @@ class ErrorLogResponse(BaseModel):
     request_body: Optional[str]
     stack_trace: Optional[str]
     context: Optional[str]
+    fingerprint: Optional[str] = None
     resolved: bool
     resolved_at: Optional[str]
     resolved_by: Optional[str]
@@ -103,6 +104,10 @@ class LogFrontendErrorRequest(BaseModel):
         return v
 
 
+def _hour_floor(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
 # Static routes must come before parameterized routes to avoid route conflicts
 # /stats must come before /{error_id}
 @router.get("/stats")
@@ -111,39 +116,47 @@ def get_error_logs_stats(
     current_user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db),
 ) -> dict:
-    """Get error log statistics for the last N hours. Admin only."""
-    cutoff_date = datetime.now(UTC) - timedelta(hours=hours)
-    
-    logs = db.query(ErrorLogModel).filter(
-        ErrorLogModel.timestamp >= cutoff_date
+    """Get error log statistics for the last N hours. Admin only.
+
+    Reads the hourly rollup maintained by the error writer, so counts include
+    occurrences that were not sampled into ``error_logs``.  The window is
+    aligned to whole hours.
+    """
+    cutoff_bucket = _hour_floor(datetime.now(UTC) - timedelta(hours=hours))
+
+    rows = db.query(
+        ErrorStatsHourly.severity,
+        ErrorStatsHourly.source,
+        ErrorStatsHourly.error_type,
+        func.sum(ErrorStatsHourly.count),
+    ).filter(
+        ErrorStatsHourly.bucket >= cutoff_bucket
+    ).group_by(
+        ErrorStatsHourly.severity,
+        ErrorStatsHourly.source,
+        ErrorStatsHourly.error_type,
     ).all()
-    
-    # Calculate statistics
+
     stats = {
-        "total_errors": len(logs),
+        "total_errors": 0,
         "by_severity": {},
         "by_source": {},
         "by_error_type": {},
         "critical_count": 0,
     }
-    
-    for log in logs:
-        # By severity
-        severity = log.severity or "unknown"
-        stats["by_severity"][severity] = stats["by_severity"].get(severity, 0) + 1
-        
-        # By source
-        source = log.source or "unknown"
-        stats["by_source"][source] = stats["by_source"].get(source, 0) + 1
-        
-        # By error type
-        error_type = log.error_type or "unknown"
-        stats["by_error_type"][error_type] = stats["by_error_type"].get(error_type, 0) + 1
-        
-        # Critical count
-        if log.severity == "critical":
-            stats["critical_count"] += 1
-    
+
+    for severity, source, error_type, count in rows:
+        count = int(count or 0)
+        severity = severity or "unknown"
+        source = source or "unknown"
+        error_type = error_type or "unknown"
+        stats["total_errors"] += count
+        stats["by_severity"][severity] = stats["by_severity"].get(severity, 0) + count
+        stats["by_source"][source] = stats["by_source"].get(source, 0) + count
+        stats["by_error_type"][error_type] = stats["by_error_type"].get(error_type, 0) + count
+        if severity == "critical":
+            stats["critical_count"] += count
+
     return stats
 
 
@@ -154,45 +167,64 @@ def get_error_logs_summary(
     db: Session = Depends(get_db),
 ) -> dict:
     """Get a summary of recent errors. Admin only."""
-    # Last 24 hours
-    last_24h = datetime.now(UTC) - timedelta(hours=24)
-    
-    recent_errors = db.query(ErrorLogModel).filter(
-        ErrorLogModel.timestamp >= last_24h
-    ).all()
-    
-    # Last 7 days
-    last_7d = datetime.now(UTC) - timedelta(days=7)
-    week_errors = db.query(ErrorLogModel).filter(
-        ErrorLogModel.timestamp >= last_7d
-    ).all()
-    
+    now = datetime.now(UTC)
+    last_24h = _hour_floor(now - timedelta(hours=24))
+    last_7d = _hour_floor(now - timedelta(days=7))
+
+    def _total_since(cutoff: datetime) -> int:
+        total = db.query(func.sum(ErrorStatsHourly.count)).filter(
+            ErrorStatsHourly.bucket >= cutoff
+        ).scalar()
+        return int(total or 0)
+
     # Unresolved critical errors
     critical_unresolved = db.query(ErrorLogModel).filter(
         ErrorLogModel.severity == "critical",
         ErrorLogModel.resolved == False
     ).count()
-    
+
+    type_count = func.sum(ErrorStatsHourly.count)
+    most_common = db.query(
+        ErrorStatsHourly.error_type,
+        type_count,
+    ).filter(
+        ErrorStatsHourly.bucket >= last_24h
+    ).group_by(
+        ErrorStatsHourly.error_type
+    ).order_by(
+        desc(type_count)
+    ).limit(5).all()
+
+    top_fingerprints = db.query(ErrorFingerprint).filter(
+        ErrorFingerprint.last_seen >= last_24h
+    ).order_by(
+        desc(ErrorFingerprint.count)
+    ).limit(5).all()
+
     return {
-        "errors_last_24h": len(recent_errors),
-        "errors_last_7d": len(week_errors),
+        "errors_last_24h": _total_since(last_24h),
+        "errors_last_7d": _total_since(last_7d),
         "critical_unresolved": critical_unresolved,
         "most_common_errors": [
             {
-                "error_type": log[0],
-                "count": log[1]
+                "error_type": error_type,
+                "count": int(count or 0)
+            }
+            for error_type, count in most_common
+        ],
+        "top_fingerprints": [
+            {
+                "fingerprint": fp.fingerprint,
+                "error_type": fp.error_type,
+                "endpoint": fp.endpoint,
+                "message": fp.sample_message,
+                "count": fp.count,
+                "stored_count": fp.stored_count,
+                "first_seen": fp.first_seen.isoformat() if fp.first_seen else None,
+                "last_seen": fp.last_seen.isoformat() if fp.last_seen else None,
             }
-            for log in db.query(
-                ErrorLogModel.error_type,
-                func.count(ErrorLogModel.id)
-            ).filter(
-                ErrorLogModel.timestamp >= last_24h
-            ).group_by(
-                ErrorLogModel.error_type
-            ).order_by(
-                desc(func.count(ErrorLogModel.id))
-            ).limit(5).all()
-        ]
+            for fp in top_fingerprints
+        ],
     }
 
 
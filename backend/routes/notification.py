@@ -5,6 +5,7 @@ from models import SystemNotification, User
 from pydantic import BaseModel
 from typing import List, Optional
 from utils.session import get_current_user
+from utils.response_cache import NOTIFICATIONS, cached_body, json_body_response
 
 router = APIRouter()
 
@@ -35,9 +36,7 @@ class NotificationResponse(BaseModel):
         from_attributes = True
 
 
-@router.get("/api/notification/active")
-async def get_active_notification(db: Session = Depends(get_db)):
-    """Get the active notification (public endpoint)"""
+def _active_notification(db: Session) -> Optional[dict]:
     notification = db.query(SystemNotification).filter(
         SystemNotification.is_active == True
     ).first()
@@ -55,6 +54,20 @@ async def get_active_notification(db: Session = Depends(get_db)):
     }
 
 
+@router.get("/api/notification/active")
+def get_active_notification(db: Session = Depends(get_db)):
+    """Get the active notification (public endpoint)"""
+    body = cached_body(
+        "notification:active", "any",
+        surrogates=(NOTIFICATIONS,),
+        build=_active_notification,
+        db=db,
+        fresh_s=60,
+        stale_s=300,
+    )
+    return json_body_response(body)
+
+
 @router.get("/api/admin/notifications")
 async def get_all_notifications(
     current_user: User = Depends(get_current_user),
@@ -11,6 +11,7 @@ from utils.session import verify_session_token
 from utils.sms_utils import send_verification_code, verify_code
 from utils.audit_logger import record_audit
 from utils.request_utils import get_client_ip, get_user_agent, get_request_metadata
+from utils import ephemeral_store
 
 router = APIRouter()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -94,12 +95,27 @@ def change_password(request: Request, payload: dict = None, db: Session = Depend
 
 # ==================== 密码重置相关端点 ====================
 
-# 存储重置密码的验证码和token（生产环境应使用Redis）
-reset_verification_codes = {}
-reset_tokens = {}
+# 重置密码的验证码和token存放在Redis中（多worker共享，过期由TTL处理）
+RESET_CODE_TTL_S = 300
+RESET_CODE_INTERVAL_S = 60
+RESET_TOKEN_TTL_S = 600
+
+
+def _reset_code_key(email: str) -> str:
+    return f"password_reset:code:{email}"
+
+
+def _reset_code_window_key(email: str) -> str:
+    return f"password_reset:send_window:{email}"
+
+
+def _reset_token_key(reset_token: str) -> str:
+    return f"password_reset:token:{reset_token}"
+
 
 @router.post("/api/send-reset-code-phone")
 async def send_reset_code_phone(
+    request: Request,
     phone_number: str = Form(...),
     db: Session = Depends(get_db)
 ):
@@ -113,7 +129,7 @@ async def send_reset_code_phone(
         )
     
     # 发送验证码
-    result = await send_verification_code(phone_number)
+    result = await send_verification_code(phone_number, get_client_ip(request))
     return result
 
 
@@ -141,12 +157,8 @@ def verify_reset_code_phone(
     
     # 生成重置token
     import secrets
-    from datetime import datetime, timedelta
     reset_token = secrets.token_urlsafe(32)
-    reset_tokens[reset_token] = {
-        'user_id': user.id,
-        'expires_at': datetime.now() + timedelta(minutes=10)
-    }
+    ephemeral_store.put_json(_reset_token_key(reset_token), {'user_id': user.id}, RESET_TOKEN_TTL_S)
     
     return {
         "success": True,
@@ -170,23 +182,16 @@ def send_reset_code_email(
     
     # 生成6位数字验证码
     import secrets
-    from datetime import datetime, timedelta
     code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
     
     # 存储验证码（60秒内不能重复发送）
-    if email in reset_verification_codes:
-        last_send = reset_verification_codes[email].get('sent_at')
-        if last_send and (datetime.now() - last_send).total_seconds() < 60:
-            return {
-                "success": False,
-                "message": "请求过于频繁，请60秒后再试"
-            }
+    if not ephemeral_store.claim_window(_reset_code_window_key(email), RESET_CODE_INTERVAL_S):
+        return {
+            "success": False,
+            "message": "请求过于频繁，请60秒后再试"
+        }
     
-    reset_verification_codes[email] = {
-        'code': code,
-        'sent_at': datetime.now(),
-        'expires_at': datetime.now() + timedelta(minutes=5)
-    }
+    ephemeral_store.put_json(_reset_code_key(email), {'code': code}, RESET_CODE_TTL_S)
     
     # TODO: 实际发送邮件（需要配置邮件服务）
     # 开发环境直接返回验证码
@@ -206,21 +211,12 @@ def verify_reset_code_email(
     db: Session = Depends(get_db)
 ):
     """验证邮箱密码重置验证码"""
-    from datetime import datetime
-    
-    # 验证验证码
-    if email not in reset_verification_codes:
+    # 验证验证码（过期的验证码已被Redis TTL清除）
+    stored = ephemeral_store.get_json(_reset_code_key(email))
+    if not stored:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="请先获取验证码"
-        )
-    
-    stored = reset_verification_codes[email]
-    if datetime.now() > stored['expires_at']:
-        del reset_verification_codes[email]
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="验证码已过期"
+            detail="验证码不存在或已过期，请重新获取"
         )
     
     if stored['code'] != code:
@@ -239,15 +235,11 @@ def verify_reset_code_email(
     
     # 生成重置token
     import secrets
-    from datetime import timedelta
     reset_token = secrets.token_urlsafe(32)
-    reset_tokens[reset_token] = {
-        'user_id': user.id,
-        'expires_at': datetime.now() + timedelta(minutes=10)
-    }
+    ephemeral_store.put_json(_reset_token_key(reset_token), {'user_id': user.id}, RESET_TOKEN_TTL_S)
     
     # 删除已使用的验证码
-    del reset_verification_codes[email]
+    ephemeral_store.delete(_reset_code_key(email))
     
     return {
         "success": True,
@@ -262,21 +254,12 @@ def reset_password_with_token(
     db: Session = Depends(get_db)
 ):
     """使用重置token重置密码"""
-    from datetime import datetime
-    
-    # 验证token
-    if reset_token not in reset_tokens:
+    # 验证token（一次性使用：原子取出并删除，过期由Redis TTL处理）
+    token_data = ephemeral_store.take_json(_reset_token_key(reset_token))
+    if not token_data:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="无效的重置令牌"
-        )
-    
-    token_data = reset_tokens[reset_token]
-    if datetime.now() > token_data['expires_at']:
-        del reset_tokens[reset_token]
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="重置令牌已过期，请重新验证"
+            detail="无效或已过期的重置令牌，请重新验证"
         )
     
     # 获取用户
@@ -292,9 +275,6 @@ def reset_password_with_token(
     user.hashed_password = hashed_password
     db.commit()
     
-    # 删除已使用的token
-    del reset_tokens[reset_token]
-    
     return {
         "success": True,
         "message": "密码重置成功"
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request, Depends, HTTPException, Form, UploadFile, File, Query
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, Form, UploadFile, File, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy import func
 from sqlalchemy.orm import Session
@@ -15,21 +15,21 @@ from datetime import datetime, UTC
 from schemas import PersonaOut, PersonaListOut
 from utils.content_censor import censor_form_payload
 from utils.user_utils import get_active_ban_type, is_upload_banned
+from utils.view_counter import overlay_pending_views
+from utils.liked_set import get_liked_ids
+from utils.following_feed import publish_to_followers
+from utils.creator_stats import record_created, record_deleted
+from utils.conditional import entity_etag, not_modified, set_etag
+from utils.fast_json import model_response
+from utils.response_cache import PERSONAS, cached_body, liked_list_response, list_variant
 
 router = APIRouter()
 
 MAX_DESCRIPTION_LENGTH = 400
 
 
-# Popular Personas
-@router.get("/api/personas/popular", response_model=PersonaListOut)
-def get_popular_personas(
-    short: bool = Query(True),
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=100),
-    current_user: User = Depends(get_optional_current_user),
-    db: Session = Depends(get_db)
-):
+def _popular_persona_page(db: Session, short: bool, page: int, page_size: int) -> PersonaListOut:
+    """User-independent page of popular personas (``liked`` is overlaid by the caller)."""
     total = db.query(Persona).filter(Persona.is_public == True).count()
     base_query = (
         db.query(Persona, User.profile_pic.label("creator_profile_pic"))
@@ -37,28 +37,37 @@ def get_popular_personas(
         .filter(Persona.is_public == True)
         .order_by(((Persona.views + Persona.likes * 3) / (func.extract('epoch', func.now() - Persona.created_time) / 86400.0 + 2)).desc())
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
     if short:
         rows = base_query.limit(10).all()
-        items = []
-        for persona, creator_profile_pic in rows:
-            persona.creator_profile_pic = creator_profile_pic
-            persona.liked = persona.id in liked_ids
-            items.append(persona)
-        return PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
+    else:
+        rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
     for persona, creator_profile_pic in rows:
         persona.creator_profile_pic = creator_profile_pic
-        persona.liked = persona.id in liked_ids
         items.append(persona)
+    if short:
+        return PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True)
     return PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False)
 
+
+# Popular Personas
+@router.get("/api/personas/popular", response_model=PersonaListOut)
+def get_popular_personas(
+    short: bool = Query(True),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_optional_current_user),
+    db: Session = Depends(get_db)
+):
+    body = cached_body(
+        "personas:popular",
+        list_variant(short, page, page_size),
+        surrogates=(PERSONAS,),
+        build=lambda session: _popular_persona_page(session, short, page, page_size),
+        db=db,
+    )
+    return liked_list_response(body, db, current_user, "persona")
+
 # Recent Personas
 @router.get("/api/personas/recent", response_model=PersonaListOut)
 def get_recent_personas(
@@ -75,27 +84,23 @@ def get_recent_personas(
         .filter(Persona.is_public == True)
         .order_by(Persona.created_time.desc())
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
     if short:
         rows = base_query.limit(10).all()
         items = []
+        liked_ids = get_liked_ids(db, current_user, "persona", [persona.id for persona, _ in rows])
         for persona, creator_profile_pic in rows:
             persona.creator_profile_pic = creator_profile_pic
             persona.liked = persona.id in liked_ids
             items.append(persona)
-        return PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True)
+        return model_response(PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True))
     rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
+    liked_ids = get_liked_ids(db, current_user, "persona", [persona.id for persona, _ in rows])
     for persona, creator_profile_pic in rows:
         persona.creator_profile_pic = creator_profile_pic
         persona.liked = persona.id in liked_ids
         items.append(persona)
-    return PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 # Recommended Personas (collaborative filtering)
 @router.get("/api/personas/recommended", response_model=PersonaListOut)
@@ -108,17 +113,12 @@ def get_recommended_personas(
 ):
     user_id = current_user.id if current_user else None
     items, total = get_cf_personas(db, user_id, page, page_size, short)
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
+    liked_ids = get_liked_ids(db, current_user, "persona", [persona.id for persona in items])
     for persona in items:
         persona.liked = persona.id in liked_ids
     if short:
-        return PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    return PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+        return model_response(PersonaListOut(items=items, total=total, page=1, page_size=len(items), short=True))
+    return model_response(PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 # ------------------- PERSONA CRUD ROUTES -------------------
 
@@ -189,8 +189,11 @@ async def create_persona(
         forked_from_name=forked_from_name,
     )
     db.add(persona)
+    record_created(db, persona)
     db.commit()
     db.refresh(persona)
+    if persona.is_public:
+        publish_to_followers(db, persona.creator_id, "persona", persona.id, persona.created_time)
     if picture:
         image_bytes = await picture.read()
         is_safe, label, _ = moderate_image_with_decision(image_bytes)
@@ -250,19 +253,26 @@ def get_personas(
     if search:
         query = query.filter(Persona.name.ilike(f"%{search}%"))
     personas = query.all()
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
+    liked_ids = get_liked_ids(db, current_user, "persona", [persona.id for persona in personas])
     for persona in personas:
         persona.liked = persona.id in liked_ids
     return personas
 
 # Read single Persona
 @router.get("/api/personas/{persona_id}", response_model=PersonaOut)
-def get_persona(persona_id: int, current_user: User = Depends(get_optional_current_user), db: Session = Depends(get_db)):
+def get_persona(
+    persona_id: int,
+    request: Request,
+    response: Response,
+    include_pending_views: bool = Query(False),
+    current_user: User = Depends(get_optional_current_user),
+    db: Session = Depends(get_db),
+):
+    etag = None if include_pending_views else entity_etag(db, "persona", persona_id, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
     persona = db.query(Persona).filter(Persona.id == persona_id).first()
     if not persona:
         raise HTTPException(status_code=404, detail="Persona not found")
@@ -280,6 +290,9 @@ def get_persona(persona_id: int, current_user: User = Depends(get_optional_curre
         persona.liked = liked is not None
     else:
         persona.liked = False
+    if include_pending_views:
+        overlay_pending_views("persona", [persona])
+    set_etag(response, etag)
     return persona
 
 # Update Persona
@@ -390,6 +403,7 @@ def delete_persona(persona_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=403, detail="Not authorized")
     picture_path = persona.picture
     avatar_path = persona.avatar_picture
+    record_deleted(db, persona)
     db.delete(persona)
     db.commit()
     delete_stored_image(picture_path)
@@ -452,7 +466,7 @@ def get_personas_created(
             query = query.filter(Persona.is_public == True)
     else:
         if not current_user:
-            return PersonaListOut(items=[], total=0, page=1, page_size=0, short=False)
+            return model_response(PersonaListOut(items=[], total=0, page=1, page_size=0, short=False))
         query = (
             db.query(Persona, User.profile_pic.label("creator_profile_pic"))
             .outerjoin(User, Persona.creator_id == User.id)
@@ -466,18 +480,13 @@ def get_personas_created(
     
     total = query.count()
     rows = query.offset((page - 1) * page_size).limit(page_size).all()
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
     items = []
+    liked_ids = get_liked_ids(db, current_user, "persona", [persona.id for persona, _ in rows])
     for persona, creator_profile_pic in rows:
         persona.creator_profile_pic = creator_profile_pic
         persona.liked = persona.id in liked_ids
         items.append(persona)
-    return PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 # Get personas liked by a user
 @router.get("/api/personas-liked", response_model=PersonaListOut)
@@ -498,7 +507,7 @@ def get_personas_liked(
         target_user_id = userId
     else:
         if not current_user:
-            return PersonaListOut(items=[], total=0, page=1, page_size=0, short=False)
+            return model_response(PersonaListOut(items=[], total=0, page=1, page_size=0, short=False))
         target_user_id = current_user.id
 
     query = (
@@ -520,4 +529,4 @@ def get_personas_liked(
         persona.creator_profile_pic = creator_profile_pic
         persona.liked = True  # all results in this endpoint are already liked by target_user
         items.append(persona)
-    return PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False)
\ No newline at end of file
+    return model_response(PersonaListOut(items=items, total=total, page=page, page_size=page_size, short=False))
\ No newline at end of file
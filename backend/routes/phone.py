@@ -17,6 +17,7 @@ from utils.request_utils import get_client_ip, get_device_fingerprint, update_tr
 from utils.image_moderation import moderate_image_with_decision
 from utils.text_moderation import moderate_form_payload_with_review
 from utils.invitation_utils import generate_invitation_code, process_invitation_code, track_invitation
+from utils.analytics_rollup import record_activity
 import re
 from typing import Optional
 
@@ -26,7 +27,7 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Send SMS verification code endpoint
 @router.post("/api/send-verification-code")
-async def send_sms_code(phone_number: str = Form(...)):
+async def send_sms_code(request: Request, phone_number: str = Form(...)):
     """发送短信验证码"""
     # 验证手机号格式（中国大陆）
     if not re.match(r'^1[3-9]\d{9}$', phone_number):
@@ -35,7 +36,7 @@ async def send_sms_code(phone_number: str = Form(...)):
             detail="Invalid phone number format"
         )
     
-    result = await send_verification_code(phone_number)
+    result = await send_verification_code(phone_number, get_client_ip(request))
     if not result['success']:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -96,6 +97,8 @@ def verify_phone(
     
     if user:
         # 已存在用户，直接登录
+        record_activity(db, user.id, login=True)
+        db.commit()
         token = create_session_token(user)
         user_response = build_user_response(user, db)
         return {
@@ -213,6 +216,7 @@ def register_with_phone(
     )
     
     db.add(user)
+    record_activity(db, user.id, registered=True)
     db.commit()
     db.refresh(user)
     
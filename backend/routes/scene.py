@@ -1,5 +1,5 @@
 
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Query
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, Form, UploadFile, File, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy import func
 from sqlalchemy.orm import Session
@@ -16,6 +16,13 @@ from datetime import datetime, UTC
 from schemas import SceneOut, SceneListOut
 from utils.content_censor import censor_form_payload
 from utils.user_utils import get_active_ban_type, is_upload_banned
+from utils.view_counter import overlay_pending_views
+from utils.liked_set import get_liked_ids
+from utils.following_feed import publish_to_followers
+from utils.creator_stats import record_created, record_deleted
+from utils.conditional import entity_etag, not_modified, set_etag
+from utils.fast_json import model_response
+from utils.response_cache import SCENES, cached_body, liked_list_response, list_variant
 
 
 router = APIRouter()
@@ -94,8 +101,11 @@ async def create_scene(
         forked_from_name=forked_from_name,
     )
     db.add(scene)
+    record_created(db, scene)
     db.commit()
     db.refresh(scene)
+    if scene.is_public:
+        publish_to_followers(db, scene.creator_id, "scene", scene.id, scene.created_time)
     if picture:
         image_bytes = await picture.read()
         is_safe, label, _ = moderate_image_with_decision(image_bytes)
@@ -160,7 +170,7 @@ def get_scenes_created(
             query = query.filter(Scene.is_public == True)
     else:
         if not current_user:
-            return SceneListOut(items=[], total=0, page=1, page_size=0, short=False)
+            return model_response(SceneListOut(items=[], total=0, page=1, page_size=0, short=False))
         query = (
             db.query(Scene, User.profile_pic.label("creator_profile_pic"))
             .outerjoin(User, Scene.creator_id == User.id)
@@ -175,23 +185,16 @@ def get_scenes_created(
     total = query.count()
     rows = query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
-    liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()} if current_user else set()
+    liked_ids = get_liked_ids(db, current_user, "scene", [scene.id for scene, _ in rows])
     for scene, creator_profile_pic in rows:
         scene.creator_profile_pic = creator_profile_pic
         scene.liked = scene.id in liked_ids
         items.append(SceneOut.from_orm(scene))
-    return SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 
-# Popular Scenes
-@router.get("/api/scenes/popular", response_model=SceneListOut)
-def get_popular_scenes(
-    short: bool = Query(True),
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=100),
-    current_user: User = Depends(get_optional_current_user),
-    db: Session = Depends(get_db)
-):
+def _popular_scene_page(db: Session, short: bool, page: int, page_size: int) -> SceneListOut:
+    """User-independent page of popular scenes (``liked`` is overlaid by the caller)."""
     total = db.query(Scene).filter(Scene.is_public == True).count()
     base_query = (
         db.query(Scene, User.profile_pic.label("creator_profile_pic"))
@@ -199,25 +202,37 @@ def get_popular_scenes(
         .filter(Scene.is_public == True)
         .order_by(((Scene.views + Scene.likes * 3) / (func.extract('epoch', func.now() - Scene.created_time) / 86400.0 + 2)).desc())
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
     if short:
         rows = base_query.limit(10).all()
-        items = []
-        for scene, creator_profile_pic in rows:
-            scene.creator_profile_pic = creator_profile_pic
-            scene.liked = scene.id in liked_ids
-            items.append(SceneOut.from_orm(scene))
-        return SceneListOut(items=items, total=total, page=1, page_size=len(items), short=True)
-    rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
+    else:
+        rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
     for scene, creator_profile_pic in rows:
         scene.creator_profile_pic = creator_profile_pic
-        scene.liked = scene.id in liked_ids
         items.append(SceneOut.from_orm(scene))
+    if short:
+        return SceneListOut(items=items, total=total, page=1, page_size=len(items), short=True)
     return SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False)
 
+
+# Popular Scenes
+@router.get("/api/scenes/popular", response_model=SceneListOut)
+def get_popular_scenes(
+    short: bool = Query(True),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(get_optional_current_user),
+    db: Session = Depends(get_db)
+):
+    body = cached_body(
+        "scenes:popular",
+        list_variant(short, page, page_size),
+        surrogates=(SCENES,),
+        build=lambda session: _popular_scene_page(session, short, page, page_size),
+        db=db,
+    )
+    return liked_list_response(body, db, current_user, "scene")
+
 # Recent Scenes
 @router.get("/api/scenes/recent", response_model=SceneListOut)
 def get_recent_scenes(
@@ -234,24 +249,23 @@ def get_recent_scenes(
         .filter(Scene.is_public == True)
         .order_by(Scene.created_time.desc())
     )
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
     if short:
         rows = base_query.limit(10).all()
         items = []
+        liked_ids = get_liked_ids(db, current_user, "scene", [scene.id for scene, _ in rows])
         for scene, creator_profile_pic in rows:
             scene.creator_profile_pic = creator_profile_pic
             scene.liked = scene.id in liked_ids
             items.append(SceneOut.from_orm(scene))
-        return SceneListOut(items=items, total=total, page=1, page_size=len(items), short=True)
+        return model_response(SceneListOut(items=items, total=total, page=1, page_size=len(items), short=True))
     rows = base_query.offset((page - 1) * page_size).limit(page_size).all()
     items = []
+    liked_ids = get_liked_ids(db, current_user, "scene", [scene.id for scene, _ in rows])
     for scene, creator_profile_pic in rows:
         scene.creator_profile_pic = creator_profile_pic
         scene.liked = scene.id in liked_ids
         items.append(SceneOut.from_orm(scene))
-    return SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False)
+    return model_response(SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False))
 
 
 # Recommended Scenes (collaborative filtering)
@@ -264,16 +278,28 @@ def get_recommended_scenes(
     db: Session = Depends(get_db)
 ):
     items, total = get_cf_scenes(db, current_user.id, page, page_size, short)
-    liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
+    liked_ids = get_liked_ids(db, current_user, "scene", [scene.id for scene in items])
     for scene in items:
         scene.liked = scene.id in liked_ids
     if short:
-        return SceneListOut(items=[SceneOut.from_orm(s) for s in items], total=total, page=1, page_size=len(items), short=True)
-    return SceneListOut(items=[SceneOut.from_orm(s) for s in items], total=total, page=page, page_size=page_size, short=False)
+        return model_response(SceneListOut(items=[SceneOut.from_orm(s) for s in items], total=total, page=1, page_size=len(items), short=True))
+    return model_response(SceneListOut(items=[SceneOut.from_orm(s) for s in items], total=total, page=page, page_size=page_size, short=False))
 
 # Read single Scene
 @router.get("/api/scenes/{scene_id}", response_model=SceneOut)
-def get_scene(scene_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_scene(
+    scene_id: int,
+    request: Request,
+    response: Response,
+    include_pending_views: bool = Query(False),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    etag = None if include_pending_views else entity_etag(db, "scene", scene_id, current_user)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
     row = (
         db.query(Scene, User.profile_pic.label("creator_profile_pic"))
         .outerjoin(User, Scene.creator_id == User.id)
@@ -297,6 +323,9 @@ def get_scene(scene_id: int, current_user: User = Depends(get_current_user), db:
         UserLikedScene.user_id == current_user.id,
         UserLikedScene.scene_id == scene.id
     ).first())
+    if include_pending_views:
+        overlay_pending_views("scene", [scene])
+    set_etag(response, etag)
     return scene
 
 # Update Scene
@@ -398,6 +427,7 @@ def delete_scene(scene_id: int, db: Session = Depends(get_db), current_user: Use
     if scene.creator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     picture_path = scene.picture
+    record_deleted(db, scene)
     db.delete(scene)
     db.commit()
     delete_stored_image(picture_path)
@@ -425,7 +455,7 @@ def get_scenes_liked(
     else:
         if not current_user:
             logger.debug("[scenes-liked] no current_user and no userId; returning empty list")
-            return SceneListOut(items=[], total=0, page=1, page_size=0, short=False)
+            return model_response(SceneListOut(items=[], total=0, page=1, page_size=0, short=False))
         target_user_id = current_user.id
 
     logger.debug(
@@ -463,4 +493,4 @@ def get_scenes_liked(
         scene.creator_profile_pic = creator_profile_pic
         scene.liked = True
         items.append(SceneOut.from_orm(scene))
-    return SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False)
\ No newline at end of file
+    return model_response(SceneListOut(items=items, total=total, page=page, page_size=page_size, short=False))
\ No newline at end of file
@@ -3,10 +3,12 @@ from fastapi import APIRouter, Request, Depends, HTTPException, Query
 from sqlalchemy import func, case
 from sqlalchemy.orm import Session
 from database import get_db
-from models import SearchTerm, Character, User, Scene, Persona, UserLikedPersona, UserLikedCharacter, UserLikedScene
+from models import SearchTerm, Character, User, Scene, Persona
 from schemas import CharacterOut, SceneOut, PersonaOut, CharacterListOut, SceneListOut, PersonaListOut, UserOut, UserListOut
-from utils.user_utils import enrich_user_with_character_count
+from utils.user_utils import enrich_users_with_character_count
 from utils.session import get_optional_current_user
+from utils.liked_set import mark_liked
+from utils.fast_json import model_response
 
 from datetime import datetime, UTC
 
@@ -66,12 +68,8 @@ def search_characters(
         total = query.count()
         chars = query.offset((page - 1) * page_size).limit(page_size).all()
     
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
-    for char in chars:
-        char.liked = char.id in liked_ids
-    return CharacterListOut(items=chars, total=total, page=page, page_size=page_size, short=False)
+    mark_liked(db, current_user, "character", chars)
+    return model_response(CharacterListOut(items=chars, total=total, page=page, page_size=page_size, short=False))
 
 # --- Scene Search Endpoint ---
 @router.get("/api/scenes/search", response_model=SceneListOut)
@@ -118,12 +116,8 @@ def search_scenes(
         query = base_query.order_by(Scene.name.asc())
         total = query.count()
         scenes = query.offset((page - 1) * page_size).limit(page_size).all()
-    liked_ids = set()
-    if current_user:
-        liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
-    for scene in scenes:
-        scene.liked = scene.id in liked_ids
-    return SceneListOut(items=[SceneOut.from_orm(s) for s in scenes], total=total, page=page, page_size=page_size, short=False)
+    mark_liked(db, current_user, "scene", scenes)
+    return model_response(SceneListOut(items=[SceneOut.from_orm(s) for s in scenes], total=total, page=page, page_size=page_size, short=False))
 
 # --- Persona Search Endpoint ---
 @router.get("/api/personas/search", response_model=PersonaListOut)
@@ -170,15 +164,8 @@ def search_personas(
         query = base_query.order_by(Persona.name.asc())
         total = query.count()
         personas = query.offset((page - 1) * page_size).limit(page_size).all()
-    liked_ids = set()
-    if current_user:
-        liked_ids = {
-            r.persona_id for r in
-            db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()
-        }
-    for persona in personas:
-        persona.liked = persona.id in liked_ids
-    return PersonaListOut(items=personas, total=total, page=page, page_size=page_size, short=False)
+    mark_liked(db, current_user, "persona", personas)
+    return model_response(PersonaListOut(items=personas, total=total, page=page, page_size=page_size, short=False))
 
 @router.post("/api/update-search-term")
 async def update_search_term(request: Request, db: Session = Depends(get_db)):
@@ -269,5 +256,5 @@ def search_users(
         total = query.count()
         users = query.offset((page - 1) * page_size).limit(page_size).all()
     
-    items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return UserListOut(items=items, total=total, page=page, page_size=page_size)
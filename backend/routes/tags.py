@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from database import get_db
 from models import Tag, User
 from utils.session import get_current_user
+from utils.response_cache import TAGS, cached_body, json_body_response
 
 router = APIRouter()
 
@@ -14,7 +15,11 @@ def tag_suggestions(q: str = "", db: Session = Depends(get_db)):
         tags = db.query(Tag).filter(Tag.name.ilike(f"%{q}%")).order_by(Tag.likes.desc()).limit(10).all()
     return [{"name": t.name, "likes": t.likes} for t in tags]
 
+def _all_tags(db: Session) -> list[dict]:
+    tags = db.query(Tag).order_by(Tag.name).all()
+    return [{"name": t.name, "likes": t.likes} for t in tags]
+
 @router.get("/api/tags/all")
 def get_all_tags(db: Session = Depends(get_db)):
-    tags = db.query(Tag).order_by(Tag.name).all()
-    return [{"name": t.name, "likes": t.likes} for t in tags]
\ No newline at end of file
+    body = cached_body("tags:all", "all", surrogates=(TAGS,), build=_all_tags, db=db, fresh_s=300, stale_s=600)
+    return json_body_response(body)
@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Body
-from schemas import UserOut, UserListOut, CharacterOut, SceneOut, PersonaOut
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Body, Request, Response
+from schemas import UserOut, UserListOut, CharacterOut, SceneOut, PersonaOut, BulkLikeRequest
 from sqlalchemy.orm import Session
 from database import get_db
 from models import User, Character, Scene, Persona, Tag, UserLikedCharacter, UserLikedScene, UserLikedPersona, UserCreditWalletLedger, UserFollow
@@ -7,11 +7,17 @@ from utils.session import get_current_user, get_optional_current_user
 from utils.local_storage_utils import save_image
 from utils.image_moderation import moderate_image_with_decision
 from utils.text_moderation import moderate_form_payload_with_review
-from utils.user_utils import build_user_response, enrich_user_with_character_count
+from utils.user_utils import build_user_response, enrich_users_with_character_count
 from utils.validators import validate_account_fields
-from utils.sms_utils import send_verification_code, verify_code
+from utils.sms_utils import send_verification_code, verify_code_async
+from utils.request_utils import get_client_ip
 from utils.credit_cap import get_credit_cap_info
 from utils.invitation_utils import count_today_invites, INVITATION_BONUS_CREDITS, INVITATION_MAX_PER_DAY
+from utils.view_counter import record_views, overlay_pending_views
+from utils.like_engine import ENTITY_TABLES, MAX_BULK_ITEMS, like_entities, unlike_entities, explain_noop
+from utils.liked_set import get_liked_ids, update_liked_set
+from utils.conditional import not_modified, set_etag, user_etag
+from utils.following_feed import FEED_MODELS, count_feed_entries, decode_cursor, encode_cursor, get_feed_entries, load_feed_items, invalidate_timeline
 from sqlalchemy import func
 import re
 import os
@@ -42,7 +48,7 @@ def browse_users(
         query = query.order_by(User.views.desc(), User.id.asc())
         total = query.count()
         users = query.offset((page - 1) * page_size).limit(page_size).all()
-        items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+        items = enrich_users_with_character_count(users, db, current_user)
         return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
     query = db.query(User)
@@ -74,7 +80,7 @@ def browse_users(
 
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
 @router.get("/api/users/popular", response_model=UserListOut)
@@ -88,7 +94,7 @@ def get_popular_users(
     query = db.query(User).order_by(User.views.desc(), User.id.asc())
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
 @router.get("/api/users/recent", response_model=UserListOut)
@@ -102,7 +108,7 @@ def get_recent_users(
     query = db.query(User).order_by(User.id.desc())
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
 @router.get("/api/users/recommended", response_model=UserListOut)
@@ -118,7 +124,7 @@ def get_recommended_users(
         query = db.query(User).order_by(User.views.desc(), User.id.asc())
         total = query.count()
         users = query.offset((page - 1) * page_size).limit(page_size).all()
-        items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+        items = enrich_users_with_character_count(users, db, current_user)
         return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
     # Recommend users with high engagement.
@@ -128,7 +134,7 @@ def get_recommended_users(
     query = query.order_by(User.views.desc(), User.id.asc())
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(user, db, current_user) for user in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return UserListOut(items=items, total=total, page=page, page_size=page_size)
 
 
@@ -222,7 +228,7 @@ def get_user_following(
     query = db.query(User).filter(User.id.in_(subq))
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(u, db, current_user) for u in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return {"items": items, "total": total, "page": page, "page_size": page_size}
 
 
@@ -243,7 +249,7 @@ def get_user_followers(
     query = db.query(User).filter(User.id.in_(subq))
     total = query.count()
     users = query.offset((page - 1) * page_size).limit(page_size).all()
-    items = [enrich_user_with_character_count(u, db, current_user) for u in users]
+    items = enrich_users_with_character_count(users, db, current_user)
     return {"items": items, "total": total, "page": page, "page_size": page_size}
 
 
@@ -275,6 +281,7 @@ def follow_user(
     if not existing:
         db.add(UserFollow(follower_id=current_user.id, creator_id=creator_id))
         db.commit()
+        invalidate_timeline(current_user.id)
     return {"following": True}
 
 
@@ -290,23 +297,44 @@ def unfollow_user(
     if follow:
         db.delete(follow)
         db.commit()
+        invalidate_timeline(current_user.id)
     return {"following": False}
 
 
 # --- Single User Endpoints (comes AFTER specific routes above) ---
 
 @router.get("/api/user/{user_id}", response_model=UserOut)
-def get_user_by_id(user_id: str, db: Session = Depends(get_db)):
+def get_user_by_id(
+    user_id: str,
+    request: Request,
+    response: Response,
+    include_pending_views: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    etag = None if include_pending_views else user_etag(db, user_id)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if include_pending_views:
+        overlay_pending_views("creator", [user])
 
+    set_etag(response, etag)
     return build_user_response(user, db)
 
 # Add alias for plural endpoint for frontend compatibility
 @router.get("/api/users/{user_id}", response_model=UserOut)
-def get_user_by_id_alias(user_id: str, db: Session = Depends(get_db)):
-    return get_user_by_id(user_id, db)
+def get_user_by_id_alias(
+    user_id: str,
+    request: Request,
+    response: Response,
+    include_pending_views: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    return get_user_by_id(user_id, request, response, include_pending_views, db)
 
 @router.post("/api/update-profile")
 async def update_profile(
@@ -359,52 +387,18 @@ def like_entity(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    entity_map = {
-        "character": (Character, UserLikedCharacter, "character_id"),
-        "scene": (Scene, UserLikedScene, "scene_id"),
-        "persona": (Persona, UserLikedPersona, "persona_id"),
-    }
-    if entity_type not in entity_map:
+    if entity_type not in ENTITY_TABLES:
         raise HTTPException(status_code=400, detail="Invalid entity type")
 
-    Model, LikeModel, id_field = entity_map[entity_type]
-    entity = db.query(Model).filter(getattr(Model, "id") == entity_id).first()
-    if not entity:
-        raise HTTPException(status_code=404, detail=f"{entity_type.capitalize()} not found")
-
-    # Get the creator of the entity
-    creator = db.query(User).filter(User.id == entity.creator_id).first() if getattr(entity, "creator_id", None) else None
-    if not creator:
-        raise HTTPException(status_code=404, detail=f"{entity_type.capitalize()} creator not found")
-
-    # Check if user already liked this entity
-    filter_kwargs = {"user_id": current_user.id, id_field: entity_id}
-    existing_like = db.query(LikeModel).filter_by(**filter_kwargs).first()
-    if existing_like:
-        raise HTTPException(status_code=400, detail=f"Already liked this {entity_type}")
-
-    # Create like record
-    like = LikeModel(user_id=current_user.id, **{id_field: entity_id})
-    db.add(like)
-
-    # Update entity like count
-    entity.likes = (entity.likes or 0) + 1
-
-    # Update creator's total likes count
-    creator.likes = (creator.likes or 0) + 1
-
-    # Update user's liked tags (if entity has tags)
-    tags = getattr(entity, "tags", [])
-    for tag in tags or []:
-        db_tag = db.query(Tag).filter(Tag.name == tag).first()
-        if db_tag:
-            db_tag.likes += 1
-        if tag not in current_user.liked_tags:
-            current_user.liked_tags = current_user.liked_tags + [tag]
+    updated = like_entities(db, current_user.id, entity_type, [entity_id])
+    if entity_id not in updated:
+        db.rollback()
+        status_code, detail = explain_noop(db, entity_type, entity_id, like=True)
+        raise HTTPException(status_code=status_code, detail=detail)
 
     db.commit()
-
-    return {"likes": entity.likes}
+    update_liked_set(current_user.id, entity_type, [entity_id], liked=True)
+    return {"likes": updated[entity_id]}
 
 # Unlike route for character, scene, or persona
 @router.post("/api/unlike/{entity_type}/{entity_id}")
@@ -414,51 +408,62 @@ def unlike_entity(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    entity_map = {
-        "character": (Character, UserLikedCharacter, "character_id"),
-        "scene": (Scene, UserLikedScene, "scene_id"),
-        "persona": (Persona, UserLikedPersona, "persona_id"),
-    }
-    if entity_type not in entity_map:
+    """Remove the current user's like.
+
+    404 if the entity does not exist, 400 if the user has not liked it.
+    Unlike liking, this also works on an entity whose creator account is gone.
+    """
+    if entity_type not in ENTITY_TABLES:
         raise HTTPException(status_code=400, detail="Invalid entity type")
 
-    Model, LikeModel, id_field = entity_map[entity_type]
-    entity = db.query(Model).filter(getattr(Model, "id") == entity_id).first()
-    if not entity:
-        raise HTTPException(status_code=404, detail=f"{entity_type.capitalize()} not found")
+    updated = unlike_entities(db, current_user.id, entity_type, [entity_id])
+    if entity_id not in updated:
+        db.rollback()
+        status_code, detail = explain_noop(db, entity_type, entity_id, like=False)
+        raise HTTPException(status_code=status_code, detail=detail)
 
-    creator = db.query(User).filter(User.id == entity.creator_id).first() if getattr(entity, "creator_id", None) else None
-    if not creator:
-        raise HTTPException(status_code=404, detail=f"{entity_type.capitalize()} creator not found")
-
-    filter_kwargs = {"user_id": current_user.id, id_field: entity_id}
-    existing_like = db.query(LikeModel).filter_by(**filter_kwargs).first()
-    if not existing_like:
-        raise HTTPException(status_code=400, detail=f"You have not liked this {entity_type}")
-
-    db.delete(existing_like)
-
-    # Update entity like count
-    if entity.likes and entity.likes > 0:
-        entity.likes -= 1
-
-    # Update creator's total likes count
-    if creator.likes and creator.likes > 0:
-        creator.likes -= 1
-
-    # Update user's liked tags (if entity has tags)
-    tags = getattr(entity, "tags", [])
-    for tag in tags or []:
-        db_tag = db.query(Tag).filter(Tag.name == tag).first()
-        if db_tag and db_tag.likes and db_tag.likes > 0:
-            db_tag.likes -= 1
-        if tag in current_user.liked_tags:
-            # Remove tag if user has no more likes for this tag
-            # (Optional: check if user still likes any entity with this tag)
-            current_user.liked_tags = [t for t in current_user.liked_tags if t != tag]
+    db.commit()
+    update_liked_set(current_user.id, entity_type, [entity_id], liked=False)
+    return {"likes": updated[entity_id]}
 
+
+@router.post("/api/likes/bulk")
+def bulk_like(
+    payload: BulkLikeRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Like or unlike several characters/scenes/personas in one request.
+
+    Items that are already in the requested state (or do not exist) are
+    skipped.  Returns the new like counts of the items that changed.
+    """
+    if len(payload.items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} items per request")
+
+    ids_by_type = {}
+    for item in payload.items:
+        if item.type not in ENTITY_TABLES:
+            raise HTTPException(status_code=400, detail="Invalid entity type")
+        ids_by_type.setdefault(item.type, []).append(item.id)
+
+    apply = like_entities if payload.action == "like" else unlike_entities
+    updated = {
+        entity_type: apply(db, current_user.id, entity_type, ids)
+        for entity_type, ids in ids_by_type.items()
+    }
     db.commit()
-    return {"likes": entity.likes}
+    for entity_type, counts in updated.items():
+        update_liked_set(current_user.id, entity_type, list(counts), liked=payload.action == "like")
+
+    return {
+        "action": payload.action,
+        "updated": [
+            {"type": entity_type, "id": entity_id, "likes": likes}
+            for entity_type, counts in updated.items()
+            for entity_id, likes in counts.items()
+        ],
+    }
 
 
 from typing import Optional
@@ -481,16 +486,13 @@ def is_liked_multi(
     result = {}
 
     if character_id is not None:
-        like = db.query(UserLikedCharacter).filter_by(user_id=current_user.id, character_id=character_id).first()
-        result["character"] = {"id": character_id, "liked": bool(like)}
+        result["character"] = {"id": character_id, "liked": character_id in get_liked_ids(db, current_user, "character", [character_id])}
 
     if scene_id is not None:
-        like = db.query(UserLikedScene).filter_by(user_id=current_user.id, scene_id=scene_id).first()
-        result["scene"] = {"id": scene_id, "liked": bool(like)}
+        result["scene"] = {"id": scene_id, "liked": scene_id in get_liked_ids(db, current_user, "scene", [scene_id])}
 
     if persona_id is not None:
-        like = db.query(UserLikedPersona).filter_by(user_id=current_user.id, persona_id=persona_id).first()
-        result["persona"] = {"id": persona_id, "liked": bool(like)}
+        result["persona"] = {"id": persona_id, "liked": persona_id in get_liked_ids(db, current_user, "persona", [persona_id])}
 
     return result
 
@@ -499,42 +501,18 @@ def is_liked_multi(
 @router.post("/api/views/increment-multi")
 def increment_views_multi(
     payload: dict = Body(...),
-    db: Session = Depends(get_db)
 ):
-    character_id = payload.get("character_id")
-    scene_id = payload.get("scene_id")
-    persona_id = payload.get("persona_id")
+    """Count a view for each of character/scene/persona (and their creators).
 
-    updated = {}
-
-    if character_id is not None:
-        char = db.query(Character).filter(Character.id == character_id).first()
-        if char:
-            char.views = (char.views or 0) + 1
-            updated["character"] = {"id": character_id, "views": char.views}
-            creator = db.query(User).filter(User.id == char.creator_id).first() if char.creator_id else None
-            if creator:
-                creator.views = (creator.views or 0) + 1
-
-    if scene_id is not None:
-        scene = db.query(Scene).filter(Scene.id == scene_id).first()
-        if scene:
-            scene.views = (scene.views or 0) + 1
-            updated["scene"] = {"id": scene_id, "views": scene.views}
-            creator = db.query(User).filter(User.id == scene.creator_id).first() if scene.creator_id else None
-            if creator:
-                creator.views = (creator.views or 0) + 1
-
-    if persona_id is not None:
-        persona = db.query(Persona).filter(Persona.id == persona_id).first()
-        if persona:
-            persona.views = (persona.views or 0) + 1
-            updated["persona"] = {"id": persona_id, "views": persona.views}
-            creator = db.query(User).filter(User.id == persona.creator_id).first() if persona.creator_id else None
-            if creator:
-                creator.views = (creator.views or 0) + 1
-
-    db.commit()
+    Views are buffered in Redis and flushed to Postgres by ``utils.view_counter``.
+    """
+    ids = {
+        "character": payload.get("character_id"),
+        "scene": payload.get("scene_id"),
+        "persona": payload.get("persona_id"),
+    }
+    record_views(ids)
+    updated = {entity_type: {"id": entity_id} for entity_type, entity_id in ids.items() if entity_id is not None}
     return {"message": "views updated", "updated": updated}
 
 
@@ -558,6 +536,7 @@ def request_change_email(payload: dict = Body(...), current_user: User = Depends
 
 @router.post('/api/change-phone/send-current-code')
 async def send_code_to_current_phone(
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -568,7 +547,7 @@ async def send_code_to_current_phone(
         raise HTTPException(status_code=400, detail='当前账号未绑定手机号')
     
     # 发送验证码到当前手机号
-    result = await send_verification_code(current_user.phone_number)
+    result = await send_verification_code(current_user.phone_number, get_client_ip(request))
     
     if not result.get('success'):
         raise HTTPException(status_code=400, detail=result.get('message', '发送验证码失败'))
@@ -596,7 +575,7 @@ async def verify_current_phone(
         raise HTTPException(status_code=400, detail='当前账号未绑定手机号')
     
     # 验证验证�?
-    if not verify_code(current_user.phone_number, code):
+    if not await verify_code_async(current_user.phone_number, code):
         raise HTTPException(status_code=400, detail='验证码错误或已过期')
     
     return {"message": "当前手机号验证成功", "verified": True}
@@ -604,6 +583,7 @@ async def verify_current_phone(
 
 @router.post('/api/change-phone/send-new-code')
 async def send_code_to_new_phone(
+    request: Request,
     payload: dict = Body(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -625,7 +605,7 @@ async def send_code_to_new_phone(
         raise HTTPException(status_code=400, detail='该手机号已被其他账号使用')
     
     # 发送验证码到新手机号
-    result = await send_verification_code(new_phone)
+    result = await send_verification_code(new_phone, get_client_ip(request))
     
     if not result.get('success'):
         raise HTTPException(status_code=400, detail=result.get('message', '发送验证码失败'))
@@ -661,7 +641,7 @@ async def confirm_phone_change(
         raise HTTPException(status_code=400, detail='该手机号已被其他账号使用')
     
     # 验证新手机号的验证码
-    if not verify_code(new_phone, code):
+    if not await verify_code_async(new_phone, code):
         raise HTTPException(status_code=400, detail='验证码错误或已过期')
     
     # 更新手机号
@@ -704,82 +684,60 @@ def delete_account(payload: dict = Body(...), current_user: User = Depends(get_c
 
 @router.get("/api/following/feed")
 def get_following_feed(
+    cursor: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     """Return a time-ordered mixed feed of characters, scenes, and personas
-    from creators the current user follows."""
-    from datetime import datetime
+    from creators the current user follows.
 
+    Pass the returned ``next_cursor`` back as ``cursor`` for the next page;
+    ``page`` is still accepted for older clients.  ``total`` is only counted
+    on the first page and is ``None`` on later ones.
+    """
+    first_page = not cursor and page == 1
+    empty = {
+        "items": [], "total": 0 if first_page else None,
+        "next_cursor": None, "has_more": False, "page": page, "page_size": page_size,
+    }
     if not current_user:
-        return {"items": [], "total": 0, "page": page, "page_size": page_size}
-
-    followed_ids = [
-        r.creator_id
-        for r in db.query(UserFollow.creator_id)
-        .filter(UserFollow.follower_id == current_user.id)
-        .all()
-    ]
-
-    if not followed_ids:
-        return {"items": [], "total": 0, "page": page, "page_size": page_size}
-
-    # Fetch all public items from each type for the followed creators
-    char_rows = (
-        db.query(Character, User.profile_pic.label("creator_profile_pic"))
-        .outerjoin(User, Character.creator_id == User.id)
-        .filter(Character.is_public == True, Character.creator_id.in_(followed_ids))
-        .all()
-    )
-    scene_rows = (
-        db.query(Scene, User.profile_pic.label("creator_profile_pic"))
-        .outerjoin(User, Scene.creator_id == User.id)
-        .filter(Scene.is_public == True, Scene.creator_id.in_(followed_ids))
-        .all()
-    )
-    persona_rows = (
-        db.query(Persona, User.profile_pic.label("creator_profile_pic"))
-        .outerjoin(User, Persona.creator_id == User.id)
-        .filter(Persona.is_public == True, Persona.creator_id.in_(followed_ids))
-        .all()
-    )
-
-    all_items = []
-    for char, pic in char_rows:
-        char.creator_profile_pic = pic
-        all_items.append(("character", char.created_time, char))
-    for scene, pic in scene_rows:
-        scene.creator_profile_pic = pic
-        all_items.append(("scene", scene.created_time, scene))
-    for persona, pic in persona_rows:
-        persona.creator_profile_pic = pic
-        all_items.append(("persona", persona.created_time, persona))
-
-    # Sort by created_time descending (None treated as oldest)
-    all_items.sort(key=lambda x: x[1] or datetime.min, reverse=True)
-
-    total = len(all_items)
-    offset = (page - 1) * page_size
-    page_slice = all_items[offset : offset + page_size]
-
-    char_liked_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
-    scene_liked_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
-    persona_liked_ids = {r.persona_id for r in db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()}
+        return empty
+
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    offset = 0 if cursor else (page - 1) * page_size
+
+    # One extra row tells us whether another page exists
+    entries = get_feed_entries(db, current_user.id, page_size + 1, after=after, offset=offset)
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+    if not entries:
+        return empty
+
+    page_items = load_feed_items(db, entries)
+    liked_ids = {
+        kind: get_liked_ids(db, current_user, kind, [obj.id for t, obj in page_items if t == kind])
+        for kind in FEED_MODELS
+    }
+    schemas = {"character": CharacterOut, "scene": SceneOut, "persona": PersonaOut}
 
     result = []
-    for item_type, _, obj in page_slice:
-        if item_type == "character":
-            obj.liked = obj.id in char_liked_ids
-            d = CharacterOut.from_orm(obj).dict()
-        elif item_type == "scene":
-            obj.liked = obj.id in scene_liked_ids
-            d = SceneOut.from_orm(obj).dict()
-        else:
-            obj.liked = obj.id in persona_liked_ids
-            d = PersonaOut.from_orm(obj).dict()
+    for item_type, obj in page_items:
+        obj.liked = obj.id in liked_ids[item_type]
+        d = schemas[item_type].from_orm(obj).dict()
         d["type"] = item_type
         result.append(d)
 
-    return {"items": result, "total": total, "page": page, "page_size": page_size}
+    return {
+        "items": result,
+        "total": count_feed_entries(db, current_user.id) if first_page else None,
+        "next_cursor": encode_cursor(entries[-1]) if has_more else None,
+        "has_more": has_more,
+        "page": page,
+        "page_size": page_size,
+    }
@@ -1,6 +1,6 @@
 
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Any, Union
+from typing import Optional, List, Any, Union, Literal
 
 class SceneOut(BaseModel):
     id: int
@@ -59,6 +59,7 @@ class CharacterOut(BaseModel):
     example_messages: Optional[str] = ""
     long_description: Optional[str] = ""
     long_description_chunks: list[dict[str, str]] = []
+    chunking_status: str = "none"
     context_label: str = "standard"
     tagline: Optional[str] = ""
     tags: list[str] = []
@@ -193,6 +194,14 @@ class VerifyPhoneNewUserOut(BaseModel):
 
 VerifyPhoneOut = Union[VerifyPhoneExistingUserOut, VerifyPhoneNewUserOut]
 
+class BulkLikeItem(BaseModel):
+    type: str  # character | scene | persona
+    id: int
+
+class BulkLikeRequest(BaseModel):
+    action: Literal["like", "unlike"]
+    items: List[BulkLikeItem]
+
 class ProblemReportCreate(BaseModel):
     description: Optional[str] = None
     screenshot: Optional[str] = None
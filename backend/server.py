@@ -1,166 +1,220 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.middleware import Middleware
-from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
-from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+"""
+ASGI entry point.
+
+``create_app()`` builds the FastAPI application.  Importing this module does
+nothing else: ``server.app`` is created on first access (so ``uvicorn
+server:app`` and ``gunicorn server:app`` keep working), provider SDKs are
+imported on first use by the modules that wrap them, and the schema is
+managed by ``init_db.py`` and ``migrations/`` rather than on every boot.
+
+Startup work that needs the network — waiting for Postgres, connecting to
+Redis, starting background writers — runs in the async lifespan, and
+``/readyz`` reports 200 only once it has finished.
+"""
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
-from utils.security_middleware import (
-    RateLimitMiddleware,
-    SecurityHeadersMiddleware,
-    RequestSizeLimitMiddleware,
-    ErrorLoggingMiddleware
-)
-from utils.redis_client import get_redis, close_redis
-from utils.upstream_bucket import start_dispensers, stop_dispensers
+from contextlib import asynccontextmanager
 
-import logging
-logging.basicConfig(level=logging.INFO)
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
 
-print(f"Current working directory: {os.getcwd()}")
+logger = logging.getLogger(__name__)
 
 # Only load .env if it exists (for local dev); skip on Render
-if os.path.exists("../secrets/Mikoshi.env"):
-    print("Loading environment variables from .env file")
-    load_dotenv("../secrets/Mikoshi.env")
-
-from database import engine, Base, SessionLocal
-# Import models so that all SQLAlchemy mappers are registered before create_all
-import models  # noqa: F401
-from routes import auth, character, chat, user, search, tags, scene, persona, admin, problem_report, notification, error_log, audit_log, alipay, wechat_pay, user_messages, content_ban_appeals, password, phone
-
-# Initialize error logger with database factory
-from utils.error_logger import set_db_factory
-set_db_factory(SessionLocal)
-
-
-# Middleware
-middleware = []
-
-# App
-app = FastAPI(middleware=middleware)
-
-# Disable HTTPS redirects in development
-if os.getenv("ENVIRONMENT") != "production":
-    app.force_https = False  # If using FastAPI-HTTPS middleware
-
-# Configure CORS (must run before other middleware so errors/preflights get CORS headers)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://localhost",
-        "http://localhost:80",
-        "https://localhost",
-        "https://localhost:443",
-        "http://43.138.173.199",           # Add this
-        "http://43.138.173.199:80",        # Add this
-        "https://43.138.173.199",          # Add this (for future SSL)
-        "https://43.138.173.199:443",      # Add this (for future SSL)
-    ],  # Your Vite frontend URLs
-    allow_credentials=True,
-    allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
-    allow_headers=["*"],
-    expose_headers=["*"]  # Expose all headers to the frontend
-)
-
-# Add security middleware
-# Note: Order matters - error logging should be early, rate limiting and security last
-app.add_middleware(ErrorLoggingMiddleware)
-app.add_middleware(RequestSizeLimitMiddleware, max_size=10 * 1024 * 1024)  # 10MB limit
-app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(
-    RateLimitMiddleware,
-    requests_per_minute=100,  # Adjust based on your needs
-    requests_per_hour=1000,   # Adjust based on your needs
-    exempt_paths=["/api"]  # Exempt all API routes - they're legitimate frontend requests
-)
-
-# Wake up PostgreSQL database and wait for it to be available
-import time
-from sqlalchemy.exc import OperationalError
-from sqlalchemy import text
-
-def wait_for_neon_db(max_retries=20, delay=3):
-    for attempt in range(1, max_retries + 1):
+ENV_FILE = "../secrets/Mikoshi.env"
+
+DB_WAIT_TIMEOUT_S = float(os.getenv("DB_WAIT_TIMEOUT_S", "60"))
+DB_WAIT_DELAY_S = 3
+
+
+def _load_env() -> None:
+    if os.path.exists(ENV_FILE):
+        load_dotenv(ENV_FILE)
+
+
+async def wait_for_database(timeout_s: float = DB_WAIT_TIMEOUT_S, delay_s: float = DB_WAIT_DELAY_S) -> bool:
+    """Ping Postgres until it answers or *timeout_s* elapses, without blocking the event loop."""
+    from sqlalchemy import text
+    from database import engine
+
+    def _ping() -> None:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            with engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
-            print(f"Database is available (attempt {attempt}).")
+            await asyncio.to_thread(_ping)
+            logger.info("Database is available (attempt %d)", attempt)
             return True
-        except OperationalError as e:
-            print(f"Attempt {attempt}: Database not available yet: {e}")
-            time.sleep(delay)
-    print("Failed to connect to database after retries. Exiting.")
-    exit(1)
-
-wait_for_neon_db()
-
-# Create DB tables after confirming DB is up (models must be imported first)
-Base.metadata.create_all(bind=engine)
-
-
-
-# Serve static files (images, etc.) at /static
-app.mount(
-    "/static",
-    StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")),
-    name="static",
-)
-
-# Always include API routes
-app.include_router(auth.router)
-app.include_router(password.router)
-app.include_router(phone.router)
-app.include_router(user.router)
-app.include_router(character.router)
-app.include_router(chat.router)
-app.include_router(search.router)
-app.include_router(tags.router)
-app.include_router(scene.router)
-app.include_router(persona.router)
-app.include_router(admin.router)
-app.include_router(problem_report.router)
-app.include_router(notification.router)
-app.include_router(error_log.router)
-app.include_router(audit_log.router)
-app.include_router(alipay.router)
-app.include_router(wechat_pay.router)
-app.include_router(user_messages.router)
-app.include_router(content_ban_appeals.router)
-
-
-# ---------------------------------------------------------------------------
-# Startup / shutdown events
-# ---------------------------------------------------------------------------
-
-@app.on_event("startup")
-async def startup_redis():
-    """Warm up the Redis connection on app start."""
+        except Exception as exc:
+            if loop.time() + delay_s > deadline:
+                logger.error("Database not available after %d attempts: %s", attempt, exc)
+                return False
+            logger.warning("Attempt %d: database not available yet: %s", attempt, exc)
+            await asyncio.sleep(delay_s)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from utils.redis_client import get_redis, close_redis
+    from utils.upstream_bucket import start_dispensers, stop_dispensers
+    from utils.audit_logger import start_audit_writer, stop_audit_writer
+    from utils.error_logger import start_error_writer, stop_error_writer
+    from utils.view_counter import start_view_flusher, stop_view_flusher
+    from utils.long_description_chunker import start_chunking_worker, stop_chunking_worker
+
+    app.state.ready = False
+    if not await wait_for_database():
+        raise RuntimeError("Database unavailable; refusing to start")
+
+    # Buffered audit and error log writers
+    start_audit_writer()
+    start_error_writer()
+    # LLM chunking of character long descriptions, queued in Postgres
+    start_chunking_worker()
+
     try:
         redis = await get_redis()
         await redis.ping()
-        logging.getLogger(__name__).info("Redis is ready")
+        logger.info("Redis is ready")
         # Start upstream bucket dispensers (one per rate-limited model)
         await start_dispensers()
+        # Periodically fold buffered view counters into Postgres
+        start_view_flusher()
     except Exception:
-        logging.getLogger(__name__).warning(
-            "Redis is not available — rate limiting will return 503 for chat requests"
-        )
-
-
-@app.on_event("shutdown")
-async def shutdown_redis():
-    """Gracefully close the Redis connection."""
-    await stop_dispensers()
-    await close_redis()
+        logger.warning("Redis is not available — rate limiting will return 503 for chat requests")
 
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        # Flush buffered audit and error log entries before exit
+        stop_audit_writer()
+        stop_error_writer()
+        stop_chunking_worker()
+        await stop_dispensers()
+        stop_view_flusher()
+        await close_redis()
+
+
+def create_app() -> FastAPI:
+    """Build the FastAPI application (routes, middleware, static files)."""
+    logging.basicConfig(level=logging.INFO)
+    _load_env()
+
+    # Imported here so the environment is loaded before database.py reads DATABASE_URL
+    from database import SessionLocal
+    from routes import auth, character, chat, user, search, tags, scene, persona, admin, problem_report, notification, error_log, audit_log, alipay, wechat_pay, user_messages, content_ban_appeals, password, phone
+    from utils.error_logger import set_db_factory
+    from utils.security_middleware import (
+        RateLimitMiddleware,
+        SecurityHeadersMiddleware,
+        RequestSizeLimitMiddleware,
+        ErrorLoggingMiddleware
+    )
+
+    # Initialize error logger with database factory
+    set_db_factory(SessionLocal)
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.ready = False
+
+    # Disable HTTPS redirects in development
+    if os.getenv("ENVIRONMENT") != "production":
+        app.force_https = False  # If using FastAPI-HTTPS middleware
+
+    # Configure CORS (must run before other middleware so errors/preflights get CORS headers)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",
+            "http://localhost",
+            "http://localhost:80",
+            "https://localhost",
+            "https://localhost:443",
+            "http://43.138.173.199",           # Add this
+            "http://43.138.173.199:80",        # Add this
+            "https://43.138.173.199",          # Add this (for future SSL)
+            "https://43.138.173.199:443",      # Add this (for future SSL)
+        ],  # Your Vite frontend URLs
+        allow_credentials=True,
+        allow_methods=["*"],  # Allows all methods (GET, POST, etc.)
+        allow_headers=["*"],
+        expose_headers=["*"]  # Expose all headers to the frontend
+    )
+
+    # Add security middleware
+    # Note: Order matters - error logging should be early, rate limiting and security last
+    app.add_middleware(ErrorLoggingMiddleware)
+    app.add_middleware(RequestSizeLimitMiddleware, max_size=10 * 1024 * 1024)  # 10MB limit
+    app.add_middleware(SecurityHeadersMiddleware)
+    app.add_middleware(
+        RateLimitMiddleware,
+        requests_per_minute=100,  # Adjust based on your needs
+        requests_per_hour=1000,   # Adjust based on your needs
+        exempt_paths=["/api", "/readyz"]  # Exempt all API routes - they're legitimate frontend requests
+    )
+
+    # Serve static files (images, etc.) at /static
+    app.mount(
+        "/static",
+        StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")),
+        name="static",
+    )
+
+    # Always include API routes
+    app.include_router(auth.router)
+    app.include_router(password.router)
+    app.include_router(phone.router)
+    app.include_router(user.router)
+    app.include_router(character.router)
+    app.include_router(chat.router)
+    app.include_router(search.router)
+    app.include_router(tags.router)
+    app.include_router(scene.router)
+    app.include_router(persona.router)
+    app.include_router(admin.router)
+    app.include_router(problem_report.router)
+    app.include_router(notification.router)
+    app.include_router(error_log.router)
+    app.include_router(audit_log.router)
+    app.include_router(alipay.router)
+    app.include_router(wechat_pay.router)
+    app.include_router(user_messages.router)
+    app.include_router(content_ban_appeals.router)
+
+    @app.get("/readyz", include_in_schema=False)
+    async def readiness():
+        """200 once the lifespan startup (database, Redis, writers) has completed."""
+        if getattr(app.state, "ready", False):
+            return {"status": "ready"}
+        return JSONResponse(content={"status": "starting"}, status_code=503)
+
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # ``server.app`` is built on first access, keeping ``import server`` cheap
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# (Optional) You can still keep the async wake-up for later pings if needed
 
-# Add this below all your existing code
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -168,4 +222,4 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True if os.getenv("ENVIRONMENT") != "production" else False
-    )
\ No newline at end of file
+    )
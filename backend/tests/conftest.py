@@ -0,0 +1,86 @@
+"""
+Shared fixtures.
+
+Tests that need Postgres use ``db``; they are skipped unless
+``TEST_DATABASE_URL`` points at a database the tests may create schemas in.
+Each test module gets its own throwaway schema with the full model set.
+"""
+
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# database.py builds its engine from DATABASE_URL at import time
+os.environ.setdefault("DATABASE_URL", TEST_DATABASE_URL or "postgresql://tests@127.0.0.1:1/none")
+# utils/session.py builds its token serializer at import time
+os.environ.setdefault("SECRET_KEY", "tests")
+
+
+@pytest.fixture(scope="module")
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from sqlalchemy import create_engine, text
+
+    import models  # noqa: F401  (registers every table on Base.metadata)
+    from database import Base
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(TEST_DATABASE_URL)
+    with admin.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    engine = create_engine(TEST_DATABASE_URL, connect_args={"options": f"-csearch_path={schema}"})
+    Base.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        admin.dispose()
+
+
+@pytest.fixture
+def db(pg_engine):
+    """Session inside a transaction that is rolled back after the test.
+
+    ``commit()`` and ``rollback()`` in the code under test only release or
+    roll back a savepoint, so routes can be called as they are.
+    """
+    from sqlalchemy.orm import Session
+
+    connection = pg_engine.connect()
+    outer = connection.begin()
+    session = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        outer.rollback()
+        connection.close()
+
+
+@contextmanager
+def count_statements(engine):
+    """Count the SQL statements *engine* sends while the block runs."""
+    from sqlalchemy import event
+
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield executed
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
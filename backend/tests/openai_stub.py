@@ -0,0 +1,102 @@
+"""
+Minimal OpenAI-compatible chat completions provider for tests.
+
+``StubProvider`` answers ``POST /chat/completions`` (streaming and not) on an
+``httpx.MockTransport``, so an ``AsyncOpenAI`` client built by ``client()``
+talks to it in-process, with no sockets.  Each provider can wait before its
+first token, fail with an HTTP status, or raise a transport timeout, and it
+reports a distinct ``usage`` so tests can tell which attempt was billed.
+"""
+
+import asyncio
+import json
+from typing import List, Optional
+
+import httpx
+
+
+class StubProvider:
+    def __init__(
+        self,
+        name: str,
+        reply: str = "hello there",
+        first_token_delay_s: float = 0.0,
+        status: int = 200,
+        timeout: bool = False,
+        completion_tokens: int = 10,
+    ):
+        self.name = name
+        self.reply = reply
+        self.first_token_delay_s = first_token_delay_s
+        self.status = status
+        self.timeout = timeout
+        self.usage = {
+            "prompt_tokens": 100,
+            "completion_tokens": completion_tokens,
+            "total_tokens": 100 + completion_tokens,
+        }
+        self.requests: List[dict] = []
+        self.streams_finished = 0
+
+    def client(self):
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(
+            api_key="test",
+            base_url=f"http://{self.name}.stub/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self._handle)),
+        )
+
+    async def _handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        if self.timeout:
+            raise httpx.ReadTimeout("stub timed out", request=request)
+        if self.status != 200:
+            await asyncio.sleep(self.first_token_delay_s)
+            return httpx.Response(
+                self.status,
+                json={"error": {"message": f"{self.name} failed", "type": "stub_error", "code": self.status}},
+            )
+        if body.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=self._events(body["model"]),
+            )
+        await asyncio.sleep(self.first_token_delay_s)
+        return httpx.Response(200, json={
+            "id": f"{self.name}-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": self.usage,
+        })
+
+    def _chunk(self, model: str, content: Optional[str] = None, usage: Optional[dict] = None) -> bytes:
+        chunk = {
+            "id": f"{self.name}-1",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": model,
+            "choices": [] if content is None else [
+                {"index": 0, "delta": {"content": content}, "finish_reason": None},
+            ],
+        }
+        if usage is not None:
+            chunk["usage"] = usage
+        return f"data: {json.dumps(chunk)}\n\n".encode()
+
+    async def _events(self, model: str):
+        await asyncio.sleep(self.first_token_delay_s)
+        for word in self.reply.split(" "):
+            yield self._chunk(model, content=word + " ")
+        yield self._chunk(model, usage=self.usage)
+        yield b"data: [DONE]\n\n"
+        self.streams_finished += 1
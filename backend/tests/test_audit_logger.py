@@ -0,0 +1,54 @@
+"""
+Batched audit inserts lose only the entries Postgres rejects.
+"""
+
+from datetime import datetime, UTC
+
+import pytest
+
+
+def _row(action: str) -> dict:
+    return {
+        "user_id": "audit-user",
+        "action": action,
+        "timestamp": datetime.now(UTC),
+        "ip_address": "127.0.0.1",
+        "user_agent": None,
+        "metadata": {},
+        "status": "success",
+        "error_message": None,
+    }
+
+
+@pytest.fixture
+def insert_rows(db, monkeypatch):
+    from sqlalchemy.orm import sessionmaker
+
+    from utils import audit_logger
+
+    # Writer sessions join the test's transaction
+    monkeypatch.setattr(
+        audit_logger,
+        "SessionLocal",
+        sessionmaker(bind=db.get_bind(), join_transaction_mode="create_savepoint"),
+    )
+    return audit_logger._insert_rows
+
+
+def _actions(db) -> list:
+    from utils.audit_logger import AuditLog
+
+    return sorted(a for (a,) in db.query(AuditLog.action).filter(AuditLog.user_id == "audit-user"))
+
+
+def test_batch_is_written_in_one_go(db, insert_rows):
+    assert insert_rows([_row(f"action-{n}") for n in range(5)]) is True
+    assert _actions(db) == [f"action-{n}" for n in range(5)]
+
+
+def test_bad_entry_only_loses_itself(db, insert_rows):
+    rows = [_row(f"action-{n}") for n in range(7)]
+    rows[3]["action"] = "x" * 300  # over the 255-character column
+
+    assert insert_rows(rows) is False
+    assert _actions(db) == [f"action-{n}" for n in range(7) if n != 3]
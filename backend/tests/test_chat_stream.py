@@ -0,0 +1,155 @@
+"""
+A chat stream whose client goes away mid-reply: the partial reply is billed
+off the event loop and the interrupted-stream metric is recorded.
+
+Drives the real ``/api/chat`` handler and its SSEResponse; the upstream,
+admission and the Postgres side of billing are replaced by recorders.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+PARTIAL_REPLY = "Once upon a time, "
+
+
+class _Admission:
+    rejected = False
+    limit = 10
+    remaining = 9
+
+    def __init__(self):
+        self.released = []
+
+    async def wait_upstream(self) -> bool:
+        return True
+
+    async def release(self, tokens: int) -> None:
+        self.released.append(tokens)
+
+    async def refund(self) -> None:
+        pass
+
+
+class _Request:
+    async def json(self) -> dict:
+        return {"messages": [{"role": "user", "content": "Tell me a story"}], "stream": True}
+
+
+class _Session:
+    """Enough of a Session for _bill_interrupted_stream."""
+
+    def __init__(self, user):
+        self.user = user
+        self.committed = False
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def first(self):
+        return self.user
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def chat_route(monkeypatch):
+    import database
+    from routes import chat
+    from utils import stream_metrics
+
+    user = SimpleNamespace(id="stream-user", is_pro=False)
+    recorded = SimpleNamespace(admission=_Admission(), billed=[], metrics=[], sessions=[])
+
+    async def upstream(messages, **kwargs):
+        yield {"type": "delta", "content": PARTIAL_REPLY}
+        await asyncio.sleep(3600)  # the client leaves while the provider is still generating
+        yield {"type": "delta", "content": "never sent"}
+
+    async def admit_chat(*args, **kwargs):
+        return recorded.admission
+
+    def apply_credit_usage_with_wallet(db_session, *, user, usage, source, credit_amount, **kwargs):
+        recorded.billed.append({
+            "usage": usage,
+            "source": source,
+            "credit_amount": credit_amount,
+            "on_loop_thread": threading.current_thread() is threading.main_thread(),
+        })
+        return {"success": True}
+
+    def session_local():
+        session = _Session(user)
+        recorded.sessions.append(session)
+        return session
+
+    async def incr_daily(name, fields):
+        recorded.metrics.append((name, fields))
+
+    monkeypatch.setattr(chat, "stream_chat_completion", upstream)
+    monkeypatch.setattr(chat, "admit_chat", admit_chat)
+    monkeypatch.setattr(chat, "is_chat_banned", lambda user: False)
+    monkeypatch.setattr(chat, "can_send_user_message", lambda *a: {"blocked": False, "is_user_request": True, "limit": {}})
+    monkeypatch.setattr(chat, "can_consume_credits", lambda *a: {"blocked": False, "limit": {}})
+    monkeypatch.setattr(chat, "increment_user_message_count", lambda *a: {})
+    monkeypatch.setattr(chat, "apply_credit_usage_with_wallet", apply_credit_usage_with_wallet)
+    monkeypatch.setattr(chat, "get_credit_cap_info", lambda *a: {})
+    monkeypatch.setattr(database, "SessionLocal", session_local)
+    monkeypatch.setattr(stream_metrics, "incr_daily", incr_daily)
+
+    async def run(disconnect_after_s: float) -> list:
+        response = await chat.chat(_Request(), current_user=user, db=None)
+        sent = []
+
+        async def receive():
+            await asyncio.sleep(disconnect_after_s)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await response({"type": "http"}, receive, send)
+        return sent
+
+    return run, recorded
+
+
+def test_disconnect_mid_stream_bills_the_partial_reply_and_records_it(chat_route):
+    from routes.chat import estimate_tokens
+
+    run, recorded = chat_route
+
+    sent = asyncio.run(run(disconnect_after_s=0.1))
+
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    assert PARTIAL_REPLY.encode() in body
+
+    [billed] = recorded.billed
+    assert billed["source"] == "chat_stream_interrupted"
+    assert billed["usage"]["interrupted"] and billed["usage"]["estimated"]
+    assert billed["usage"]["completion_tokens"] == estimate_tokens(PARTIAL_REPLY)
+    assert billed["credit_amount"] > 0
+    assert not billed["on_loop_thread"]
+    assert [s.committed for s in recorded.sessions] == [True]
+
+    [(name, fields)] = recorded.metrics
+    assert name == "chat_stream"
+    assert fields["interrupted"] == 1
+    assert fields["interrupted_completion_tokens"] == estimate_tokens(PARTIAL_REPLY)
+
+    # The in-flight slot went back with the partial usage
+    assert recorded.admission.released and recorded.admission.released[0] > 0
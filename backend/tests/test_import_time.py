@@ -0,0 +1,93 @@
+"""
+Import cost of the ASGI entry point.
+
+``import server`` and building the app must not pull in the provider SDKs
+(they are imported on first use), and ``import server`` must stay within
+``IMPORT_BUDGET_MS`` of cumulative import time as reported by
+``python -X importtime``.  Each check runs in a fresh interpreter so modules
+already imported by pytest do not hide the cost.
+
+Run from backend/:  python -m pytest tests/test_import_time.py
+"""
+
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budget for the cumulative import time of ``server`` alone
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+
+PROVIDER_SDK_MODULES = (
+    "openai",
+    "tencentcloud",
+    "alibabacloud_dypnsapi20170525",
+    "alibabacloud_captcha20230305",
+    "alibabacloud_tea_openapi",
+    "alipay",
+    "wechatpayv3",
+)
+
+_REPORT_LOADED_SDKS = """
+import sys
+{setup}
+loaded = sorted(
+    name for name in sys.modules
+    if name.split(".")[0] in {modules!r}
+)
+print(",".join(loaded))
+"""
+
+
+def _run(code: str, *args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    # database.py only builds the engine; nothing connects during these checks
+    env.setdefault("DATABASE_URL", "postgresql://import-check@127.0.0.1:1/none")
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+
+def _loaded_sdks(setup: str) -> list:
+    result = _run(_REPORT_LOADED_SDKS.format(setup=setup, modules=PROVIDER_SDK_MODULES))
+    assert result.returncode == 0, result.stderr
+    out = result.stdout.strip().splitlines()
+    return [name for name in (out[-1] if out else "").split(",") if name]
+
+
+def _cumulative_us(importtime_log: str, module: str) -> int:
+    # "import time: self [us] | cumulative | imported package"
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Top-level imports are indented by one space, nested ones by more
+        if name.strip() == module and not name.startswith("  "):
+            return int(cumulative)
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_import_server_does_not_load_provider_sdks():
+    assert _loaded_sdks("import server") == []
+
+
+def test_create_app_does_not_load_provider_sdks():
+    assert _loaded_sdks("import server; server.create_app()") == []
+
+
+def test_import_server_within_budget():
+    # Best of three fresh interpreters, so one cold-cache run does not fail the check
+    timings = []
+    for _ in range(3):
+        result = _run("import server", "-X", "importtime")
+        assert result.returncode == 0, result.stderr
+        timings.append(_cumulative_us(result.stderr, "server") / 1000)
+    assert min(timings) <= IMPORT_BUDGET_MS, (
+        f"import server took {min(timings):.0f} ms, budget is {IMPORT_BUDGET_MS:.0f} ms"
+    )
@@ -0,0 +1,59 @@
+"""
+Status codes of the single like / unlike routes.
+"""
+
+import pytest
+
+
+@pytest.fixture
+def liker(db, monkeypatch):
+    from models import Character, User
+
+    # The liked-set cache is best effort; keep these tests off Redis
+    monkeypatch.setattr("routes.user.update_liked_set", lambda *args, **kwargs: None)
+
+    creator = User(id="like-creator", name="creator", hashed_password="x")
+    user = User(id="like-user", name="user", hashed_password="x")
+    db.add_all([creator, user])
+    db.flush()
+    character = Character(name="like-target", persona="p", creator_id=creator.id)
+    db.add(character)
+    db.commit()
+    return user, character
+
+
+def _status(call) -> int:
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as excinfo:
+        call()
+    return excinfo.value.status_code
+
+
+def test_like_then_unlike(db, liker):
+    from routes.user import like_entity, unlike_entity
+
+    user, character = liker
+    assert like_entity("character", character.id, current_user=user, db=db) == {"likes": 1}
+    assert unlike_entity("character", character.id, current_user=user, db=db) == {"likes": 0}
+
+
+def test_unlike_missing_entity_is_404(db, liker):
+    from routes.user import unlike_entity
+
+    user, _ = liker
+    assert _status(lambda: unlike_entity("character", 987654321, current_user=user, db=db)) == 404
+
+
+def test_unlike_without_like_is_400(db, liker):
+    from routes.user import unlike_entity
+
+    user, character = liker
+    assert _status(lambda: unlike_entity("character", character.id, current_user=user, db=db)) == 400
+
+
+def test_like_missing_entity_is_404(db, liker):
+    from routes.user import like_entity
+
+    user, _ = liker
+    assert _status(lambda: like_entity("character", 987654321, current_user=user, db=db)) == 404
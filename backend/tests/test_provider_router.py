@@ -0,0 +1,186 @@
+"""
+Hedging and failover in utils/provider_router.py against in-process
+OpenAI-compatible stubs (tests/openai_stub.py).
+"""
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+
+from openai_stub import StubProvider  # noqa: E402
+from utils import provider_router  # noqa: E402
+from utils.provider_router import Route, _ProviderHealth  # noqa: E402
+
+MODEL = "stub-model"
+HEDGE_S = 0.1
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Route MODEL to the given stubs, in order, with fresh health and a short hedge delay."""
+
+    def install(*stubs: StubProvider):
+        monkeypatch.setattr(provider_router, "_clients", {s.name: s.client() for s in stubs})
+        monkeypatch.setattr(provider_router, "_health", {s.name: _ProviderHealth() for s in stubs})
+        monkeypatch.setattr(provider_router, "_ROUTES", {MODEL: [Route(s.name, MODEL) for s in stubs]})
+        return stubs
+
+    monkeypatch.setattr(provider_router, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(provider_router, "HEDGE_DEFAULT_S", HEDGE_S)
+    monkeypatch.setattr(provider_router, "HEDGE_MIN_S", HEDGE_S)
+    return install
+
+
+def _stream(**kwargs):
+    async def collect():
+        events = []
+        async for event in provider_router.stream_chat_completion([{"role": "user", "content": "hi"}], model=MODEL, **kwargs):
+            events.append(event)
+        return events
+
+    return asyncio.run(collect())
+
+
+def _text(events) -> str:
+    return "".join(e["content"] for e in events if e["type"] == "delta")
+
+
+def _billed(events) -> list:
+    return [e["usage"].total_tokens for e in events if e["type"] == "usage"]
+
+
+def test_fast_primary_is_not_hedged(providers):
+    primary, backup = providers(StubProvider("primary"), StubProvider("backup"))
+
+    events = _stream()
+
+    assert _text(events).strip() == primary.reply
+    assert len(backup.requests) == 0
+    assert _billed(events) == [primary.usage["total_tokens"]]
+
+
+def test_slow_primary_is_hedged_and_only_the_winner_is_billed(providers):
+    primary, backup = providers(
+        StubProvider("primary", reply="slow reply", first_token_delay_s=1.0, completion_tokens=11),
+        StubProvider("backup", reply="fast reply", completion_tokens=22),
+    )
+
+    started = time.monotonic()
+    events = _stream()
+    elapsed = time.monotonic() - started
+
+    assert _text(events).strip() == "fast reply"
+    assert len(primary.requests) == 1 and len(backup.requests) == 1
+    assert _billed(events) == [backup.usage["total_tokens"]]
+    assert primary.streams_finished == 0
+    assert elapsed < primary.first_token_delay_s
+    health = provider_router.get_provider_health()
+    assert health["primary"]["hedged"] == 1
+    assert health["primary"]["cancelled"] == 1
+
+
+def test_hedge_waits_for_the_deadline(providers):
+    primary, backup = providers(
+        StubProvider("primary", first_token_delay_s=HEDGE_S / 4),
+        StubProvider("backup"),
+    )
+
+    events = _stream()
+
+    assert _billed(events) == [primary.usage["total_tokens"]]
+    assert len(backup.requests) == 0
+
+
+def test_hedging_disabled_waits_for_the_primary(providers, monkeypatch):
+    primary, backup = providers(StubProvider("primary", first_token_delay_s=HEDGE_S * 3), StubProvider("backup"))
+    monkeypatch.setattr(provider_router, "HEDGE_ENABLED", False)
+
+    events = _stream()
+
+    assert _billed(events) == [primary.usage["total_tokens"]]
+    assert len(backup.requests) == 0
+
+
+def test_scheduled_models_are_not_hedged(providers, monkeypatch):
+    primary, backup = providers(StubProvider("primary", first_token_delay_s=HEDGE_S * 3), StubProvider("backup"))
+    # The admission slot covers one upstream request only
+    monkeypatch.setattr(provider_router, "is_scheduled", lambda model: True)
+
+    events = _stream()
+
+    assert _billed(events) == [primary.usage["total_tokens"]]
+    assert len(backup.requests) == 0
+
+
+def test_client_error_from_the_hedge_does_not_count_a_cancellation(providers):
+    import openai
+
+    providers(StubProvider("primary", first_token_delay_s=1.0), StubProvider("backup", status=400))
+
+    with pytest.raises(openai.BadRequestError):
+        _stream()
+    assert provider_router.get_provider_health()["primary"]["cancelled"] == 0
+
+
+@pytest.mark.parametrize("failing", [
+    StubProvider("primary", status=503),
+    StubProvider("primary", status=429),
+    StubProvider("primary", timeout=True),
+], ids=["5xx", "429", "timeout"])
+def test_stream_fails_over_before_first_token(providers, failing):
+    primary, backup = providers(failing, StubProvider("backup", reply="from backup"))
+
+    events = _stream()
+
+    assert _text(events).strip() == "from backup"
+    assert _billed(events) == [backup.usage["total_tokens"]]
+    health = provider_router.get_provider_health()
+    assert health["primary"]["errors"] == 1
+    assert health["backup"]["errors"] == 0
+
+
+def test_client_errors_are_not_failed_over(providers):
+    import openai
+
+    primary, backup = providers(StubProvider("primary", status=400), StubProvider("backup"))
+
+    with pytest.raises(openai.BadRequestError):
+        _stream()
+    assert len(backup.requests) == 0
+
+
+def test_all_providers_failing_raises_the_last_error(providers):
+    import openai
+
+    providers(StubProvider("primary", status=502), StubProvider("backup", status=503))
+
+    with pytest.raises(openai.InternalServerError) as excinfo:
+        _stream()
+    assert excinfo.value.status_code == 503
+
+
+def test_failed_provider_is_ranked_last_next_time(providers):
+    primary, backup = providers(StubProvider("primary", status=500), StubProvider("backup"))
+
+    _stream()
+    primary.status = 200
+    events = _stream()
+
+    assert _billed(events) == [backup.usage["total_tokens"]]
+    assert len(primary.requests) == 1
+
+
+@pytest.mark.parametrize("failing", [
+    StubProvider("primary", status=500),
+    StubProvider("primary", timeout=True),
+], ids=["5xx", "timeout"])
+def test_completion_fails_over(providers, failing):
+    primary, backup = providers(failing, StubProvider("backup", reply="from backup"))
+
+    response = asyncio.run(provider_router.create_chat_completion([{"role": "user", "content": "hi"}], model=MODEL))
+
+    assert response.choices[0].message.content == "from backup"
+    assert response.usage.total_tokens == backup.usage["total_tokens"]
@@ -0,0 +1,93 @@
+"""
+Retry policy of utils/redis_client.py against a scripted local server:
+failures before a command is written are retried, a lost reply is not.
+"""
+
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip("redis")
+
+from utils import redis_client  # noqa: E402
+
+
+class _ScriptedServer:
+    """Answers the connection handshake and PING; what happens to INCRBY is
+    decided per connection by *script*: ``"drop"`` closes the connection
+    before the handshake, ``"swallow"`` reads INCRBY and closes without a
+    reply, ``"reply"`` answers it."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.incrby_received = 0
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.listener.getsockname()[1]}/0"
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            behaviour = self.script.pop(0) if self.script else "reply"
+            with conn:
+                if behaviour == "drop":
+                    continue
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    if b"INCRBY" in data:
+                        self.incrby_received += 1
+                        if behaviour == "swallow":
+                            break
+                        conn.sendall(b":1\r\n")
+                    elif b"HELLO" in data:
+                        conn.sendall(b"%1\r\n$5\r\nproto\r\n:3\r\n")
+                    elif b"PING" in data:
+                        conn.sendall(b"+PONG\r\n")
+                    else:
+                        conn.sendall(b"+OK\r\n" * data.count(b"*"))
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    servers = []
+
+    def start(*script):
+        srv = _ScriptedServer(script)
+        servers.append(srv)
+        monkeypatch.setenv("REDIS_URL", srv.url)
+        return srv
+
+    monkeypatch.setattr(redis_client, "_sync_redis", None)
+    yield start
+    for srv in servers:
+        srv.close()
+    monkeypatch.setattr(redis_client, "_sync_redis", None)
+
+
+def test_lost_reply_is_not_resent(server):
+    srv = server("swallow", "reply")
+
+    with pytest.raises(redis_client.RedisReplyLostError):
+        redis_client.get_sync_redis().incrby("counter", 1)
+    assert srv.incrby_received == 1
+
+
+def test_failure_before_sending_is_retried(server):
+    srv = server("drop", "reply")
+
+    assert redis_client.get_sync_redis().incrby("counter", 1) == 1
+    assert srv.incrby_received == 1
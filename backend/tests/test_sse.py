@@ -0,0 +1,99 @@
+"""
+Framing, error reporting and close hooks of utils/sse.py, driven through
+the ASGI interface directly.
+"""
+
+import asyncio
+import json
+
+from utils.sse import SSEResponse
+
+
+async def _run(response: SSEResponse, disconnect_after_s: float = None) -> list:
+    sent = []
+
+    async def receive():
+        if disconnect_after_s is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after_s)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await response({"type": "http"}, receive, send)
+    return sent
+
+
+def _events(sent: list) -> list:
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return [json.loads(line[len("data: "):]) for line in body.decode().split("\n\n") if line.startswith("data: ")]
+
+
+def test_text_is_coalesced_and_events_are_separate_frames():
+    async def content():
+        for word in ("one ", "two ", "three"):
+            yield word
+        yield {"done": True}
+
+    events = _events(asyncio.run(_run(SSEResponse(content(), flush_interval_s=10))))
+
+    assert events == [{"chunk": "one two three"}, {"done": True}]
+
+
+def test_generator_error_sends_text_so_far_then_an_error_frame():
+    async def content():
+        yield "partial "
+        raise RuntimeError("upstream exploded")
+
+    sent = asyncio.run(_run(SSEResponse(content(), flush_interval_s=10)))
+
+    assert _events(sent) == [{"chunk": "partial "}, {"error": "upstream exploded"}]
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_on_close_runs_when_the_generator_is_never_started():
+    closed = []
+
+    async def content():
+        yield "never read"
+
+    async def on_close():
+        closed.append(True)
+
+    async def failing_send(message):
+        raise OSError("client gone before the headers")
+
+    response = SSEResponse(content(), on_close=on_close)
+
+    async def run():
+        try:
+            await response({"type": "http"}, lambda: asyncio.sleep(3600), failing_send)
+        except OSError:
+            pass
+
+    asyncio.run(run())
+    assert closed == [True]
+
+
+def test_disconnect_closes_the_generator_and_calls_the_hooks():
+    calls = []
+
+    async def content():
+        try:
+            yield "hello"
+            await asyncio.sleep(3600)
+            yield "never"
+        finally:
+            calls.append("generator closed")
+
+    async def on_disconnect():
+        calls.append("on_disconnect")
+
+    async def on_close():
+        calls.append("on_close")
+
+    response = SSEResponse(content(), on_disconnect=on_disconnect, on_close=on_close, flush_interval_s=0)
+    asyncio.run(_run(response, disconnect_after_s=0.05))
+
+    assert calls == ["generator closed", "on_disconnect", "on_close"]
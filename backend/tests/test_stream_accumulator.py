@@ -0,0 +1,40 @@
+"""
+Running completion estimate of utils/stream_accumulator.py.
+"""
+
+from utils.context_window import estimate_tokens
+from utils.stream_accumulator import StreamAccumulator
+
+REPLY = "The quiet night, she smiled and whispered: remember our promise? 他看着窗外的雨。" * 40
+
+
+def _stream(reply: str, step: int, **kwargs) -> StreamAccumulator:
+    accumulator = StreamAccumulator("deepseek-v4-flash", [], **kwargs)
+    for i in range(0, len(reply), step):
+        if not accumulator.add(reply[i:i + step]):
+            break
+    return accumulator
+
+
+def test_small_deltas_are_not_overcounted():
+    accumulator = _stream(REPLY, 3)
+
+    assert accumulator.text == REPLY
+    # Within a few tokens of estimating the whole reply at once
+    assert abs(accumulator.completion_tokens - estimate_tokens(REPLY)) <= 2
+
+
+def test_estimate_does_not_depend_on_delta_size():
+    counts = {_stream(REPLY, step).completion_tokens for step in (1, 4, 17, 100)}
+
+    assert max(counts) - min(counts) <= 2
+
+
+def test_budget_stops_the_reply():
+    full = _stream(REPLY, 5)
+    budget = full.credits_for(full.completion_tokens // 2)
+
+    capped = _stream(REPLY, 5, budget_credits=budget)
+
+    assert 0 < len(capped.text) < len(REPLY)
+    assert capped.credits <= budget
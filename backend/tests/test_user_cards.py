@@ -0,0 +1,87 @@
+"""
+Profile cards are built with a fixed number of queries per page.
+
+``enrich_users_with_character_count`` and the list routes that call it must
+issue the same number of statements for one user as for a full page.
+"""
+
+import pytest
+
+from conftest import count_statements
+
+PAGE = 12
+
+
+@pytest.fixture
+def creators(db, monkeypatch):
+    from models import Character, CreatorStats, Persona, Scene, User, UserLikedCharacter
+
+    # Liked ids come from Postgres, not a Redis that may or may not be up
+    def no_redis():
+        raise ConnectionError("redis disabled in tests")
+
+    monkeypatch.setattr("utils.liked_set.get_sync_redis", no_redis)
+
+    users = [
+        User(id=f"creator-{n:02d}", name=f"creator {n}", hashed_password="x", views=100 - n)
+        for n in range(PAGE)
+    ]
+    viewer = User(id="viewer", name="viewer", hashed_password="x", views=0)
+    db.add_all(users + [viewer])
+    db.flush()
+    for n, user in enumerate(users):
+        db.add(CreatorStats(user_id=user.id, character_count=5))
+        for k in range(5):
+            character = Character(name=f"c-{n}-{k}", persona="p", creator_id=user.id, creator_name=user.name)
+            db.add(character)
+            db.flush()
+            if k % 2 == 0:
+                db.add(UserLikedCharacter(user_id=viewer.id, character_id=character.id))
+        for k in range(4):
+            db.add(Scene(name=f"s-{n}-{k}", description="d", creator_id=user.id))
+            db.add(Persona(name=f"p-{n}-{k}", creator_id=user.id))
+    db.flush()
+    return users, viewer
+
+
+def _statements(engine, fn):
+    with count_statements(engine) as executed:
+        fn()
+    return len(executed)
+
+
+def test_enrich_query_count_does_not_grow_with_users(db, pg_engine, creators):
+    from utils.user_utils import enrich_users_with_character_count
+
+    users, viewer = creators
+    one = _statements(pg_engine, lambda: enrich_users_with_character_count(users[:1], db, viewer))
+    many = _statements(pg_engine, lambda: enrich_users_with_character_count(users, db, viewer))
+    assert one == many
+
+    cards = enrich_users_with_character_count(users, db, viewer)
+    assert [card["id"] for card in cards] == [user.id for user in users]
+    assert all(card["characters_created"] == 5 for card in cards)
+    assert all(len(card["recent_characters"]) == 4 for card in cards)
+
+
+@pytest.mark.parametrize("route", ["get_popular_users", "get_recent_users", "get_recommended_users"])
+def test_user_list_routes_query_count_does_not_grow_with_page_size(db, pg_engine, creators, route):
+    from routes import user as user_routes
+
+    _, viewer = creators
+    handler = getattr(user_routes, route)
+    one = _statements(pg_engine, lambda: handler(page=1, page_size=1, current_user=viewer, db=db))
+    many = _statements(pg_engine, lambda: handler(page=1, page_size=PAGE, current_user=viewer, db=db))
+    assert one == many
+
+
+def test_following_list_query_count_does_not_grow_with_page_size(db, pg_engine, creators):
+    from models import UserFollow
+    from routes.user import get_user_following
+
+    users, viewer = creators
+    db.add_all(UserFollow(follower_id=viewer.id, creator_id=user.id) for user in users)
+    db.flush()
+    one = _statements(pg_engine, lambda: get_user_following(viewer.id, page=1, page_size=1, current_user=viewer, db=db))
+    many = _statements(pg_engine, lambda: get_user_following(viewer.id, page=1, page_size=PAGE, current_user=viewer, db=db))
+    assert one == many
@@ -0,0 +1,192 @@
+"""
+Incremental analytics rollups for the admin dashboard.
+
+``/api/admin/user-stats`` used to pull every login audit row and every chat's
+user id for the last 30 days into Python sets, and join every chat with its
+messages to get an average length.  Activity is now rolled up as it happens:
+
+* ``user_activity_daily`` — one row per (UTC day, user), upserted from the
+  register/login, chat-turn and credit-ledger paths in the caller's
+  transaction.  Retention and registration counts read a handful of rows
+  per day from here.
+* ``analytics:active:{YYYY-MM-DD}`` — a Redis HyperLogLog of the users active
+  that day.  ``PFCOUNT`` over 1/7/30 day keys gives DAU/WAU/MAU without
+  touching Postgres; when a day key is missing (Redis was flushed, or the
+  days predate the rollup) the distinct count falls back to the table.
+  Users are added after the caller's transaction commits, so a rolled-back
+  event never counts as activity.
+"""
+
+import logging
+from datetime import date, datetime, timedelta, UTC
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import UserActivityDaily
+from utils.redis_client import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_HLL_TTL_S = 40 * 24 * 3600
+_ACTIVE_PREFIX = "analytics:active"
+_PENDING_KEY = "analytics_active_pending"
+
+# (date, user_id) pairs already added to today's HyperLogLog by this process
+_hll_seen: set = set()
+_hll_seen_date: Optional[date] = None
+
+
+def _active_key(day: date) -> str:
+    return f"{_ACTIVE_PREFIX}:{day.isoformat()}"
+
+
+def _mark_active_hll(day: date, user_id: str) -> None:
+    global _hll_seen, _hll_seen_date
+    if _hll_seen_date != day:
+        _hll_seen, _hll_seen_date = set(), day
+    if user_id in _hll_seen:
+        return
+    try:
+        redis = get_sync_redis()
+        pipe = redis.pipeline(transaction=False)
+        pipe.pfadd(_active_key(day), user_id)
+        pipe.expire(_active_key(day), ACTIVE_HLL_TTL_S)
+        pipe.execute()
+        _hll_seen.add(user_id)
+    except Exception:
+        logger.debug("Could not update active-user HyperLogLog", exc_info=True)
+
+
+def record_activity(
+    db: Session,
+    user_id: Optional[str],
+    *,
+    registered: bool = False,
+    login: bool = False,
+    chat_messages: int = 0,
+    new_chat: bool = False,
+    usage: bool = False,
+    when: Optional[datetime] = None,
+) -> None:
+    """Add one activity event to the user's row for the day.  Does not commit."""
+    if not user_id:
+        return
+    day = (when or datetime.now(UTC)).date()
+    increments = {
+        "login_count": int(login),
+        "chat_messages": int(chat_messages),
+        "new_chats": int(new_chat),
+        "usage_count": int(usage),
+    }
+    stmt = insert(UserActivityDaily).values(
+        activity_date=day,
+        user_id=user_id,
+        registered=registered,
+        **increments,
+    )
+    set_ = {
+        name: getattr(UserActivityDaily, name) + delta
+        for name, delta in increments.items()
+        if delta
+    }
+    if registered:
+        set_["registered"] = True
+    if set_:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserActivityDaily.activity_date, UserActivityDaily.user_id],
+            set_=set_,
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+    db.execute(stmt)
+    db.info.setdefault(_PENDING_KEY, set()).add((day, user_id))
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _mark_committed_active(session) -> None:
+    for day, user_id in session.info.pop(_PENDING_KEY, ()):
+        _mark_active_hll(day, user_id)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending_active(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ===================================================================
+# Dashboard reads
+# ===================================================================
+
+_DAILY_TOTALS_SQL = text("""
+SELECT activity_date,
+       COUNT(*) AS active_users,
+       COUNT(*) FILTER (WHERE registered) AS registrations,
+       COALESCE(SUM(chat_messages), 0) AS chat_messages,
+       COALESCE(SUM(new_chats), 0) AS new_chats
+  FROM user_activity_daily
+ WHERE activity_date >= :since
+ GROUP BY activity_date
+""")
+
+_DISTINCT_ACTIVE_SQL = text("""
+SELECT COUNT(DISTINCT user_id)
+  FROM user_activity_daily
+ WHERE activity_date >= :since
+""")
+
+_RETENTION_SQL = text("""
+SELECT COUNT(*) FILTER (WHERE r.activity_date + 1 <= :today) AS d1_eligible,
+       COUNT(d1.user_id) AS d1_retained,
+       COUNT(*) FILTER (WHERE r.activity_date + 7 <= :today) AS d7_eligible,
+       COUNT(d7.user_id) AS d7_retained
+  FROM user_activity_daily r
+  LEFT JOIN user_activity_daily d1
+         ON d1.user_id = r.user_id AND d1.activity_date = r.activity_date + 1
+  LEFT JOIN user_activity_daily d7
+         ON d7.user_id = r.user_id AND d7.activity_date = r.activity_date + 7
+ WHERE r.registered
+   AND r.activity_date >= :since
+""")
+
+
+def daily_totals(db: Session, since: date) -> Dict[date, Dict[str, int]]:
+    """Return ``{day: {active_users, registrations, chat_messages, new_chats}}``."""
+    rows = db.execute(_DAILY_TOTALS_SQL, {"since": since}).all()
+    return {
+        row.activity_date: {
+            "active_users": int(row.active_users),
+            "registrations": int(row.registrations),
+            "chat_messages": int(row.chat_messages),
+            "new_chats": int(row.new_chats),
+        }
+        for row in rows
+    }
+
+
+def count_active_users(db: Session, today: date, days: int) -> int:
+    """Distinct users active in the last *days* days, today included."""
+    day_list: List[date] = [today - timedelta(days=offset) for offset in range(days)]
+    keys = [_active_key(day) for day in day_list]
+    try:
+        redis = get_sync_redis()
+        if redis.exists(*keys) == len(keys):
+            return int(redis.pfcount(*keys))
+    except Exception:
+        logger.debug("Active-user HyperLogLog unavailable, counting in Postgres", exc_info=True)
+    return int(db.execute(_DISTINCT_ACTIVE_SQL, {"since": day_list[-1]}).scalar() or 0)
+
+
+def retention(db: Session, today: date, cohort_days: int = 8) -> Dict[str, float]:
+    """D1/D7 retention (percent) for users registered in the last *cohort_days* days."""
+    row = db.execute(
+        _RETENTION_SQL,
+        {"today": today, "since": today - timedelta(days=cohort_days)},
+    ).one()
+    return {
+        "d1_retention": (row.d1_retained / row.d1_eligible * 100) if row.d1_eligible else 0,
+        "d7_retention": (row.d7_retained / row.d7_eligible * 100) if row.d7_eligible else 0,
+    }
@@ -1,15 +1,33 @@
 """
 Audit Log System for tracking user operations
+
+Entries are buffered in a bounded in-memory queue and written by a
+background thread in batched multi-row INSERTs, so request handlers do not
+pay for a separate transaction per audit entry.  When the writer is not
+running (scripts, tests) or the queue stays full, ``record_audit`` falls
+back to a synchronous insert so entries are never dropped.
 """
 from sqlalchemy import Column, String, Integer, DateTime, Text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.dialects.postgresql import JSONB
 from database import Base, SessionLocal
 from datetime import datetime, UTC
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
+import os
+import queue
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Writer tuning
+AUDIT_QUEUE_MAXSIZE = int(os.getenv("AUDIT_QUEUE_MAXSIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL_S = float(os.getenv("AUDIT_FLUSH_INTERVAL_S", "2.0"))
+# How long a producer blocks on a full queue before writing synchronously
+AUDIT_ENQUEUE_TIMEOUT_S = 0.05
+
 
 class AuditLog(Base):
     """Audit log model for tracking user operations"""
@@ -64,27 +82,143 @@ def record_audit(
             metadata={"method": "password", "endpoint": "/api/auth/login"}
         )
     """
+    row = {
+        "user_id": user_id,
+        "action": action,
+        "timestamp": datetime.now(UTC),
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "metadata": metadata or {},  # column name of AuditLog.meta
+        "status": status,
+        "error_message": error_message,
+    }
+
+    if _writer.running:
+        try:
+            # Backpressure: block briefly on a full queue, then write inline
+            _writer.queue.put(row, timeout=AUDIT_ENQUEUE_TIMEOUT_S)
+            return True
+        except queue.Full:
+            logger.warning("Audit queue full, writing entry synchronously")
+
+    return _insert_rows([row])
+
+
+def _insert_rows(rows: List[Dict[str, Any]]) -> bool:
+    """Insert *rows* in a single multi-row INSERT statement.
+
+    If the statement is rejected because of the data (an over-long field,
+    an unserialisable metadata value), the batch is split in halves and
+    retried, so only the bad entries are lost.  Connection errors are not
+    retried.
+    """
+    if not rows:
+        return True
     db = SessionLocal()
     try:
-        audit_entry = AuditLog(
-            user_id=user_id,
-            action=action,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            meta=metadata or {},
-            status=status,
-            error_message=error_message
-        )
-        db.add(audit_entry)
+        db.execute(AuditLog.__table__.insert().values(rows))
         db.commit()
         return True
-    except Exception as e:
-        logger.error(f"Failed to record audit log: {e}")
+    except OperationalError as e:
+        logger.error(f"Failed to record {len(rows)} audit log(s): {e}")
         db.rollback()
         return False
+    except Exception as e:
+        db.rollback()
+        error = e
     finally:
         db.close()
 
+    if len(rows) == 1:
+        logger.error(f"Dropped audit log {rows[0].get('action')!r}: {error}")
+        return False
+    mid = len(rows) // 2
+    first_ok = _insert_rows(rows[:mid])
+    second_ok = _insert_rows(rows[mid:])
+    return first_ok and second_ok
+
+
+class _AuditWriter:
+    """Background thread that drains the audit queue in batches.
+
+    A batch is flushed when it reaches ``AUDIT_BATCH_SIZE`` entries or when
+    ``AUDIT_FLUSH_INTERVAL_S`` has elapsed since the first entry in it.
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=AUDIT_QUEUE_MAXSIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        logger.info("Audit log writer started")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the thread and flush everything still queued."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        # Anything enqueued after the thread exited is written here
+        self._drain()
+        logger.info("Audit log writer stopped")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=AUDIT_FLUSH_INTERVAL_S)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL_S
+            while len(batch) < AUDIT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            _insert_rows(batch)
+
+        self._drain()
+
+    def _drain(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= AUDIT_BATCH_SIZE:
+                _insert_rows(batch)
+                batch = []
+        _insert_rows(batch)
+
+
+_writer = _AuditWriter()
+
+
+def start_audit_writer() -> None:
+    """Start the background audit writer (called on app startup)."""
+    _writer.start()
+
+
+def stop_audit_writer() -> None:
+    """Flush pending audit entries and stop the writer (called on shutdown)."""
+    _writer.stop()
+
 
 def get_audit_logs(
     user_id: Optional[str] = None,
@@ -5,12 +5,11 @@
 """
 import os
 import json
-from typing import Dict, Optional
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
 
-from alibabacloud_captcha20230305.client import Client as CaptchaClient
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_captcha20230305 import models as captcha_models
-from alibabacloud_tea_util import models as util_models
+if TYPE_CHECKING:
+    from alibabacloud_captcha20230305.client import Client as CaptchaClient
 
 
 class CaptchaVerifier:
@@ -23,7 +22,7 @@ class CaptchaVerifier:
         self.is_available = self.client is not None
     
     @staticmethod
-    def _create_client() -> CaptchaClient:
+    def _create_client() -> "CaptchaClient":
         """
         创建阿里云验证码客户端
         使用默认凭证链（推荐方式）
@@ -50,6 +49,10 @@ class CaptchaVerifier:
             # 直接使用 AccessKey 凭证（避免 CredentialClient 凭证链的副作用：
             # 1. signal.signal() 只能在主线程调用
             # 2. EcsRamRoleCredentialsProvider 每实例创建一个 APScheduler 循环任务）
+            # 阿里云SDK导入较慢，首次使用时再导入
+            from alibabacloud_captcha20230305.client import Client as CaptchaClient
+            from alibabacloud_tea_openapi import models as open_api_models
+
             config = open_api_models.Config(
                 access_key_id=access_key_id,
                 access_key_secret=access_key_secret
@@ -101,6 +104,9 @@ class CaptchaVerifier:
             
             print(f"🔍 验证验证码参数: scene_id={scene_id}, param_length={len(captcha_verify_param)}")
             
+            from alibabacloud_captcha20230305 import models as captcha_models
+            from alibabacloud_tea_util import models as util_models
+
             # 构建验证请求
             request = captcha_models.VerifyIntelligentCaptchaRequest(
                 captcha_verify_param=captcha_verify_param,
@@ -184,54 +190,52 @@ class CaptchaVerifier:
             }
 
 
-# 全局验证器实例
-# 在模块加载时立即初始化（主线程），避免后续在 worker 线程中初始化
-# 导致 CredentialClient 内部 signal.signal() 调用失败
+# 每个进程一个验证器实例（只持有API客户端，不保存任何验证状态，验签结果由阿里云判定，
+# 因此多 worker/多节点部署下无需共享）。
+# 首次使用时在当前进程中创建，而不是在模块加载时创建：gunicorn preload 模式下
+# 模块在 master 进程中导入，提前创建的客户端连接会被 fork 到所有 worker 中共享。
+# 客户端直接使用 AccessKey 凭证，不涉及 CredentialClient 的 signal.signal()，可在任意线程初始化。
 _captcha_verifier: Optional[CaptchaVerifier] = None
+_captcha_verifier_pid: Optional[int] = None
+_captcha_verifier_lock = threading.Lock()
 
 
 def _init_captcha_verifier():
-    """在模块加载时（主线程）初始化验证码验证器"""
-    global _captcha_verifier
+    """初始化当前进程的验证码验证器"""
+    global _captcha_verifier, _captcha_verifier_pid
     try:
         _captcha_verifier = CaptchaVerifier()
     except Exception as e:
-        print(f"⚠️  验证码验证器模块加载时初始化失败: {str(e)}")
+        print(f"⚠️  验证码验证器初始化失败: {str(e)}")
         _captcha_verifier = None
+    _captcha_verifier_pid = os.getpid()
 
 
 def get_captcha_verifier() -> CaptchaVerifier:
     """
-    获取验证码验证器实例（单例模式）
-    注意：验证器在模块加载时已初始化，此函数仅返回已有实例。
-    如果初始化失败（凭证未配置），会返回一个 client 为 None 的实例。
+    获取当前进程的验证码验证器实例（单例模式，首次调用时创建）
+    如果凭证未配置，会返回一个 client 为 None 的实例。
     """
-    global _captcha_verifier
-    if _captcha_verifier is None:
-        # 兜底：如果模块加载时初始化失败，在此处重试
-        # 此时应确保在主线程中调用（例如从 startup 事件）
-        _init_captcha_verifier()
+    if _captcha_verifier is None or _captcha_verifier_pid != os.getpid():
+        with _captcha_verifier_lock:
+            if _captcha_verifier is None or _captcha_verifier_pid != os.getpid():
+                _init_captcha_verifier()
     return _captcha_verifier
 
 
 def reinitialize_captcha_verifier():
     """
-    强制重新初始化验证码验证器（仅在主线程中调用）
+    强制重新初始化验证码验证器
     用于在环境变量加载后重新创建客户端
     """
-    global _captcha_verifier
-    _captcha_verifier = None
-    _init_captcha_verifier()
+    with _captcha_verifier_lock:
+        _init_captcha_verifier()
     if _captcha_verifier and _captcha_verifier.is_available:
         print("✓ 验证码验证器重新初始化成功")
     else:
         print("⚠️  验证码验证器重新初始化失败（凭证可能未配置）")
 
 
-# 模块加载时立即初始化（在主线程中）
-_init_captcha_verifier()
-
-
 def verify_captcha_param(captcha_verify_param: str, scene_id: Optional[str] = None) -> bool:
     """
     快速验证验证码参数
@@ -0,0 +1,342 @@
+"""
+Chat admission: every pre-flight limit of ``/api/chat`` in one Lua call.
+
+The script evaluates, in this order and atomically:
+
+1. ``credit_cap_blocked:{user_id}`` — cached "credit cap reached and no
+   wallet balance" flag (String holding the credit-limit payload)
+2. ``rate_limit:{user_id}:minute`` — per-user sliding window (shared with
+   ``RateLimiter.status``)
+3. ``chat_inflight:{user_id}`` — Sorted Set of in-flight tickets scored by
+   lease expiry, capping concurrent chat turns per user
+4. the model's RPM, TPM and concurrency limits, through the scheduler
+   functions of ``upstream_bucket`` (``SCHEDULER_LUA``)
+
+and answers *admit*, *queue* (user limits passed, model saturated: the
+ticket is appended to the model's pro/free stream for the dispenser) or
+*reject* with a retry-after.  Nothing is recorded on reject.  The turn is
+charged its estimated prompt tokens plus ``max_tokens`` against the model's
+TPM window; :meth:`Admission.release` reconciles that with actual usage.
+
+The credit flag is only a cache: it is set when the Postgres credit check
+finds the user blocked, expires after at most ``CREDIT_FLAG_TTL_S`` and is
+cleared when the user tops up or upgrades.
+
+Like the limiters it replaces, admission fails open when Redis is down.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, UTC
+from typing import Any, Optional
+
+from utils.model_rate_limiter import KEY_TTL_S, WINDOW_S, minute_key, rpm_for
+from utils.redis_client import get_redis, get_script, get_sync_redis
+from utils.upstream_bucket import (
+    SCHEDULER_LUA,
+    discard_waiter,
+    is_scheduled,
+    limit_args,
+    model_keys,
+    new_request_id,
+    register_waiter,
+    stream_key,
+    wait_for_slot,
+)
+
+logger = logging.getLogger(__name__)
+
+ADMIT = "admit"
+QUEUE = "queue"
+REJECT = "reject"
+
+# Reject reasons
+CREDIT_CAP = "credit_cap"
+RATE_LIMIT = "rate_limit"
+CONCURRENCY = "concurrency"
+
+CHAT_MAX_INFLIGHT_FREE = int(os.getenv("CHAT_MAX_INFLIGHT_FREE", "2"))
+CHAT_MAX_INFLIGHT_PRO = int(os.getenv("CHAT_MAX_INFLIGHT_PRO", "4"))
+# A turn that never releases its ticket (crashed worker) frees the slot after this
+CHAT_INFLIGHT_LEASE_S = 300
+CONCURRENCY_RETRY_AFTER_S = 2
+CREDIT_FLAG_TTL_S = 60
+UPSTREAM_WAIT_TIMEOUT_S = 30.0
+
+
+def _credit_flag_key(user_id: str) -> str:
+    return f"credit_cap_blocked:{user_id}"
+
+
+def _inflight_key(user_id: str) -> str:
+    return f"chat_inflight:{user_id}"
+
+
+# KEYS[1] = credit flag  KEYS[2] = user window  KEYS[3] = user in-flight set
+# KEYS[4..7] = model keys  KEYS[8] = upstream stream (pro or free)
+# ARGV[1] = ticket  ARGV[2] = user window s  ARGV[3] = user rpm  ARGV[4] = user window TTL
+# ARGV[5] = max in-flight  ARGV[6] = lease s  ARGV[7] = concurrency retry-after s
+# ARGV[8] = token charge  ARGV[9..16] = model limits (ARGV[9] = now)
+# Returns {decision, detail, retry_after_s, user_remaining}
+#   reject: detail = reason (credit_cap also returns the cached payload as 5th item)
+#   queue:  detail = stream message id
+_ADMIT_LUA = SCHEDULER_LUA + r"""
+local m      = model_ctx(4, 9)
+local now    = m.now
+local ticket = ARGV[1]
+
+local credit = redis.call('GET', KEYS[1])
+if credit then
+    return {'reject', 'credit_cap', math.max(redis.call('TTL', KEYS[1]), 1), 0, credit}
+end
+
+local user_window = tonumber(ARGV[2])
+local user_rpm    = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - user_window)
+local user_count = redis.call('ZCARD', KEYS[2])
+if user_count >= user_rpm then
+    local retry = 1
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        retry = math.max(math.ceil(tonumber(oldest[2]) + user_window - now), 1)
+    end
+    return {'reject', 'rate_limit', retry, 0}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[5]) then
+    return {'reject', 'concurrency', tonumber(ARGV[7]), user_rpm - user_count}
+end
+
+local lease = tonumber(ARGV[6])
+redis.call('ZADD', KEYS[2], now, ticket)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('ZADD', KEYS[3], now + lease, ticket)
+redis.call('EXPIRE', KEYS[3], lease)
+local remaining = user_rpm - user_count - 1
+
+local cost = tonumber(ARGV[8])
+model_purge(m)
+if model_wait_ms(m, cost) == 0 then
+    model_take(m, ticket, cost)
+    return {'admit', '', 0, remaining}
+end
+local msg_id = redis.call('XADD', KEYS[8], '*', 'request_id', ticket, 'tokens', cost, 'ts', math.floor(now))
+return {'queue', msg_id, 0, remaining}
+"""
+
+# End of a turn: free the user's in-flight slot and finish the model slot.
+# KEYS[1] = user in-flight set  KEYS[2..5] = model keys
+# ARGV[1] = ticket  ARGV[2] = tokens charged  ARGV[3] = actual tokens (-1 unknown)
+# ARGV[4..11] = model limits
+_RELEASE_LUA = SCHEDULER_LUA + r"""
+local m = model_ctx(2, 4)
+redis.call('ZREM', KEYS[1], ARGV[1])
+model_finish(m, ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]))
+return 1
+"""
+
+# Undo an admission that was turned down afterwards (Postgres credit check).
+# KEYS[1] = user window  KEYS[2] = user in-flight set  KEYS[3..6] = model keys
+# KEYS[7] = upstream stream
+# ARGV[1] = ticket  ARGV[2] = stream message id or ''  ARGV[3] = tokens charged
+# ARGV[4..11] = model limits
+_REFUND_LUA = SCHEDULER_LUA + r"""
+local m = model_ctx(3, 4)
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', m.rate, ARGV[1])
+model_finish(m, ARGV[1], tonumber(ARGV[3]), 0)
+if ARGV[2] ~= '' then
+    redis.call('XDEL', KEYS[7], ARGV[2])
+end
+return 1
+"""
+
+
+@dataclass
+class Admission:
+    decision: str
+    user_id: str
+    tier: str
+    limit: int
+    remaining: int = 0
+    reason: str = ""
+    retry_after_s: int = 0
+    ticket: str = ""
+    model_id: str = ""
+    charged_tokens: int = 0
+    credit_limits: Optional[dict] = None
+    _stream_key: str = field(default="", repr=False)
+    _msg_id: str = field(default="", repr=False)
+    _waiter: Optional[asyncio.Future] = field(default=None, repr=False)
+    _released: bool = field(default=False, repr=False)
+
+    @property
+    def rejected(self) -> bool:
+        return self.decision == REJECT
+
+    async def wait_upstream(self, timeout_s: float = UPSTREAM_WAIT_TIMEOUT_S) -> bool:
+        """Return once the model has a slot for this turn (immediately unless queued).
+
+        On timeout or cancellation the ticket is released.
+        """
+        if self.decision != QUEUE:
+            return True
+        try:
+            released = await wait_for_slot(self.ticket, self._waiter, self._stream_key, self._msg_id, timeout_s)
+        except asyncio.CancelledError:
+            await self.refund()
+            raise
+        except Exception:
+            logger.exception("Upstream wait failed for ticket=%s — failing open", self.ticket)
+            return True
+        if not released:
+            await self.release()
+        return released
+
+    async def release(self, actual_tokens: Optional[int] = None) -> None:
+        """Free this turn's in-flight slots and settle its TPM charge with
+        *actual_tokens* (prompt + completion; kept as charged when unknown).
+        Idempotent and best-effort."""
+        if self._released or not self.ticket or self.decision == REJECT:
+            return
+        self._released = True
+        if self._waiter is not None:
+            discard_waiter(self.ticket)
+        try:
+            release = await get_script(_RELEASE_LUA)
+            await release(
+                keys=[_inflight_key(self.user_id), *model_keys(self.model_id)],
+                args=[
+                    self.ticket,
+                    self.charged_tokens,
+                    -1 if not actual_tokens else actual_tokens,
+                    *limit_args(self.model_id),
+                ],
+            )
+        except Exception:
+            logger.debug("Could not release chat ticket %s", self.ticket, exc_info=True)
+
+    async def refund(self) -> None:
+        """Undo the admission entirely: window entries, in-flight slot and queue entry."""
+        if self._released or not self.ticket or self.decision == REJECT:
+            return
+        self._released = True
+        if self._waiter is not None:
+            discard_waiter(self.ticket)
+        try:
+            refund = await get_script(_REFUND_LUA)
+            await refund(
+                keys=[
+                    minute_key(self.user_id),
+                    _inflight_key(self.user_id),
+                    *model_keys(self.model_id),
+                    self._stream_key,
+                ],
+                args=[self.ticket, self._msg_id, self.charged_tokens, *limit_args(self.model_id)],
+            )
+        except Exception:
+            logger.debug("Could not refund chat ticket %s", self.ticket, exc_info=True)
+
+
+async def admit_chat(user_id: str, model_id: str, *, is_pro: bool, tokens: int = 0) -> Admission:
+    """Run every pre-flight limit for one chat turn in a single round-trip.
+
+    *tokens* is the turn's TPM charge: estimated prompt tokens plus ``max_tokens``.
+    """
+    user_rpm = rpm_for(is_pro)
+    tier = "pro" if is_pro else "free"
+    queue_key = stream_key(model_id, is_pro)
+    ticket = new_request_id()
+
+    # Listening before the script runs, so a queued ticket's release is never missed
+    waiter = register_waiter(ticket) if is_scheduled(model_id) else None
+    try:
+        admit = await get_script(_ADMIT_LUA)
+        result = await admit(
+            keys=[
+                _credit_flag_key(user_id),
+                minute_key(user_id),
+                _inflight_key(user_id),
+                *model_keys(model_id),
+                queue_key,
+            ],
+            args=[
+                ticket,
+                WINDOW_S,
+                user_rpm,
+                KEY_TTL_S,
+                CHAT_MAX_INFLIGHT_PRO if is_pro else CHAT_MAX_INFLIGHT_FREE,
+                CHAT_INFLIGHT_LEASE_S,
+                CONCURRENCY_RETRY_AFTER_S,
+                tokens,
+                *limit_args(model_id),
+            ],
+        )
+    except Exception:
+        logger.exception("Redis error during chat admission — failing open")
+        if waiter is not None:
+            discard_waiter(ticket)
+        return Admission(ADMIT, user_id, tier, user_rpm, remaining=user_rpm)
+
+    decision, detail, retry_after_s, remaining = result[0], result[1], int(result[2]), int(result[3])
+    admission = Admission(
+        decision,
+        user_id,
+        tier,
+        user_rpm,
+        remaining=remaining,
+        ticket=ticket,
+        model_id=model_id,
+        charged_tokens=tokens,
+        _stream_key=queue_key,
+    )
+    if decision == REJECT:
+        admission.reason = detail
+        admission.retry_after_s = retry_after_s
+        if detail == CREDIT_CAP:
+            admission.credit_limits = _decode_credit_limits(result[4])
+    elif decision == QUEUE:
+        admission._msg_id = detail
+        admission._waiter = waiter
+        return admission
+    if waiter is not None:
+        discard_waiter(ticket)
+    return admission
+
+
+def _decode_credit_limits(raw: Any) -> dict:
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+
+
+async def cache_credit_block(user_id: str, credit_limits: dict) -> None:
+    """Remember that *user_id* is out of credits until the cap resets (at most ``CREDIT_FLAG_TTL_S``)."""
+    ttl = CREDIT_FLAG_TTL_S
+    reset_at = credit_limits.get("reset_at")
+    if reset_at:
+        try:
+            until_reset = (datetime.fromisoformat(reset_at) - datetime.now(UTC)).total_seconds()
+            ttl = max(1, min(ttl, int(until_reset)))
+        except (TypeError, ValueError):
+            pass
+    try:
+        redis = await get_redis()
+        await redis.set(_credit_flag_key(user_id), json.dumps(credit_limits, default=str), ex=ttl)
+    except Exception:
+        logger.debug("Could not cache credit cap for %s", user_id, exc_info=True)
+
+
+def clear_credit_block(user_id: str) -> None:
+    """Drop the cached credit flag after a top-up or plan change (sync callers)."""
+    try:
+        get_sync_redis().delete(_credit_flag_key(user_id))
+    except Exception:
+        logger.debug("Could not clear credit cap flag for %s", user_id, exc_info=True)
@@ -0,0 +1,174 @@
+"""
+Conditional GETs for the detail endpoints clients poll.
+
+Each endpoint builds a weak ETag from version columns only — never from the
+response body — so a repeat request whose ``If-None-Match`` still matches
+costs one narrow query and an empty ``304`` instead of loading, serialising
+and resending the full body.
+
+``row_version`` on ``characters``, ``scenes``, ``personas``, ``users`` and
+``chat_histories`` is bumped by the ``bump_row_version`` trigger on every
+UPDATE, so raw-SQL counter updates (views, likes) change it too.  Message
+store writes always touch their parent ``chat_histories`` row in the same
+transaction.
+
+The viewer's id and admin flag are part of every ETag: a 304 only goes to a
+caller that was served this exact version before, so the visibility checks
+of the full path need not be repeated here.  Fields derived from the clock
+(plan days left, ban expiry, credit windows) are folded in as well.
+
+``include_pending_views`` requests read live Redis counters and are never
+answered with 304.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta, UTC
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from utils.credit_cap import get_free_daily_usage_date
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts: Any) -> str:
+    payload = json.dumps(parts, default=str, separators=(",", ":"))
+    return f'W/"{hashlib.sha1(payload.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of *etag* against an ``If-None-Match`` header (RFC 9110 §13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = _opaque(etag)
+    return any(_opaque(candidate) == wanted for candidate in if_none_match.split(","))
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """A ``304`` response when the client already holds *etag*, else None."""
+    if etag is None or not etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: Optional[str]) -> None:
+    if etag is not None:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = CACHE_CONTROL
+
+
+def _viewer(user) -> tuple:
+    return (user.id, bool(user.is_admin)) if user is not None else (None, False)
+
+
+# ---------------------------------------------------------------------------
+# Version queries
+# ---------------------------------------------------------------------------
+
+_ENTITY_VERSION_SQL = {
+    "character": text("""
+        SELECT c.row_version, u.row_version,
+               EXISTS (SELECT 1 FROM user_liked_characters l
+                       WHERE l.user_id = :viewer_id AND l.character_id = c.id)
+        FROM characters c LEFT JOIN users u ON u.id = c.creator_id
+        WHERE c.id = :id
+    """),
+    "scene": text("""
+        SELECT s.row_version, u.row_version,
+               EXISTS (SELECT 1 FROM user_liked_scenes l
+                       WHERE l.user_id = :viewer_id AND l.scene_id = s.id)
+        FROM scenes s LEFT JOIN users u ON u.id = s.creator_id
+        WHERE s.id = :id
+    """),
+    "persona": text("""
+        SELECT p.row_version, NULL,
+               EXISTS (SELECT 1 FROM user_liked_personas l
+                       WHERE l.user_id = :viewer_id AND l.persona_id = p.id)
+        FROM personas p
+        WHERE p.id = :id
+    """),
+}
+
+
+def entity_etag(db: Session, entity_type: str, entity_id: int, viewer) -> Optional[str]:
+    """ETag of ``/api/{entity}/{id}`` for *viewer* (None if the row does not exist)."""
+    row = db.execute(
+        _ENTITY_VERSION_SQL[entity_type],
+        {"id": entity_id, "viewer_id": viewer.id if viewer is not None else None},
+    ).first()
+    if row is None:
+        return None
+    return weak_etag(entity_type, entity_id, *row, *_viewer(viewer))
+
+
+_CHAT_PAGE_VERSION_SQL = text("""
+    SELECT id, row_version FROM chat_histories
+    WHERE user_id = :user_id
+    ORDER BY last_updated DESC, id DESC
+    OFFSET :offset LIMIT :limit
+""")
+
+_CHAT_COUNT_SQL = text("SELECT count(*) FROM chat_histories WHERE user_id = :user_id")
+
+
+def chat_history_page_etag(db: Session, user_id: str, page: int, page_size: int) -> str:
+    """ETag of one ``/api/chat/history`` page: the total plus (id, row_version) of its rows."""
+    total = db.execute(_CHAT_COUNT_SQL, {"user_id": user_id}).scalar()
+    rows = db.execute(
+        _CHAT_PAGE_VERSION_SQL,
+        {"user_id": user_id, "offset": (page - 1) * page_size, "limit": page_size},
+    ).all()
+    return weak_etag("chat_history", user_id, page, page_size, total, [tuple(r) for r in rows])
+
+
+_USER_VERSION_SQL = text("""
+    SELECT u.row_version,
+           (SELECT p.row_version FROM personas p WHERE p.id = u.default_persona_id),
+           (SELECT cs.character_count FROM creator_stats cs WHERE cs.user_id = u.id),
+           (SELECT count(*) || ':' || coalesce(sum(l.credit_amount), 0)
+            FROM user_credit_usage_ledger l
+            WHERE l.user_id = u.id AND l.usage_date >= :usage_since),
+           floor(extract(epoch FROM (u.pro_expire_date - now())) / 86400),
+           u.ban_until > now()
+    FROM users u
+    WHERE u.id = :id
+""")
+
+# Mirrors fetch_user_chat_history: the 30 most recent visible chats and the
+# moderation state of their characters
+_USER_CHATS_VERSION_SQL = text("""
+    SELECT h.id, h.row_version, h.character_id IS NULL, c.moderation_status
+    FROM chat_histories h LEFT JOIN characters c ON c.id = h.character_id
+    WHERE h.user_id = :id AND h.hidden_from_recent = false
+    ORDER BY h.last_updated DESC, h.id DESC
+    LIMIT 30
+""")
+
+
+def user_etag(db: Session, user_id: str) -> Optional[str]:
+    """ETag of ``/api/user/{id}`` (None if the user does not exist)."""
+    now = datetime.now(UTC)
+    row = db.execute(
+        _USER_VERSION_SQL,
+        # Covers both the free daily and the Pro monthly credit window
+        {"id": user_id, "usage_since": now.date() - timedelta(days=32)},
+    ).first()
+    if row is None:
+        return None
+    chats = db.execute(_USER_CHATS_VERSION_SQL, {"id": user_id}).all()
+    return weak_etag(
+        "user", user_id, *row, [tuple(c) for c in chats],
+        now.date(), get_free_daily_usage_date(now),
+    )
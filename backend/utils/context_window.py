@@ -116,6 +116,11 @@ def _estimate_tokens(text: str) -> int:
     return max(1, int(estimate))
 
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count for *text*, for when the provider has not reported usage."""
+    return _estimate_tokens(text) if text else 0
+
+
 def _sanitize_messages(messages: List[dict]) -> List[dict]:
     clean_messages: List[dict] = []
     for msg in messages:
@@ -340,3 +345,41 @@ def compact_conversation_messages(
         "compaction_trigger_tokens": compaction_trigger_tokens,
         "token_source": token_source,
     }
+
+
+def assemble_prompt(messages: List[dict], turn_context: Optional[dict] = None) -> List[dict]:
+    """Order a prompt stable-first so provider context caches can reuse its prefix.
+
+    Providers cache on exact prompt prefixes, so content is laid out from the
+    least to the most volatile:
+
+    1. character / system prompts — identical on every turn
+    2. the compaction summary — changes only when the history is compacted
+    3. conversation history — only ever grows at the end
+    4. ``turn_context`` (per-turn retrieval such as character memory chunks)
+       and the latest user message — new on every turn
+
+    Relative order within each group is kept.
+    """
+    system_messages: List[dict] = []
+    summary_messages: List[dict] = []
+    conversation_messages: List[dict] = []
+    for message in messages or []:
+        if not isinstance(message, dict):
+            continue
+        if _is_summary_system_message(message):
+            summary_messages.append(message)
+        elif message.get("role") == "system":
+            system_messages.append(message)
+        else:
+            conversation_messages.append(message)
+
+    latest_user: List[dict] = []
+    if conversation_messages and conversation_messages[-1].get("role") == "user":
+        latest_user = [conversation_messages.pop()]
+
+    assembled = [*system_messages, *summary_messages, *conversation_messages]
+    if turn_context:
+        assembled.append(turn_context)
+    assembled.extend(latest_user)
+    return assembled
@@ -0,0 +1,108 @@
+"""
+Denormalised per-creator content statistics (``creator_stats``).
+
+Profile pages and user cards used to count a creator's characters and sum
+their views and likes on every request.  These counters are kept up to date
+by the write paths instead, inside the same transaction as the change:
+
+* create / delete routes call ``record_created`` / ``record_deleted``
+* ``like_engine`` bumps ``{kind}_likes`` in its like/unlike statement
+* ``view_counter`` folds ``{kind}_views`` in with each write-behind flush
+
+Rows are upserted on first write, so creators without one simply read as
+zeros.  None of the helpers commit.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import Character, Scene, Persona, CreatorStats
+
+STAT_KINDS = ("character", "scene", "persona")
+
+_KIND_BY_MODEL = {
+    Character: "character",
+    Scene: "scene",
+    Persona: "persona",
+}
+
+_STAT_COLUMNS = {
+    f"{kind}_{stat}" for kind in STAT_KINDS for stat in ("count", "views", "likes")
+}
+
+
+# Existing rows take the delta (clamped at 0); creators without a row get one.
+_BUMP_SQL_TEMPLATE = """
+WITH d AS (
+    SELECT * FROM unnest(CAST(:user_ids AS varchar[]), CAST(:deltas AS bigint[])) AS d(user_id, delta)
+),
+updated AS (
+    UPDATE creator_stats s
+       SET {col} = GREATEST(s.{col} + d.delta, 0)
+      FROM d
+     WHERE s.user_id = d.user_id
+    RETURNING s.user_id
+)
+INSERT INTO creator_stats (user_id, {col})
+SELECT d.user_id, GREATEST(d.delta, 0)
+  FROM d
+ WHERE d.user_id NOT IN (SELECT user_id FROM updated)
+ON CONFLICT (user_id) DO UPDATE
+   SET {col} = GREATEST(creator_stats.{col} + EXCLUDED.{col}, 0)
+"""
+_BUMP_SQL = {column: text(_BUMP_SQL_TEMPLATE.format(col=column)) for column in _STAT_COLUMNS}
+
+
+def _bump(db: Session, column: str, deltas: Dict[str, int]) -> None:
+    """Add ``deltas[user_id]`` to *column* for each creator (negative deltas clamp at 0)."""
+    deltas = {user_id: n for user_id, n in deltas.items() if user_id and n}
+    if not deltas:
+        return
+    db.execute(_BUMP_SQL[column], {"user_ids": list(deltas), "deltas": list(deltas.values())})
+
+
+def _entity_kind(entity) -> str:
+    return _KIND_BY_MODEL[type(entity)]
+
+
+def record_created(db: Session, entity) -> None:
+    """Count a newly added character, scene or persona for its creator."""
+    if entity.creator_id:
+        _bump(db, f"{_entity_kind(entity)}_count", {entity.creator_id: 1})
+
+
+def record_deleted(db: Session, entity) -> None:
+    """Remove a character, scene or persona (and its views and likes) from its creator's totals.
+
+    Call before ``db.delete(entity)``.
+    """
+    if not entity.creator_id:
+        return
+    kind = _entity_kind(entity)
+    _bump(db, f"{kind}_count", {entity.creator_id: -1})
+    _bump(db, f"{kind}_views", {entity.creator_id: -(entity.views or 0)})
+    _bump(db, f"{kind}_likes", {entity.creator_id: -(entity.likes or 0)})
+
+
+def add_views(db: Session, kind: str, deltas: Dict[str, int]) -> None:
+    """Add flushed view deltas (``{creator_id: views}``) for *kind* content."""
+    _bump(db, f"{kind}_views", deltas)
+
+
+def get_creator_stats(db: Session, user_id: str) -> Optional[CreatorStats]:
+    return db.query(CreatorStats).filter(CreatorStats.user_id == user_id).first()
+
+
+def get_character_counts(db: Session, user_ids: Iterable[str]) -> Dict[str, int]:
+    """Return ``{user_id: characters created}`` for *user_ids* (missing rows omitted)."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    return dict(
+        db.query(CreatorStats.user_id, CreatorStats.character_count)
+        .filter(CreatorStats.user_id.in_(user_ids))
+        .all()
+    )
@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
 
 from models import User, UserCreditUsageLedger
+from utils.analytics_rollup import record_activity
 from utils.credit_cap import can_consume_credits, get_free_daily_usage_date, is_user_pro_active
 from utils.credit_wallet import consume_wallet_credits
 from utils.usage_utils import normalize_usage
@@ -51,6 +52,7 @@ def record_credit_usage(
     )
 
     db_session.execute(stmt)
+    record_activity(db_session, user_id, usage=True, when=when)
 
 
 def apply_credit_usage_with_wallet(
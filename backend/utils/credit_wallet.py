@@ -5,6 +5,7 @@ from typing import Any
 from sqlalchemy.orm import Session
 
 from models import User, UserCreditWalletLedger
+from utils.chat_admission import clear_credit_block
 
 DEFAULT_CREDIT_TOPUP_PACKAGES = [
     {"id": "topup_test", "credits": 10, "price_cny": 0.01, "label": "测试"},
@@ -136,6 +137,7 @@ def credit_wallet(
     ))
 
     db.flush()
+    clear_credit_block(user_id)
     return True, new_balance
 
 
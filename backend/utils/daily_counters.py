@@ -0,0 +1,47 @@
+"""
+Day-bucketed counters in Redis, shared by the metrics modules.
+
+Key: ``metrics:{name}:{YYYY-MM-DD}`` — Hash of integer counters for one UTC
+day, kept for ``DAILY_COUNTER_TTL_S``.
+
+Best-effort: a Redis error is logged and the increment is lost.
+"""
+
+import logging
+from datetime import date, datetime, timedelta, UTC
+from typing import Dict, List, Tuple
+
+from utils.redis_client import get_sync_redis, run_pipeline
+
+logger = logging.getLogger(__name__)
+
+DAILY_COUNTER_TTL_S = 40 * 24 * 3600
+
+
+def daily_key(name: str, day: date) -> str:
+    return f"metrics:{name}:{day.isoformat()}"
+
+
+async def incr_daily(name: str, fields: Dict[str, int]) -> None:
+    """Add *fields* to today's counters of *name* in one round-trip."""
+    key = daily_key(name, datetime.now(UTC).date())
+
+    def build(pipe) -> None:
+        for field, amount in fields.items():
+            pipe.hincrby(key, field, amount)
+        pipe.expire(key, DAILY_COUNTER_TTL_S)
+
+    try:
+        await run_pipeline(build)
+    except Exception:
+        logger.debug("Could not record %s metrics", name, exc_info=True)
+
+
+def read_daily(name: str, days: int) -> List[Tuple[date, Dict[str, str]]]:
+    """``(day, counters)`` for the last *days* days of *name*, oldest first."""
+    today = datetime.now(UTC).date()
+    day_list = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    pipe = get_sync_redis().pipeline(transaction=False)
+    for day in day_list:
+        pipe.hgetall(daily_key(name, day))
+    return list(zip(day_list, pipe.execute()))
@@ -0,0 +1,45 @@
+"""
+Short-lived shared state (verification codes, one-time tokens) in Redis.
+
+These used to live in module-level dicts, which only works with a single
+worker process: a code sent by one worker could not be verified by another.
+Values are JSON with a Redis TTL, so expiry needs no cleanup.  Reads that
+consume a value (``take_json``) are atomic, so a one-time token can only be
+redeemed once across all workers.
+
+Callers are sync route handlers; errors propagate so that a missing Redis is
+treated as "not verified" rather than silently accepted.
+"""
+
+import json
+from typing import Any, Optional
+
+from utils.redis_client import get_sync_redis
+
+
+def put_json(key: str, value: Any, ttl_s: int) -> None:
+    """Store *value* under *key* for *ttl_s* seconds, replacing any old value."""
+    get_sync_redis().set(key, json.dumps(value), ex=ttl_s)
+
+
+def get_json(key: str) -> Optional[Any]:
+    raw = get_sync_redis().get(key)
+    return json.loads(raw) if raw is not None else None
+
+
+def take_json(key: str) -> Optional[Any]:
+    """Atomically read and delete *key*."""
+    raw = get_sync_redis().getdel(key)
+    return json.loads(raw) if raw is not None else None
+
+
+def delete(key: str) -> None:
+    get_sync_redis().delete(key)
+
+
+def claim_window(key: str, ttl_s: int) -> bool:
+    """Return ``True`` if no claim on *key* exists, and hold it for *ttl_s*.
+
+    Used for "at most once per N seconds" send limits.
+    """
+    return bool(get_sync_redis().set(key, "1", nx=True, ex=ttl_s))
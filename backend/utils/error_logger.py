@@ -1,11 +1,23 @@
 """
 Error logging utility for capturing, storing, and tracking application errors.
+
+Errors are fingerprinted (type + normalised endpoint + top stack frames) and
+handed to a background writer instead of being committed inline.  Repeats of
+the same fingerprint are aggregated into counters (``error_fingerprints`` and
+the hourly ``error_stats_hourly`` rollup); only a rate-limited sample of the
+full entries is written to ``error_logs``.  This keeps an incident (e.g. an
+upstream LLM outage) from turning into one extra DB write per failed request.
 """
 import logging
 import json
+import hashlib
+import queue
+import re
+import threading
+import time
 import traceback
 from datetime import datetime, UTC
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 import os
 
@@ -38,6 +50,17 @@ logger.setLevel(logging.DEBUG)
 logger.addHandler(error_file_handler)
 logger.addHandler(console_handler)
 
+# Pipeline tuning
+ERROR_FLUSH_INTERVAL_S = float(os.getenv("ERROR_FLUSH_INTERVAL_S", "5.0"))
+ERROR_QUEUE_MAXSIZE = int(os.getenv("ERROR_QUEUE_MAXSIZE", "5000"))
+# Full error_logs rows kept per fingerprint per sampling window; the rest are only counted
+ERROR_SAMPLES_PER_WINDOW = int(os.getenv("ERROR_SAMPLES_PER_WINDOW", "5"))
+ERROR_SAMPLE_WINDOW_S = float(os.getenv("ERROR_SAMPLE_WINDOW_S", "60"))
+# Stack frames (innermost last) that feed the fingerprint
+FINGERPRINT_FRAMES = 3
+
+_NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
 
 class ErrorLog:
     """Represents a single error log entry"""
@@ -73,6 +96,7 @@ class ErrorLog:
         self.stack_trace = stack_trace
         self.context = context or {}
         self.resolved = False
+        self.fingerprint: Optional[str] = None
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert error log to dictionary"""
@@ -92,6 +116,7 @@ class ErrorLog:
             "stack_trace": self.stack_trace,
             "context": self.context,
             "resolved": self.resolved,
+            "fingerprint": self.fingerprint,
         }
 
     def to_json(self) -> str:
@@ -163,9 +188,11 @@ class ErrorLogger:
             ErrorLog: The captured error log
         """
         stack_trace = None
+        frames: List[str] = []
         if exception:
             stack_trace = traceback.format_exc()
             error_type = type(exception).__name__
+            frames = _top_frames(exception)
 
         error_log = ErrorLog(
             message=message,
@@ -183,6 +210,17 @@ class ErrorLogger:
             context=context,
         )
 
+        error_log.fingerprint = compute_fingerprint(
+            error_log.error_type, endpoint, frames, severity=severity, source=source
+        )
+        sampled = _sampler.allow(error_log.fingerprint)
+
+        if not sampled:
+            # Repeat of a noisy fingerprint: count it, skip the traceback and the row
+            self.logger.debug("[%s] %s (suppressed, fingerprint=%s)", error_log.error_type, message, error_log.fingerprint)
+            self._enqueue(error_log, sampled=False)
+            return error_log
+
         # Log to file
         log_message = f"[{error_log.error_type}] {message}"
         if endpoint:
@@ -201,59 +239,54 @@ class ErrorLogger:
         else:
             self.logger.info(log_message)
 
-        # Store in database
-        self._store_in_db(error_log)
+        # Store in database (asynchronously when the writer is running)
+        self._enqueue(error_log, sampled=True)
 
         return error_log
 
+    def _enqueue(self, error_log: ErrorLog, sampled: bool) -> None:
+        """Hand the entry to the background writer, or store inline without one."""
+        if _writer.running:
+            try:
+                _writer.queue.put_nowait((error_log, sampled))
+                return
+            except queue.Full:
+                # Never block a failing request on error bookkeeping
+                _writer.dropped += 1
+                return
+        if sampled:
+            self._store_in_db(error_log)
+
+    def _build_row(self, error_log: ErrorLog) -> Dict[str, Any]:
+        """Build an ``error_logs`` row with oversized fields truncated."""
+        context_json = json.dumps(error_log.context) if error_log.context else None
+        if context_json and len(context_json) > self.MAX_CONTEXT:
+            context_json = context_json[:self.MAX_CONTEXT] + f"\n... (truncated, original length: {len(context_json)})"
+
+        return {
+            "timestamp": error_log.timestamp,
+            "message": self._truncate_string(error_log.message, self.MAX_MESSAGE),
+            "error_type": error_log.error_type,
+            "severity": error_log.severity,
+            "source": error_log.source,
+            "user_id": error_log.user_id,
+            "endpoint": self._truncate_string(error_log.endpoint, self.MAX_ENDPOINT),
+            "method": error_log.method,
+            "status_code": error_log.status_code,
+            "client_ip": error_log.client_ip,
+            "user_agent": self._truncate_string(error_log.user_agent, self.MAX_USER_AGENT),
+            "request_body": json.dumps(error_log.request_body) if error_log.request_body else None,
+            "stack_trace": self._truncate_string(error_log.stack_trace, self.MAX_STACK_TRACE),
+            "context": context_json,
+            "resolved": error_log.resolved,
+            "fingerprint": error_log.fingerprint,
+        }
+
     def _store_in_db(self, error_log: ErrorLog) -> None:
-        """Store error log in database"""
+        """Store a single error log synchronously (used when the writer is not running)"""
         if not self.db_session_factory:
             return
-
-        try:
-            from models import ErrorLogModel
-            
-            db = self.db_session_factory()
-            try:
-                # Truncate fields to prevent database growth issues
-                truncated_message = self._truncate_string(error_log.message, self.MAX_MESSAGE)
-                truncated_endpoint = self._truncate_string(error_log.endpoint, self.MAX_ENDPOINT)
-                truncated_user_agent = self._truncate_string(error_log.user_agent, self.MAX_USER_AGENT)
-                truncated_stack_trace = self._truncate_string(error_log.stack_trace, self.MAX_STACK_TRACE)
-                
-                # Truncate context JSON
-                context_json = json.dumps(error_log.context) if error_log.context else None
-                if context_json and len(context_json) > self.MAX_CONTEXT:
-                    context_json = context_json[:self.MAX_CONTEXT] + f"\n... (truncated, original length: {len(context_json)})"
-                
-                db_error = ErrorLogModel(
-                    timestamp=error_log.timestamp,
-                    message=truncated_message,
-                    error_type=error_log.error_type,
-                    severity=error_log.severity,
-                    source=error_log.source,
-                    user_id=error_log.user_id,
-                    endpoint=truncated_endpoint,
-                    method=error_log.method,
-                    status_code=error_log.status_code,
-                    client_ip=error_log.client_ip,
-                    user_agent=truncated_user_agent,
-                    request_body=json.dumps(error_log.request_body) if error_log.request_body else None,
-                    stack_trace=truncated_stack_trace,
-                    context=context_json,
-                    resolved=error_log.resolved,
-                )
-                db.add(db_error)
-                db.commit()
-            except Exception as e:
-                db.rollback()
-                self.logger.warning(f"Failed to store error log in database: {str(e)}")
-            finally:
-                db.close()
-        except ImportError:
-            # Models not yet available
-            pass
+        _flush_batch(self.db_session_factory, [self._build_row(error_log)], _aggregate([(error_log, True)]))
 
     def log_http_error(
         self,
@@ -344,6 +377,248 @@ class ErrorLogger:
         )
 
 
+# ---------------------------------------------------------------------------
+# Fingerprinting and sampling
+# ---------------------------------------------------------------------------
+
+def _top_frames(exception: BaseException) -> List[str]:
+    """Return ``file:function`` for the innermost stack frames of *exception*."""
+    tb = traceback.extract_tb(exception.__traceback__) if exception.__traceback__ else []
+    return [f"{os.path.basename(f.filename)}:{f.name}" for f in tb[-FINGERPRINT_FRAMES:]]
+
+
+def normalize_endpoint(endpoint: Optional[str]) -> str:
+    """Collapse ids and query strings so ``/api/character/12`` and ``/api/character/34`` group together."""
+    if not endpoint:
+        return ""
+    path = endpoint.split("?", 1)[0]
+    return _NUMERIC_SEGMENT.sub("/{n}", path)
+
+
+def compute_fingerprint(
+    error_type: str,
+    endpoint: Optional[str],
+    frames: Optional[List[str]] = None,
+    severity: str = "error",
+    source: str = "backend",
+) -> str:
+    """Stable identifier for "the same error": type + endpoint + top frames.
+
+    MD5, so ``migrations/add_error_fingerprints.sql`` can compute the same
+    value in SQL for rows without frames.
+    """
+    parts = [error_type or "Unknown", severity, source, normalize_endpoint(endpoint), *(frames or [])]
+    return hashlib.md5("|".join(parts).encode("utf-8"), usedforsecurity=False).hexdigest()
+
+
+class _FingerprintSampler:
+    """Fixed-window rate limit of stored samples per fingerprint."""
+
+    def __init__(self, limit: int, window_s: float):
+        self.limit = limit
+        self.window_s = window_s
+        self._windows: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, fingerprint: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            start, used = self._windows.get(fingerprint, (now, 0))
+            if now - start >= self.window_s:
+                start, used = now, 0
+            if used >= self.limit:
+                self._windows[fingerprint] = (start, used)
+                return False
+            self._windows[fingerprint] = (start, used + 1)
+            if len(self._windows) > 10000:
+                # Forget idle fingerprints so the map stays bounded
+                self._windows = {
+                    fp: w for fp, w in self._windows.items() if now - w[0] < self.window_s
+                }
+            return True
+
+
+_sampler = _FingerprintSampler(ERROR_SAMPLES_PER_WINDOW, ERROR_SAMPLE_WINDOW_S)
+
+
+# ---------------------------------------------------------------------------
+# Background writer
+# ---------------------------------------------------------------------------
+
+def _aggregate(entries: List[Tuple[ErrorLog, bool]]) -> Dict[Tuple[datetime, str], Dict[str, Any]]:
+    """Fold entries into per (hour bucket, fingerprint) counters."""
+    counters: Dict[Tuple[datetime, str], Dict[str, Any]] = {}
+    for error_log, sampled in entries:
+        bucket = error_log.timestamp.replace(minute=0, second=0, microsecond=0)
+        key = (bucket, error_log.fingerprint)
+        agg = counters.get(key)
+        if agg is None:
+            agg = counters[key] = {
+                "error_type": error_log.error_type,
+                "severity": error_log.severity,
+                "source": error_log.source,
+                "endpoint": normalize_endpoint(error_log.endpoint)[:ErrorLogger.MAX_ENDPOINT] or None,
+                "message": (error_log.message or "")[:ErrorLogger.MAX_MESSAGE],
+                "count": 0,
+                "stored": 0,
+                "first_seen": error_log.timestamp,
+                "last_seen": error_log.timestamp,
+            }
+        agg["count"] += 1
+        agg["stored"] += 1 if sampled else 0
+        agg["first_seen"] = min(agg["first_seen"], error_log.timestamp)
+        agg["last_seen"] = max(agg["last_seen"], error_log.timestamp)
+    return counters
+
+
+def _flush_batch(db_session_factory, rows: List[Dict[str, Any]], counters: Dict[Tuple[datetime, str], Dict[str, Any]]) -> None:
+    """Write sampled rows and upsert counters in a single transaction."""
+    if not rows and not counters:
+        return
+    try:
+        from sqlalchemy import func
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        from models import ErrorLogModel, ErrorFingerprint, ErrorStatsHourly
+    except ImportError:
+        # Models not yet available
+        return
+
+    # Collapse hourly counters to one upsert row per fingerprint
+    fingerprints: Dict[str, Dict[str, Any]] = {}
+    for (_, fp), agg in counters.items():
+        cur = fingerprints.get(fp)
+        if cur is None:
+            fingerprints[fp] = dict(agg)
+        else:
+            cur["count"] += agg["count"]
+            cur["stored"] += agg["stored"]
+            cur["first_seen"] = min(cur["first_seen"], agg["first_seen"])
+            cur["last_seen"] = max(cur["last_seen"], agg["last_seen"])
+
+    db = db_session_factory()
+    try:
+        if rows:
+            db.execute(ErrorLogModel.__table__.insert().values(rows))
+
+        if fingerprints:
+            stmt = pg_insert(ErrorFingerprint.__table__).values([
+                {
+                    "fingerprint": fp,
+                    "error_type": agg["error_type"],
+                    "severity": agg["severity"],
+                    "source": agg["source"],
+                    "endpoint": agg["endpoint"],
+                    "sample_message": agg["message"],
+                    "count": agg["count"],
+                    "stored_count": agg["stored"],
+                    "first_seen": agg["first_seen"],
+                    "last_seen": agg["last_seen"],
+                }
+                for fp, agg in fingerprints.items()
+            ])
+            table = ErrorFingerprint.__table__
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[table.c.fingerprint],
+                set_={
+                    "count": table.c.count + stmt.excluded.count,
+                    "stored_count": table.c.stored_count + stmt.excluded.stored_count,
+                    "first_seen": func.least(table.c.first_seen, stmt.excluded.first_seen),
+                    "last_seen": func.greatest(table.c.last_seen, stmt.excluded.last_seen),
+                    "sample_message": stmt.excluded.sample_message,
+                },
+            ))
+
+            stmt = pg_insert(ErrorStatsHourly.__table__).values([
+                {
+                    "bucket": bucket,
+                    "fingerprint": fp,
+                    "error_type": agg["error_type"],
+                    "severity": agg["severity"],
+                    "source": agg["source"],
+                    "count": agg["count"],
+                }
+                for (bucket, fp), agg in counters.items()
+            ])
+            hourly = ErrorStatsHourly.__table__
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[hourly.c.bucket, hourly.c.fingerprint],
+                set_={"count": hourly.c.count + stmt.excluded.count},
+            ))
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to store {len(rows)} error log(s) in database: {str(e)}")
+    finally:
+        db.close()
+
+
+class _ErrorWriter:
+    """Background thread that drains captured errors every ``ERROR_FLUSH_INTERVAL_S``."""
+
+    def __init__(self):
+        self.queue: "queue.Queue[Tuple[ErrorLog, bool]]" = queue.Queue(maxsize=ERROR_QUEUE_MAXSIZE)
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="error-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(ERROR_FLUSH_INTERVAL_S):
+            self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        entries: List[Tuple[ErrorLog, bool]] = []
+        while True:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.dropped:
+            logger.warning("Error log queue overflowed, %d entries dropped", self.dropped)
+            self.dropped = 0
+        if not entries:
+            return
+
+        error_logger = get_error_logger()
+        if not error_logger.db_session_factory:
+            return
+        rows = [error_logger._build_row(e) for e, sampled in entries if sampled]
+        _flush_batch(error_logger.db_session_factory, rows, _aggregate(entries))
+
+
+_writer = _ErrorWriter()
+
+
+def start_error_writer() -> None:
+    """Start the background error writer (called on app startup)."""
+    _writer.start()
+
+
+def stop_error_writer() -> None:
+    """Flush pending errors and stop the writer (called on shutdown)."""
+    _writer.stop()
+
+
 # Global error logger instance
 _error_logger: Optional[ErrorLogger] = None
 
@@ -0,0 +1,352 @@
+"""
+Following feed: public characters, scenes and personas from the creators a
+user follows, newest first.
+
+Pages come from one ``UNION ALL`` query ordered by ``(created_time, kind,
+id)`` descending.  Each branch walks the followed creators with a ``LATERAL``
+lookup per creator, so every lookup is a backward range scan of
+``ix_*_creator_public_created`` on the raw ``created_time`` column, limited to
+the page size; a page reads at most ``creators × 3 × limit`` index entries no
+matter how much the followed creators have published.  Paging is by keyset
+cursor (the sort key of the last row), not offset.  Items without a
+``created_time`` (rows older than the column default) are not in the feed.
+
+Users who follow many creators (``FEED_TIMELINE_MIN_FOLLOWING``) also get a
+fan-out-on-write timeline in Redis:
+
+* ``feed:timeline:{user_id}`` — Sorted set of ``"{kind}:{id:010d}"`` scored
+  by ``created_time`` in microseconds, capped at ``FEED_TIMELINE_MAX``.
+
+It is built from the SQL query on first read, new public items are pushed to
+the followers' timelines that exist, and follow/unfollow drops it.  The TTL
+bounds drift from edits that are not pushed (visibility changes, deletes);
+hydration re-checks ``is_public`` anyway.  Pages the timeline cannot fully
+answer, and any Redis error, fall back to SQL.
+"""
+
+import base64
+import logging
+import os
+from datetime import UTC, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import Character, Scene, Persona, User, UserFollow
+from utils.redis_client import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+FEED_TIMELINE_MIN_FOLLOWING = int(os.getenv("FEED_TIMELINE_MIN_FOLLOWING", "200"))
+FEED_TIMELINE_MAX = 500
+FEED_TIMELINE_TTL_S = 3600
+_FAN_OUT_BATCH = 500
+
+FEED_MODELS = {
+    "character": Character,
+    "scene": Scene,
+    "persona": Persona,
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+# (kind, id, sort_time)
+FeedEntry = Tuple[str, int, datetime]
+
+_BRANCH_SQL = """
+    (SELECT '{kind}' AS kind, t.id, t.created_time AS sort_time
+     FROM followed f
+     CROSS JOIN LATERAL (
+         SELECT t.id, t.created_time
+         FROM {table} t
+         WHERE t.creator_id = f.creator_id
+           AND t.is_public
+           AND t.created_time IS NOT NULL{cursor_filter}
+         ORDER BY t.created_time DESC, t.id DESC
+         LIMIT :branch_limit
+     ) t
+     ORDER BY t.created_time DESC, t.id DESC
+     LIMIT :branch_limit)"""
+
+# The kind is a constant per branch, so the (created_time, kind, id) cursor
+# reduces to a bound on created_time (the index range) plus a tie-break on id
+_CURSOR_FILTER = {
+    "before": """
+           AND t.created_time < :cursor_time""",
+    "same": """
+           AND t.created_time <= :cursor_time
+           AND (t.created_time, t.id) < (:cursor_time, :cursor_id)""",
+    "after": """
+           AND t.created_time <= :cursor_time""",
+}
+
+
+def _cursor_filter(kind: str, cursor_kind: Optional[str]) -> str:
+    if cursor_kind is None:
+        return ""
+    if kind == cursor_kind:
+        return _CURSOR_FILTER["same"]
+    # Feed order is descending: a kind that sorts after the cursor's comes
+    # first, so it has already been served at the cursor's created_time
+    return _CURSOR_FILTER["before" if kind > cursor_kind else "after"]
+
+
+def _feed_sql(cursor_kind: Optional[str]):
+    branches = "\n    UNION ALL".join(
+        _BRANCH_SQL.format(
+            kind=kind,
+            table=model.__tablename__,
+            cursor_filter=_cursor_filter(kind, cursor_kind),
+        )
+        for kind, model in FEED_MODELS.items()
+    )
+    return text(f"""
+        WITH followed AS (
+            SELECT creator_id FROM user_follows WHERE follower_id = :user_id
+        )
+        SELECT kind, id, sort_time FROM ({branches}
+        ) feed
+        ORDER BY sort_time DESC, kind DESC, id DESC
+        LIMIT :limit OFFSET :offset
+    """)
+
+
+def _count_sql():
+    counts = " + ".join(
+        f"""(SELECT count(*) FROM {model.__tablename__} t
+             JOIN followed f ON f.creator_id = t.creator_id
+             WHERE t.is_public AND t.created_time IS NOT NULL)"""
+        for model in FEED_MODELS.values()
+    )
+    return text(f"""
+        WITH followed AS (
+            SELECT creator_id FROM user_follows WHERE follower_id = :user_id
+        )
+        SELECT {counts}
+    """)
+
+
+_FEED_SQL = _feed_sql(None)
+_FEED_AFTER_CURSOR_SQL = {kind: _feed_sql(kind) for kind in FEED_MODELS}
+_COUNT_SQL = _count_sql()
+
+
+# ---------------------------------------------------------------------------
+# Cursors
+# ---------------------------------------------------------------------------
+
+def _to_micros(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=UTC)
+    return (ts - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def encode_cursor(entry: FeedEntry) -> str:
+    kind, entity_id, sort_time = entry
+    raw = f"{_to_micros(sort_time)}:{kind}:{entity_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[FeedEntry]:
+    """Return the entry a cursor points after, or ``None`` if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        micros, kind, entity_id = raw.split(":")
+        if kind not in FEED_MODELS:
+            return None
+        return kind, int(entity_id), _from_micros(int(micros))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# SQL path
+# ---------------------------------------------------------------------------
+
+def _query_entries(
+    db: Session,
+    user_id: str,
+    limit: int,
+    after: Optional[FeedEntry] = None,
+    offset: int = 0,
+) -> List[FeedEntry]:
+    params = {
+        "user_id": user_id,
+        "limit": limit,
+        "offset": offset,
+        "branch_limit": limit + offset,
+    }
+    if after is not None:
+        params.update(cursor_kind=after[0], cursor_id=after[1], cursor_time=after[2])
+        rows = db.execute(_FEED_AFTER_CURSOR_SQL[after[0]], params).all()
+    else:
+        rows = db.execute(_FEED_SQL, params).all()
+    return [(row.kind, row.id, row.sort_time) for row in rows]
+
+
+def count_feed_entries(db: Session, user_id: str) -> int:
+    """Number of items in the user's feed.
+
+    Counts every public item of every followed creator, so it grows with what
+    they have published; callers should only ask for it once per feed view.
+    """
+    return db.execute(_COUNT_SQL, {"user_id": user_id}).scalar() or 0
+
+
+# ---------------------------------------------------------------------------
+# Redis timeline
+# ---------------------------------------------------------------------------
+
+def _timeline_key(user_id: str) -> str:
+    return f"feed:timeline:{user_id}"
+
+
+def _member(kind: str, entity_id: int) -> str:
+    # Zero-padded so members with equal scores sort like (kind, id)
+    return f"{kind}:{entity_id:010d}"
+
+
+def _parse_member(member: str, score: float) -> FeedEntry:
+    kind, entity_id = member.split(":")
+    return kind, int(entity_id), _from_micros(int(score))
+
+
+# KEYS = follower timelines; ARGV[1] = score, ARGV[2] = member, ARGV[3] = cap
+_FAN_OUT_LUA = """
+local cap = tonumber(ARGV[3])
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 0, -(cap + 1))
+    end
+end
+return 1
+"""
+_fan_out_script = None
+
+
+def _build_timeline(redis, db: Session, user_id: str) -> None:
+    entries = _query_entries(db, user_id, FEED_TIMELINE_MAX)
+    key = _timeline_key(user_id)
+    pipe = redis.pipeline(transaction=True)
+    pipe.delete(key)
+    if entries:
+        pipe.zadd(key, {_member(kind, entity_id): _to_micros(ts) for kind, entity_id, ts in entries})
+        pipe.expire(key, FEED_TIMELINE_TTL_S)
+    pipe.execute()
+
+
+def _timeline_entries(
+    db: Session,
+    user_id: str,
+    limit: int,
+    after: Optional[FeedEntry],
+) -> Optional[List[FeedEntry]]:
+    """Serve ``limit`` entries from the Redis timeline, or ``None`` to use SQL."""
+    redis = get_sync_redis()
+    key = _timeline_key(user_id)
+    if not redis.exists(key):
+        following = db.query(UserFollow.creator_id).filter(UserFollow.follower_id == user_id).count()
+        if following < FEED_TIMELINE_MIN_FOLLOWING:
+            return None
+        _build_timeline(redis, db, user_id)
+
+    start = 0
+    if after is not None:
+        rank = redis.zrevrank(key, _member(after[0], after[1]))
+        if rank is None:
+            return None
+        start = rank + 1
+    rows = redis.zrevrange(key, start, start + limit - 1, withscores=True)
+    if len(rows) < limit:
+        # Past the capped window or the real end: let SQL decide
+        return None
+    return [_parse_member(member, score) for member, score in rows]
+
+
+def publish_to_followers(db: Session, creator_id: Optional[str], kind: str, entity_id: int, created_time: Optional[datetime]) -> None:
+    """Push a newly public item onto the timelines of the creator's followers."""
+    global _fan_out_script
+    if not creator_id:
+        return
+    follower_ids = [
+        row.follower_id
+        for row in db.query(UserFollow.follower_id).filter(UserFollow.creator_id == creator_id).all()
+    ]
+    if not follower_ids:
+        return
+    score = _to_micros(created_time or datetime.now(UTC))
+    member = _member(kind, entity_id)
+    try:
+        redis = get_sync_redis()
+        if _fan_out_script is None:
+            _fan_out_script = redis.register_script(_FAN_OUT_LUA)
+        for i in range(0, len(follower_ids), _FAN_OUT_BATCH):
+            keys = [_timeline_key(uid) for uid in follower_ids[i:i + _FAN_OUT_BATCH]]
+            _fan_out_script(keys=keys, args=[score, member, FEED_TIMELINE_MAX])
+    except Exception:
+        logger.debug("Could not fan out %s %s to follower timelines", kind, entity_id, exc_info=True)
+
+
+def invalidate_timeline(user_id: str) -> None:
+    """Drop a user's timeline after their follow list changed."""
+    try:
+        get_sync_redis().delete(_timeline_key(user_id))
+    except Exception:
+        logger.debug("Could not drop feed timeline for %s", user_id, exc_info=True)
+
+
+# ---------------------------------------------------------------------------
+# Pages
+# ---------------------------------------------------------------------------
+
+def get_feed_entries(
+    db: Session,
+    user_id: str,
+    limit: int,
+    after: Optional[FeedEntry] = None,
+    offset: int = 0,
+) -> List[FeedEntry]:
+    """Return up to *limit* feed entries after the cursor entry *after*.
+
+    *offset* is only for clients still paging by page number.
+    """
+    if offset == 0:
+        try:
+            entries = _timeline_entries(db, user_id, limit, after)
+            if entries is not None:
+                return entries
+        except Exception:
+            logger.debug("Feed timeline lookup failed, using the database", exc_info=True)
+    return _query_entries(db, user_id, limit, after, offset)
+
+
+def load_feed_items(db: Session, entries: List[FeedEntry]) -> List[Tuple[str, object]]:
+    """Load the entities for *entries*, in feed order, with ``creator_profile_pic`` set.
+
+    Entries whose entity was deleted or made private since are dropped.
+    """
+    loaded = {}
+    for kind, model in FEED_MODELS.items():
+        ids = [entity_id for k, entity_id, _ in entries if k == kind]
+        if not ids:
+            continue
+        rows = (
+            db.query(model, User.profile_pic.label("creator_profile_pic"))
+            .outerjoin(User, model.creator_id == User.id)
+            .filter(model.id.in_(ids), model.is_public == True)
+            .all()
+        )
+        for obj, pic in rows:
+            obj.creator_profile_pic = pic
+            loaded[(kind, obj.id)] = obj
+    return [
+        (kind, loaded[(kind, entity_id)])
+        for kind, entity_id, _ in entries
+        if (kind, entity_id) in loaded
+    ]
@@ -3,12 +3,6 @@ import base64
 import json
 import logging
 
-from tencentcloud.common import credential
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
-from tencentcloud.ims.v20201229 import ims_client, models
-
 logger = logging.getLogger(__name__)
 
 # Maximum Base64 content size Tencent IMS accepts is 10 MB
@@ -70,6 +64,13 @@ def moderate_image_with_decision(image_bytes: bytes) -> tuple[bool, str, str]:
         )
         return True, "", ""
 
+    # Imported on first use: the Tencent Cloud SDK is slow to import
+    from tencentcloud.common import credential
+    from tencentcloud.common.profile.client_profile import ClientProfile
+    from tencentcloud.common.profile.http_profile import HttpProfile
+    from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+    from tencentcloud.ims.v20201229 import ims_client, models
+
     try:
         cred = credential.Credential(secret_id, secret_key)
 
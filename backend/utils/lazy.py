@@ -0,0 +1,37 @@
+"""
+Deferred construction of module-level provider clients.
+
+Several modules expose a ready-made client (``client``, ``alipay_client``,
+``wechat_pay_client``) that the rest of the code imports by name.  Building
+those at import time drags the provider SDKs into every process start; a
+``LazyObject`` keeps the same name importable and builds the real object on
+first attribute access.
+"""
+
+import threading
+from typing import Any, Callable
+
+
+class LazyObject:
+    """Proxy that calls *factory* once, on first use, and forwards attributes to the result."""
+
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self) -> Any:
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._resolve(), name, value)
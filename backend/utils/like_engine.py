@@ -0,0 +1,200 @@
+"""
+Set-based like / unlike.
+
+A like used to load the entity and its creator, probe for an existing like,
+then SELECT each tag in a loop and rebuild ``User.liked_tags`` one tag at a
+time.  Here a (bulk) like is a single statement built from data-modifying
+CTEs:
+
+* ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` decides which likes are new
+* the entity, creator, ``creator_stats`` and tag counters are bumped with
+  atomic ``likes = likes + n`` updates for exactly those rows
+* ``User.liked_tags`` is merged in one array expression afterwards (a separate
+  statement, because the liker can also be the creator and Postgres does not
+  allow updating the same row twice in one statement)
+
+Unlike mirrors this with ``DELETE ... RETURNING`` and clamps counters at 0.
+"""
+
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# entity_type -> (entity table, like table, like id column)
+ENTITY_TABLES = {
+    "character": ("characters", "user_liked_characters", "character_id"),
+    "scene": ("scenes", "user_liked_scenes", "scene_id"),
+    "persona": ("personas", "user_liked_personas", "persona_id"),
+}
+
+# Cap for the bulk endpoint
+MAX_BULK_ITEMS = 100
+
+# ---------- pre-compiled SQL templates ----------
+
+_LIKE_SQL_TEMPLATE = """
+WITH inserted AS (
+    INSERT INTO {like_table} (user_id, {id_col}, liked_at)
+    SELECT :user_id, e.id, now()
+      FROM {table} e
+     WHERE e.id = ANY(:ids)
+       AND e.creator_id IS NOT NULL
+    ON CONFLICT DO NOTHING
+    RETURNING {id_col} AS id
+),
+bumped AS (
+    UPDATE {table} e
+       SET likes = COALESCE(e.likes, 0) + 1
+      FROM inserted i
+     WHERE e.id = i.id
+    RETURNING e.id, e.likes, e.creator_id, e.tags
+),
+creator_counts AS (
+    UPDATE users u
+       SET likes = COALESCE(u.likes, 0) + c.n
+      FROM (SELECT creator_id, COUNT(*) AS n FROM bumped GROUP BY creator_id) c
+     WHERE u.id = c.creator_id
+    RETURNING u.id
+),
+stats_counts AS (
+    INSERT INTO creator_stats (user_id, {stats_col})
+    SELECT creator_id, COUNT(*) FROM bumped GROUP BY creator_id
+    ON CONFLICT (user_id) DO UPDATE
+       SET {stats_col} = creator_stats.{stats_col} + EXCLUDED.{stats_col}
+    RETURNING user_id
+),
+tag_counts AS (
+    UPDATE tags t
+       SET likes = COALESCE(t.likes, 0) + c.n
+      FROM (SELECT tag, COUNT(*) AS n FROM bumped, unnest(bumped.tags) AS tag GROUP BY tag) c
+     WHERE t.name = c.tag
+    RETURNING t.id
+)
+SELECT id, likes, tags FROM bumped
+"""
+
+_UNLIKE_SQL_TEMPLATE = """
+WITH deleted AS (
+    DELETE FROM {like_table}
+     WHERE user_id = :user_id
+       AND {id_col} = ANY(:ids)
+    RETURNING {id_col} AS id
+),
+bumped AS (
+    UPDATE {table} e
+       SET likes = GREATEST(COALESCE(e.likes, 0) - 1, 0)
+      FROM deleted d
+     WHERE e.id = d.id
+    RETURNING e.id, e.likes, e.creator_id, e.tags
+),
+creator_counts AS (
+    UPDATE users u
+       SET likes = GREATEST(COALESCE(u.likes, 0) - c.n, 0)
+      FROM (SELECT creator_id, COUNT(*) AS n FROM bumped GROUP BY creator_id) c
+     WHERE u.id = c.creator_id
+    RETURNING u.id
+),
+stats_counts AS (
+    UPDATE creator_stats cs
+       SET {stats_col} = GREATEST(cs.{stats_col} - c.n, 0)
+      FROM (SELECT creator_id, COUNT(*) AS n FROM bumped GROUP BY creator_id) c
+     WHERE cs.user_id = c.creator_id
+    RETURNING cs.user_id
+),
+tag_counts AS (
+    UPDATE tags t
+       SET likes = GREATEST(COALESCE(t.likes, 0) - c.n, 0)
+      FROM (SELECT tag, COUNT(*) AS n FROM bumped, unnest(bumped.tags) AS tag GROUP BY tag) c
+     WHERE t.name = c.tag
+    RETURNING t.id
+)
+SELECT id, likes, tags FROM bumped
+"""
+
+_LIKE_SQL = {
+    entity_type: text(_LIKE_SQL_TEMPLATE.format(
+        table=table, like_table=like_table, id_col=id_col, stats_col=f"{entity_type}_likes",
+    ))
+    for entity_type, (table, like_table, id_col) in ENTITY_TABLES.items()
+}
+_UNLIKE_SQL = {
+    entity_type: text(_UNLIKE_SQL_TEMPLATE.format(
+        table=table, like_table=like_table, id_col=id_col, stats_col=f"{entity_type}_likes",
+    ))
+    for entity_type, (table, like_table, id_col) in ENTITY_TABLES.items()
+}
+
+# Append tags not already present, keeping first-seen order
+_ADD_LIKED_TAGS_SQL = text("""
+UPDATE users
+   SET liked_tags = ARRAY(
+        SELECT u.tag
+          FROM unnest(COALESCE(liked_tags, '{}'::text[]) || CAST(:tags AS text[]))
+               WITH ORDINALITY AS u(tag, n)
+         GROUP BY u.tag
+         ORDER BY MIN(u.n)
+       )
+ WHERE id = :user_id
+""")
+
+_REMOVE_LIKED_TAGS_SQL = text("""
+UPDATE users
+   SET liked_tags = ARRAY(
+        SELECT u.tag
+          FROM unnest(COALESCE(liked_tags, '{}'::text[])) WITH ORDINALITY AS u(tag, n)
+         WHERE u.tag <> ALL(CAST(:tags AS text[]))
+         ORDER BY u.n
+       )
+ WHERE id = :user_id
+""")
+
+_ENTITY_STATE_SQL = {
+    entity_type: text(f"SELECT id, creator_id FROM {table} WHERE id = ANY(:ids)")
+    for entity_type, (table, _, _) in ENTITY_TABLES.items()
+}
+
+
+def _apply(db: Session, user_id: str, entity_type: str, entity_ids: List[int], like: bool) -> Dict[int, int]:
+    """Run the like/unlike statement; returns ``{entity_id: new_like_count}`` for changed rows."""
+    ids = sorted({int(i) for i in entity_ids})
+    if not ids:
+        return {}
+
+    sql = _LIKE_SQL[entity_type] if like else _UNLIKE_SQL[entity_type]
+    rows = db.execute(sql, {"user_id": user_id, "ids": ids}).all()
+
+    tags = sorted({tag for _, _, entity_tags in rows for tag in (entity_tags or [])})
+    if tags:
+        db.execute(
+            _ADD_LIKED_TAGS_SQL if like else _REMOVE_LIKED_TAGS_SQL,
+            {"user_id": user_id, "tags": tags},
+        )
+    return {entity_id: likes for entity_id, likes, _ in rows}
+
+
+def like_entities(db: Session, user_id: str, entity_type: str, entity_ids: List[int]) -> Dict[int, int]:
+    """Like every entity in *entity_ids* that exists, has a creator and is not
+    already liked.  Does not commit."""
+    return _apply(db, user_id, entity_type, entity_ids, like=True)
+
+
+def unlike_entities(db: Session, user_id: str, entity_type: str, entity_ids: List[int]) -> Dict[int, int]:
+    """Remove the user's likes on *entity_ids*.  Does not commit."""
+    return _apply(db, user_id, entity_type, entity_ids, like=False)
+
+
+def explain_noop(db: Session, entity_type: str, entity_id: int, like: bool) -> Tuple[int, str]:
+    """Return ``(status_code, detail)`` for a single like/unlike that changed nothing.
+
+    Only runs on the failure path, so the happy path stays one statement.
+    """
+    row = db.execute(_ENTITY_STATE_SQL[entity_type], {"ids": [entity_id]}).first()
+    label = entity_type.capitalize()
+    if row is None:
+        return 404, f"{label} not found"
+    if like and not row.creator_id:
+        return 404, f"{label} creator not found"
+    if like:
+        return 400, f"Already liked this {entity_type}"
+    return 400, f"You have not liked this {entity_type}"
@@ -0,0 +1,115 @@
+"""
+Per-user liked-ID sets cached in Redis.
+
+List endpoints only need to know which of the 10–20 items on a page the
+viewer has liked, but used to load the viewer's whole like table into a
+Python set on every request.  Each user's liked ids per entity type are kept
+in a Redis set and pages are tagged with one ``SMISMEMBER``.
+
+Key: ``liked:{entity_type}:{user_id}`` — Set of entity ids plus a sentinel
+member, so an empty-but-cached set is distinguishable from a cache miss.
+
+On a miss the page is answered from Postgres with an ``IN (page ids)`` query
+and the full set is loaded into Redis for the following requests.  The
+like/unlike routes update the set after they commit; the TTL bounds any
+drift from other writers (cascading deletes, concurrent warm-ups).
+Any Redis error falls back to Postgres.
+"""
+
+import logging
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from models import User, UserLikedCharacter, UserLikedScene, UserLikedPersona
+from utils.redis_client import get_sync_redis
+
+logger = logging.getLogger(__name__)
+
+LIKED_SET_TTL_S = 3600
+_SENTINEL = "-"
+
+_LIKE_MODELS = {
+    "character": (UserLikedCharacter, UserLikedCharacter.character_id),
+    "scene": (UserLikedScene, UserLikedScene.scene_id),
+    "persona": (UserLikedPersona, UserLikedPersona.persona_id),
+}
+
+
+def _key(entity_type: str, user_id: str) -> str:
+    return f"liked:{entity_type}:{user_id}"
+
+
+def _query_liked(db: Session, user_id: str, entity_type: str, ids: Optional[List[int]] = None) -> Set[int]:
+    LikeModel, id_col = _LIKE_MODELS[entity_type]
+    query = db.query(id_col).filter(LikeModel.user_id == user_id)
+    if ids is not None:
+        query = query.filter(id_col.in_(ids))
+    return {row[0] for row in query.all()}
+
+
+def _warm(db: Session, user_id: str, entity_type: str) -> None:
+    """Load the user's full liked set into Redis."""
+    all_ids = _query_liked(db, user_id, entity_type)
+    try:
+        redis = get_sync_redis()
+        key = _key(entity_type, user_id)
+        pipe = redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.sadd(key, _SENTINEL, *all_ids)
+        pipe.expire(key, LIKED_SET_TTL_S)
+        pipe.execute()
+    except Exception:
+        logger.debug("Could not warm liked set %s for %s", entity_type, user_id, exc_info=True)
+
+
+def get_liked_ids(
+    db: Session,
+    current_user: Optional[User],
+    entity_type: str,
+    entity_ids: Iterable[int],
+) -> Set[int]:
+    """Return the subset of *entity_ids* that *current_user* has liked."""
+    ids = list(dict.fromkeys(entity_ids))
+    if current_user is None or not ids:
+        return set()
+
+    key = _key(entity_type, current_user.id)
+    try:
+        flags = get_sync_redis().smismember(key, [_SENTINEL, *ids])
+    except Exception:
+        logger.debug("Liked set lookup failed, using the database", exc_info=True)
+        return _query_liked(db, current_user.id, entity_type, ids)
+
+    if flags and flags[0]:
+        return {entity_id for entity_id, flag in zip(ids, flags[1:]) if flag}
+
+    liked = _query_liked(db, current_user.id, entity_type, ids)
+    _warm(db, current_user.id, entity_type)
+    return liked
+
+
+def mark_liked(db: Session, current_user: Optional[User], entity_type: str, objs: Iterable) -> None:
+    """Set ``obj.liked`` on each loaded entity for *current_user*."""
+    objs = list(objs)
+    liked = get_liked_ids(db, current_user, entity_type, [o.id for o in objs])
+    for obj in objs:
+        obj.liked = obj.id in liked
+
+
+def update_liked_set(user_id: str, entity_type: str, entity_ids: Iterable[int], liked: bool) -> None:
+    """Reflect committed likes/unlikes in the cached set, if it is cached."""
+    ids = list(entity_ids)
+    if not ids:
+        return
+    key = _key(entity_type, user_id)
+    try:
+        redis = get_sync_redis()
+        if liked:
+            # Only touch sets that are already warm; a miss reloads from the DB anyway
+            if redis.sismember(key, _SENTINEL):
+                redis.sadd(key, *ids)
+        else:
+            redis.srem(key, *ids)
+    except Exception:
+        logger.debug("Could not update liked set %s for %s", entity_type, user_id, exc_info=True)
@@ -0,0 +1,344 @@
+"""
+Background LLM chunking of character long descriptions.
+
+Saving an advanced character no longer waits for the chunking model: the
+route stores ``fallback_split_chunks`` output, sets
+``characters.chunking_status = 'pending'`` and returns.  A worker thread in
+every process claims pending rows with ``FOR UPDATE SKIP LOCKED`` (so the
+``characters`` table itself is the durable job queue, shared by all
+workers), calls the model outside any transaction and writes the chunks
+back, billing the creator for the split.
+
+``chunking_status``: ``none`` (no long description / standard context),
+``pending``, ``running``, ``done`` or ``failed`` (fallback chunks kept).
+
+``long_description_hash`` is the SHA-256 of the text the current chunks
+were made from.  Updates that leave the text unchanged skip re-chunking,
+and a result is only written back if the hash still matches, so an edit
+made while a job is running is never overwritten by stale chunks.
+A ``running`` row whose worker died is reclaimed after ``CHUNKING_LEASE_S``.
+The ``chunking_started_at`` set by a claim is that claim's token: results
+and failures are only written (and billed) while it is unchanged, so a
+worker that outlived its lease cannot finish a job that was handed on.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import text
+
+from database import SessionLocal
+from models import User
+from utils.llm_client import client
+from utils.response_cache import CHARACTERS, invalidate
+from utils.usage_utils import normalize_usage, usage_to_credits
+
+logger = logging.getLogger(__name__)
+
+CHUNKING_MODEL = "deepseek-v4-flash"
+CHUNKING_POLL_S = float(os.getenv("CHUNKING_POLL_S", "5"))
+CHUNKING_LEASE_S = 300
+
+STATUS_NONE = "none"
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+LONG_DESCRIPTION_CHUNK_PROMPT = """Split the following character description into semantic chunks for an AI roleplay system.
+
+Rules:
+
+* Each chunk should contain one coherent idea or topic.
+* Each chunk must be understandable on its own.
+* Maximum 800 words per chunk.
+* Maximum 20 chunks total.
+* Preserve important roleplay information.
+* Avoid repeating information across chunks.
+* Rewrite content into dense instruction-style text.
+* Use short phrases and compact wording.
+
+Order the chunks by importance for roleplay:
+
+* Most important character traits, behavior rules, and personality first.
+* Then relationships or motivations.
+* Then background or lore.
+* Least important details last.
+
+Output JSON only:
+
+{
+"chunks": [
+{"content": "..."},
+{"content": "..."}
+]
+}"""
+
+
+def _extract_json_payload(raw: str) -> dict:
+    content = (raw or "").strip()
+    if "```json" in content:
+        content = content.split("```json", 1)[1].split("```", 1)[0].strip()
+    elif "```" in content:
+        content = content.split("```", 1)[1].split("```", 1)[0].strip()
+    return json.loads(content)
+
+
+def _sanitize_chunks(payload: dict) -> list[dict[str, str]]:
+    chunks = payload.get("chunks") if isinstance(payload, dict) else []
+    if not isinstance(chunks, list):
+        return []
+    cleaned: list[dict[str, str]] = []
+    for chunk in chunks[:20]:
+        if not isinstance(chunk, dict):
+            continue
+        text = str(chunk.get("content", "")).strip()
+        if not text:
+            continue
+        words = text.split()
+        if len(words) > 800:
+            text = " ".join(words[:800]).strip()
+        cleaned.append({"content": text})
+    return cleaned
+
+
+def fallback_split_chunks(long_description: str) -> list[dict[str, str]]:
+    words = (long_description or "").split()
+    if not words:
+        return []
+    chunks = []
+    for i in range(0, len(words), 800):
+        piece = " ".join(words[i:i + 800]).strip()
+        if piece:
+            chunks.append({"content": piece})
+        if len(chunks) >= 20:
+            break
+    return chunks
+
+
+def split_long_description_chunks(long_description: str) -> tuple[list[dict[str, str]], bool, dict]:
+    source = (long_description or "").strip()
+    empty_usage = normalize_usage(None)
+    if not source:
+        return [], True, empty_usage
+    try:
+        response = client.chat.completions.create(
+            model=CHUNKING_MODEL,
+            messages=[
+                {"role": "system", "content": LONG_DESCRIPTION_CHUNK_PROMPT},
+                {"role": "user", "content": source},
+            ],
+            max_tokens=1800,
+            temperature=0.2,
+            top_p=0.9,
+            # Give up well before the worker's claim can be reclaimed
+            timeout=CHUNKING_LEASE_S / 2,
+        )
+        usage = normalize_usage(getattr(response, "usage", None))
+        raw = response.choices[0].message.content if response and response.choices else ""
+        parsed = _extract_json_payload(raw or "")
+        chunks = _sanitize_chunks(parsed)
+        if chunks:
+            return chunks, True, usage
+        return fallback_split_chunks(source), False, usage
+    except Exception:
+        return fallback_split_chunks(source), False, empty_usage
+
+
+def description_hash(long_description: str) -> str:
+    return hashlib.sha256(long_description.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Route helpers
+# ---------------------------------------------------------------------------
+
+def schedule_chunking(char, long_description: str) -> bool:
+    """Queue LLM chunking of *long_description* for *char* (not yet committed).
+
+    Stores the fallback chunks right away.  Returns False without touching
+    the character when its chunks already come from the same text.
+    """
+    digest = description_hash(long_description)
+    if char.long_description_hash == digest and char.chunking_status in (
+        STATUS_PENDING, STATUS_RUNNING, STATUS_DONE,
+    ):
+        return False
+    char.long_description_chunks = fallback_split_chunks(long_description)
+    char.long_description_hash = digest
+    char.chunking_status = STATUS_PENDING
+    char.chunking_started_at = None
+    return True
+
+
+def clear_chunking(char) -> None:
+    char.long_description_chunks = []
+    char.long_description_hash = None
+    char.chunking_status = STATUS_NONE
+    char.chunking_started_at = None
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+_CLAIM_SQL = text("""
+    UPDATE characters SET chunking_status = 'running', chunking_started_at = now()
+    WHERE id = (
+        SELECT id FROM characters
+        WHERE chunking_status = 'pending'
+           OR (chunking_status = 'running'
+               AND chunking_started_at < now() - make_interval(secs => :lease_s))
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, creator_id, long_description, long_description_hash, chunking_started_at
+""")
+
+_FINISH_SQL = text("""
+    UPDATE characters
+    SET long_description_chunks = CAST(:chunks AS JSONB), chunking_status = :status
+    WHERE id = :id AND long_description_hash = :digest AND chunking_status = 'running'
+      AND chunking_started_at = :claimed_at
+""")
+
+_FAIL_SQL = text("""
+    UPDATE characters SET chunking_status = 'failed'
+    WHERE id = :id AND long_description_hash = :digest AND chunking_status = 'running'
+      AND chunking_started_at = :claimed_at
+""")
+
+
+def _claim_job():
+    db = SessionLocal()
+    try:
+        row = db.execute(_CLAIM_SQL, {"lease_s": CHUNKING_LEASE_S}).first()
+        db.commit()
+        return row
+    finally:
+        db.close()
+
+
+def _finish_job(
+    character_id: int,
+    creator_id: Optional[str],
+    digest: str,
+    claimed_at,
+    chunks,
+    split_ok: bool,
+    usage: dict,
+) -> None:
+    from utils.credit_usage_ledger import apply_credit_usage_with_wallet
+
+    db = SessionLocal()
+    try:
+        if not split_ok:
+            db.execute(_FAIL_SQL, {"id": character_id, "digest": digest, "claimed_at": claimed_at})
+            db.commit()
+            return
+
+        updated = db.execute(_FINISH_SQL, {
+            "id": character_id,
+            "digest": digest,
+            "claimed_at": claimed_at,
+            "chunks": json.dumps(chunks, ensure_ascii=False),
+            "status": STATUS_DONE,
+        }).rowcount
+        if not updated:
+            # Text changed, character deleted or job reclaimed while the model was running
+            db.rollback()
+            return
+
+        creator = db.query(User).filter(User.id == creator_id).first() if creator_id else None
+        if creator is not None and usage["total_tokens"] > 0:
+            usage_result = apply_credit_usage_with_wallet(
+                db,
+                user=creator,
+                usage=usage,
+                source="character_long_description_split",
+                source_order_no=str(character_id),
+                credit_amount=usage_to_credits(usage, CHUNKING_MODEL),
+            )
+            if not usage_result.get("success"):
+                db.rollback()
+                db.execute(_FAIL_SQL, {"id": character_id, "digest": digest, "claimed_at": claimed_at})
+        db.commit()
+        # Raw SQL bypasses the ORM hook that keeps cached browse lists in step
+        invalidate(CHARACTERS)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def run_chunking_job() -> bool:
+    """Claim and process one pending job.  Returns False when the queue is empty."""
+    row = _claim_job()
+    if row is None:
+        return False
+    character_id, creator_id, long_description, digest, claimed_at = row
+    chunks, split_ok, usage = split_long_description_chunks(long_description or "")
+    _finish_job(character_id, creator_id, digest, claimed_at, chunks, split_ok, usage)
+    logger.info("Chunked long description of character %s (ok=%s, chunks=%d)", character_id, split_ok, len(chunks))
+    return True
+
+
+class _ChunkingWorker:
+    """Background thread that drains pending chunking jobs."""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="chunking-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if run_chunking_job():
+                    continue
+            except Exception:
+                logger.exception("Chunking worker error")
+            self._wake.wait(CHUNKING_POLL_S)
+            self._wake.clear()
+
+
+_worker = _ChunkingWorker()
+
+
+def start_chunking_worker() -> None:
+    """Start the chunking worker (called on app startup)."""
+    _worker.start()
+
+
+def stop_chunking_worker() -> None:
+    """Stop the chunking worker; an interrupted job is reclaimed after the lease."""
+    _worker.stop()
+
+
+def notify_chunking_worker() -> None:
+    """Wake this process's worker after committing a pending job."""
+    _worker.wake()
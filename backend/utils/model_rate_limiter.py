@@ -10,7 +10,7 @@ from __future__ import annotations
 import time
 import logging
 
-from utils.redis_client import get_redis
+from utils.redis_client import get_redis, get_script
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +23,19 @@ _PRO_RPM = 60         # requests per minute  (pro)
 
 _WINDOW_GRACE_S = 5   # small grace period so clock skew doesn't reject early
 
+WINDOW_S = 60 + _WINDOW_GRACE_S
+KEY_TTL_S = 120
+
+
+def rpm_for(is_pro: bool) -> int:
+    return _PRO_RPM if is_pro else _FREE_RPM
+
+
+def minute_key(user_id: str) -> str:
+    return f"rate_limit:{user_id}:minute"
+
 # ---------------------------------------------------------------------------
-# Lua script (loaded once per process)
+# Lua script (registered once per process via ``get_script``)
 # ---------------------------------------------------------------------------
 
 # Atomic sliding‑window check + add.
@@ -61,23 +72,6 @@ local remaining = limit - (count + 1)
 return {1, remaining, now + window}
 """
 
-# ---------------------------------------------------------------------------
-# Module‑level script cache
-# ---------------------------------------------------------------------------
-
-_scripts_loaded = False
-_sha_sliding = ""
-
-
-async def _ensure_script() -> None:
-    global _scripts_loaded, _sha_sliding
-    if _scripts_loaded:
-        return
-    redis = await get_redis()
-    _sha_sliding = await redis.script_load(_SLIDING_WINDOW_LUA)
-    _scripts_loaded = True
-
-
 # ===================================================================
 # RateLimiter
 # ===================================================================
@@ -105,24 +99,16 @@ class RateLimiter:
 
         Fails open when Redis is unreachable.
         """
-        rpm = _PRO_RPM if is_pro else _FREE_RPM
+        rpm = rpm_for(is_pro)
 
         try:
-            await _ensure_script()
-            redis = await get_redis()
+            sliding_window = await get_script(_SLIDING_WINDOW_LUA)
             now = time.time()
 
-            minute_key = f"rate_limit:{user_id}:minute"
-
             # ── atomic sliding‑window check‑and‑add ──
-            result = await redis.evalsha(
-                _sha_sliding,
-                1,
-                minute_key,
-                60 + _WINDOW_GRACE_S,
-                rpm,
-                int(now),
-                120,
+            result = await sliding_window(
+                keys=[minute_key(user_id)],
+                args=[WINDOW_S, rpm, int(now), KEY_TTL_S],
             )
             allowed, remaining, reset_time = (
                 bool(result[0]),
@@ -155,15 +141,13 @@ class RateLimiter:
     ) -> dict:
         """Return current rate‑limit status without consuming a request.
         Fails open when Redis is unreachable."""
-        rpm = _PRO_RPM if is_pro else _FREE_RPM
+        rpm = rpm_for(is_pro)
 
         try:
-            await _ensure_script()
             redis = await get_redis()
             now = time.time()
 
-            minute_key = f"rate_limit:{user_id}:minute"
-            count_min = await redis.zcount(minute_key, now - (60 + _WINDOW_GRACE_S), "+inf")
+            count_min = await redis.zcount(minute_key(user_id), now - WINDOW_S, "+inf")
 
             return {
                 "tier": "pro" if is_pro else "free",
@@ -0,0 +1,179 @@
+"""
+Redis-backed one-time passcode (OTP) store and SMS send throttling.
+
+Codes are never stored in clear: ``otp:code:{phone}`` is a hash holding an
+HMAC of the code plus a failed-attempt counter, with the code's validity as
+the key TTL.  Verification is one Lua call that deletes the code on success
+and burns it after ``OTP_MAX_ATTEMPTS`` wrong guesses.
+
+Sends are throttled atomically in Lua before the SMS provider is called:
+
+* ``otp:send:phone:{phone}:interval`` — one send per ``OTP_SEND_INTERVAL_S``
+* ``otp:send:phone:{phone}:day``      — at most ``OTP_PHONE_DAILY_MAX`` per day
+* ``otp:send:ip:{ip}:hour``           — at most ``OTP_IP_HOURLY_MAX`` per hour
+
+A failed provider call releases the reservation so the user can retry.
+Async helpers are for coroutine routes; the sync ``verify_otp`` is for
+threadpool routes.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.redis_client import get_redis, get_script, get_sync_script
+
+OTP_TTL_S = 300
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+OTP_SEND_INTERVAL_S = 60
+OTP_PHONE_DAILY_MAX = int(os.getenv("OTP_PHONE_DAILY_MAX", "10"))
+OTP_IP_HOURLY_MAX = int(os.getenv("OTP_IP_HOURLY_MAX", "20"))
+
+# Verify results
+VERIFIED = 1
+MISMATCH = 0
+MISSING = -1   # never sent, expired or already used
+LOCKED = -2    # too many wrong attempts; the code has been burned
+
+
+def _code_key(phone_number: str) -> str:
+    return f"otp:code:{phone_number}"
+
+
+def _send_keys(phone_number: str, client_ip: Optional[str]) -> list[str]:
+    return [
+        f"otp:send:phone:{phone_number}:interval",
+        f"otp:send:phone:{phone_number}:day",
+        f"otp:send:ip:{client_ip or '-'}:hour",
+    ]
+
+
+def _hash_code(phone_number: str, code: str) -> str:
+    key = (os.getenv("SECRET_KEY") or "").encode()
+    return hmac.new(key, f"{phone_number}:{code}".encode(), hashlib.sha256).hexdigest()
+
+
+# KEYS[1] = per-phone interval key  KEYS[2] = per-phone daily counter
+# KEYS[3] = per-IP hourly counter
+# ARGV[1] = interval s  ARGV[2] = phone daily max  ARGV[3] = ip hourly max
+# ARGV[4] = 1 if an IP was supplied
+# Returns {allowed (0|1), reason, retry_after_ms}
+_RESERVE_SEND_LUA = r"""
+local interval_ttl = redis.call('PTTL', KEYS[1])
+if interval_ttl > 0 then
+    return {0, 'phone_interval', interval_ttl}
+end
+local day_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+if day_count >= tonumber(ARGV[2]) then
+    return {0, 'phone_daily', redis.call('PTTL', KEYS[2])}
+end
+local check_ip = ARGV[4] == '1'
+if check_ip then
+    local ip_count = tonumber(redis.call('GET', KEYS[3]) or '0')
+    if ip_count >= tonumber(ARGV[3]) then
+        return {0, 'ip_hourly', redis.call('PTTL', KEYS[3])}
+    end
+end
+
+redis.call('SET', KEYS[1], '1', 'EX', ARGV[1])
+if redis.call('INCR', KEYS[2]) == 1 then
+    redis.call('EXPIRE', KEYS[2], 86400)
+end
+if check_ip and redis.call('INCR', KEYS[3]) == 1 then
+    redis.call('EXPIRE', KEYS[3], 3600)
+end
+return {1, 'ok', 0}
+"""
+
+# Undo a reservation after the provider rejected the send.
+_RELEASE_SEND_LUA = r"""
+redis.call('DEL', KEYS[1])
+if tonumber(redis.call('GET', KEYS[2]) or '0') > 0 then
+    redis.call('DECR', KEYS[2])
+end
+if ARGV[1] == '1' and tonumber(redis.call('GET', KEYS[3]) or '0') > 0 then
+    redis.call('DECR', KEYS[3])
+end
+return 1
+"""
+
+# KEYS[1] = otp:code:{phone}
+# ARGV[1] = submitted code hash  ARGV[2] = max attempts
+_VERIFY_LUA = r"""
+local stored = redis.call('HMGET', KEYS[1], 'h', 'attempts')
+if not stored[1] then
+    return -1
+end
+if stored[1] == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+local attempts = redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+    return -2
+end
+return 0
+"""
+
+
+@dataclass
+class SendReservation:
+    allowed: bool
+    reason: str = "ok"
+    retry_after_s: int = 0
+
+
+async def reserve_send(phone_number: str, client_ip: Optional[str] = None) -> SendReservation:
+    """Atomically check and consume the per-phone and per-IP send windows."""
+    reserve = await get_script(_RESERVE_SEND_LUA)
+    allowed, reason, retry_after_ms = await reserve(
+        keys=_send_keys(phone_number, client_ip),
+        args=[OTP_SEND_INTERVAL_S, OTP_PHONE_DAILY_MAX, OTP_IP_HOURLY_MAX, "1" if client_ip else "0"],
+    )
+    retry_after_s = max(int(retry_after_ms) // 1000, 1) if not allowed else 0
+    return SendReservation(bool(allowed), reason, retry_after_s)
+
+
+async def release_send(phone_number: str, client_ip: Optional[str] = None) -> None:
+    """Give back a reservation when the SMS was not actually sent."""
+    release = await get_script(_RELEASE_SEND_LUA)
+    await release(
+        keys=_send_keys(phone_number, client_ip),
+        args=["1" if client_ip else "0"],
+    )
+
+
+async def store_code(phone_number: str, code: str) -> None:
+    """Store the HMAC of *code* for *phone_number*, replacing any earlier code."""
+    redis = await get_redis()
+    key = _code_key(phone_number)
+    pipe = redis.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.hset(key, mapping={"h": _hash_code(phone_number, code), "attempts": 0})
+    pipe.expire(key, OTP_TTL_S)
+    await pipe.execute()
+
+
+def verify_otp(phone_number: str, code: str) -> int:
+    """Check *code*; returns ``VERIFIED``, ``MISMATCH``, ``MISSING`` or ``LOCKED``."""
+    if not code:
+        return MISMATCH
+    return int(get_sync_script(_VERIFY_LUA)(
+        keys=[_code_key(phone_number)],
+        args=[_hash_code(phone_number, str(code).strip()), OTP_MAX_ATTEMPTS],
+    ))
+
+
+async def verify_otp_async(phone_number: str, code: str) -> int:
+    """Async variant of :func:`verify_otp` for coroutine routes."""
+    if not code:
+        return MISMATCH
+    verify = await get_script(_VERIFY_LUA)
+    return int(await verify(
+        keys=[_code_key(phone_number)],
+        args=[_hash_code(phone_number, str(code).strip()), OTP_MAX_ATTEMPTS],
+    ))
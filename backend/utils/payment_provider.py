@@ -5,9 +5,19 @@ from abc import ABC, abstractmethod
 from typing import Optional
 from urllib.parse import urlencode
 
-from utils.alipay_utils import alipay_client
+from utils.lazy import LazyObject
 from utils.wechat_pay_utils import wechat_pay_client
 
+
+def _load_alipay_client():
+    # The Alipay SDK is imported (and the client built) on first payment call
+    from utils.alipay_utils import alipay_client as client
+
+    return client
+
+
+alipay_client = LazyObject(_load_alipay_client)
+
 logger = logging.getLogger(__name__)
 
 
@@ -0,0 +1,47 @@
+"""
+Daily provider context-cache counters per model, kept in Redis.
+
+Key: ``metrics:prompt_cache:{YYYY-MM-DD}`` — Hash (``utils.daily_counters``)
+with, for each model,
+
+* ``{model}:requests`` — chat completions that reported usage
+* ``{model}:hit`` / ``{model}:miss`` — prompt tokens the provider served
+  from / did not serve from its context cache
+"""
+
+from typing import Any, Dict, List
+
+from utils.daily_counters import incr_daily, read_daily
+from utils.usage_utils import normalize_usage
+
+_NAME = "prompt_cache"
+
+
+async def record_prompt_cache_usage(model_id: str, usage: Any) -> None:
+    normalized = normalize_usage(usage)
+    if normalized["prompt_tokens"] <= 0:
+        return
+    await incr_daily(_NAME, {
+        f"{model_id}:requests": 1,
+        f"{model_id}:hit": normalized["prompt_cache_hit_tokens"],
+        f"{model_id}:miss": normalized["prompt_cache_miss_tokens"],
+    })
+
+
+def _per_model(row: Dict[str, str]) -> Dict[str, dict]:
+    models: Dict[str, dict] = {}
+    for field, value in row.items():
+        model_id, _, counter = field.rpartition(":")
+        if not model_id:
+            continue
+        stats = models.setdefault(model_id, {"requests": 0, "hit": 0, "miss": 0})
+        stats[counter] = int(value)
+    for stats in models.values():
+        prompt_tokens = stats["hit"] + stats["miss"]
+        stats["hit_ratio"] = round(stats["hit"] / prompt_tokens, 4) if prompt_tokens else 0.0
+    return models
+
+
+def get_prompt_cache_metrics(days: int = 7) -> List[dict]:
+    """Per-day, per-model cache hit/miss tokens for the last *days* days, oldest first."""
+    return [{"date": day.isoformat(), "models": _per_model(row)} for day, row in read_daily(_NAME, days)]
@@ -0,0 +1,410 @@
+"""
+Provider routing for chat completions, with hedged first-token requests.
+
+A model can be served by several OpenAI-compatible providers — its
+*equivalence group*.  Each provider keeps a per-process health record (an
+EWMA of time-to-first-token, an EWMA error rate and a window of recent TTFT
+samples) and a group is tried best score first, in configured order on a tie.
+
+Streams are *hedged*: when the first token hasn't arrived within the
+primary's p95 TTFT (clamped to ``HEDGE_MIN_S``..``HEDGE_MAX_S``), the same
+request goes to the next provider and whichever yields a token first wins.
+The loser is cancelled, which closes its HTTP response, and only the
+winner's usage event is passed on, so only the winner is billed.  Models
+gated by the upstream scheduler (``upstream_bucket.is_scheduled``) are not
+hedged: admission takes one RPM / TPM / in-flight slot per turn, and a
+second concurrent request would exceed the limits declared for the group.  A provider
+that fails before its first token is replaced by the next one right away;
+client errors (4xx other than 429) are raised without failover.
+
+Configuration (JSON in the environment):
+
+* ``LLM_PROVIDERS`` — extra or overridden providers,
+  ``{"name": {"base_url": "...", "api_key_env": "ENV_NAME"}}``; ``api_key``
+  may be given inline (e.g. for a local stub server)
+* ``LLM_MODEL_ROUTES`` — equivalence groups,
+  ``{"deepseek-v4-flash": ["deepseek", ["dashscope", "deepseek-v4-flash"]]}``;
+  an entry is a provider name (same model id upstream) or
+  ``[provider, upstream_model]``
+
+Pointing a provider's ``base_url`` at a local OpenAI-compatible stub server
+is enough to exercise hedging and failover end to end.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from utils.lazy import LazyObject
+from utils.llm_client import (
+    DEEPSEEK_API_KEY,
+    DEEPSEEK_BASE_URL,
+    DEEPSEEK_DIRECT_MODELS,
+    QWEN_API_KEY,
+    QWEN_BASE_URL,
+    build_async_client,
+)
+from utils.upstream_bucket import is_scheduled
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") not in {"0", "false", "False"}
+HEDGE_DEFAULT_S = float(os.getenv("LLM_HEDGE_DEFAULT_S", "2.0"))
+HEDGE_MIN_S = 0.3
+HEDGE_MAX_S = 5.0
+HEDGE_MIN_SAMPLES = 20       # below this the p95 is too noisy; use HEDGE_DEFAULT_S
+HEALTH_SAMPLES = 200         # TTFT samples kept per provider for the p95
+EWMA_ALPHA = 0.2
+ERROR_PENALTY = 4.0          # score = ttft_ewma × (1 + ERROR_PENALTY × error_rate)
+
+
+# ---------------------------------------------------------------------------
+# Providers and equivalence groups
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+
+
+def _load_json_env(name: str) -> dict:
+    raw = os.getenv(name)
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        logger.error("Ignoring %s: not valid JSON", name)
+        return {}
+    if not isinstance(value, dict):
+        logger.error("Ignoring %s: expected a JSON object", name)
+        return {}
+    return value
+
+
+def _provider_settings() -> Dict[str, Tuple[Optional[str], str]]:
+    providers = {
+        "deepseek": (DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL),
+        "dashscope": (QWEN_API_KEY, QWEN_BASE_URL),
+    }
+    for name, spec in _load_json_env("LLM_PROVIDERS").items():
+        if not isinstance(spec, dict) or not spec.get("base_url"):
+            logger.error("Ignoring LLM_PROVIDERS[%r]: base_url is required", name)
+            continue
+        api_key = spec.get("api_key") or os.getenv(spec.get("api_key_env") or "")
+        providers[name] = (api_key, spec["base_url"])
+    return providers
+
+
+def _configured_routes() -> Dict[str, List[Route]]:
+    routes: Dict[str, List[Route]] = {}
+    for model_id, entries in _load_json_env("LLM_MODEL_ROUTES").items():
+        group = []
+        for entry in entries if isinstance(entries, list) else []:
+            if isinstance(entry, str):
+                group.append(Route(entry, model_id))
+            elif isinstance(entry, list) and len(entry) == 2:
+                group.append(Route(str(entry[0]), str(entry[1])))
+        unknown = [r.provider for r in group if r.provider not in _PROVIDERS]
+        if unknown or not group:
+            logger.error("Ignoring LLM_MODEL_ROUTES[%r]: unknown providers %s", model_id, unknown)
+            continue
+        routes[model_id] = group
+    return routes
+
+
+_PROVIDERS = _provider_settings()
+_ROUTES = _configured_routes()
+_clients: Dict[str, Any] = {
+    name: LazyObject(lambda key=key, url=url: build_async_client(key, url))
+    for name, (key, url) in _PROVIDERS.items()
+}
+
+
+def routes_for_model(model: str) -> List[Route]:
+    """The model's equivalence group in configured order (defaults to its single direct provider)."""
+    routes = _ROUTES.get(model)
+    if routes:
+        return list(routes)
+    provider = "deepseek" if model in DEEPSEEK_DIRECT_MODELS else "dashscope"
+    return [Route(provider, model)]
+
+
+# ---------------------------------------------------------------------------
+# Health
+# ---------------------------------------------------------------------------
+
+class _ProviderHealth:
+    __slots__ = ("ttft_ewma_s", "error_rate", "samples", "requests", "errors", "hedged", "cancelled")
+
+    def __init__(self):
+        self.ttft_ewma_s: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples: deque = deque(maxlen=HEALTH_SAMPLES)
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0      # times a hedge was sent because this provider was slow
+        self.cancelled = 0   # times this provider lost a hedge race
+
+    def score(self) -> float:
+        ttft = HEDGE_DEFAULT_S if self.ttft_ewma_s is None else self.ttft_ewma_s
+        return ttft * (1 + ERROR_PENALTY * self.error_rate)
+
+    def hedge_deadline_s(self) -> float:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            deadline = HEDGE_DEFAULT_S
+        else:
+            ordered = sorted(self.samples)
+            deadline = ordered[int(0.95 * (len(ordered) - 1))]
+        return min(max(deadline, HEDGE_MIN_S), HEDGE_MAX_S)
+
+    def record_ttft(self, ttft_s: float) -> None:
+        self.samples.append(ttft_s)
+        self._fold_ttft(ttft_s)
+        self.error_rate *= 1 - EWMA_ALPHA
+
+    def record_ok(self) -> None:
+        self.error_rate *= 1 - EWMA_ALPHA
+
+    def record_error(self) -> None:
+        self.errors += 1
+        self.error_rate = self.error_rate * (1 - EWMA_ALPHA) + EWMA_ALPHA
+
+    def record_cancelled(self, elapsed_s: float) -> None:
+        # Censored sample: the first token would have taken at least this long
+        self.cancelled += 1
+        if self.ttft_ewma_s is None or elapsed_s > self.ttft_ewma_s:
+            self._fold_ttft(elapsed_s)
+
+    def _fold_ttft(self, ttft_s: float) -> None:
+        if self.ttft_ewma_s is None:
+            self.ttft_ewma_s = ttft_s
+        else:
+            self.ttft_ewma_s += EWMA_ALPHA * (ttft_s - self.ttft_ewma_s)
+
+
+_health: Dict[str, _ProviderHealth] = {name: _ProviderHealth() for name in _PROVIDERS}
+
+
+def ranked_routes(model: str) -> List[Route]:
+    """The model's equivalence group, healthiest provider first."""
+    routes = routes_for_model(model)
+    return sorted(routes, key=lambda route: _health[route.provider].score())
+
+
+def get_provider_health() -> Dict[str, dict]:
+    """Health of each provider as seen by this process."""
+    return {
+        name: {
+            "ttft_ewma_ms": None if h.ttft_ewma_s is None else round(h.ttft_ewma_s * 1000, 1),
+            "hedge_deadline_ms": round(h.hedge_deadline_s() * 1000, 1),
+            "error_rate": round(h.error_rate, 4),
+            "samples": len(h.samples),
+            "requests": h.requests,
+            "errors": h.errors,
+            "hedged": h.hedged,
+            "cancelled": h.cancelled,
+        }
+        for name, h in sorted(_health.items())
+    }
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Whether another provider might succeed: network errors, timeouts, 429 and 5xx."""
+    status = getattr(exc, "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+# ---------------------------------------------------------------------------
+# Streaming with hedging
+# ---------------------------------------------------------------------------
+
+def _chunk_events(chunk) -> List[dict]:
+    events = []
+    chunk_usage = getattr(chunk, "usage", None)
+    if chunk_usage is not None:
+        events.append({"type": "usage", "usage": chunk_usage})
+    choices = getattr(chunk, "choices", None) or []
+    if choices:
+        content = getattr(choices[0].delta, "content", None)
+        if content is not None:
+            events.append({"type": "delta", "content": content})
+    return events
+
+
+@dataclass
+class _OpenStream:
+    route: Route
+    stream: Any
+    chunks: AsyncIterator
+    events: List[dict]
+    ttft_s: float
+
+
+async def _open_stream(route: Route, request: dict) -> _OpenStream:
+    """Start a stream on *route* and read up to its first token."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    stream = await _clients[route.provider].chat.completions.create(
+        model=route.model,
+        stream=True,
+        stream_options={"include_usage": True},
+        **request,
+    )
+    chunks = stream.__aiter__()
+    events: List[dict] = []
+    try:
+        while True:
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break  # finished without any text; still a valid (empty) reply
+            events.extend(_chunk_events(chunk))
+            if any(e["type"] == "delta" and e["content"] for e in events):
+                break
+    except BaseException:
+        await stream.close()
+        raise
+    return _OpenStream(route, stream, chunks, events, loop.time() - started)
+
+
+async def _race_first_token(model: str, request: dict) -> _OpenStream:
+    """Open the stream that yields a first token soonest, hedging a slow primary once."""
+    loop = asyncio.get_running_loop()
+    remaining = ranked_routes(model)
+    hedge_enabled = HEDGE_ENABLED and not is_scheduled(model)
+    pending: Dict["asyncio.Future", Tuple[Route, float]] = {}
+    hedge_at: Optional[float] = None
+    hedged = False
+    winner: Optional[_OpenStream] = None
+    last_error: Optional[BaseException] = None
+
+    def launch() -> None:
+        nonlocal hedge_at
+        route = remaining.pop(0)
+        _health[route.provider].requests += 1
+        task = asyncio.ensure_future(_open_stream(route, request))
+        pending[task] = (route, loop.time())
+        if not hedged:
+            hedge_at = loop.time() + _health[route.provider].hedge_deadline_s()
+
+    launch()
+    try:
+        while pending:
+            timeout = None
+            if hedge_enabled and not hedged and remaining and hedge_at is not None:
+                timeout = max(hedge_at - loop.time(), 0)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                for route, _ in pending.values():
+                    _health[route.provider].hedged += 1
+                hedged = True
+                launch()
+                continue
+
+            for task in done:
+                route, _ = pending.pop(task)
+                try:
+                    opened = task.result()
+                except Exception as exc:
+                    if not _is_retryable(exc):
+                        raise
+                    _health[route.provider].record_error()
+                    logger.warning("Provider %s failed before first token for %s: %r", route.provider, model, exc)
+                    last_error = exc
+                    continue
+                if winner is None:
+                    winner = opened
+                    _health[route.provider].record_ttft(opened.ttft_s)
+                else:
+                    await opened.stream.close()
+            if winner is not None:
+                return winner
+            if not pending and remaining:
+                launch()
+    finally:
+        if pending:
+            for task, (route, started) in pending.items():
+                task.cancel()
+                if winner is not None:
+                    # Lost the race; not counted when an error is being raised
+                    _health[route.provider].record_cancelled(loop.time() - started)
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, _OpenStream):
+                    await result.stream.close()
+
+    if last_error is not None:
+        raise last_error
+    raise RuntimeError(f"No provider available for model {model}")
+
+
+async def stream_chat_completion(
+    messages,
+    model="deepseek-v4-flash",
+    max_tokens=250,
+    temperature=1.3,
+    top_p=0.9,
+    presence_penalty=0,
+    frequency_penalty=0,
+):
+    """Yield ``{"type": "delta", "content"}`` and ``{"type": "usage", "usage"}`` events.
+
+    The events come from the provider that won the first-token race only.
+    Closing the generator early (``aclose()`` or cancellation) closes the
+    upstream HTTP response, which stops generation at the provider.
+    """
+    request = {
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "presence_penalty": presence_penalty,
+        "frequency_penalty": frequency_penalty,
+    }
+    opened = await _race_first_token(model, request)
+    try:
+        for event in opened.events:
+            yield event
+        while True:
+            try:
+                chunk = await opened.chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            for event in _chunk_events(chunk):
+                yield event
+    except Exception:
+        _health[opened.route.provider].record_error()
+        raise
+    finally:
+        await opened.stream.close()
+
+
+async def create_chat_completion(messages, model="deepseek-v4-flash", **params):
+    """Non-streaming completion, failing over along the model's equivalence group."""
+    last_error: Optional[BaseException] = None
+    for route in ranked_routes(model):
+        health = _health[route.provider]
+        health.requests += 1
+        try:
+            response = await _clients[route.provider].chat.completions.create(
+                model=route.model,
+                messages=messages,
+                **params,
+            )
+        except Exception as exc:
+            if not _is_retryable(exc):
+                raise
+            health.record_error()
+            logger.warning("Provider %s failed for %s: %r", route.provider, model, exc)
+            last_error = exc
+            continue
+        health.record_ok()
+        return response
+    if last_error is not None:
+        raise last_error
+    raise RuntimeError(f"No provider available for model {model}")
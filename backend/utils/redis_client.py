@@ -1,15 +1,59 @@
 """
 Redis client singleton for the Mikoshi backend.
-Provides a lazily-initialized async Redis connection.
+Provides a lazily-initialized async Redis connection, plus a synchronous
+client for the (threadpool) sync route handlers.
+
+Both clients sit on an explicitly sized, blocking connection pool
+(``REDIS_MAX_CONNECTIONS`` / ``REDIS_SYNC_MAX_CONNECTIONS``): a burst waits
+up to ``REDIS_POOL_TIMEOUT_S`` for a free connection instead of opening an
+unbounded number of sockets.  Liveness is left to the pool — idle
+connections are health-checked every ``health_check_interval`` seconds
+and commands are retried on a fresh connection after a connection or
+timeout error — so callers no longer pay a PING round-trip per call.
+
+Only errors raised before any byte of a command was written are retried
+(connecting, the health-check PING).  Once a command is on the wire it may
+have run on the server, so a failure while writing it or reading its reply
+raises ``RedisReplyLostError`` instead; sending it again would apply
+non-idempotent writes (Lua admission, HINCRBY, INCRBY) twice.  This holds
+for ``redis://`` URLs; ``rediss://`` and ``unix://`` use redis-py's own
+connection classes.
+
+Helpers:
+
+* ``run_pipeline`` / ``run_sync_pipeline`` — queue several commands and
+  send them in one round-trip
+* ``get_script`` / ``get_sync_script`` — per-process cache of registered
+  Lua scripts (EVALSHA, reloaded automatically after ``NOSCRIPT``)
+* ``get_command_stats`` — per-command latency of this process, including
+  whole pipelines (``PIPELINE``)
 """
 import os
+import time
 import logging
+import threading
+import redis
 import redis.asyncio as aioredis
-from typing import Optional
+from redis.asyncio.client import Pipeline as _AsyncPipeline
+from redis.asyncio.retry import Retry as _AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.client import Pipeline as _SyncPipeline
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+from typing import Any, Callable, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_SYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_SYNC_MAX_CONNECTIONS", "32"))
+REDIS_POOL_TIMEOUT_S = float(os.getenv("REDIS_POOL_TIMEOUT_S", "2"))
+REDIS_HEALTH_CHECK_INTERVAL_S = 30
+REDIS_RETRIES = 2
+
 _redis: Optional[aioredis.Redis] = None
+_sync_redis: Optional[redis.Redis] = None
+_async_scripts: Dict[str, Any] = {}
+_sync_scripts: Dict[str, Any] = {}
 
 
 def _build_redis_url() -> str:
@@ -17,36 +61,334 @@ def _build_redis_url() -> str:
     return os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
 
+# ---------------------------------------------------------------------------
+# Per-command latency
+# ---------------------------------------------------------------------------
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open.
+_LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000, float("inf"))
+
+
+class _CommandStats:
+    __slots__ = ("count", "errors", "total_s", "max_s", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.buckets = [0] * len(_LATENCY_BUCKETS_MS)
+
+
+_stats: Dict[str, _CommandStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _observe(command: Any, elapsed_s: float, failed: bool) -> None:
+    name = command.decode() if isinstance(command, bytes) else str(command)
+    name = name.upper()
+    elapsed_ms = elapsed_s * 1000
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = _CommandStats()
+        stats.count += 1
+        stats.errors += failed
+        stats.total_s += elapsed_s
+        if elapsed_s > stats.max_s:
+            stats.max_s = elapsed_s
+        for i, bound in enumerate(_LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                stats.buckets[i] += 1
+                break
+
+
+def _percentile_ms(buckets: list, count: int, q: float) -> float:
+    """Upper bound of the bucket holding the *q* quantile."""
+    rank = q * count
+    seen = 0
+    for bound, n in zip(_LATENCY_BUCKETS_MS, buckets):
+        seen += n
+        if seen >= rank:
+            return bound
+    return _LATENCY_BUCKETS_MS[-1]
+
+
+def get_command_stats() -> Dict[str, dict]:
+    """Latency per Redis command for this process since start (or last reset).
+
+    Percentiles are bucket upper bounds; blocking commands (``XREADGROUP``
+    with ``BLOCK``, ``BLPOP``) include the time spent waiting.
+    """
+    with _stats_lock:
+        snapshot = {
+            name: (s.count, s.errors, s.total_s, s.max_s, list(s.buckets))
+            for name, s in _stats.items()
+        }
+    result = {}
+    for name, (count, errors, total_s, max_s, buckets) in sorted(snapshot.items()):
+        result[name] = {
+            "count": count,
+            "errors": errors,
+            "avg_ms": round(total_s * 1000 / count, 3) if count else 0.0,
+            "p50_ms": _percentile_ms(buckets, count, 0.5),
+            "p99_ms": _percentile_ms(buckets, count, 0.99),
+            "max_ms": round(max_s * 1000, 3),
+        }
+    return result
+
+
+def reset_command_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
+
+
+class _TimedAsyncPipeline(_AsyncPipeline):
+    async def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            _observe("PIPELINE", time.perf_counter() - start, failed)
+
+
+class _TimedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            _observe(args[0], time.perf_counter() - start, failed)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> _TimedAsyncPipeline:
+        return _TimedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class _TimedSyncPipeline(_SyncPipeline):
+    def execute(self, raise_on_error: bool = True):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(raise_on_error)
+            failed = False
+            return result
+        finally:
+            _observe("PIPELINE", time.perf_counter() - start, failed)
+
+
+class _TimedSyncRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            _observe(args[0], time.perf_counter() - start, failed)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> _TimedSyncPipeline:
+        return _TimedSyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# ---------------------------------------------------------------------------
+# Clients
+# ---------------------------------------------------------------------------
+
+_RETRY_ON = [RedisConnectionError, RedisTimeoutError]
+
+
+class RedisReplyLostError(redis.exceptions.RedisError):
+    """The connection failed after a command was sent; it may or may not have run."""
+
+
+class _SyncConnection(redis.Connection):
+    # Set while connecting (handshake) or health-checking; those commands are safe to resend
+    _preparing = False
+
+    def connect(self, *args, **kwargs):
+        self._preparing = True
+        try:
+            super().connect(*args, **kwargs)
+        finally:
+            self._preparing = False
+
+    def check_health(self):
+        self._preparing = True
+        try:
+            super().check_health()
+        finally:
+            self._preparing = False
+
+    def send_packed_command(self, command, check_health=True):
+        if self._preparing:
+            return super().send_packed_command(command, check_health)
+        if self._sock is None:
+            self.connect()
+        if check_health:
+            self.check_health()
+        try:
+            super().send_packed_command(command, check_health=False)
+        except tuple(_RETRY_ON) as exc:
+            raise RedisReplyLostError(str(exc)) from exc
+
+    def read_response(self, *args, **kwargs):
+        if self._preparing:
+            return super().read_response(*args, **kwargs)
+        try:
+            return super().read_response(*args, **kwargs)
+        except tuple(_RETRY_ON) as exc:
+            raise RedisReplyLostError(str(exc)) from exc
+
+
+class _AsyncConnection(aioredis.Connection):
+    _preparing = False
+
+    async def connect(self, *args, **kwargs):
+        self._preparing = True
+        try:
+            await super().connect(*args, **kwargs)
+        finally:
+            self._preparing = False
+
+    async def check_health(self):
+        self._preparing = True
+        try:
+            await super().check_health()
+        finally:
+            self._preparing = False
+
+    async def send_packed_command(self, command, check_health=True):
+        if self._preparing:
+            return await super().send_packed_command(command, check_health)
+        if not self.is_connected:
+            await self.connect()
+        if check_health:
+            await self.check_health()
+        try:
+            await super().send_packed_command(command, check_health=False)
+        except tuple(_RETRY_ON) as exc:
+            raise RedisReplyLostError(str(exc)) from exc
+
+    async def read_response(self, *args, **kwargs):
+        if self._preparing:
+            return await super().read_response(*args, **kwargs)
+        try:
+            return await super().read_response(*args, **kwargs)
+        except tuple(_RETRY_ON) as exc:
+            raise RedisReplyLostError(str(exc)) from exc
+
+
 async def get_redis() -> aioredis.Redis:
-    """Return the shared async Redis client, creating it on first call."""
+    """Return the shared async Redis client, creating it on first call.
+
+    Creating the client does not connect; the first command does.  Callers
+    must treat Redis as optional and fall back when a command raises.
+    """
     global _redis
     if _redis is not None:
-        try:
-            await _redis.ping()
-            return _redis
-        except Exception:
-            logger.warning("Redis ping failed, reconnecting...")
-            _redis = None
+        return _redis
 
     url = _build_redis_url()
-    logger.info("Connecting to Redis at %s", url)
-    _redis = aioredis.from_url(
+    logger.info("Connecting to Redis at %s (pool of %d)", url, REDIS_MAX_CONNECTIONS)
+    pool = aioredis.BlockingConnectionPool.from_url(
         url,
+        connection_class=_AsyncConnection,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT_S,
         encoding="utf-8",
         decode_responses=True,
         socket_connect_timeout=3,
         socket_keepalive=True,
-        health_check_interval=30,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_S,
+        retry=_AsyncRetry(ExponentialBackoff(cap=0.5, base=0.05), REDIS_RETRIES),
+        retry_on_error=_RETRY_ON,
     )
-    await _redis.ping()
-    logger.info("Redis connection established")
+    _redis = _TimedAsyncRedis(connection_pool=pool)
     return _redis
 
 
+def get_sync_redis() -> redis.Redis:
+    """Return the shared synchronous Redis client for use from sync routes.
+
+    The client is thread-safe (one pooled connection per concurrent caller).
+    Callers must treat Redis as optional and fall back when a command raises.
+    """
+    global _sync_redis
+    if _sync_redis is None:
+        pool = redis.BlockingConnectionPool.from_url(
+            _build_redis_url(),
+            connection_class=_SyncConnection,
+            max_connections=REDIS_SYNC_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT_S,
+            encoding="utf-8",
+            decode_responses=True,
+            socket_connect_timeout=3,
+            socket_timeout=3,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_S,
+            retry=Retry(ExponentialBackoff(cap=0.5, base=0.05), REDIS_RETRIES),
+            retry_on_error=_RETRY_ON,
+        )
+        _sync_redis = _TimedSyncRedis(connection_pool=pool)
+    return _sync_redis
+
+
+# ---------------------------------------------------------------------------
+# Pipelines and Lua scripts
+# ---------------------------------------------------------------------------
+
+async def run_pipeline(build: Callable[[Any], None], transaction: bool = False) -> list:
+    """Queue commands with ``build(pipe)`` and send them in one round-trip."""
+    pipe = (await get_redis()).pipeline(transaction=transaction)
+    build(pipe)
+    return await pipe.execute()
+
+
+def run_sync_pipeline(build: Callable[[Any], None], transaction: bool = False) -> list:
+    """Sync variant of :func:`run_pipeline`."""
+    pipe = get_sync_redis().pipeline(transaction=transaction)
+    build(pipe)
+    return pipe.execute()
+
+
+async def get_script(source: str):
+    """Registered async Lua script for *source*, cached per process.
+
+    Call it as ``await script(keys=[...], args=[...])``; the script is sent
+    by SHA and reloaded transparently if Redis lost it.
+    """
+    script = _async_scripts.get(source)
+    if script is None:
+        script = _async_scripts[source] = (await get_redis()).register_script(source)
+    return script
+
+
+def get_sync_script(source: str):
+    """Sync variant of :func:`get_script`."""
+    script = _sync_scripts.get(source)
+    if script is None:
+        script = _sync_scripts[source] = get_sync_redis().register_script(source)
+    return script
+
+
 async def close_redis() -> None:
-    """Close the Redis connection gracefully."""
-    global _redis
+    """Close the Redis connections gracefully."""
+    global _redis, _sync_redis
     if _redis is not None:
-        await _redis.close()
+        await _redis.aclose()
+        await _redis.connection_pool.disconnect()
         _redis = None
         logger.info("Redis connection closed")
+    if _sync_redis is not None:
+        _sync_redis.close()
+        _sync_redis.connection_pool.disconnect()
+        _sync_redis = None
+    _async_scripts.clear()
+    _sync_scripts.clear()
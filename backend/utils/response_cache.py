@@ -0,0 +1,274 @@
+"""
+Shared cache for public browse responses, with stale-while-revalidate and
+surrogate-key invalidation.
+
+Keys:
+
+* ``resp_cache:{name}:{variant}`` — Hash ``{body, fresh_until}``: the
+  serialised JSON body and the unix time it stops being fresh; expires
+  ``stale_s`` after that
+* ``resp_cache_tag:{surrogate}`` — Set of the cache keys built from that
+  surrogate's rows (``characters``, ``scenes``, ``personas``, ``tags``,
+  ``notifications``)
+* ``resp_cache_lock:{name}:{variant}`` — String, held while one worker
+  rebuilds a stale entry
+* ``resp_cache_gen:{surrogate}`` — String counter bumped by every
+  invalidation of that surrogate; a body is only stored if none of its
+  surrogates' counters moved while it was being built, so a build that read
+  rows from before a commit cannot overwrite the invalidation
+
+Only the user-independent body is cached; per-user fields (``liked``) are
+overlaid after the lookup.  A fresh entry is served as is; a stale one is
+served right away while a single worker rebuilds it in the background with
+its own DB session; a miss is built inline.
+
+A commit that added, changed or deleted a ``Character``, ``Scene``,
+``Persona``, ``Tag`` or ``SystemNotification`` through the ORM drops the
+entries of the matching surrogates, which covers the create, update, delete
+and moderation routes.  A ``User`` whose ``name`` or ``profile_pic`` changed
+(or who was deleted) drops the character, scene and persona lists, which
+show the creator's name and picture.  Raw-SQL counter updates (views, likes) are left to
+the short TTL; raw-SQL writers that change listed fields call
+``invalidate`` themselves.
+
+Redis errors fall back to building the response uncached.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Character, Persona, Scene, SystemNotification, Tag, User
+from utils.fast_json import dumps, loads
+from utils.liked_set import get_liked_ids
+from utils.redis_client import get_sync_redis, get_sync_script
+
+logger = logging.getLogger(__name__)
+
+CHARACTERS = "characters"
+SCENES = "scenes"
+PERSONAS = "personas"
+TAGS = "tags"
+NOTIFICATIONS = "notifications"
+
+LIST_FRESH_S = 30
+LIST_STALE_S = 120
+REBUILD_LOCK_S = 30
+
+_KEY_PREFIX = "resp_cache"
+_TAG_PREFIX = "resp_cache_tag"
+_LOCK_PREFIX = "resp_cache_lock"
+_GEN_PREFIX = "resp_cache_gen"
+
+_SURROGATES_BY_MODEL = {
+    Character: (CHARACTERS, TAGS),  # tag counts move with characters
+    Scene: (SCENES,),
+    Persona: (PERSONAS,),
+    Tag: (TAGS,),
+    SystemNotification: (NOTIFICATIONS,),
+}
+
+# Creator fields copied into list items
+_CREATOR_FIELDS = ("name", "profile_pic")
+_CREATOR_SURROGATES = (CHARACTERS, SCENES, PERSONAS)
+
+_rebuilds = ThreadPoolExecutor(max_workers=2, thread_name_prefix="resp-cache")
+
+
+def _encode(value: Any) -> str:
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    return dumps(value).decode("utf-8")
+
+
+# KEYS = entry, n generation counters, n tag sets
+# ARGV = body, fresh_until, ttl, n generations read before the build
+_STORE_LUA = """
+local n = (#KEYS - 1) / 2
+for i = 1, n do
+    if (redis.call('GET', KEYS[1 + i]) or '0') ~= ARGV[3 + i] then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], 'body', ARGV[1], 'fresh_until', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+for i = 1, n do
+    redis.call('SADD', KEYS[1 + n + i], KEYS[1])
+    redis.call('EXPIRE', KEYS[1 + n + i], ARGV[3])
+end
+return 1
+"""
+
+
+def _generations(redis, surrogates: tuple) -> list:
+    """Invalidation counters of *surrogates*, read before building a body."""
+    return [gen or "0" for gen in redis.mget([f"{_GEN_PREFIX}:{s}" for s in surrogates])]
+
+
+def _store(redis, key: str, body: str, surrogates: tuple, generations: list, fresh_s: int, stale_s: int) -> bool:
+    """Store *body* unless a surrogate was invalidated since *generations* were read."""
+    stored = get_sync_script(_STORE_LUA)(
+        keys=[
+            key,
+            *(f"{_GEN_PREFIX}:{s}" for s in surrogates),
+            *(f"{_TAG_PREFIX}:{s}" for s in surrogates),
+        ],
+        args=[body, time.time() + fresh_s, fresh_s + stale_s, *generations],
+    )
+    if not stored:
+        logger.debug("Skipped storing %s: invalidated during the build", key)
+    return bool(stored)
+
+
+def _rebuild(key: str, build: Callable[[Session], Any], surrogates: tuple, fresh_s: int, stale_s: int) -> None:
+    redis = get_sync_redis()
+    db = SessionLocal()
+    try:
+        generations = _generations(redis, surrogates)
+        _store(redis, key, _encode(build(db)), surrogates, generations, fresh_s, stale_s)
+    except Exception:
+        logger.warning("Response cache rebuild failed for %s", key, exc_info=True)
+    finally:
+        db.close()
+        try:
+            redis.delete(f"{_LOCK_PREFIX}:{key[len(_KEY_PREFIX) + 1:]}")
+        except Exception:
+            pass
+
+
+def cached_body(
+    name: str,
+    variant: str,
+    *,
+    surrogates: tuple,
+    build: Callable[[Session], Any],
+    db: Session,
+    fresh_s: int = LIST_FRESH_S,
+    stale_s: int = LIST_STALE_S,
+) -> str:
+    """Serialised JSON body of ``build(db)``, served from the shared cache when possible.
+
+    *build* must not depend on the current user; it may be called later from
+    a background thread with a different session.
+    """
+    key = f"{_KEY_PREFIX}:{name}:{variant}"
+    try:
+        redis = get_sync_redis()
+        entry = redis.hgetall(key)
+    except Exception:
+        logger.debug("Response cache unavailable for %s", key, exc_info=True)
+        return _encode(build(db))
+
+    if entry:
+        if float(entry.get("fresh_until", 0)) < time.time():
+            try:
+                if redis.set(f"{_LOCK_PREFIX}:{name}:{variant}", 1, nx=True, ex=REBUILD_LOCK_S):
+                    _rebuilds.submit(_rebuild, key, build, surrogates, fresh_s, stale_s)
+            except Exception:
+                logger.debug("Could not schedule response cache rebuild", exc_info=True)
+        return entry["body"]
+
+    try:
+        generations = _generations(redis, surrogates)
+    except Exception:
+        logger.debug("Response cache unavailable for %s", key, exc_info=True)
+        return _encode(build(db))
+    body = _encode(build(db))
+    try:
+        _store(redis, key, body, surrogates, generations, fresh_s, stale_s)
+    except Exception:
+        logger.debug("Could not store response cache entry %s", key, exc_info=True)
+    return body
+
+
+def json_body_response(body) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+def liked_list_response(body: str, db: Session, current_user, entity_type: str) -> Response:
+    """Cached ``*ListOut`` body with the caller's ``liked`` flags filled in."""
+    if current_user is None:
+        return json_body_response(body)
+    data = loads(body)
+    items = data.get("items") or []
+    liked_ids = get_liked_ids(db, current_user, entity_type, [item["id"] for item in items])
+    for item in items:
+        item["liked"] = item["id"] in liked_ids
+    return json_body_response(dumps(data))
+
+
+def list_variant(short: bool, page: int, page_size: int) -> str:
+    # short lists ignore paging, so they share one entry
+    return "short" if short else f"page={page}&size={page_size}"
+
+
+# ---------------------------------------------------------------------------
+# Invalidation
+# ---------------------------------------------------------------------------
+
+# KEYS = n tag sets, then their n generation counters
+_INVALIDATE_LUA = """
+local n = #KEYS / 2
+for i = 1, n do
+    redis.call('INCR', KEYS[n + i])
+    local members = redis.call('SMEMBERS', KEYS[i])
+    for j = 1, #members, 500 do
+        redis.call('DEL', unpack(members, j, math.min(j + 499, #members)))
+    end
+    redis.call('DEL', KEYS[i])
+end
+return 1
+"""
+
+
+def invalidate(*surrogates: str) -> None:
+    """Drop every cached response built from *surrogates*."""
+    if not surrogates:
+        return
+    try:
+        get_sync_script(_INVALIDATE_LUA)(keys=[
+            *(f"{_TAG_PREFIX}:{s}" for s in surrogates),
+            *(f"{_GEN_PREFIX}:{s}" for s in surrogates),
+        ])
+    except Exception:
+        logger.warning("Response cache invalidation failed for %s", surrogates, exc_info=True)
+
+
+_PENDING_KEY = "resp_cache_surrogates"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_surrogates(session, flush_context) -> None:
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        surrogates = _SURROGATES_BY_MODEL.get(type(obj))
+        if surrogates and (obj not in session.dirty or session.is_modified(obj)):
+            pending.update(surrogates)
+        elif isinstance(obj, User) and obj not in session.new and _creator_fields_changed(obj, session):
+            pending.update(_CREATOR_SURROGATES)
+
+
+def _creator_fields_changed(user: User, session) -> bool:
+    if user in session.deleted:
+        return True
+    attrs = inspect(user).attrs
+    return any(attrs[field].history.has_changes() for field in _CREATOR_FIELDS)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _invalidate_committed(session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        invalidate(*sorted(pending))
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending(session) -> None:
+    session.info.pop(_PENDING_KEY, None)
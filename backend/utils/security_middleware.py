@@ -6,9 +6,12 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 from starlette.requests import ClientDisconnect
 import time
-from typing import Dict, Tuple
+import uuid
+from typing import Tuple
 import logging
 
+from utils.redis_client import get_redis, get_sync_redis
+
 logger = logging.getLogger(__name__)
 
 
@@ -64,95 +67,101 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         return response
 
 
+# KEYS[1] = request log      (ip_rate:{ip})   sorted set of request timestamps
+# KEYS[2] = block marker     (ip_block:{ip})  string with TTL
+# ARGV[1] = now (float seconds)
+# ARGV[2] = per-minute limit
+# ARGV[3] = per-hour limit
+# ARGV[4] = block duration (seconds)
+# ARGV[5] = unique member for this request
+# Returns: {allowed (0|1), remaining_minute, remaining_hour, block_ttl_s}
+_IP_RATE_LUA = r"""
+local block_ttl = redis.call('TTL', KEYS[2])
+if block_ttl > 0 then
+    return {0, 0, 0, block_ttl}
+end
+
+local now = tonumber(ARGV[1])
+local per_minute = tonumber(ARGV[2])
+local per_hour = tonumber(ARGV[3])
+local block_s = tonumber(ARGV[4])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - 3600)
+local hour_count = redis.call('ZCARD', KEYS[1])
+local minute_count = redis.call('ZCOUNT', KEYS[1], now - 60, '+inf')
+
+if minute_count >= per_minute or hour_count >= per_hour then
+    -- Block for repeated violations
+    if minute_count >= per_minute * 2 or hour_count >= per_hour * 2 then
+        redis.call('SET', KEYS[2], '1', 'EX', block_s)
+        return {0, 0, 0, block_s}
+    end
+    -- Still record the attempt so sustained hammering escalates to a block
+    redis.call('ZADD', KEYS[1], now, ARGV[5])
+    redis.call('EXPIRE', KEYS[1], 3600)
+    return {0, math.max(per_minute - minute_count, 0), math.max(per_hour - hour_count, 0), 0}
+end
+
+redis.call('ZADD', KEYS[1], now, ARGV[5])
+redis.call('EXPIRE', KEYS[1], 3600)
+return {1, per_minute - minute_count - 1, per_hour - hour_count - 1, 0}
+"""
+
+
 class IPTracker:
     """
-    Simple in-memory IP tracker for rate limiting.
-    For production, consider using Redis or similar.
-    """
-    def __init__(self):
-        self.requests: Dict[str, list] = {}
-        self.blocked_ips: Dict[str, float] = {}
-        self.cleanup_interval = 300  # Clean old entries every 5 minutes
-        self.last_cleanup = time.time()
+    Redis-backed IP tracker for rate limiting.
 
-    def cleanup(self):
-        """Remove old entries to prevent memory bloat"""
-        current_time = time.time()
-        if current_time - self.last_cleanup > self.cleanup_interval:
-            # Clean up requests older than 1 hour
-            cutoff_time = current_time - 3600
-            for ip in list(self.requests.keys()):
-                self.requests[ip] = [
-                    timestamp for timestamp in self.requests[ip] 
-                    if timestamp > cutoff_time
-                ]
-                if not self.requests[ip]:
-                    del self.requests[ip]
-            
-            # Clean up expired blocks
-            for ip in list(self.blocked_ips.keys()):
-                if self.blocked_ips[ip] < current_time:
-                    del self.blocked_ips[ip]
-            
-            self.last_cleanup = current_time
+    Request timestamps and blocks live in Redis so every worker process (and
+    every node) enforces one shared limit.  The check is a single Lua call;
+    on Redis errors requests are allowed (fail open), matching the other
+    Redis-backed limiters.
+    """
+    RATE_PREFIX = "ip_rate"
+    BLOCK_PREFIX = "ip_block"
+    BLOCK_DURATION_S = 3600
 
-    def is_blocked(self, ip: str) -> Tuple[bool, float]:
-        """Check if an IP is currently blocked"""
-        if ip in self.blocked_ips:
-            if self.blocked_ips[ip] > time.time():
-                return True, self.blocked_ips[ip]
-            else:
-                del self.blocked_ips[ip]
-        return False, 0
+    def __init__(self):
+        self._script = None
 
-    def block_ip(self, ip: str, duration: int = 3600):
-        """Block an IP for a specified duration (default 1 hour)"""
-        self.blocked_ips[ip] = time.time() + duration
-        logger.warning(f"IP {ip} has been blocked for {duration} seconds")
+    def _keys(self, ip: str) -> list:
+        return [f"{self.RATE_PREFIX}:{ip}", f"{self.BLOCK_PREFIX}:{ip}"]
 
-    def check_rate_limit(
-        self, 
-        ip: str, 
-        limit: int = 100, 
-        window: int = 60
-    ) -> Tuple[bool, int]:
+    async def check_rate_limit(
+        self,
+        ip: str,
+        per_minute: int = 100,
+        per_hour: int = 1000,
+    ) -> Tuple[bool, int, int, int]:
         """
-        Check if an IP has exceeded rate limit.
-        Returns (is_allowed, remaining_requests)
+        Record one request and check both windows.
+        Returns (is_allowed, remaining_minute, remaining_hour, blocked_for_s)
         """
-        self.cleanup()
-        
-        # Check if IP is blocked
-        is_blocked, block_time = self.is_blocked(ip)
-        if is_blocked:
-            return False, 0
-        
-        current_time = time.time()
-        
-        # Initialize if new IP
-        if ip not in self.requests:
-            self.requests[ip] = []
-        
-        # Remove requests outside the time window
-        cutoff_time = current_time - window
-        self.requests[ip] = [
-            timestamp for timestamp in self.requests[ip] 
-            if timestamp > cutoff_time
-        ]
-        
-        # Check if limit exceeded
-        request_count = len(self.requests[ip])
-        if request_count >= limit:
-            # Block IP for repeated violations
-            if request_count >= limit * 2:
-                self.block_ip(ip, duration=3600)  # Block for 1 hour
-            return False, 0
-        
-        # Add current request
-        self.requests[ip].append(current_time)
-        
-        remaining = limit - (request_count + 1)
-        return True, remaining
+        try:
+            redis = await get_redis()
+            if self._script is None:
+                self._script = redis.register_script(_IP_RATE_LUA)
+            allowed, remaining_minute, remaining_hour, blocked_for = await self._script(
+                keys=self._keys(ip),
+                args=[time.time(), per_minute, per_hour, self.BLOCK_DURATION_S, uuid.uuid4().hex],
+            )
+        except Exception:
+            logger.debug("IP rate limit check failed, allowing request", exc_info=True)
+            return True, per_minute, per_hour, 0
+        if blocked_for:
+            logger.warning(f"IP {ip} is blocked for {blocked_for} seconds")
+        return bool(allowed), int(remaining_minute), int(remaining_hour), int(blocked_for)
+
+    def status(self, ip: str) -> Tuple[int, int, int]:
+        """Return (blocked_for_s, requests_last_minute, requests_last_hour)."""
+        rate_key, block_key = self._keys(ip)
+        now = time.time()
+        pipe = get_sync_redis().pipeline(transaction=False)
+        pipe.ttl(block_key)
+        pipe.zcount(rate_key, now - 60, "+inf")
+        pipe.zcount(rate_key, now - 3600, "+inf")
+        block_ttl, last_minute, last_hour = pipe.execute()
+        return max(int(block_ttl), 0), int(last_minute), int(last_hour)
 
 
 # Global IP tracker instance
@@ -205,31 +214,20 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         
         client_ip = self.get_client_ip(request)
         
-        # Check if IP is blocked
-        is_blocked, block_time = ip_tracker.is_blocked(client_ip)
-        if is_blocked:
-            remaining_time = int(block_time - time.time())
+        # Check block + per-minute + per-hour limits in one round-trip
+        allowed, remaining_minute, remaining_hour, blocked_for = await ip_tracker.check_rate_limit(
+            client_ip,
+            per_minute=self.requests_per_minute,
+            per_hour=self.requests_per_hour,
+        )
+        if blocked_for:
             return Response(
-                content=f"Too many requests. IP blocked for {remaining_time} more seconds.",
+                content=f"Too many requests. IP blocked for {blocked_for} more seconds.",
                 status_code=429,
-                headers={"Retry-After": str(remaining_time)}
+                headers={"Retry-After": str(blocked_for)}
             )
         
-        # Check per-minute rate limit
-        allowed_minute, remaining_minute = ip_tracker.check_rate_limit(
-            client_ip, 
-            limit=self.requests_per_minute, 
-            window=60
-        )
-        
-        # Check per-hour rate limit
-        allowed_hour, remaining_hour = ip_tracker.check_rate_limit(
-            client_ip, 
-            limit=self.requests_per_hour, 
-            window=3600
-        )
-        
-        if not allowed_minute or not allowed_hour:
+        if not allowed:
             logger.warning(f"Rate limit exceeded for IP: {client_ip}")
             return Response(
                 content="Rate limit exceeded. Please try again later.",
@@ -258,26 +256,16 @@ def get_rate_limit_status(ip: str) -> dict:
     Get current rate limit status for an IP address.
     Useful for monitoring and debugging.
     """
-    is_blocked, block_time = ip_tracker.is_blocked(ip)
+    blocked_for, requests_last_minute, requests_last_hour = ip_tracker.status(ip)
     
-    if is_blocked:
+    if blocked_for:
         return {
             "ip": ip,
             "blocked": True,
-            "block_expires_at": block_time,
-            "remaining_time": int(block_time - time.time())
+            "block_expires_at": time.time() + blocked_for,
+            "remaining_time": blocked_for
         }
     
-    # Get request counts
-    current_time = time.time()
-    requests = ip_tracker.requests.get(ip, [])
-    
-    minute_ago = current_time - 60
-    hour_ago = current_time - 3600
-    
-    requests_last_minute = len([t for t in requests if t > minute_ago])
-    requests_last_hour = len([t for t in requests if t > hour_ago])
-    
     return {
         "ip": ip,
         "blocked": False,
@@ -1,22 +1,33 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import os
-import json
 import secrets
-from alibabacloud_dypnsapi20170525.client import Client as DypnsapiClient
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_dypnsapi20170525 import models as dypnsapi_models
-from alibabacloud_tea_util import models as util_models
-from datetime import datetime, timedelta
-from typing import Dict
+from typing import TYPE_CHECKING, Optional
 
-# 验证码缓存（生产环境建议使用Redis）
-verification_codes: Dict[str, dict] = {}
+from utils import ephemeral_store, otp_store
 
-# 已验证手机号的临时token（验证通过后5分钟内有效，用于注册）
-verified_phone_tokens: Dict[str, dict] = {}
+if TYPE_CHECKING:
+    from alibabacloud_dypnsapi20170525.client import Client as DypnsapiClient
 
+# 验证码（哈希存储）、发送频率限制和已验证手机号token都存放在Redis中，多个worker进程共享
+# 验证码相关逻辑见 utils/otp_store.py
+PHONE_TOKEN_TTL_S = 300   # 已验证手机号的临时token（验证通过后5分钟内有效，用于注册）
 
-def create_sms_client() -> DypnsapiClient:
+_THROTTLE_MESSAGES = {
+    "phone_interval": "请求过于频繁，请{retry_after}秒后再试",
+    "phone_daily": "该手机号今日获取验证码次数已达上限，请明天再试",
+    "ip_hourly": "当前网络获取验证码过于频繁，请稍后再试",
+}
+
+_sms_client = None
+_sms_client_lock = asyncio.Lock()
+
+
+def _phone_token_key(token: str) -> str:
+    return f"sms:verified_phone:{token}"
+
+
+def create_sms_client() -> "DypnsapiClient":
     """
     创建阿里云短信服务客户端
     直接使用 AccessKey 凭证（避免 CredentialClient 凭证链的副作用：
@@ -31,6 +42,10 @@ def create_sms_client() -> DypnsapiClient:
             "must be set in environment variables"
         )
 
+    # 阿里云SDK导入较慢，首次使用时再导入
+    from alibabacloud_dypnsapi20170525.client import Client as DypnsapiClient
+    from alibabacloud_tea_openapi import models as open_api_models
+
     config = open_api_models.Config(
         access_key_id=access_key_id,
         access_key_secret=access_key_secret
@@ -39,64 +54,86 @@ def create_sms_client() -> DypnsapiClient:
     return DypnsapiClient(config)
 
 
-async def send_verification_code(phone_number: str) -> dict:
+async def _get_sms_client() -> "DypnsapiClient":
+    """进程内复用的短信客户端；SDK导入和客户端创建是同步操作，放到线程中执行，不阻塞事件循环"""
+    global _sms_client
+    if _sms_client is None:
+        async with _sms_client_lock:
+            if _sms_client is None:
+                _sms_client = await asyncio.to_thread(create_sms_client)
+    return _sms_client
+
+
+def _build_send_request(phone_number: str):
+    from alibabacloud_dypnsapi20170525 import models as dypnsapi_models
+    from alibabacloud_tea_util import models as util_models
+
+    request = dypnsapi_models.SendSmsVerifyCodeRequest(
+        phone_number=phone_number,
+        sign_name='速通互联验证码',
+        template_code='100001',
+        template_param='{"code":"##code##","min":"5"}',  # 验证码占位符
+        code_type=1,  # 数字验证码
+        code_length=6,  # 6位验证码
+        valid_time=otp_store.OTP_TTL_S,  # 5分钟有效期
+        interval=otp_store.OTP_SEND_INTERVAL_S,  # 60秒发送间隔
+        return_verify_code=True,  # 需要阿里云返回验证码，由本服务哈希后保存并校验
+        duplicate_policy=1  # 新验证码覆盖旧验证码
+    )
+    return request, util_models.RuntimeOptions()
+
+
+async def send_verification_code(phone_number: str, client_ip: Optional[str] = None) -> dict:
     """
     发送短信验证码
     
     Args:
         phone_number: 手机号（不含+86）
+        client_ip: 请求方IP，用于按IP限制发送频率（可选）
         
     Returns:
-        dict: {"success": bool, "message": str, "verify_code": str (仅开发环境)}
+        dict: {"success": bool, "message": str, "verify_code": str (仅非生产环境)}
     """
     try:
-        # 频率限制：同一手机号60秒内只能发送一次
-        if phone_number in verification_codes:
-            last_send = verification_codes[phone_number].get('sent_at')
-            if last_send and (datetime.now() - last_send).total_seconds() < 60:
-                return {
-                    "success": False,
-                    "message": "请求过于频繁，请60秒后再试"
-                }
-        
-        client = create_sms_client()
-        request = dypnsapi_models.SendSmsVerifyCodeRequest(
-            phone_number=phone_number,
-            sign_name='速通互联验证码',
-            template_code='100001',
-            template_param='{"code":"##code##","min":"5"}',  # 验证码占位符
-            code_type=1,  # 数字验证码
-            code_length=6,  # 6位验证码
-            valid_time=300,  # 5分钟有效期
-            interval=60,  # 60秒发送间隔
-            return_verify_code=True,  # 开发环境返回验证码
-            duplicate_policy=1  # 新验证码覆盖旧验证码
-        )
-        
-        runtime = util_models.RuntimeOptions()
+        # 频率限制：按手机号（60秒间隔、每日上限）和IP（每小时上限），在Lua中原子检查并占位
+        reservation = await otp_store.reserve_send(phone_number, client_ip)
+    except Exception as e:
+        print(f"SMS throttle error: {str(e)}")
+        return {
+            "success": False,
+            "message": "验证码服务暂不可用，请稍后再试"
+        }
+    if not reservation.allowed:
+        return {
+            "success": False,
+            "message": _THROTTLE_MESSAGES[reservation.reason].format(retry_after=reservation.retry_after_s),
+            "retry_after": reservation.retry_after_s,
+        }
+
+    try:
+        client = await _get_sms_client()
+        request, runtime = await asyncio.to_thread(_build_send_request, phone_number)
         response = await client.send_sms_verify_code_with_options_async(request, runtime)
 
         # 如果阿里云返回非OK，直接透传错误信息，方便定位签名/模板/参数问题
         if response.body.code == 'OK':
-            # 存储验证码到缓存
             verify_code = response.body.model.verify_code if response.body.model else None
-            verification_codes[phone_number] = {
-                'code': verify_code,
-                'sent_at': datetime.now(),
-                'expires_at': datetime.now() + timedelta(minutes=5),
-                'biz_id': response.body.model.biz_id if response.body.model else None
-            }
+            if not verify_code:
+                raise RuntimeError("SMS provider did not return the verification code")
+            # 只保存验证码的哈希
+            await otp_store.store_code(phone_number, verify_code)
             
             result = {
                 "success": True,
                 "message": "验证码已发送"
             }
-            # 开发环境返回验证码（生产环境删除此行）
-            if verify_code:
+            # 仅非生产环境返回验证码，方便调试
+            if os.getenv("ENVIRONMENT") != "production":
                 result['verify_code'] = verify_code
             
             return result
         else:
+            await _release_send(phone_number, client_ip)
             err_code = response.body.code or 'Unknown'
             err_msg = response.body.message or 'Invalid parameters'
             detail = getattr(response.body, 'access_denied_detail', None) or getattr(response.body, 'AccessDeniedDetail', None)
@@ -108,40 +145,46 @@ async def send_verification_code(phone_number: str) -> dict:
             
     except Exception as e:
         print(f"SMS Error: {str(e)}")
+        await _release_send(phone_number, client_ip)
         return {
             "success": False,
             "message": f"发送失败：{str(e)}"
         }
 
 
+async def _release_send(phone_number: str, client_ip: Optional[str]) -> None:
+    """发送失败时释放频率限制占位，允许立即重试"""
+    try:
+        await otp_store.release_send(phone_number, client_ip)
+    except Exception:
+        pass
+
+
 def verify_code(phone_number: str, code: str) -> bool:
     """
-    验证短信验证码
+    验证短信验证码（同步路由使用）
     
     Args:
         phone_number: 手机号
         code: 用户输入的验证码
         
     Returns:
-        bool: 验证是否成功
+        bool: 验证是否成功。验证成功后验证码失效；连续输错次数过多验证码也会失效
     """
-    if phone_number not in verification_codes:
+    try:
+        return otp_store.verify_otp(phone_number, code) == otp_store.VERIFIED
+    except Exception as e:
+        print(f"SMS verify error: {str(e)}")
         return False
-    
-    stored = verification_codes[phone_number]
-    
-    # 检查是否过期
-    if datetime.now() > stored['expires_at']:
-        del verification_codes[phone_number]
+
+
+async def verify_code_async(phone_number: str, code: str) -> bool:
+    """验证短信验证码（异步路由使用，不阻塞事件循环）"""
+    try:
+        return await otp_store.verify_otp_async(phone_number, code) == otp_store.VERIFIED
+    except Exception as e:
+        print(f"SMS verify error: {str(e)}")
         return False
-    
-    # 验证码匹配
-    if stored['code'] == code:
-        # 验证成功后删除验证码（一次性使用）
-        del verification_codes[phone_number]
-        return True
-    
-    return False
 
 
 def create_verified_phone_token(phone_number: str) -> str:
@@ -156,14 +199,11 @@ def create_verified_phone_token(phone_number: str) -> str:
         str: 临时token（5分钟有效）
     """
     token = secrets.token_urlsafe(32)
-    verified_phone_tokens[token] = {
-        'phone_number': phone_number,
-        'expires_at': datetime.now() + timedelta(minutes=5)
-    }
+    ephemeral_store.put_json(_phone_token_key(token), {'phone_number': phone_number}, PHONE_TOKEN_TTL_S)
     return token
 
 
-def verify_phone_token(token: str) -> str:
+def verify_phone_token(token: str) -> Optional[str]:
     """
     验证临时token并返回关联的手机号
     
@@ -173,17 +213,12 @@ def verify_phone_token(token: str) -> str:
     Returns:
         str: 手机号，如果token无效或过期返回None
     """
-    if token not in verified_phone_tokens:
+    if not token:
         return None
-    
-    stored = verified_phone_tokens[token]
-    
-    # 检查是否过期
-    if datetime.now() > stored['expires_at']:
-        del verified_phone_tokens[token]
+    # Token验证成功后删除（一次性使用），过期由Redis TTL处理
+    try:
+        stored = ephemeral_store.take_json(_phone_token_key(token))
+    except Exception as e:
+        print(f"Phone token verify error: {str(e)}")
         return None
-    
-    # Token验证成功后删除（一次性使用）
-    phone_number = stored['phone_number']
-    del verified_phone_tokens[token]
-    return phone_number
+    return stored.get('phone_number') if stored else None
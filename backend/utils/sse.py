@@ -0,0 +1,219 @@
+"""
+Server-Sent Events response for token streams.
+
+``SSEResponse`` wraps an async generator that yields either ``str`` text
+deltas or ``dict`` events:
+
+* text deltas are coalesced into one ``{"chunk": ...}`` frame per
+  ``flush_interval_s`` (20 ms) or ``flush_bytes`` (256 B), whichever comes
+  first, instead of one JSON encode and one ASGI send per token
+* dict events flush any pending text and are sent as their own frame
+* an SSE comment heartbeat keeps idle connections (proxies, load balancers)
+  from timing out while waiting on the upstream
+* frames go through a bounded queue, so a slow client pauses the generator
+  rather than buffering the whole reply in memory
+* if the generator raises, the text so far and an ``{"error": ...}`` frame
+  are sent before the stream ends, so the client does not mistake a failure
+  for a complete reply
+
+The response listens for ``http.disconnect`` itself.  When the client goes
+away the generator is closed (``GeneratorExit`` at its current ``yield`` or
+``CancelledError`` at its current ``await``), so it can stop the upstream
+completion early; ``on_disconnect`` is called afterwards.  ``on_close`` runs
+once the response is over, however it ended — also when the generator never
+started, so a caller can free what it reserved for the stream.
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Mapping, Optional, Union
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from utils.fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+SSE_FLUSH_INTERVAL_S = 0.02
+SSE_FLUSH_BYTES = 256
+SSE_HEARTBEAT_S = 15.0
+_QUEUE_FRAMES = 32
+
+_CHUNK_PREFIX = b'data: {"chunk": '
+_CHUNK_SUFFIX = b"}\n\n"
+_DATA_PREFIX = b"data: "
+_FRAME_END = b"\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+
+StreamItem = Union[str, dict]
+
+
+def chunk_frame(text: str) -> bytes:
+    """``data: {"chunk": "<text>"}`` frame, built from a pre-encoded template."""
+    return _CHUNK_PREFIX + dumps(text) + _CHUNK_SUFFIX
+
+
+def event_frame(payload: dict) -> bytes:
+    return _DATA_PREFIX + dumps(payload) + _FRAME_END
+
+
+_END = object()
+
+
+class SSEResponse(Response):
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        content: AsyncIterator[StreamItem],
+        *,
+        headers: Optional[Mapping[str, str]] = None,
+        flush_interval_s: float = SSE_FLUSH_INTERVAL_S,
+        flush_bytes: int = SSE_FLUSH_BYTES,
+        heartbeat_s: float = SSE_HEARTBEAT_S,
+        on_disconnect: Optional[Callable[[], Awaitable[None]]] = None,
+        on_close: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.content = content
+        self.flush_interval_s = flush_interval_s
+        self.flush_bytes = flush_bytes
+        self.heartbeat_s = heartbeat_s
+        self.on_disconnect = on_disconnect
+        self.on_close = on_close
+        self.status_code = 200
+        self.background = None
+        self.init_headers({
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx: don't buffer the stream
+            **(headers or {}),
+        })
+
+    async def _produce(self, queue: "asyncio.Queue") -> None:
+        """Coalesce generator output into frames and hand them to the sender."""
+        loop = asyncio.get_running_loop()
+        pending: list[str] = []
+        pending_bytes = 0
+        deadline = None
+        items = self.content.__aiter__()
+        next_item = None
+        try:
+            while True:
+                if next_item is None:
+                    next_item = asyncio.ensure_future(items.__anext__())
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                done, _ = await asyncio.wait({next_item}, timeout=timeout)
+
+                if not done:
+                    # Flush budget elapsed while the upstream is quiet
+                    await queue.put(chunk_frame("".join(pending)))
+                    pending, pending_bytes, deadline = [], 0, None
+                    continue
+
+                try:
+                    item = next_item.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_item = None
+
+                if isinstance(item, str):
+                    if not item:
+                        continue
+                    pending.append(item)
+                    pending_bytes += len(item.encode())
+                    if deadline is None:
+                        deadline = loop.time() + self.flush_interval_s
+                    if pending_bytes < self.flush_bytes and loop.time() < deadline:
+                        continue
+                    frame = chunk_frame("".join(pending))
+                    pending, pending_bytes, deadline = [], 0, None
+                    await queue.put(frame)
+                else:
+                    if pending:
+                        await queue.put(chunk_frame("".join(pending)))
+                        pending, pending_bytes, deadline = [], 0, None
+                    await queue.put(event_frame(item))
+
+            if pending:
+                await queue.put(chunk_frame("".join(pending)))
+        except Exception as exc:
+            logger.exception("SSE content generator failed")
+            if pending:
+                await queue.put(chunk_frame("".join(pending)))
+            await queue.put(event_frame({"error": str(exc) or type(exc).__name__}))
+        finally:
+            if next_item is not None:
+                # Cancelled mid-await (client disconnected): stop the generator there
+                next_item.cancel()
+                try:
+                    await next_item
+                except BaseException:
+                    pass
+            await _aclose(self.content)
+        await queue.put(_END)
+
+    async def _send_frames(self, queue: "asyncio.Queue", send: Send) -> None:
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_s)
+            except asyncio.TimeoutError:
+                frame = HEARTBEAT_FRAME
+            if frame is _END:
+                return
+            await send({"type": "http.response.body", "body": frame, "more_body": True})
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await self._stream(receive, send)
+        finally:
+            if self.on_close is not None:
+                await self.on_close()
+
+    async def _stream(self, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_FRAMES)
+        producer = asyncio.ensure_future(self._produce(queue))
+        sender = asyncio.ensure_future(self._send_frames(queue, send))
+        watcher = asyncio.ensure_future(self._wait_for_disconnect(receive))
+
+        disconnected = False
+        try:
+            done, _ = await asyncio.wait({sender, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            disconnected = watcher in done or (sender in done and sender.exception() is not None)
+        finally:
+            for task in (watcher, sender, producer):
+                if not task.done():
+                    task.cancel()
+            results = await asyncio.gather(producer, sender, watcher, return_exceptions=True)
+            for result in results[:2]:
+                if isinstance(result, Exception) and not isinstance(result, OSError):
+                    logger.warning("SSE stream ended with an error: %r", result)
+
+        if disconnected:
+            if self.on_disconnect is not None:
+                await self.on_disconnect()
+            return
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _aclose(agen) -> None:
+    aclose = getattr(agen, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception:
+        logger.debug("Error while closing SSE content generator", exc_info=True)
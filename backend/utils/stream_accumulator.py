@@ -0,0 +1,91 @@
+"""
+Running reply, token count and credit cost of one chat stream.
+
+The provider reports usage only in its last chunk, so while a reply streams
+the completion is counted with ``estimate_tokens`` as each delta arrives
+and priced with the prompt estimate at the full (cache-miss) input price.
+Deltas split words and are often a single token, so they are not estimated
+one by one: the text since the last checkpoint is estimated as a whole, and
+every ``_RECOUNT_CHARS`` characters the checkpoint moves up to an estimate
+of the full reply.
+That lets the stream loop stop the upstream *before* a reply costs more
+than the user can still spend, instead of rejecting it after the fact.
+
+Delta text is kept in a list and joined once when the reply is needed.
+"""
+
+from typing import Any, List, Optional
+
+from model_configs import get_model
+from utils.context_window import estimate_tokens
+
+_RECOUNT_CHARS = 512
+
+
+def available_credits(credit_limits: Optional[dict]) -> Optional[float]:
+    """Credits the user can still spend: plan credits left plus wallet balance.
+
+    ``None`` when the plan has no cap (nothing to enforce).
+    """
+    if not isinstance(credit_limits, dict) or not credit_limits.get("is_limited"):
+        return None
+    remaining = float(credit_limits.get("remaining_credits") or 0.0)
+    wallet = float(credit_limits.get("purchased_credit_balance") or 0.0)
+    return remaining + wallet
+
+
+class StreamAccumulator:
+    """Collects deltas and keeps a running token and credit estimate."""
+
+    def __init__(self, model_id: str, prompt_messages: List[dict], *, budget_credits: Optional[float] = None):
+        self._parts: List[str] = []
+        self._text: Optional[str] = ""
+        self._model = get_model(model_id)
+        self.prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in prompt_messages)
+        self.completion_tokens = 0
+        self.budget_credits = budget_credits
+        self._settled_tokens = 0  # estimate of the reply up to the checkpoint
+        self._tail = ""           # reply text after the checkpoint
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(self._parts)
+        return self._text
+
+    def credits_for(self, completion_tokens: int) -> float:
+        if self._model is None:
+            return 0.0
+        return self._model.tokens_to_credits(self.prompt_tokens, completion_tokens)
+
+    @property
+    def credits(self) -> float:
+        return self.credits_for(self.completion_tokens)
+
+    def add(self, chunk: str) -> bool:
+        """Append *chunk* unless it would take the reply over budget.
+
+        Returns False (and drops the chunk) when the budget would be exceeded.
+        """
+        tail = self._tail + chunk
+        tokens = self._settled_tokens + estimate_tokens(tail)
+        if self.budget_credits is not None and self.credits_for(tokens) > self.budget_credits:
+            return False
+        self._parts.append(chunk)
+        self._text = None
+        if len(tail) >= _RECOUNT_CHARS:
+            tokens = estimate_tokens(self.text)
+            self._settled_tokens = tokens
+            self._tail = ""
+        else:
+            self._tail = tail
+        self.completion_tokens = tokens
+        return True
+
+    def estimated_usage(self) -> dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "estimated": True,
+        }
@@ -0,0 +1,39 @@
+"""
+Daily counters for chat streams, kept in Redis.
+
+Key: ``metrics:chat_stream:{YYYY-MM-DD}`` — Hash (``utils.daily_counters``) with
+
+* ``completed`` / ``interrupted`` — streams that ran to the end / whose
+  client disconnected first
+* ``interrupted_completion_tokens`` — tokens generated (and billed) before
+  the upstream was closed
+* ``tokens_saved`` — ``max_tokens`` minus the tokens already generated, for
+  each interrupted stream: an upper bound on what closing early avoided
+"""
+
+from typing import List
+
+from utils.daily_counters import incr_daily, read_daily
+
+_NAME = "chat_stream"
+_FIELDS = ("completed", "interrupted", "interrupted_completion_tokens", "tokens_saved")
+
+
+async def record_completed_stream() -> None:
+    await incr_daily(_NAME, {"completed": 1})
+
+
+async def record_interrupted_stream(completion_tokens: int, max_tokens: int) -> None:
+    await incr_daily(_NAME, {
+        "interrupted": 1,
+        "interrupted_completion_tokens": completion_tokens,
+        "tokens_saved": max(max_tokens - completion_tokens, 0),
+    })
+
+
+def get_stream_metrics(days: int = 7) -> List[dict]:
+    """Per-day counters for the last *days* days, oldest first."""
+    return [
+        {"date": day.isoformat(), **{field: int(row.get(field, 0)) for field in _FIELDS}}
+        for day, row in read_daily(_NAME, days)
+    ]
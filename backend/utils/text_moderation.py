@@ -4,12 +4,6 @@ import os
 import logging
 from typing import Any, Dict, Iterable, Tuple
 
-from tencentcloud.common import credential
-from tencentcloud.common.profile.client_profile import ClientProfile
-from tencentcloud.common.profile.http_profile import HttpProfile
-from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
-from tencentcloud.tms.v20201229 import tms_client, models
-
 logger = logging.getLogger(__name__)
 
 _MAX_TEXT_LENGTH = 10000
@@ -72,6 +66,13 @@ def moderate_text_with_decision(text: str, data_id: str = "") -> Tuple[str, str]
     saw_review = False
     review_label = ""
 
+    # Imported on first use: the Tencent Cloud SDK is slow to import
+    from tencentcloud.common import credential
+    from tencentcloud.common.profile.client_profile import ClientProfile
+    from tencentcloud.common.profile.http_profile import HttpProfile
+    from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+    from tencentcloud.tms.v20201229 import tms_client, models
+
     try:
         cred = credential.Credential(secret_id, secret_key)
 
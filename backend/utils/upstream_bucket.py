@@ -1,5 +1,5 @@
 """
-Per-model upstream request bucket with Redis Streams.
+Per-model upstream scheduler with Redis Streams.
 
 Provides rate-paced, priority-ordered access to upstream model providers.
 Pro users get priority in the queue: two separate streams per model
@@ -9,23 +9,53 @@ ordering is FIFO.
 Completely separate from user-facing rate limiting — this only gates
 the moment a request actually calls the provider API.
 
-Models without an ``rpm`` in their ModelConfig are never rate-limited
-(the bucket passes them through immediately).
+A request is gated on every limit its ModelConfig declares:
+
+* ``rpm``            — requests per sliding 60 s window
+* ``tpm``            — tokens per sliding 60 s window; a request is charged
+  its estimated prompt tokens plus ``max_tokens`` up front, and the charge
+  is reconciled with the reported usage when it finishes
+* ``max_concurrent`` — requests in flight, held as a leased semaphore
+
+Models that declare none of them pass straight through.
 
 Architecture
 ------------
-Each model with an RPM cap gets three Redis keys:
-
-* ``upstream_rate:{model_id}``        — Sorted Set  (sliding window, 60 s)
+Each scheduled model gets these Redis keys:
+
+* ``upstream_rate:{model_id}``        — Sorted Set  (RPM window, 60 s)
+* ``upstream_tpm:{model_id}``         — Sorted Set of ``"{request_id}|{tokens}"``
+  (TPM window, 60 s)
+* ``upstream_tpm_used:{model_id}``    — String, token total of that window
+* ``upstream_inflight:{model_id}``    — Sorted Set of request ids scored by
+  lease expiry (``UPSTREAM_LEASE_S``), so a crashed worker cannot leak slots
 * ``upstream_bucket:{model_id}:pro``  — Redis Stream (FIFO, pro tier)
 * ``upstream_bucket:{model_id}:free`` — Redis Stream (FIFO, free tier)
 
-A Lua script atomically checks the sliding window.  Requests that fall
-within the RPM limit are admitted immediately.  Requests that exceed it
-are appended to the pro or free stream depending on the user's tier.
-A background *dispenser* task (one per model) reads from the two streams
-(pro first, then free) at the model's RPM pace and unblocks the waiting
-request via a short‑lived Redis list signal.
+The checks live in one set of Lua functions (``SCHEDULER_LUA``) shared by
+every script that admits a request (``chat_admission``).  Requests that fit
+all limits are admitted immediately; the rest are appended to the pro or
+free stream.
+A background *dispenser* task (one per model) reads batches from the two
+streams and, in one Lua call per tick, releases queued requests in order
+for as long as they fit (pro first, then free): the script takes the
+slots, acknowledges the stream entries and publishes the released request
+ids on the ``upstream_signal`` channel.  An entry a waiter has already
+deleted (timeout, refund) is acknowledged and skipped without taking a slot.
+``Admission.release`` returns the in-flight slot and corrects the TPM charge.
+
+Waiters do not hold a Redis connection each.  Every process keeps one
+pub/sub subscription to ``upstream_signal`` and resolves an in-process
+future per waiting request.  The script also leaves a short-lived
+``upstream_signal:{request_id}`` key, which waiters check now and then in
+case a pub/sub message was missed during a reconnect.
+
+Every worker process starts dispensers, but only the holder of
+``upstream_dispenser_lease:{model_id}`` drains the streams; the others stand
+by and take over when the lease expires.  All dispensers share one consumer
+group, so a new leader reclaims whatever the previous one left pending and
+each queued request is released exactly once, no matter how many workers
+or nodes are running.
 """
 from __future__ import annotations
 
@@ -35,10 +65,11 @@ import platform
 import time
 import uuid
 import logging
-from typing import Dict
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
 
-from utils.redis_client import get_redis
-from model_configs import get_model, MODELS
+from utils.redis_client import get_redis, get_script
+from model_configs import get_model, MODELS, ModelConfig
 
 logger = logging.getLogger(__name__)
 
@@ -48,17 +79,33 @@ logger = logging.getLogger(__name__)
 
 _STREAM_PREFIX = "upstream_bucket"
 _RATE_PREFIX = "upstream_rate"
+_TPM_PREFIX = "upstream_tpm"
+_TPM_USED_PREFIX = "upstream_tpm_used"
+_INFLIGHT_PREFIX = "upstream_inflight"
 _SIGNAL_PREFIX = "upstream_signal"
 
-# Per‑instance consumer group so multiple workers don't compete for the same
-# pending entries.  hostname + pid is stable within a process lifetime.
-_INSTANCE_ID = f"{platform.node()}_{os.getpid()}"
-CONSUMER_GROUP = f"upstream_dispenser_{_INSTANCE_ID}"
+_LEASE_PREFIX = "upstream_dispenser_lease"
+
+# One consumer group shared by every process; the lease below ensures a
+# single active reader per model.
+CONSUMER_GROUP = "upstream_dispenser"
+
+# Leader lease: renewed on every loop iteration, so it must outlive one
+# XREADGROUP block plus the longest pacing sleep.
+LEASE_TTL_MS = 15000
+STANDBY_POLL_S = 5
 
 WINDOW_S = 60
-RATE_KEY_TTL = 120       # 2× window — safety net for the sorted set
+RATE_KEY_TTL = 120       # 2× window — safety net for the sorted sets
 SIGNAL_TTL = 60          # waiter either picks the signal up or times out
 
+# An in-flight slot that is never finished (crashed worker) frees itself after this.
+UPSTREAM_LEASE_S = 300
+
+# Retry hint while every concurrent slot is taken; slots free up on finish,
+# not on a schedule, so this is a short poll.
+CONCURRENCY_RETRY_MS = 250
+
 # Stream trimming: keep at most this many entries per stream.
 # At 120 RPM × 30 s timeout worst case, ~60 entries could pile up.
 # 1000 gives plenty of headroom without unbounded growth.
@@ -67,149 +114,376 @@ STREAM_MAXLEN = 1000
 # XREADGROUP poll cooldown when a stream has no data (ms).
 XREAD_BLOCK_MS = 5000
 
+# Queued entries fetched per XREADGROUP and considered per release call.
+DISPENSE_BATCH = 64
+
+# Longest the dispenser sleeps while the model is saturated, so it keeps
+# renewing its lease and picks up newly queued pro requests.
+MAX_FULL_WINDOW_SLEEP_S = 1.0
+
+# Pub/sub channel carrying space-separated released request ids.
+SIGNAL_CHANNEL = "upstream_signal"
+
+# How often a waiter double-checks its signal key (missed pub/sub message).
+SIGNAL_POLL_S = 5.0
+
 # How long a message must be idle before XAUTOCLAIM steals it (ms).
 AUTOCLAIM_MIN_IDLE_MS = 1000
 
+
+def _limits(model: Optional[ModelConfig]) -> Tuple[int, int, int]:
+    """(rpm, tpm, max_concurrent) with 0 meaning unlimited."""
+    if model is None:
+        return 0, 0, 0
+    return model.rpm or 0, model.tpm or 0, model.max_concurrent or 0
+
+
+def is_scheduled(model_id: str) -> bool:
+    """Whether requests for *model_id* go through the scheduler at all."""
+    return any(_limits(get_model(model_id)))
+
+
+def model_keys(model_id: str) -> List[str]:
+    """The four per-model scheduler keys, in the order ``SCHEDULER_LUA`` expects."""
+    return [
+        f"{_RATE_PREFIX}:{model_id}",
+        f"{_TPM_PREFIX}:{model_id}",
+        f"{_TPM_USED_PREFIX}:{model_id}",
+        f"{_INFLIGHT_PREFIX}:{model_id}",
+    ]
+
+
+def stream_key(model_id: str, is_pro: bool) -> str:
+    return f"{_STREAM_PREFIX}:{model_id}:{'pro' if is_pro else 'free'}"
+
+
+def limit_args(model_id: str, now: Optional[float] = None) -> list:
+    """The ``LIMIT_ARGC`` limit arguments ``SCHEDULER_LUA`` expects."""
+    rpm, tpm, max_concurrent = _limits(get_model(model_id))
+    return [
+        time.time() if now is None else now,
+        WINDOW_S,
+        RATE_KEY_TTL,
+        rpm,
+        tpm,
+        max_concurrent,
+        UPSTREAM_LEASE_S,
+        CONCURRENCY_RETRY_MS,
+    ]
+
+
+LIMIT_ARGC = 8
+
 # ---------------------------------------------------------------------------
-# Lua script: atomic check-or-queue
+# Lua: scheduler functions shared by every admitting script
 # ---------------------------------------------------------------------------
 
-# KEYS[1] = rate sorted set   (upstream_rate:{model})
-# KEYS[2] = stream            (upstream_bucket:{model}:pro  or  :free)
-# ARGV[1] = rpm limit
-# ARGV[2] = window seconds    (60)
-# ARGV[3] = current timestamp (int)
-# ARGV[4] = rate-key TTL
-# ARGV[5] = unique request id  (ts_hex:uuid_hex — deduplicates across restarts)
-#
-# Returns:  { status, detail }
-#   status = 1  →  detail = remaining (int)
-#   status = 0  →  detail = stream message id (str)
-_ACQUIRE_LUA = r"""
-local rate_key   = KEYS[1]
-local stream_key = KEYS[2]
-local rpm        = tonumber(ARGV[1])
-local window     = tonumber(ARGV[2])
-local now        = tonumber(ARGV[3])
-local ttl        = tonumber(ARGV[4])
-local request_id = ARGV[5]
-
--- 1. Purge expired entries from the sliding window
-redis.call('ZREMRANGEBYSCORE', rate_key, '-inf', now - window)
-
--- 2. Count current in-window requests
-local count = redis.call('ZCARD', rate_key)
-
--- 3. Under limit → admit immediately
-if count < rpm then
-    redis.call('ZADD', rate_key, now, request_id)
-    redis.call('EXPIRE', rate_key, ttl)
-    return {1, rpm - count - 1}
+# model_ctx(kb, ab) reads the model keys from KEYS[kb..kb+3]
+#   (rate window, TPM window, TPM total, in-flight set — see model_keys)
+# and the limits from ARGV[ab..ab+7]
+#   (now, window s, key TTL, rpm, tpm, max_concurrent, lease s, concurrency retry ms — see limit_args).
+# A limit of 0 is unlimited.
+SCHEDULER_LUA = r"""
+local function model_ctx(kb, ab)
+    return {
+        rate = KEYS[kb], tpm_set = KEYS[kb + 1], tpm_used = KEYS[kb + 2], inflight = KEYS[kb + 3],
+        now = tonumber(ARGV[ab]), window = tonumber(ARGV[ab + 1]), ttl = tonumber(ARGV[ab + 2]),
+        rpm = tonumber(ARGV[ab + 3]), tpm = tonumber(ARGV[ab + 4]), conc = tonumber(ARGV[ab + 5]),
+        lease = tonumber(ARGV[ab + 6]), conc_retry_ms = tonumber(ARGV[ab + 7]),
+    }
 end
 
--- 4. Over limit → queue in tiered stream (FIFO)
-local msg_id = redis.call(
-    'XADD', stream_key, '*',
-    'request_id', request_id,
-    'ts', now
-)
-return {0, msg_id}
-"""
+local function model_purge(m)
+    local cutoff = m.now - m.window
+    if m.rpm > 0 then
+        redis.call('ZREMRANGEBYSCORE', m.rate, '-inf', cutoff)
+    end
+    if m.tpm > 0 then
+        local expired = redis.call('ZRANGEBYSCORE', m.tpm_set, '-inf', cutoff)
+        if #expired > 0 then
+            local freed = 0
+            for _, member in ipairs(expired) do
+                freed = freed + tonumber(string.match(member, '|(%d+)$') or '0')
+            end
+            redis.call('ZREMRANGEBYSCORE', m.tpm_set, '-inf', cutoff)
+            if redis.call('DECRBY', m.tpm_used, freed) < 0 then
+                redis.call('SET', m.tpm_used, 0, 'KEEPTTL')
+            end
+        end
+        if redis.call('ZCARD', m.tpm_set) == 0 then
+            redis.call('DEL', m.tpm_used)
+        end
+    end
+    if m.conc > 0 then
+        redis.call('ZREMRANGEBYSCORE', m.inflight, '-inf', m.now)
+    end
+end
 
-# ---------------------------------------------------------------------------
-# Script cache
-# ---------------------------------------------------------------------------
+local function window_wait_ms(m, key)
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        return math.max(math.floor((tonumber(oldest[2]) + m.window - m.now) * 1000), 1)
+    end
+    return 1
+end
 
-_scripts_ready = False
-_sha_acquire: str = ""
+-- 0 if a request costing `cost` tokens fits every limit now, else ms to wait
+local function model_wait_ms(m, cost)
+    if m.rpm > 0 and redis.call('ZCARD', m.rate) >= m.rpm then
+        return window_wait_ms(m, m.rate)
+    end
+    if m.tpm > 0 and cost > 0 then
+        local used = tonumber(redis.call('GET', m.tpm_used) or '0')
+        -- a request larger than the whole budget still runs, on an empty window
+        if used > 0 and used + cost > m.tpm then
+            return window_wait_ms(m, m.tpm_set)
+        end
+    end
+    if m.conc > 0 and redis.call('ZCARD', m.inflight) >= m.conc then
+        return m.conc_retry_ms
+    end
+    return 0
+end
 
+local function model_take(m, request_id, cost)
+    if m.rpm > 0 then
+        redis.call('ZADD', m.rate, m.now, request_id)
+        redis.call('EXPIRE', m.rate, m.ttl)
+    end
+    if m.tpm > 0 and cost > 0 then
+        redis.call('ZADD', m.tpm_set, m.now, request_id .. '|' .. cost)
+        redis.call('INCRBY', m.tpm_used, cost)
+        redis.call('EXPIRE', m.tpm_set, m.ttl)
+        redis.call('EXPIRE', m.tpm_used, m.ttl)
+    end
+    if m.conc > 0 then
+        redis.call('ZADD', m.inflight, m.now + m.lease, request_id)
+        redis.call('EXPIRE', m.inflight, m.lease)
+    end
+end
 
-async def _ensure_script() -> None:
-    global _scripts_ready, _sha_acquire
-    if _scripts_ready:
+-- Return the in-flight slot; re-charge the TPM window with `actual` tokens
+-- (-1 = unknown, keep the estimate; 0 = drop the charge)
+local function model_finish(m, request_id, charged, actual)
+    redis.call('ZREM', m.inflight, request_id)
+    if m.tpm <= 0 or actual < 0 or actual == charged then
         return
-    redis = await get_redis()
-    _sha_acquire = await redis.script_load(_ACQUIRE_LUA)
-    _scripts_ready = True
+    end
+    local score = m.now
+    if charged > 0 then
+        local old = request_id .. '|' .. charged
+        score = redis.call('ZSCORE', m.tpm_set, old)
+        if not score then
+            return  -- already out of the window
+        end
+        redis.call('ZREM', m.tpm_set, old)
+    end
+    if actual > 0 then
+        redis.call('ZADD', m.tpm_set, score, request_id .. '|' .. actual)
+        redis.call('EXPIRE', m.tpm_set, m.ttl)
+    end
+    if redis.call('INCRBY', m.tpm_used, actual - charged) < 0 then
+        redis.call('SET', m.tpm_used, 0)
+    end
+    redis.call('EXPIRE', m.tpm_used, m.ttl)
+end
+"""
 
+# KEYS[1] = lease key         (upstream_dispenser_lease:{model})
+# ARGV[1] = holder id
+# ARGV[2] = lease TTL (ms)
+# Returns 1 if the caller holds the lease (newly acquired or renewed).
+_LEASE_LUA = r"""
+local holder = redis.call('GET', KEYS[1])
+if holder == false then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
 
-# ===================================================================
-# Public API
-# ===================================================================
+# KEYS[1..4] = model keys   KEYS[5] = pro stream   KEYS[6] = free stream
+# ARGV[1..8] = limits
+# ARGV[9] = consumer group  ARGV[10] = stream maxlen  ARGV[11] = signal TTL
+# ARGV[12] = signal channel  ARGV[13] = signal key prefix
+# ARGV[14..] = candidates in release order, as quadruples
+#              (stream index 5|6, stream message id, request id, token charge)
+#
+# Releases candidates in order while they fit every limit.
+# Returns { candidates consumed, ms until the next one may fit (0 if none is blocked) }
+_RELEASE_LUA = SCHEDULER_LUA + r"""
+local m     = model_ctx(1, 1)
+local group = ARGV[9]
+
+model_purge(m)
+
+local released = {}
+local retry_ms = 0
+local i = 14
+while i + 3 <= #ARGV do
+    local stream_key = KEYS[tonumber(ARGV[i])]
+    local msg_id     = ARGV[i + 1]
+    local request_id = ARGV[i + 2]
+    local cost       = tonumber(ARGV[i + 3]) or 0
+    if request_id == '' or #redis.call('XRANGE', stream_key, msg_id, msg_id) == 0 then
+        -- malformed entry, or deleted by a waiter that gave up: drop it without using a slot
+        redis.call('XACK', stream_key, group, msg_id)
+    else
+        retry_ms = model_wait_ms(m, cost)
+        if retry_ms > 0 then
+            break
+        end
+        model_take(m, request_id, cost)
+        redis.call('SET', ARGV[13] .. request_id, '1', 'EX', ARGV[11])
+        redis.call('XACK', stream_key, group, msg_id)
+        table.insert(released, request_id)
+    end
+    i = i + 4
+end
+local consumed = (i - 14) / 4
 
+if #released > 0 then
+    redis.call('PUBLISH', ARGV[12], table.concat(released, ' '))
+    redis.call('XTRIM', KEYS[5], 'MAXLEN', '~', ARGV[10])
+    redis.call('XTRIM', KEYS[6], 'MAXLEN', '~', ARGV[10])
+end
+return {consumed, retry_ms}
+"""
 
-async def acquire_upstream(
-    model_id: str,
-    *,
-    is_pro: bool = False,
-    timeout_s: float = 30.0,
-) -> bool:
-    """Try to acquire an upstream request slot for *model_id*.
+async def _hold_lease(model_id: str, holder_id: str) -> bool:
+    """Acquire or renew *holder_id*'s dispenser lease for *model_id*."""
+    lease = await get_script(_LEASE_LUA)
+    held = await lease(
+        keys=[f"{_LEASE_PREFIX}:{model_id}"], args=[holder_id, LEASE_TTL_MS]
+    )
+    return bool(held)
 
-    * If the model has no ``rpm`` configured, always returns ``True``.
-    * If the model is under its RPM cap, returns ``True`` immediately.
-    * Otherwise the call is queued in the pro or free Redis Stream
-      (depending on *is_pro*) and this coroutine blocks until the
-      dispenser releases a slot, or *timeout_s* elapses.
 
-    Pro requests are dispatched before free requests by the dispenser.
+# ===================================================================
+# Waiter wake-ups (one pub/sub subscription per process)
+# ===================================================================
 
-    Fails **open** — returns ``True`` on any Redis error so that a
-    transient infrastructure problem does not block requests.
-    """
-    model = get_model(model_id)
-    if model is None or model.rpm is None:
-        return True  # not rate-limited
 
-    rpm: int = model.rpm
-    tier = "pro" if is_pro else "free"
-    stream_key = f"{_STREAM_PREFIX}:{model_id}:{tier}"
+class _SignalHub:
+    """Multiplexes ``upstream_signal`` messages onto per-request futures."""
+
+    def __init__(self):
+        self._waiters: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, request_id: str) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = fut
+        return fut
+
+    def discard(self, request_id: str) -> None:
+        self._waiters.pop(request_id, None)
+
+    def ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _deliver(self, data: str) -> None:
+        for request_id in data.split():
+            fut = self._waiters.pop(request_id, None)
+            if fut is not None and not fut.done():
+                fut.set_result(True)
+
+    async def _run(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                redis = await get_redis()
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(SIGNAL_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._deliver(message.get("data") or "")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Upstream signal subscription lost — resubscribing in 1 s", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+
+_signal_hub = _SignalHub()
+
+
+async def _wait_for_release(redis, request_id: str, fut: asyncio.Future, timeout_s: float) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_s
+    signal_key = f"{_SIGNAL_PREFIX}:{request_id}"
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=min(SIGNAL_POLL_S, remaining))
+            return True
+        except asyncio.TimeoutError:
+            # Covers a release published while the subscription was reconnecting
+            if await redis.exists(signal_key):
+                return True
+
+
+def new_request_id() -> str:
     # Timestamp prefix makes collisions effectively impossible even under
     # pathological clock conditions, and gives us a rough ordering hint.
-    request_id = f"{int(time.time()):x}:{uuid.uuid4().hex}"
+    return f"{int(time.time()):x}:{uuid.uuid4().hex}"
 
-    try:
-        await _ensure_script()
-        redis = await get_redis()
-        now = time.time()
 
-        result = await redis.evalsha(
-            _sha_acquire,
-            2,
-            f"{_RATE_PREFIX}:{model_id}",
-            stream_key,
-            rpm,
-            WINDOW_S,
-            int(now),
-            RATE_KEY_TTL,
-            request_id,
-        )
+def register_waiter(request_id: str) -> asyncio.Future:
+    """Start listening for *request_id*'s release.
 
-        status = int(result[0])
+    Call before the request can be queued, so a release can never beat the
+    waiter; pair with :func:`wait_for_slot` or :func:`discard_waiter`.
+    """
+    fut = _signal_hub.register(request_id)
+    _signal_hub.ensure_started()
+    return fut
 
-        if status == 1:
-            return True  # admitted immediately
 
-        # ---- queued — wait for dispenser signal ----
-        signal_key = f"{_SIGNAL_PREFIX}:{request_id}"
-        popped = await redis.blpop(signal_key, timeout=int(timeout_s))
+def discard_waiter(request_id: str) -> None:
+    _signal_hub.discard(request_id)
 
-        if popped is None:
-            logger.debug(
-                "Upstream bucket wait timed out for model=%s req=%s tier=%s",
-                model_id,
-                request_id,
-                tier,
-            )
-            return False
 
-        return True
+async def wait_for_slot(
+    request_id: str,
+    fut: asyncio.Future,
+    stream_key: str,
+    msg_id: str,
+    timeout_s: float,
+) -> bool:
+    """Wait until the dispenser releases a queued request.
 
-    except Exception:
-        logger.exception(
-            "Upstream bucket error for model=%s — failing open", model_id
-        )
-        return True
+    On timeout the stream entry is deleted; the release script skips
+    deleted entries, so the dispenser does not spend a slot on a caller that
+    has given up.
+    """
+    try:
+        redis = await get_redis()
+        if await _wait_for_release(redis, request_id, fut, timeout_s):
+            return True
+        await redis.xdel(stream_key, msg_id)
+        return False
+    finally:
+        _signal_hub.discard(request_id)
 
 
 # ===================================================================
@@ -217,37 +491,102 @@ async def acquire_upstream(
 # ===================================================================
 
 _dispenser_tasks: Dict[str, asyncio.Task] = {}
+# Lease holder id of this process's dispensers, set by start_dispensers()
+_holder_id: Optional[str] = None
 
 
 def _stream_keys(model_id: str) -> tuple[str, str]:
     """Return (pro_stream_key, free_stream_key) for *model_id*."""
-    return (
-        f"{_STREAM_PREFIX}:{model_id}:pro",
-        f"{_STREAM_PREFIX}:{model_id}:free",
-    )
+    return stream_key(model_id, True), stream_key(model_id, False)
+
+
+def _scheduled_model_ids() -> list[str]:
+    """Return model ids that declare at least one upstream limit."""
+    return [m.id for m in MODELS if any(_limits(m))]
+
+
+# Stream indexes in the release script's KEYS
+_PRO_STREAM_INDEX = 5
+_FREE_STREAM_INDEX = 6
+
+# (stream index, message id, request id, token charge)
+_Queued = Tuple[int, str, str, int]
 
 
-def _model_ids_with_rpm() -> list[str]:
-    """Return model ids that have an ``rpm`` defined in the registry."""
-    return [m.id for m in MODELS if m.rpm is not None]
+def _queue_entries(backlog: Deque[_Queued], stream_index: int, entries) -> None:
+    for msg_id, fields in entries:
+        try:
+            tokens = int(fields.get("tokens") or 0)
+        except ValueError:
+            tokens = 0
+        backlog.append((stream_index, msg_id, fields.get("request_id", ""), tokens))
+
+
+async def _release_batch(
+    model_id: str,
+    pro_key: str,
+    free_key: str,
+    pro: Deque[_Queued],
+    free: Deque[_Queued],
+) -> int:
+    """Release queued requests (pro first) in one script call while they fit
+    every limit.  Released entries are popped from the backlogs.  Returns the
+    milliseconds until the next one may fit if it is blocked, else 0."""
+    candidates = list(pro)[:DISPENSE_BATCH]
+    candidates += list(free)[:DISPENSE_BATCH - len(candidates)]
+    args: list = [
+        *limit_args(model_id),
+        CONSUMER_GROUP,
+        STREAM_MAXLEN,
+        SIGNAL_TTL,
+        SIGNAL_CHANNEL,
+        f"{_SIGNAL_PREFIX}:",
+    ]
+    for entry in candidates:
+        args.extend(entry)
+
+    release = await get_script(_RELEASE_LUA)
+    consumed, retry_ms = await release(keys=[*model_keys(model_id), pro_key, free_key], args=args)
+    for _ in range(int(consumed)):
+        (pro if pro else free).popleft()
+    return int(retry_ms)
+
+
+async def _read_streams(
+    redis,
+    consumer_id: str,
+    streams: Dict[str, str],
+    count: int,
+    block_ms: Optional[int],
+    pro_key: str,
+    pro: Deque[_Queued],
+    free: Deque[_Queued],
+) -> None:
+    """XREADGROUP new entries of *streams* onto the pro / free backlogs."""
+    result = await redis.xreadgroup(CONSUMER_GROUP, consumer_id, streams, count=count, block=block_ms)
+    for stream_name, entries in result or ():
+        if stream_name == pro_key:
+            _queue_entries(pro, _PRO_STREAM_INDEX, entries)
+        else:
+            _queue_entries(free, _FREE_STREAM_INDEX, entries)
 
 
-async def _run_dispenser(model_id: str, rpm: int) -> None:
-    """Read from *model_id*'s two streams (pro first, free second)
-    at *rpm* pace and unblock waiters."""
-    consumer_id = f"disp-{uuid.uuid4().hex[:8]}"
-    interval = 60.0 / rpm  # seconds between dispatches
+async def _run_dispenser(model_id: str, holder_id: str) -> None:
+    """Release queued requests for *model_id* (pro first, free second) as its
+    limits allow, while *holder_id* holds the lease."""
+    consumer_id = f"disp-{holder_id}"
 
+    rpm, tpm, max_concurrent = _limits(get_model(model_id))
     logger.info(
-        "🔀 Upstream dispenser: model=%s rpm=%d interval=%.4fs",
+        "🔀 Upstream dispenser: model=%s rpm=%s tpm=%s max_concurrent=%s",
         model_id,
-        rpm,
-        interval,
+        rpm or "-",
+        tpm or "-",
+        max_concurrent or "-",
     )
 
     redis = await get_redis()
     pro_key, free_key = _stream_keys(model_id)
-    rate_key = f"{_RATE_PREFIX}:{model_id}"
 
     # -- Ensure consumer groups exist on both streams (idempotent) --
     for sk in (pro_key, free_key):
@@ -258,55 +597,56 @@ async def _run_dispenser(model_id: str, rpm: int) -> None:
         except Exception:
             pass  # GROUP already exists
 
-    # -- Reclaim pending from both streams (pro first, at RPM pace) --
-    await _claim_pending(redis, pro_key, consumer_id, rate_key, rpm, interval)
-    await _claim_pending(redis, free_key, consumer_id, rate_key, rpm, interval)
-
-    last_dispatch = time.monotonic()
+    is_leader = False
+    # Read from the streams but not yet released (the model was saturated)
+    pro: Deque[_Queued] = deque()
+    free: Deque[_Queued] = deque()
 
     while True:
         try:
-            # Read from BOTH streams — pro listed first wins on tie
-            streams = await redis.xreadgroup(
-                CONSUMER_GROUP,
-                consumer_id,
-                {pro_key: ">", free_key: ">"},
-                count=1,
-                block=XREAD_BLOCK_MS,
-            )
-
-            if not streams:
+            if not await _hold_lease(model_id, holder_id):
+                if is_leader:
+                    logger.info("🔀 Dispenser lease lost: model=%s", model_id)
+                    # Our unreleased entries stay pending; the next leader reclaims them
+                    pro.clear()
+                    free.clear()
+                is_leader = False
+                await asyncio.sleep(STANDBY_POLL_S)
                 continue
 
-            for stream_name, entries in streams:
-                for msg_id, fields in entries:
-                    request_id = fields.get("request_id", "")
-                    if not request_id:
-                        await redis.xack(stream_name, CONSUMER_GROUP, msg_id)
-                        continue
-
-                    # ---- pace to RPM ----
-                    now_mono = time.monotonic()
-                    delay = interval - (now_mono - last_dispatch)
-                    if delay > 0:
-                        await asyncio.sleep(delay)
-
-                    # ---- consume RPM slot ----
-                    await redis.zadd(rate_key, {request_id: time.time()})
-                    await redis.expire(rate_key, RATE_KEY_TTL)
-
-                    # ---- unblock waiter ----
-                    signal_key = f"{_SIGNAL_PREFIX}:{request_id}"
-                    await redis.lpush(signal_key, "go")
-                    await redis.expire(signal_key, SIGNAL_TTL)
-
-                    # ---- acknowledge ----
-                    await redis.xack(stream_name, CONSUMER_GROUP, msg_id)
-
-                    # ---- trim stream to bound memory ----
-                    await redis.xtrim(stream_name, maxlen=STREAM_MAXLEN, approximate=True)
+            if not is_leader:
+                is_leader = True
+                logger.info("🔀 Dispenser lease acquired: model=%s instance=%s", model_id, holder_id)
+                # -- Reclaim what a previous leader left pending --
+                await _claim_pending(redis, pro_key, consumer_id, _PRO_STREAM_INDEX, pro)
+                await _claim_pending(redis, free_key, consumer_id, _FREE_STREAM_INDEX, free)
+
+            # Top up the backlog; only block when there is nothing to release
+            if not (pro or free):
+                await _read_streams(
+                    redis, consumer_id, {pro_key: ">", free_key: ">"}, DISPENSE_BATCH, XREAD_BLOCK_MS,
+                    pro_key, pro, free,
+                )
+            else:
+                # Pro entries get their own quota, so a backlog of free ones
+                # waiting on a saturated model never holds newer pro ones back
+                if len(pro) < DISPENSE_BATCH:
+                    await _read_streams(
+                        redis, consumer_id, {pro_key: ">"}, DISPENSE_BATCH - len(pro), None, pro_key, pro, free,
+                    )
+                free_room = DISPENSE_BATCH - len(pro) - len(free)
+                if free_room > 0:
+                    await _read_streams(
+                        redis, consumer_id, {free_key: ">"}, free_room, None, pro_key, pro, free,
+                    )
+
+            if not (pro or free):
+                continue
 
-                    last_dispatch = time.monotonic()
+            retry_ms = await _release_batch(model_id, pro_key, free_key, pro, free)
+            if retry_ms and (pro or free):
+                # Saturated: wait for a window entry to expire or a slot to finish
+                await asyncio.sleep(min(retry_ms / 1000, MAX_FULL_WINDOW_SLEEP_S))
 
         except asyncio.CancelledError:
             raise
@@ -321,12 +661,11 @@ async def _claim_pending(
     redis,
     stream_key: str,
     consumer_id: str,
-    rate_key: str,
-    rpm: int,
-    interval: float,
+    stream_index: int,
+    backlog: Deque[_Queued],
 ) -> None:
-    """Reclaim and process pending messages, paced to *interval* so we
-    don't flood the upstream provider on startup."""
+    """Take over messages a previous leader read but never released; they go
+    to the front of the backlog and are released as the limits allow."""
     try:
         pending = await redis.xpending(stream_key, CONSUMER_GROUP)
         pending_count = pending.get("pending", 0) if isinstance(pending, dict) else 0
@@ -337,10 +676,9 @@ async def _claim_pending(
         return
 
     logger.info(
-        "🔀 Dispenser reclaiming %d pending messages for stream %s (paced at %.4fs)",
+        "🔀 Dispenser reclaiming %d pending messages for stream %s",
         pending_count,
         stream_key,
-        interval,
     )
 
     try:
@@ -352,25 +690,9 @@ async def _claim_pending(
             count=pending_count,
         )
         if isinstance(claimed, (list, tuple)) and len(claimed) >= 2:
-            for msg_id, fields in claimed[1]:
-                request_id = fields.get("request_id", "")
-                if not request_id:
-                    await redis.xack(stream_key, CONSUMER_GROUP, msg_id)
-                    continue
-
-                # Pace to RPM — don't burst all pending at once
-                await asyncio.sleep(interval)
-
-                await redis.zadd(rate_key, {request_id: time.time()})
-                await redis.expire(rate_key, RATE_KEY_TTL)
-
-                signal_key = f"{_SIGNAL_PREFIX}:{request_id}"
-                await redis.lpush(signal_key, "go")
-                await redis.expire(signal_key, SIGNAL_TTL)
-
-                await redis.xack(stream_key, CONSUMER_GROUP, msg_id)
-
-                await redis.xtrim(stream_key, maxlen=STREAM_MAXLEN, approximate=True)
+            reclaimed: Deque[_Queued] = deque()
+            _queue_entries(reclaimed, stream_index, claimed[1])
+            backlog.extendleft(reversed(reclaimed))
     except Exception:
         logger.exception("Failed to reclaim pending messages for %s", stream_key)
 
@@ -381,8 +703,8 @@ async def _claim_pending(
 
 
 async def start_dispensers() -> None:
-    """Launch one dispenser task per model that has an RPM cap."""
-    global _dispenser_tasks
+    """Launch one dispenser task per model that declares an upstream limit."""
+    global _dispenser_tasks, _holder_id
 
     # Short-circuit if Redis isn't available
     try:
@@ -391,12 +713,12 @@ async def start_dispensers() -> None:
         logger.warning("Redis unavailable — upstream buckets disabled")
         return
 
-    for model_id in _model_ids_with_rpm():
-        model = get_model(model_id)
-        if model is None or model.rpm is None:
-            continue
+    # Built here rather than at import: with gunicorn's preload_app the master
+    # imports this module and every forked worker would inherit its pid.
+    _holder_id = f"{platform.node()}_{os.getpid()}_{uuid.uuid4().hex}"
+    for model_id in _scheduled_model_ids():
         task = asyncio.create_task(
-            _run_dispenser(model_id, model.rpm)
+            _run_dispenser(model_id, _holder_id)
         )
         _dispenser_tasks[model_id] = task
 
@@ -413,5 +735,15 @@ async def stop_dispensers() -> None:
         task.cancel()
     if _dispenser_tasks:
         await asyncio.gather(*_dispenser_tasks.values(), return_exceptions=True)
+        # Hand leadership over right away instead of waiting for the lease to expire
+        try:
+            redis = await get_redis()
+            for model_id in _dispenser_tasks:
+                lease_key = f"{_LEASE_PREFIX}:{model_id}"
+                if await redis.get(lease_key) == _holder_id:
+                    await redis.delete(lease_key)
+        except Exception:
+            logger.debug("Could not release dispenser leases", exc_info=True)
     _dispenser_tasks.clear()
+    await _signal_hub.stop()
     logger.info("🔀 All upstream dispensers stopped")
@@ -12,13 +12,40 @@ def _to_non_negative_int(value: Any) -> int:
         return 0
 
 
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def _cache_hit_tokens(usage: Any) -> int:
+    """Prompt tokens served from the provider's context cache.
+
+    DeepSeek reports ``prompt_cache_hit_tokens``; OpenAI-compatible providers
+    (Qwen, Kimi, ...) report ``prompt_tokens_details.cached_tokens``.
+    """
+    hit = _field(usage, "prompt_cache_hit_tokens")
+    if hit is None:
+        hit = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    return _to_non_negative_int(hit)
+
+
 def normalize_usage(usage: Any) -> dict[str, int]:
-    """Normalize provider usage payload into prompt/completion/total token integers."""
+    """Normalize provider usage payload into prompt/completion/total token integers.
+
+    ``prompt_cache_hit_tokens`` / ``prompt_cache_miss_tokens`` split
+    ``prompt_tokens`` by whether the provider served them from its context
+    cache; providers that don't report it count every prompt token as a miss.
+    """
     if usage is None:
         return {
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": 0,
         }
 
     if isinstance(usage, dict):
@@ -33,17 +60,31 @@ def normalize_usage(usage: Any) -> dict[str, int]:
     if total_tokens <= 0:
         total_tokens = prompt_tokens + completion_tokens
 
+    cache_hit_tokens = min(_cache_hit_tokens(usage), prompt_tokens)
+
     return {
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": total_tokens,
+        "prompt_cache_hit_tokens": cache_hit_tokens,
+        "prompt_cache_miss_tokens": prompt_tokens - cache_hit_tokens,
     }
 
 
+def add_usage(total: dict[str, int], usage: Any) -> dict[str, int]:
+    """Add a usage payload into *total* (a :func:`normalize_usage` dict) in place."""
+    for key, value in normalize_usage(usage).items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
 def usage_to_credits(usage: Any, model_id: str) -> float:
     """
     Convert a usage payload into credits (点数) using the model's pricing.
 
+    Prompt tokens the provider served from its context cache are billed at
+    the model's cache-hit price.
+
     Returns 0.0 when the model is unknown or usage is empty.
     """
     normalized = normalize_usage(usage)
@@ -57,5 +98,5 @@ def usage_to_credits(usage: Any, model_id: str) -> float:
     return model_cfg.tokens_to_credits(
         normalized["prompt_tokens"],
         normalized["completion_tokens"],
+        cache_hit_tokens=normalized["prompt_cache_hit_tokens"],
     )
-
@@ -6,10 +6,13 @@ from datetime import datetime, UTC, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from models import Persona, User, Character, Scene, UserLikedCharacter, UserLikedScene, UserLikedPersona
+from models import Persona, User, Character, Scene
 from schemas import PersonaOut
 from utils.chat_history_utils import fetch_user_chat_history
 from utils.credit_cap import get_credit_cap_info
+from utils.chat_admission import clear_credit_block
+from utils.liked_set import get_liked_ids
+from utils.creator_stats import get_character_counts
 
 
 # ── Ban helpers ────────────────────────────────────────────────────────────────
@@ -60,38 +63,99 @@ def get_pro_state(user: User) -> dict[str, Any]:
     }
 
 
-def enrich_user_with_character_count(user: User, db: Session, current_user: Optional[User] = None) -> dict:
-    """Convert User to dict with characters_created count"""
-    pro_state = get_pro_state(user)
-    liked_char_ids: set = set()
-    liked_scene_ids: set = set()
-    liked_persona_ids: set = set()
-    if current_user:
-        liked_char_ids = {r.character_id for r in db.query(UserLikedCharacter.character_id).filter(UserLikedCharacter.user_id == current_user.id).all()}
-        liked_scene_ids = {r.scene_id for r in db.query(UserLikedScene.scene_id).filter(UserLikedScene.user_id == current_user.id).all()}
-        liked_persona_ids = {r.persona_id for r in db.query(UserLikedPersona.persona_id).filter(UserLikedPersona.user_id == current_user.id).all()}
-    recent_characters = (
-        db.query(Character)
-        .filter(Character.creator_id == user.id, Character.is_public == True)
-        .order_by(Character.created_time.desc())
-        .limit(4)
-        .all()
-    )
-    recent_scenes = (
-        db.query(Scene)
-        .filter(Scene.creator_id == user.id, Scene.is_public == True)
-        .order_by(Scene.created_time.desc())
-        .limit(3)
-        .all()
+RECENT_CARD_LIMITS = {"character": 4, "scene": 3, "persona": 3}
+_CARD_MODELS = {"character": Character, "scene": Scene, "persona": Persona}
+_CARD_BATCH = 500
+
+
+def _recent_public_by_creator(db: Session, model, creator_ids: list[str], limit: int) -> dict[str, list]:
+    """Newest *limit* public rows of *model* per creator, in one ``ROW_NUMBER()`` query."""
+    ranked = (
+        db.query(
+            model.id.label("id"),
+            func.row_number().over(
+                partition_by=model.creator_id,
+                order_by=model.created_time.desc(),
+            ).label("rn"),
+        )
+        .filter(model.creator_id.in_(creator_ids), model.is_public == True)
+        .subquery()
     )
-    recent_personas = (
-        db.query(Persona)
-        .filter(Persona.creator_id == user.id, Persona.is_public == True)
-        .order_by(Persona.created_time.desc())
-        .limit(3)
+    rows = (
+        db.query(model)
+        .join(ranked, ranked.c.id == model.id)
+        .filter(ranked.c.rn <= limit)
+        .order_by(model.creator_id, ranked.c.rn)
         .all()
     )
+    by_creator: dict[str, list] = {}
+    for row in rows:
+        by_creator.setdefault(row.creator_id, []).append(row)
+    return by_creator
+
+
+def enrich_users_with_character_count(users: list[User], db: Session, current_user: Optional[User] = None) -> list[dict]:
+    """Convert a page of Users to profile-card dicts.
 
+    Recent content is loaded with one query per content type, character
+    counts from ``creator_stats`` in one query, and the viewer's likes with one lookup per type,
+    however many users are on the page.
+    """
+    if not users:
+        return []
+    if len(users) > _CARD_BATCH:
+        # Keep the IN (...) lists bounded for callers that pass every user
+        return [
+            card
+            for i in range(0, len(users), _CARD_BATCH)
+            for card in enrich_users_with_character_count(users[i:i + _CARD_BATCH], db, current_user)
+        ]
+    user_ids = [user.id for user in users]
+
+    recent = {
+        kind: _recent_public_by_creator(db, model, user_ids, RECENT_CARD_LIMITS[kind])
+        for kind, model in _CARD_MODELS.items()
+    }
+    character_counts = get_character_counts(db, user_ids)
+    liked = {
+        kind: get_liked_ids(
+            db, current_user, kind,
+            [obj.id for rows in recent[kind].values() for obj in rows],
+        )
+        for kind in _CARD_MODELS
+    }
+
+    return [
+        _user_card(
+            user,
+            recent["character"].get(user.id, []),
+            recent["scene"].get(user.id, []),
+            recent["persona"].get(user.id, []),
+            liked["character"],
+            liked["scene"],
+            liked["persona"],
+            character_counts.get(user.id, 0),
+        )
+        for user in users
+    ]
+
+
+def enrich_user_with_character_count(user: User, db: Session, current_user: Optional[User] = None) -> dict:
+    """Convert User to dict with characters_created count"""
+    return enrich_users_with_character_count([user], db, current_user)[0]
+
+
+def _user_card(
+    user: User,
+    recent_characters: list,
+    recent_scenes: list,
+    recent_personas: list,
+    liked_char_ids: set,
+    liked_scene_ids: set,
+    liked_persona_ids: set,
+    characters_created: int,
+) -> dict:
+    pro_state = get_pro_state(user)
     return {
         "id": user.id,
         "email": user.email,
@@ -102,7 +166,7 @@ def enrich_user_with_character_count(user: User, db: Session, current_user: Opti
         "liked_tags": user.liked_tags or [],
         "views": user.views or 0,
         "likes": user.likes or 0,
-        "characters_created": db.query(func.count(Character.id)).filter(Character.creator_id == user.id).scalar() or 0,
+        "characters_created": characters_created,
         "recent_characters": [
             {
                 "id": character.id,
@@ -214,8 +278,7 @@ def build_user_response(user: User, db: Session) -> dict[str, Any]:
         if persona:
             default_persona = PersonaOut.model_validate(persona)
 
-    # Calculate characters_created by counting characters where creator_id matches user.id
-    characters_created = db.query(Character).filter(Character.creator_id == user.id).count()
+    characters_created = get_character_counts(db, [user.id]).get(user.id, 0)
     pro_state = get_pro_state(user)
     credit_limits = get_credit_cap_info(user, db)
 
@@ -312,6 +375,7 @@ def upgrade_to_pro(user: User, db: Session, duration_months: int = 1, duration_d
     
     db.commit()
     db.refresh(user)
+    clear_credit_block(user.id)
     
     return user
 
@@ -0,0 +1,411 @@
+"""
+Write-behind view counters.
+
+Opening a card used to SELECT + UPDATE the entity row and its creator's
+``User.views`` inside the request, which contends on the row locks of popular
+characters and their creators.  Views are now counted in Redis and folded
+into Postgres periodically.
+
+Redis keys
+----------
+* ``views:pending:{type}``      — Hash  entity id → unflushed views
+* ``views:pending:creator``     — Hash  creator id → unflushed views
+* ``views:uncredited:{type}``   — Hash  entity id → views whose creator was
+  not yet known when they were recorded (resolved at flush time)
+* ``views:creator_of:{type}``   — Hash  entity id → creator id, learned from
+  flush results so later views can be credited to the creator directly
+* ``{pending key}:flushing:{token}`` — a pending hash renamed by a flush
+* ``views:flushing``            — Sorted set  flush token → unix time the
+  flush detached its hashes
+
+A background thread renames the pending hashes atomically (so new views keep
+landing in fresh hashes), applies them with one
+``UPDATE ... FROM (VALUES ...)`` per table (plus the per-creator
+``creator_stats`` totals), and deletes the renamed keys on
+success or merges them back on failure.  Renamed hashes left behind by a
+process that died mid-flush are merged back by the first flush after
+``FLUSHING_ORPHAN_S``.  When Redis is unavailable views are written straight
+to Postgres with atomic increments.
+
+Entity ids that are not positive Postgres integers are ignored, so a bad
+client value can neither fail the request nor poison a flush.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import Integer, String, column, func, values
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import SessionLocal
+from models import Character, Scene, Persona, User
+from utils.redis_client import get_sync_redis
+from utils.creator_stats import add_views
+
+logger = logging.getLogger(__name__)
+
+VIEW_FLUSH_INTERVAL_S = float(os.getenv("VIEW_FLUSH_INTERVAL_S", "30"))
+CREATOR_MAP_TTL_S = 24 * 3600
+FLUSHING_ORPHAN_S = 600
+_MAX_ENTITY_ID = 2**31 - 1
+
+ENTITY_MODELS = {
+    "character": Character,
+    "scene": Scene,
+    "persona": Persona,
+}
+
+_PENDING_PREFIX = "views:pending"
+_UNCREDITED_PREFIX = "views:uncredited"
+_CREATOR_OF_PREFIX = "views:creator_of"
+_CREATOR_KEY = f"{_PENDING_PREFIX}:creator"
+_FLUSHING_KEY = "views:flushing"
+_FLUSHED_KEYS = (
+    [f"{_PENDING_PREFIX}:{t}" for t in ENTITY_MODELS]
+    + [f"{_UNCREDITED_PREFIX}:{t}" for t in ENTITY_MODELS]
+    + [_CREATOR_KEY]
+)
+
+# KEYS[1] = views:pending:{type}
+# KEYS[2] = views:uncredited:{type}
+# KEYS[3] = views:creator_of:{type}
+# KEYS[4] = views:pending:creator
+# ARGV[1] = entity id
+_RECORD_LUA = r"""
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+local creator = redis.call('HGET', KEYS[3], ARGV[1])
+if creator then
+    redis.call('HINCRBY', KEYS[4], creator, 1)
+else
+    redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+end
+return 1
+"""
+
+# Atomically move every non-empty pending hash out of the way.
+# KEYS[1]  = views:flushing
+# KEYS[2..] = pending / uncredited hash keys
+# ARGV[1] = flush token, ARGV[2] = now
+# Returns the list of keys that were moved.
+_DETACH_LUA = r"""
+local moved = {}
+for i = 2, #KEYS do
+    local key = KEYS[i]
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('RENAME', key, key .. ':flushing:' .. ARGV[1])
+        table.insert(moved, key)
+    end
+end
+if #moved > 0 then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+end
+return moved
+"""
+
+# Merge a flush's renamed hashes back into the live ones.
+# KEYS[1]  = views:flushing
+# KEYS[2..] = pending / uncredited hash keys
+# ARGV[1] = flush token
+_RESTORE_LUA = r"""
+for i = 2, #KEYS do
+    local tmp = KEYS[i] .. ':flushing:' .. ARGV[1]
+    local fields = redis.call('HGETALL', tmp)
+    for j = 1, #fields, 2 do
+        redis.call('HINCRBY', KEYS[i], fields[j], fields[j + 1])
+    end
+    redis.call('DEL', tmp)
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+_record_script = None
+_detach_script = None
+_restore_script = None
+
+
+def _scripts(redis):
+    global _record_script, _detach_script, _restore_script
+    if _record_script is None:
+        _record_script = redis.register_script(_RECORD_LUA)
+        _detach_script = redis.register_script(_DETACH_LUA)
+        _restore_script = redis.register_script(_RESTORE_LUA)
+    return _record_script, _detach_script, _restore_script
+
+
+# ===================================================================
+# Recording
+# ===================================================================
+
+
+def _entity_id(raw) -> Optional[int]:
+    """*raw* as an entity id, or None if it cannot be one."""
+    if isinstance(raw, bool):
+        return None
+    try:
+        entity_id = int(raw)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return entity_id if 0 < entity_id <= _MAX_ENTITY_ID else None
+
+
+def record_views(entity_ids: Dict[str, Optional[int]]) -> None:
+    """Count one view for each ``{entity_type: entity_id}`` pair.
+
+    Costs a single Redis round-trip; falls back to direct atomic
+    increments in Postgres when Redis is unavailable.  Invalid ids are
+    skipped.
+    """
+    items = [
+        (t, entity_id)
+        for t, raw in entity_ids.items()
+        if t in ENTITY_MODELS and (entity_id := _entity_id(raw)) is not None
+    ]
+    if not items:
+        return
+
+    try:
+        redis = get_sync_redis()
+        record, _, _ = _scripts(redis)
+        pipe = redis.pipeline(transaction=False)
+        for entity_type, entity_id in items:
+            record(
+                keys=[
+                    f"{_PENDING_PREFIX}:{entity_type}",
+                    f"{_UNCREDITED_PREFIX}:{entity_type}",
+                    f"{_CREATOR_OF_PREFIX}:{entity_type}",
+                    _CREATOR_KEY,
+                ],
+                args=[entity_id],
+                client=pipe,
+            )
+        pipe.execute()
+    except Exception:
+        logger.warning("Redis unavailable for view counting, writing views directly", exc_info=True)
+        _apply_deltas(
+            {t: {i: 1} for t, i in items},
+            {t: {i: 1} for t, i in items},
+            {},
+        )
+
+
+# ===================================================================
+# Read overlay
+# ===================================================================
+
+
+def get_pending_views(entity_type: str, entity_ids: Iterable) -> Dict:
+    """Return ``{id: unflushed_views}`` for *entity_ids* (``"creator"`` for users)."""
+    entity_ids = list(entity_ids)
+    ids = [str(i) for i in entity_ids]
+    if not ids:
+        return {}
+    try:
+        deltas = get_sync_redis().hmget(f"{_PENDING_PREFIX}:{entity_type}", ids)
+    except Exception:
+        return {}
+    return {raw_id: int(d) for raw_id, d in zip(entity_ids, deltas) if d}
+
+
+def overlay_pending_views(entity_type: str, objs: List) -> None:
+    """Add unflushed views to the ``views`` of loaded ORM objects.
+
+    Uses ``set_committed_value`` so the overlay never marks the rows dirty.
+    """
+    objs = [o for o in objs if o is not None]
+    pending = get_pending_views(entity_type, [o.id for o in objs])
+    for obj in objs:
+        delta = pending.get(obj.id)
+        if delta:
+            set_committed_value(obj, "views", (obj.views or 0) + delta)
+
+
+# ===================================================================
+# Flushing
+# ===================================================================
+
+
+def _values_table(rows, id_type):
+    return values(
+        column("id", id_type),
+        column("delta", Integer),
+        name="v",
+    ).data(rows)
+
+
+def _apply_deltas(
+    entity_deltas: Dict[str, Dict[int, int]],
+    uncredited: Dict[str, Dict[int, int]],
+    creator_deltas: Dict[str, int],
+) -> Dict[str, Dict[int, str]]:
+    """Apply view deltas in one transaction.
+
+    Views in *uncredited* are credited to the entity's creator using the
+    ``creator_id`` returned by the entity UPDATE.  Returns the learned
+    ``{type: {entity_id: creator_id}}`` map.
+    """
+    creator_deltas = dict(creator_deltas)
+    learned: Dict[str, Dict[int, str]] = {}
+
+    db = SessionLocal()
+    try:
+        for entity_type, deltas in entity_deltas.items():
+            if not deltas:
+                continue
+            table = ENTITY_MODELS[entity_type].__table__
+            v = _values_table(list(deltas.items()), Integer)
+            rows = db.execute(
+                table.update()
+                .where(table.c.id == v.c.id)
+                .values(views=func.coalesce(table.c.views, 0) + v.c.delta)
+                .returning(table.c.id, table.c.creator_id)
+            ).all()
+
+            owners = learned.setdefault(entity_type, {})
+            pending_credit = uncredited.get(entity_type, {})
+            stats_deltas: Dict[str, int] = {}
+            for entity_id, creator_id in rows:
+                if not creator_id:
+                    continue
+                owners[entity_id] = creator_id
+                stats_deltas[creator_id] = stats_deltas.get(creator_id, 0) + deltas[entity_id]
+                if entity_id in pending_credit:
+                    creator_deltas[creator_id] = creator_deltas.get(creator_id, 0) + pending_credit[entity_id]
+            add_views(db, entity_type, stats_deltas)
+
+        if creator_deltas:
+            table = User.__table__
+            v = _values_table(list(creator_deltas.items()), String)
+            db.execute(
+                table.update()
+                .where(table.c.id == v.c.id)
+                .values(views=func.coalesce(table.c.views, 0) + v.c.delta)
+            )
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return learned
+
+
+def _int_hash(raw: Dict[str, str], int_keys: bool = True) -> Dict:
+    deltas = {}
+    for k, v in raw.items():
+        key = _entity_id(k) if int_keys else k
+        if key is not None and int(v):
+            deltas[key] = int(v)
+    return deltas
+
+
+def _requeue_orphans(redis, restore) -> None:
+    """Merge back hashes detached by flushes that never finished (process died)."""
+    stale = redis.zrangebyscore(_FLUSHING_KEY, "-inf", time.time() - FLUSHING_ORPHAN_S)
+    for token in stale:
+        restore(keys=[_FLUSHING_KEY, *_FLUSHED_KEYS], args=[token])
+        logger.warning("Re-queued views from abandoned flush %s", token)
+
+
+def flush_views() -> None:
+    """Fold all pending view counters into Postgres."""
+    try:
+        redis = get_sync_redis()
+        _, detach, restore = _scripts(redis)
+        _requeue_orphans(redis, restore)
+        token = uuid.uuid4().hex
+        moved = detach(keys=[_FLUSHING_KEY, *_FLUSHED_KEYS], args=[token, time.time()])
+    except Exception:
+        logger.warning("View flush skipped: Redis unavailable", exc_info=True)
+        return
+
+    if not moved:
+        return
+
+    flushing = {key: f"{key}:flushing:{token}" for key in moved}
+    pipe = redis.pipeline(transaction=False)
+    for tmp in flushing.values():
+        pipe.hgetall(tmp)
+    snapshot = dict(zip(flushing.keys(), pipe.execute()))
+
+    entity_deltas = {
+        t: _int_hash(snapshot.get(f"{_PENDING_PREFIX}:{t}", {})) for t in ENTITY_MODELS
+    }
+    uncredited = {
+        t: _int_hash(snapshot.get(f"{_UNCREDITED_PREFIX}:{t}", {})) for t in ENTITY_MODELS
+    }
+    creator_deltas = _int_hash(snapshot.get(_CREATOR_KEY, {}), int_keys=False)
+
+    try:
+        learned = _apply_deltas(entity_deltas, uncredited, creator_deltas)
+    except Exception:
+        logger.exception("View flush failed, re-queueing counters")
+        restore(keys=[_FLUSHING_KEY, *moved], args=[token])
+        return
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(*flushing.values())
+    pipe.zrem(_FLUSHING_KEY, token)
+    for entity_type, owners in learned.items():
+        if owners:
+            key = f"{_CREATOR_OF_PREFIX}:{entity_type}"
+            pipe.hset(key, mapping=owners)
+            pipe.expire(key, CREATOR_MAP_TTL_S)
+    pipe.execute()
+
+    logger.debug(
+        "Flushed views: %s",
+        {t: len(d) for t, d in entity_deltas.items()},
+    )
+
+
+class _ViewFlusher:
+    """Background thread that calls ``flush_views`` every ``VIEW_FLUSH_INTERVAL_S``."""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="view-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(VIEW_FLUSH_INTERVAL_S):
+            try:
+                flush_views()
+            except Exception:
+                logger.exception("View flusher error")
+        try:
+            flush_views()
+        except Exception:
+            logger.exception("Final view flush failed")
+
+
+_flusher = _ViewFlusher()
+
+
+def start_view_flusher() -> None:
+    """Start the periodic view flush (called on app startup)."""
+    _flusher.start()
+
+
+def stop_view_flusher() -> None:
+    """Flush remaining views and stop (called on shutdown)."""
+    _flusher.stop()
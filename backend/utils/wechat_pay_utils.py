@@ -8,6 +8,8 @@ import logging
 from pathlib import Path
 from typing import Optional
 
+from utils.lazy import LazyObject
+
 logger = logging.getLogger(__name__)
 
 
@@ -295,5 +297,5 @@ class WeChatPayClient:
         return data
 
 
-# 单例
-wechat_pay_client = WeChatPayClient()
+# 单例（首次使用时初始化，避免导入时读取证书和创建SDK客户端）
+wechat_pay_client = LazyObject(WeChatPayClient)
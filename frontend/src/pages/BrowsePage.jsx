@@ -72,7 +72,8 @@ function BrowsePage() {
   const [isFeedLoading, setIsFeedLoading] = useState(false);
   const [isFeedLoadingMore, setIsFeedLoadingMore] = useState(false);
   const [feedPage, setFeedPage] = useState(1);
-  const [feedTotal, setFeedTotal] = useState(0);
+  const [feedCursor, setFeedCursor] = useState(null);
+  const feedNextCursorRef = useRef(null);
   const [feedHasMore, setFeedHasMore] = useState(true);
   const feedLoadMoreRef = useRef(null);
 
@@ -302,7 +303,8 @@ function BrowsePage() {
     if (activeTopTab === 'following') {
       setFeedPage(1);
       setFeedEntities([]);
-      setFeedTotal(0);
+      setFeedCursor(null);
+      feedNextCursorRef.current = null;
       setFeedHasMore(true);
     }
   }, [activeTopTab]);
@@ -316,16 +318,16 @@ function BrowsePage() {
     } else {
       setIsFeedLoadingMore(true);
     }
-    fetch(`${window.API_BASE_URL}/api/following/feed?page=${feedPage}&page_size=20`, {
+    const cursorParam = feedPage > 1 && feedCursor ? `&cursor=${encodeURIComponent(feedCursor)}` : '';
+    fetch(`${window.API_BASE_URL}/api/following/feed?page_size=20${cursorParam}`, {
       headers: { Authorization: sessionToken },
     })
       .then(res => res.json())
       .then(data => {
         const incoming = data.items || [];
-        const nextTotal = data.total || 0;
         setFeedEntities(prev => (feedPage === 1 ? incoming : [...prev, ...incoming]));
-        setFeedTotal(nextTotal);
-        setFeedHasMore(nextTotal > feedPage * 20);
+        feedNextCursorRef.current = data.next_cursor || null;
+        setFeedHasMore(Boolean(data.has_more && data.next_cursor));
         setIsFeedLoading(false);
         setIsFeedLoadingMore(false);
       })
@@ -334,7 +336,7 @@ function BrowsePage() {
         setIsFeedLoadingMore(false);
         setFeedHasMore(false);
       });
-  }, [activeTopTab, sessionToken, feedPage]);
+  }, [activeTopTab, sessionToken, feedPage, feedCursor]);
 
   // Infinite scroll for following feed
   useEffect(() => {
@@ -342,7 +344,12 @@ function BrowsePage() {
     if (isFeedLoading || isFeedLoadingMore || !feedHasMore) return;
     if (!feedLoadMoreRef.current) return;
     const observer = new IntersectionObserver(
-      (entries) => { if (entries[0].isIntersecting) setFeedPage(prev => prev + 1); },
+      (entries) => {
+        if (entries[0].isIntersecting) {
+          setFeedCursor(feedNextCursorRef.current);
+          setFeedPage(prev => prev + 1);
+        }
+      },
       { rootMargin: '200px 0px' }
     );
     observer.observe(feedLoadMoreRef.current);
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of response encoding: the default FastAPI path versus the
+fast path in backend/utils/fast_json.py, on payloads shaped like the real
+hot responses.
+
+* ``character_page`` — a 100-item ``CharacterListOut`` (persona text, chunks,
+  tags).  Old: ``response_model`` dump, re-validate, serialise, stdlib
+  ``json``.  New: ``model_response`` (compiled serializer, one pass).
+* ``chat_history_page`` — a ``/api/chat/history`` page of
+  ``serialize_chat_history_entry`` dicts with long branches.  Old:
+  ``jsonable_encoder`` + stdlib ``json``.  New: ``FastJSONResponse``.
+* ``admin_stats`` — ``/admin/user-stats`` plus an ``/admin/characters``
+  dump with datetimes.  Old and new as for the chat history.
+
+Every case first checks that both encoders produce the same JSON value.
+
+Usage:
+    python scripts/bench/serialization.py [--repeat 7] [--chats 20] [--messages 200]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+from datetime import datetime, timedelta, UTC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from schemas import CharacterListOut  # noqa: E402
+from utils.fast_json import FastJSONResponse, model_response, orjson  # noqa: E402
+
+_rng = random.Random(7)
+_NOW = datetime(2026, 10, 19, 12, 0, 0, 123456, tzinfo=UTC)
+_WORDS = "the quiet night she smiled 他 看着 窗外 的 雨 and whispered softly remember our promise".split()
+
+
+def _text(words: int) -> str:
+    return " ".join(_rng.choice(_WORDS) for _ in range(words))
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------------------------
+
+def character_page(items: int = 100) -> CharacterListOut:
+    characters = [
+        {
+            "id": i,
+            "name": f"Character {i}",
+            "persona": _text(300),
+            "example_messages": _text(120),
+            "long_description": _text(200),
+            "long_description_chunks": [{"content": _text(80)} for _ in range(3)],
+            "chunking_status": "done",
+            "tagline": _text(12),
+            "tags": ["fantasy", "romance", "原创"],
+            "views": _rng.randint(0, 100000),
+            "likes": _rng.randint(0, 5000),
+            "picture": f"/uploads/characters/{i}.webp",
+            "avatar_picture": f"/uploads/characters/{i}_avatar.webp",
+            "greeting": _text(40),
+            "created_time": _NOW - timedelta(days=i),
+            "creator_id": f"user-{i % 17}",
+            "creator_name": f"creator {i % 17}",
+            "creator_profile_pic": f"/uploads/users/{i % 17}.webp",
+            "is_public": True,
+            "liked": i % 3 == 0,
+            "background": {"type": "preset", "preset_id": "night-city"},
+        }
+        for i in range(items)
+    ]
+    return CharacterListOut(items=characters, total=5000, page=1, page_size=items, short=False)
+
+
+def _messages(count: int) -> list:
+    return [
+        {
+            "role": "user" if n % 2 == 0 else "assistant",
+            "content": _text(25 if n % 2 == 0 else 90),
+            "message_id": f"m{n:06d}",
+            "is_pinned": n % 50 == 0,
+            "usage": None if n % 2 == 0 else {"prompt_tokens": 1800, "completion_tokens": 160, "total_tokens": 1960},
+        }
+        for n in range(count)
+    ]
+
+
+def chat_history_page(chats: int = 20, messages: int = 200) -> dict:
+    items = []
+    for i in range(chats):
+        main = _messages(messages)
+        branches = [
+            {"branch_id": "main", "parent_branch_id": None, "parent_message_id": None, "label": "Main", "messages": main},
+            {"branch_id": f"b{i}", "parent_branch_id": "main", "parent_message_id": "m000010", "label": "Branch",
+             "messages": main[:10] + _messages(20)},
+        ]
+        items.append({
+            "chat_id": f"chat-{i}",
+            "character_id": i,
+            "character_name": f"Character {i}",
+            "character_picture": f"/uploads/characters/{i}.webp",
+            "scene_id": None,
+            "scene_name": None,
+            "scene_picture": None,
+            "persona_id": None,
+            "title": _text(6),
+            "messages": main,
+            "branches": branches,
+            "active_branch_id": "main",
+            "message_store_version": 2,
+            "chat_config": {"model": "deepseek-v4-flash", "temperature": 1.3},
+            "is_pinned": False,
+            "hidden_from_recent": False,
+            "last_updated": (_NOW - timedelta(hours=i)).isoformat(),
+            "created_at": (_NOW - timedelta(days=i)).isoformat(),
+        })
+    return {"items": items, "total": 240, "page": 1, "page_size": chats}
+
+
+def admin_stats(rows: int = 2000) -> dict:
+    return {
+        "snapshot_at": _NOW.isoformat(),
+        "metrics": {"user_count": 120000, "dau": 8100, "wau": 30500, "mau": 71200, "d1_retention": 41.27},
+        "single_user_daily_credit_usage": [
+            {"user_id": f"user-{i}", "total_tokens": 900000 - i, "credit_amount": round(12.5 - i / 10, 4)}
+            for i in range(10)
+        ],
+        "characters": [
+            {
+                "id": i,
+                "name": f"Character {i}",
+                "tagline": _text(12),
+                "creator_name": f"creator {i % 97}",
+                "is_public": True,
+                "is_forkable": i % 4 == 0,
+                "views": i * 13,
+                "likes": i * 2,
+                "created_time": _NOW - timedelta(minutes=i),
+                "tags": ["fantasy", "原创"],
+            }
+            for i in range(rows)
+        ],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Encoders
+# ---------------------------------------------------------------------------
+
+def _starlette_render(content) -> bytes:
+    # starlette.responses.JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fastapi_model_path(model, adapter: TypeAdapter) -> bytes:
+    # fastapi.routing.serialize_response with response_model set
+    value = adapter.validate_python(model.model_dump())
+    return _starlette_render(adapter.dump_python(value, mode="json"))
+
+
+def fastapi_dict_path(payload) -> bytes:
+    # fastapi.routing.serialize_response without response_model
+    return _starlette_render(jsonable_encoder(payload))
+
+
+def fast_model_path(model) -> bytes:
+    return model_response(model).body
+
+
+def fast_dict_path(payload) -> bytes:
+    return FastJSONResponse(payload).body
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def _time(fn, repeat: int) -> float:
+    number = max(1, int(0.2 / max(timeit.timeit(fn, number=1), 1e-6)))
+    return statistics.median(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    page = character_page()
+    adapter = TypeAdapter(CharacterListOut)
+    history = chat_history_page(args.chats, args.messages)
+    stats = admin_stats()
+    cases = [
+        ("character_page", lambda: fastapi_model_path(page, adapter), lambda: fast_model_path(page)),
+        ("chat_history_page", lambda: fastapi_dict_path(history), lambda: fast_dict_path(history)),
+        ("admin_stats", lambda: fastapi_dict_path(stats), lambda: fast_dict_path(stats)),
+    ]
+
+    print(f"orjson: {'yes' if orjson is not None else 'no (stdlib fallback)'}")
+    print(f"{'payload':<20} {'KiB':>8} {'old ms':>9} {'new ms':>9} {'speedup':>8}")
+    for name, old, new in cases:
+        old_body, new_body = old(), new()
+        if json.loads(old_body) != json.loads(new_body):
+            raise SystemExit(f"{name}: encoders disagree")
+        old_s, new_s = _time(old, args.repeat), _time(new, args.repeat)
+        print(f"{name:<20} {len(new_body) / 1024:>8.1f} {old_s * 1000:>9.3f} {new_s * 1000:>9.3f} {old_s / new_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Response size and DB time of a full GET versus a revalidation that ends in
+``304 Not Modified``, for the endpoints served through utils/conditional.py.
+
+Runs the app in-process (FastAPI ``TestClient``) against the database and
+Redis configured for the backend, and times every SQL statement with engine
+cursor events, so the numbers exclude network and client overhead.
+
+Usage (from the repository root):
+    python scripts/loadtest/conditional_get.py --token <session token> \
+        --path /api/chat/history --path /api/character/12 --path /api/user/<id> \
+        --rounds 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend")
+
+
+class _DbTimer:
+    def __init__(self):
+        self.seconds = 0.0
+        self.statements = 0
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["bench_started"] = time.perf_counter()
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.seconds += time.perf_counter() - conn.info.pop("bench_started", time.perf_counter())
+        self.statements += 1
+
+    def reset(self):
+        self.seconds = 0.0
+        self.statements = 0
+
+
+def _measure(client, timer: _DbTimer, path: str, headers: dict):
+    timer.reset()
+    started = time.perf_counter()
+    response = client.get(path, headers=headers)
+    elapsed = time.perf_counter() - started
+    return response, {
+        "bytes": len(response.content),
+        "db_ms": timer.seconds * 1000,
+        "statements": timer.statements,
+        "wall_ms": elapsed * 1000,
+    }
+
+
+def _summary(samples: list) -> dict:
+    return {field: statistics.mean(s[field] for s in samples) for field in samples[0]}
+
+
+def _saving(full: float, revalidated: float) -> str:
+    return f"{(1 - revalidated / full) * 100:5.1f}%" if full else "    -"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", action="append", required=True, help="endpoint path; repeatable")
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--token", help="session token sent as the Authorization header")
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+
+    from server import _load_env, create_app
+
+    _load_env()
+    from database import engine
+
+    timer = _DbTimer()
+    event.listen(engine, "before_cursor_execute", timer.before)
+    event.listen(engine, "after_cursor_execute", timer.after)
+    client = TestClient(create_app())
+    headers = {"Authorization": args.token} if args.token else {}
+
+    print(f"{'path':<40} {'':>5} {'bytes':>9} {'db ms':>8} {'stmts':>6} {'wall ms':>8}")
+    for path in args.path:
+        first, _ = _measure(client, timer, path, headers)  # warm-up; also yields the ETag
+        etag = first.headers.get("etag")
+        if first.status_code != 200 or not etag:
+            print(f"{path:<40} skipped: status {first.status_code}, ETag {etag!r}")
+            continue
+
+        full, revalidated = [], []
+        for _ in range(args.rounds):
+            full.append(_measure(client, timer, path, headers)[1])
+            response, sample = _measure(client, timer, path, {**headers, "If-None-Match": etag})
+            if response.status_code != 304:
+                # Changed under us: continue with the new version
+                etag = response.headers.get("etag") or etag
+            revalidated.append(sample)
+
+        full_avg, revalidated_avg = _summary(full), _summary(revalidated)
+        for label, avg in (("200", full_avg), ("304", revalidated_avg)):
+            print(
+                f"{path:<40} {label:>5} {avg['bytes']:>9.0f} {avg['db_ms']:>8.2f} "
+                f"{avg['statements']:>6.1f} {avg['wall_ms']:>8.2f}"
+            )
+        print(
+            f"{'':<40} {'saved':>5} {_saving(full_avg['bytes'], revalidated_avg['bytes']):>9} "
+            f"{_saving(full_avg['db_ms'], revalidated_avg['db_ms']):>8} {'':>6} "
+            f"{_saving(full_avg['wall_ms'], revalidated_avg['wall_ms']):>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Closed-loop HTTP load generator for checking how throughput scales with
+gunicorn worker count.  Standard library only, so it runs from any host.
+
+Usage:
+    python worker_scaling.py --url http://127.0.0.1:8000/api/characters/popular \
+        --concurrency 64 --duration 30
+
+Run it once per worker count (WEB_CONCURRENCY=1, 2, 4, ...) against the same
+deployment and compare the requests/s lines; see README.md.
+"""
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def _worker(url: str, deadline: float, headers: dict, latencies: list, errors: list, lock: threading.Lock):
+    local_latencies = []
+    local_errors = 0
+    while time.monotonic() < deadline:
+        request = urllib.request.Request(url, headers=headers)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+                if response.status >= 500:
+                    local_errors += 1
+        except (urllib.error.URLError, OSError):
+            local_errors += 1
+            continue
+        local_latencies.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", required=True)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--token", help="session token sent as the Authorization header")
+    args = parser.parse_args()
+
+    headers = {"Authorization": args.token} if args.token else {}
+    latencies: list = []
+    errors: list = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    threads = [
+        threading.Thread(target=_worker, args=(args.url, deadline, headers, latencies, errors, lock), daemon=True)
+        for _ in range(args.concurrency)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    if not latencies:
+        print(f"no successful requests ({sum(errors)} errors)")
+        return
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"requests/s: {len(latencies) / elapsed:.1f}")
+    print(f"requests:   {len(latencies)} ok, {sum(errors)} errors in {elapsed:.1f}s")
+    print(
+        "latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+            quantiles[49] * 1000, quantiles[94] * 1000, quantiles[98] * 1000, latencies[-1] * 1000
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()